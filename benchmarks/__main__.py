@@ -0,0 +1,82 @@
+"""
+Runs the benchmark suite, building its fixture databases with sqlite3 on
+first use, and prints the results as JSON:
+
+    python -m benchmarks --suite quick --output results.json
+    python -m benchmarks --suite quick --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import SUITES
+from benchmarks.suite import BENCHMARKS, applies, compare, run_case
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--benchmark', action='append', choices=sorted(BENCHMARKS),
+                        help='run only these benchmarks, may be repeated')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of each benchmark, the best is compared')
+    parser.add_argument('--fixtures', default=os.path.join(
+        tempfile.gettempdir(), 'sqlite-benchmark-fixtures'),
+        help='directory the fixture databases are kept in between runs')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='change in time reported by --compare, a fraction')
+    args = parser.parse_args(argv)
+
+    names = args.benchmark or list(BENCHMARKS)
+    results = []
+    for fixture in SUITES[args.suite]:
+        path = fixture.create(args.fixtures)
+        for name in names:
+            if applies(name, fixture):
+                print(f'{fixture.name} {name}', file=sys.stderr)
+                results.append(run_case(name, path, fixture, args.repeat))
+
+    report = {
+        'suite': args.suite,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+        for line in compare(previous, results, args.threshold):
+            print(line, file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
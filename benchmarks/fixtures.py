@@ -0,0 +1,131 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+# a multiplicative hash spreading the row numbers, so that values look
+# random but every run builds the same file
+SCATTER = '((value * 2654435761) % 4294967296)'
+
+@dataclass(frozen=True)
+class Shape:
+    """
+    Shape is the layout of a fixture table t: its column definitions and
+    the expressions filling them from the row number value
+    """
+    name: str
+    columns: Tuple[Tuple[str, str, str], ...]  # (name, type, expression)
+    indexes: Tuple[str, ...] = ()
+
+    def create_sql(self) -> str:
+        columns = ', '.join(f'{name} {kind}' for name, kind, _ in self.columns)
+        return f'CREATE TABLE t(id INTEGER PRIMARY KEY, {columns})'
+
+    def insert_sql(self, rows: int) -> str:
+        names = ', '.join(name for name, _, _ in self.columns)
+        exprs = ', '.join(expr for _, _, expr in self.columns)
+        return (
+            'WITH RECURSIVE s(value) AS (SELECT 1 UNION ALL SELECT value + 1 '
+            f'FROM s WHERE value < {rows}) '
+            f'INSERT INTO t(id, {names}) SELECT value, {exprs} FROM s'
+        )
+
+def wide_columns(count: int) -> Tuple[Tuple[str, str, str], ...]:
+    """
+    wide_columns cycles through integers of growing width, reals and
+    zero-padded text
+    """
+    columns = []
+    for i in range(count):
+        if i % 3 == 0:
+            columns.append((f'c{i}', 'INTEGER', f'{SCATTER} % {10 ** (i % 9 + 1)}'))
+        elif i % 3 == 1:
+            columns.append((f'c{i}', 'REAL', f'{SCATTER} / 7.0'))
+        else:
+            columns.append((f'c{i}', 'TEXT', f"printf('%0{i + 4}d', value)"))
+    return tuple(columns)
+
+SHAPES: Dict[str, Shape] = {
+    shape.name: shape for shape in (
+        Shape('narrow', (
+            ('a', 'INTEGER', f'{SCATTER} % 1000'),
+            ('b', 'TEXT', "'name ' || (value % 997)"),
+        ), indexes=('CREATE INDEX t_a ON t(a)',)),
+        Shape('wide', wide_columns(24), indexes=('CREATE INDEX t_c0_c1 ON t(c0, c1)',)),
+        # blobs past the page size spill onto overflow pages
+        Shape('blob', (
+            ('a', 'INTEGER', 'value % 100'),
+            ('data', 'BLOB', f'zeroblob(2000 + {SCATTER} % 8000)'),
+        )),
+    )
+}
+
+@dataclass(frozen=True)
+class Fixture:
+    shape: Shape
+    rows: int
+    page_size: int
+
+    @property
+    def name(self) -> str:
+        return f'{self.shape.name}-{self.rows}-{self.page_size}'
+
+    def path(self, directory: str) -> str:
+        return os.path.join(directory, f'{self.name}.db')
+
+    def create(self, directory: str) -> str:
+        """
+        create writes the fixture into directory unless an earlier run did,
+        returning its path
+        """
+        path = self.path(directory)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(directory, exist_ok=True)
+        building = path + '.tmp'
+        if os.path.exists(building):
+            os.remove(building)
+
+        connection = sqlite3.connect(building)
+        connection.execute(f'PRAGMA page_size = {self.page_size}')
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute(self.shape.create_sql())
+        connection.execute(self.shape.insert_sql(self.rows))
+        for sql in self.shape.indexes:
+            connection.execute(sql)
+        connection.commit()
+        connection.close()
+
+        os.replace(building, path)
+        return path
+
+# the fixtures of each suite, the larger ones take a while to build once
+SUITES: Dict[str, List[Fixture]] = {
+    'quick': [
+        Fixture(SHAPES['narrow'], 1_000, 4096),
+        Fixture(SHAPES['narrow'], 10_000, 1024),
+        Fixture(SHAPES['wide'], 10_000, 4096),
+        Fixture(SHAPES['blob'], 1_000, 4096),
+    ],
+    'standard': [
+        Fixture(SHAPES['narrow'], 1_000, 4096),
+        Fixture(SHAPES['narrow'], 100_000, 1024),
+        Fixture(SHAPES['narrow'], 100_000, 4096),
+        Fixture(SHAPES['narrow'], 100_000, 65536),
+        Fixture(SHAPES['wide'], 100_000, 4096),
+        Fixture(SHAPES['blob'], 10_000, 4096),
+        Fixture(SHAPES['blob'], 10_000, 16384),
+    ],
+    'full': [
+        Fixture(SHAPES['narrow'], 1_000, 4096),
+        Fixture(SHAPES['narrow'], 1_000_000, 4096),
+        Fixture(SHAPES['narrow'], 10_000_000, 4096),
+        Fixture(SHAPES['narrow'], 1_000_000, 1024),
+        Fixture(SHAPES['narrow'], 1_000_000, 65536),
+        Fixture(SHAPES['wide'], 1_000_000, 4096),
+        Fixture(SHAPES['blob'], 100_000, 4096),
+        Fixture(SHAPES['blob'], 100_000, 65536),
+    ],
+}
@@ -0,0 +1,286 @@
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from benchmarks.fixtures import Fixture
+from src.backend.compression import PAGE_MAP_SUFFIX, compress_file
+from src.backend.node import Node
+from src.backend.record import Record
+from src.database import Database
+from src.dbinfo import DBInfo
+from src.writer import DatabaseWriter
+
+# lookups made by a single run of the lookup benchmarks
+LOOKUPS = 1000
+# rows read and written by the benchmarks that hold them all in memory
+MAX_ROWS = 100_000
+
+@dataclass
+class Case:
+    """
+    Case is one benchmark on one fixture: run is timed against the baseline,
+    sqlite3 unless the benchmark says otherwise, when there is one. setup,
+    when given, runs untimed before each run and its result is passed to run
+    and baseline. info holds figures reported along with the times.
+    """
+    run: Callable
+    baseline: Callable = None
+    setup: Callable = None
+    ops: int = 1
+    cleanup: Callable = None
+    info: dict = None
+
+def header_parse(path: str, fixture: Fixture) -> Case:
+    with open(path, 'rb') as f:
+        header = f.read(100)
+
+    def run(_):
+        for _ in range(LOOKUPS):
+            DBInfo(header)
+
+    # the nearest sqlite does is opening the file, which reads the header
+    def baseline(_):
+        for _ in range(LOOKUPS):
+            connection = sqlite3.connect(path)
+            connection.execute('PRAGMA page_count').fetchone()
+            connection.close()
+
+    return Case(run, baseline, ops=LOOKUPS)
+
+def table_pages(db: Database) -> List[bytes]:
+    tree = db.btree(db.catalog.table('t').root_page)
+    pages = [db.pager.get_page(page_number) for page_number, _ in tree.pages()]
+    return pages[:MAX_ROWS // 10]
+
+def page_parse(path: str, fixture: Fixture) -> Case:
+    db = Database(path)
+    pages = table_pages(db)
+    usable_size = db.dbinfo.usable_size
+    db.close()
+
+    # pages are parsed from memory, there is no sqlite counterpart
+    def run(_):
+        for data in pages:
+            Node(data, False, usable_size).cells
+
+    return Case(run, ops=len(pages))
+
+def full_scan(path: str, fixture: Fixture) -> Case:
+    db = Database(path)
+    connection = sqlite3.connect(path)
+
+    def run(_):
+        for _ in db.execute('SELECT * FROM t'):
+            pass
+
+    def baseline(_):
+        for _ in connection.execute('SELECT * FROM t'):
+            pass
+
+    def cleanup():
+        db.close()
+        connection.close()
+
+    return Case(run, baseline, ops=fixture.rows, cleanup=cleanup)
+
+def lookups(sql: str, keys: List[any]):
+    def benchmark(path: str, fixture: Fixture) -> Case:
+        db = Database(path)
+        connection = sqlite3.connect(path)
+
+        def run(_):
+            for key in keys(fixture):
+                list(db.execute(sql, (key,)))
+
+        def baseline(_):
+            for key in keys(fixture):
+                connection.execute(sql, (key,)).fetchall()
+
+        def cleanup():
+            db.close()
+            connection.close()
+
+        return Case(run, baseline, ops=LOOKUPS, cleanup=cleanup)
+    return benchmark
+
+def random_ids(fixture: Fixture) -> List[int]:
+    rows = random.Random(fixture.rows)
+    return [rows.randint(1, fixture.rows) for _ in range(LOOKUPS)]
+
+def random_values(fixture: Fixture) -> List[int]:
+    values = random.Random(fixture.rows)
+    return [values.randrange(1000) for _ in range(LOOKUPS)]
+
+point_lookup = lookups('SELECT * FROM t WHERE id = ?', random_ids)
+index_lookup = lookups('SELECT id FROM t WHERE a = ?', random_values)
+
+def bulk_write(path: str, fixture: Fixture) -> Case:
+    connection = sqlite3.connect(path)
+    rows = connection.execute(f'SELECT * FROM t LIMIT {MAX_ROWS}').fetchall()
+    connection.close()
+    columns = ', '.join(f'c{i}' for i in range(len(rows[0])))
+    sql = f'CREATE TABLE copy({columns})'
+    placeholders = ', '.join('?' * len(rows[0]))
+    directory = tempfile.mkdtemp(suffix='.bench')
+
+    # each run writes a new table into its own copy of the fixture
+    def setup() -> str:
+        copy = os.path.join(directory, 'copy.db')
+        shutil.copyfile(path, copy)
+        return copy
+
+    def run(copy: str):
+        db = Database(copy)
+        writer = DatabaseWriter(db)
+        try:
+            writer.create_table('copy', sql, rows)
+            writer.commit()
+        finally:
+            writer.close()
+            db.close()
+
+    def baseline(copy: str):
+        connection = sqlite3.connect(copy)
+        connection.execute(sql)
+        connection.executemany(f'INSERT INTO copy VALUES ({placeholders})', rows)
+        connection.commit()
+        connection.close()
+
+    return Case(
+        run,
+        baseline,
+        setup,
+        ops=len(rows),
+        cleanup=lambda: shutil.rmtree(directory),
+    )
+
+def round_trip(path: str, fixture: Fixture) -> Case:
+    db = Database(path)
+    tree = db.btree(db.catalog.table('t').root_page)
+    payloads = []
+    for cell in tree.cells():
+        payloads.append(cell.record.to_bytes())
+        if len(payloads) == MAX_ROWS:
+            break
+    encoding = db.encoding
+    db.close()
+
+    # records are decoded and encoded again in memory, checking the bytes
+    # come back unchanged
+    def run(_):
+        for payload in payloads:
+            values = Record(payload, 0, encoding).values
+            if Record.from_values(values, encoding=encoding).to_bytes() != payload:
+                raise AssertionError('record changed by a round trip')
+
+    return Case(run, ops=len(payloads))
+
+def compressed_scan(codec: str):
+    def benchmark(path: str, fixture: Fixture) -> Case:
+        directory = tempfile.mkdtemp(suffix='.bench')
+        compressed = os.path.join(directory, 'compressed.db')
+        compress_file(path, compressed, codec).close()
+        info = {
+            'file_bytes': os.path.getsize(path),
+            'compressed_bytes': os.path.getsize(compressed) +
+            os.path.getsize(compressed + PAGE_MAP_SUFFIX),
+        }
+
+        # the baseline is the same scan of the plain file, so the ratio is
+        # the cost of decompressing; each run opens the database afresh and
+        # reads every page from the file
+        def scan(file_name: str) -> int:
+            db = Database(file_name)
+            for _ in db.execute('SELECT * FROM t'):
+                pass
+            bytes_read = getattr(db.pager, 'bytes_read', None)
+            db.close()
+            return bytes_read
+
+        def run(_):
+            info['bytes_read'] = scan(compressed)
+
+        return Case(
+            run,
+            lambda _: scan(path),
+            ops=fixture.rows,
+            cleanup=lambda: shutil.rmtree(directory),
+            info=info,
+        )
+    return benchmark
+
+BENCHMARKS: Dict[str, Callable[[str, Fixture], Case]] = {
+    'header_parse': header_parse,
+    'page_parse': page_parse,
+    'full_scan': full_scan,
+    'point_lookup': point_lookup,
+    'index_lookup': index_lookup,
+    'bulk_write': bulk_write,
+    'round_trip': round_trip,
+    'zlib_scan': compressed_scan('zlib'),
+    'lzma_scan': compressed_scan('lzma'),
+}
+
+def applies(name: str, fixture: Fixture) -> bool:
+    # only the narrow shape has an index on a
+    return name != 'index_lookup' or fixture.shape.name == 'narrow'
+
+def measure(function: Callable, setup: Callable, repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+    }
+
+def run_case(name: str, path: str, fixture: Fixture, repeat: int) -> dict:
+    case = BENCHMARKS[name](path, fixture)
+    try:
+        result = {
+            'fixture': fixture.name,
+            'benchmark': name,
+            'ops': case.ops,
+            'seconds': measure(case.run, case.setup, repeat),
+            'baseline': None,
+            'ratio': None,
+        }
+        if case.baseline is not None:
+            result['baseline'] = measure(case.baseline, case.setup, repeat)
+            result['ratio'] = result['seconds']['min'] / result['baseline']['min']
+        if case.info is not None:
+            result['info'] = case.info
+    finally:
+        if case.cleanup is not None:
+            case.cleanup()
+    return result
+
+def compare(previous: List[dict], current: List[dict], threshold: float) -> List[str]:
+    """
+    compare lists the benchmarks whose best time moved by more than
+    threshold, a fraction, between two runs
+    """
+    before = {(r['fixture'], r['benchmark']): r for r in previous}
+    lines = []
+    for result in current:
+        old = before.get((result['fixture'], result['benchmark']))
+        if old is None:
+            continue
+        change = result['seconds']['min'] / old['seconds']['min'] - 1
+        if abs(change) > threshold:
+            kind = 'slower' if change > 0 else 'faster'
+            lines.append(
+                f'{result["fixture"]} {result["benchmark"]}: '
+                f'{abs(change):.1%} {kind}'
+            )
+    return lines
@@ -0,0 +1,324 @@
+import copy
+from typing import Iterator, List, Tuple
+
+from src.backend.cell import local_payload_size
+from src.backend.node import Node, NodeType
+from src.backend.predicate import Predicate
+from src.backend.record import RecordView, sort_key
+from src.util import b2i, varint
+
+# a record of no columns, the header size alone
+EMPTY_RECORD = b'\x01'
+
+class ReorderedView:
+    """
+    ReorderedView reads a record whose columns are stored in another order
+    than the table declares them, as WITHOUT ROWID tables store their
+    primary key columns first. Column i of the view is column positions[i]
+    of the record.
+    """
+    __slots__ = ('view', 'positions', 'encoding')
+
+    def __init__(self, view: RecordView, positions: List[int]):
+        self.view = view
+        self.positions = positions
+        self.encoding = view.encoding
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def serial_type(self, i: int) -> int:
+        return self.view.serial_type(self.positions[i])
+
+    def size(self, i: int) -> int:
+        return self.view.size(self.positions[i])
+
+    def raw(self, i: int) -> bytes:
+        return self.view.raw(self.positions[i])
+
+    def value(self, i: int) -> any:
+        return self.view.value(self.positions[i])
+
+    def values(self, columns: List[int] = None) -> List[any]:
+        if columns is None:
+            columns = range(len(self.positions))
+        positions = self.positions
+        return self.view.values([positions[i] for i in columns])
+
+class BTree:
+    """
+    BTree walks the pages of a single table or index b-tree starting from its
+    root page. Page 1 is always read with the 100 byte database header.
+    """
+    # records are read through views of this class
+    view_class = RecordView
+
+    def __init__(
+        self,
+        pager,
+        root_page: int,
+        usable_size: int = None,
+        encoding: str = 'utf-8',
+    ):
+        self.pager = pager
+        self.root_page = root_page
+        self.usable_size = usable_size
+        self.encoding = encoding
+        # record positions of the columns scan and lookup yield, when they
+        # differ from the order of the record
+        self.positions = None
+
+    def reordered(self, positions: List[int]) -> 'BTree':
+        """
+        reordered returns a copy of the tree whose scans and lookups read
+        column i of each record from position positions[i], or the tree
+        itself when positions is None
+        """
+        if positions is None:
+            return self
+        tree = copy.copy(self)
+        tree.positions = positions
+        return tree
+
+    def row_view(self, node: Node, pointer: int) -> Tuple[int, RecordView]:
+        row_id, view = self.record_view(node, pointer)
+        if self.positions is not None:
+            view = ReorderedView(view, self.positions)
+        return row_id, view
+
+    def node(self, page_number: int) -> Node:
+        data = self.pager.get_page(page_number)
+        cache = getattr(self.pager, 'node_cache', None)
+        if cache is None:
+            return Node(data, page_number == 1, self.usable_size, self.encoding)
+
+        node = cache.get(page_number, data)
+        if node is None or node.usable_size != self.usable_size or \
+                node.encoding != self.encoding:
+            node = Node(data, page_number == 1, self.usable_size, self.encoding)
+            cache.put(page_number, node)
+        return node
+
+    def pages(self) -> Iterator[Tuple[int, Node]]:
+        """
+        pages yields every (page number, node) pair of the tree in key order,
+        each interior node preceding its children
+        """
+        stack = [self.root_page]
+
+        while stack:
+            page_number = stack.pop()
+            node = self.node(page_number)
+            yield page_number, node
+            stack.extend(reversed(node.children()))
+
+    def leaves(self) -> Iterator[Tuple[int, Node]]:
+        for page_number, node in self.pages():
+            if node.is_leaf():
+                yield page_number, node
+
+    def entries(self, start: any = None) -> Iterator[Tuple[Node, int]]:
+        """
+        entries yields a (node, cell pointer) pair for every cell holding a
+        key in key order, leaf cells and, for index trees, the interior cells
+        between the subtrees they separate. Cells are left unparsed.
+
+        When start is given the tree is descended straight to the first key
+        that is not less than start, a rowid for table trees or a tuple of
+        sort_key values compared against the leading columns of index keys.
+        """
+        for node, pointers in self.runs(start):
+            for pointer in pointers:
+                yield node, pointer
+
+    def runs(self, start: any = None) -> Iterator[Tuple[Node, List[int]]]:
+        """
+        runs yields the cells entries does as (node, cell pointers) pairs,
+        the cells of a leaf together and each interior index cell alone
+        """
+        # each entry is a page still to visit or a (node, pointer) to yield
+        stack = [(self.root_page, None, None)]
+        seeking = start is not None
+
+        while stack:
+            page_number, node, pointer = stack.pop()
+
+            if pointer is not None:
+                yield node, [pointer]
+                continue
+
+            node = self.node(page_number)
+            pointers = node.cell_pointers()
+            if seeking:
+                pointers = pointers[self.lower_bound(node, pointers, start):]
+
+            if node.is_leaf():
+                # the descent ends at the first leaf, the rest is a plain walk
+                seeking = False
+                if pointers:
+                    yield node, pointers
+                continue
+
+            stack.append((node.right_pointer, None, None))
+            for interior_pointer in reversed(pointers):
+                if not node.is_table():
+                    stack.append((None, node, interior_pointer))
+                left_child = b2i(node.data[interior_pointer:interior_pointer + 4])
+                stack.append((left_child, None, None))
+
+    def cell_key(self, node: Node, pointer: int, length: int = None) -> any:
+        """
+        cell_key returns the key of a cell, the rowid for table trees or the
+        sort keys of the first length columns for index trees
+        """
+        if node.node_type == NodeType.TABLE_LEAF:
+            _, cursor = varint(node.data, pointer)
+            return varint(node.data, cursor)[0]
+        elif node.node_type == NodeType.TABLE_INTERIOR:
+            return varint(node.data, pointer + 4)[0]
+
+        _, view = self.record_view(node, pointer)
+        return tuple(sort_key(value) for value in view.values(range(length)))
+
+    def lower_bound(self, node: Node, pointers: List[int], start: any) -> int:
+        """
+        lower_bound binary searches a node for the first cell whose key is
+        not less than start
+        """
+        length = None if node.is_table() else len(start)
+        low, high = 0, len(pointers)
+
+        while low < high:
+            middle = (low + high) // 2
+            if self.cell_key(node, pointers[middle], length) < start:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def cells(self) -> Iterator[any]:
+        """
+        cells yields the leaf cells of the tree in key order with any overflow
+        content loaded, interior index cells are yielded between the subtrees
+        they separate
+        """
+        for node, pointer in self.entries():
+            yield self.load(node.read_cell(node.data, pointer))
+
+    def load(self, cell: any) -> any:
+        if getattr(cell, 'overflow_page', None) is not None:
+            cell.load_overflow(self.pager, self.usable_size)
+        return cell
+
+    def record_view(self, node: Node, pointer: int) -> Tuple[int, RecordView]:
+        """
+        record_view reads the row id and the record header of a cell without
+        decoding any values, the row id is None for index cells
+        """
+        row_id, data, cursor = self.cell_payload(node, pointer)
+        return row_id, self.view_class(data, cursor, self.encoding)
+
+    def cell_payload(self, node: Node, pointer: int) -> Tuple[int, bytes, int]:
+        """
+        cell_payload returns the row id of a cell, None for index cells, and
+        the data holding its record with the offset the record starts at,
+        the page itself unless the record spills onto overflow pages
+        """
+        data = node.data
+        row_id = None
+
+        if node.node_type == NodeType.INDEX_INTERIOR:
+            payload_size, cursor = varint(data, pointer + 4)
+        else:
+            payload_size, cursor = varint(data, pointer)
+        if node.node_type == NodeType.TABLE_LEAF:
+            row_id, cursor = varint(data, cursor)
+
+        local_size = payload_size
+        if self.usable_size is not None:
+            local_size = local_payload_size(
+                payload_size,
+                self.usable_size,
+                node.node_type == NodeType.TABLE_LEAF,
+            )
+
+        if local_size < payload_size:
+            cell = node.read_cell(data, pointer)
+            return row_id, self.full_payload(cell), 0
+        return row_id, data, cursor
+
+    def full_payload(self, cell: any) -> bytes:
+        payload, _ = cell.full_payload(self.pager, self.usable_size)
+        return payload
+
+    def scan(
+        self,
+        predicate: Predicate = None,
+        columns: List[int] = None,
+        start: any = None,
+    ) -> Iterator[Tuple[int, List[any]]]:
+        """
+        scan yields a (row id, values) pair for every row matching predicate,
+        in key order and beginning at start when given. The predicate runs
+        against the raw record so that only the columns it refers to are
+        decoded, and only matching rows have the requested columns decoded.
+        The row id is None for index trees.
+        """
+        for node, pointer in self.entries(start):
+            row_id, view = self.row_view(node, pointer)
+            if predicate is None or predicate.evaluate(view):
+                yield row_id, view.values(columns)
+
+    def scan_batches(
+        self,
+        predicate: Predicate = None,
+        columns: List[int] = None,
+        start: any = None,
+    ) -> Iterator[List[Tuple[int, List[any]]]]:
+        """
+        scan_batches yields the rows scan does a leaf at a time, as a list of
+        (row id, values) pairs decoded in one pass over the leaf. Leaves with
+        no matching row yield nothing. A single view is pointed at the
+        record of each cell in turn, so no view is made per row.
+        """
+        view = self.view_class(EMPTY_RECORD, 0, self.encoding)
+        reader = view
+        if self.positions is not None:
+            reader = ReorderedView(view, self.positions)
+        cell_payload = self.cell_payload
+        for node, pointers in self.runs(start):
+            batch = []
+            for pointer in pointers:
+                row_id, data, cursor = cell_payload(node, pointer)
+                view.reset(data, cursor)
+                if predicate is None or predicate.evaluate(reader):
+                    batch.append((row_id, reader.values(columns)))
+            if batch:
+                yield batch
+
+    def lookup(
+        self,
+        key: any,
+        predicate: Predicate = None,
+        columns: List[int] = None,
+    ) -> List[any]:
+        """
+        lookup descends a tree to a single row, returning its values or None
+        when the row does not exist or does not match predicate. The key is a
+        rowid for table trees or the sort keys of the leading record columns
+        for index trees, the primary key of a WITHOUT ROWID table.
+        """
+        for node, pointer in self.entries(key):
+            found_id, view = self.record_view(node, pointer)
+            if node.is_table():
+                if found_id != key:
+                    return None
+            elif tuple(sort_key(v) for v in view.values(range(len(key)))) != key:
+                return None
+            if self.positions is not None:
+                view = ReorderedView(view, self.positions)
+            if predicate is not None and not predicate.evaluate(view):
+                return None
+            return view.values(columns)
+        return None
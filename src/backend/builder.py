@@ -0,0 +1,288 @@
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple
+
+from src.backend.cell import local_payload_size
+from src.backend.node import NodeType
+from src.backend.record import Record
+from src.util import to_varint, varint_size, write_varint
+
+# size of the page header of leaf and interior pages
+LEAF_HEADER_SIZE = 8
+INTERIOR_HEADER_SIZE = 12
+
+@dataclass
+class Entry:
+    """
+    Entry is a payload prepared for a page, the part stored in the cell and
+    the first page of the overflow chain holding the rest
+    """
+    payload_size: int
+    local: bytes
+    overflow_page: int = 0
+
+    def payload_bytes(self) -> bytes:
+        data = to_varint(self.payload_size) + self.local
+        if self.overflow_page:
+            data += self.overflow_page.to_bytes(4)
+        return data
+
+class RecordCell:
+    """
+    RecordCell is a table leaf cell whose record fits on the page, kept as
+    the record until its node is written so that it is encoded straight
+    into the page
+    """
+    __slots__ = ('record', 'row_id', 'payload_size', 'size')
+
+    def __init__(self, record: Record, row_id: int):
+        self.record = record
+        self.row_id = row_id
+        self.payload_size = record.size()
+        self.size = varint_size(self.payload_size) + varint_size(row_id) + \
+            self.payload_size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def encode_into(self, buf: bytearray, offset: int) -> int:
+        offset = write_varint(buf, offset, self.payload_size)
+        offset = write_varint(buf, offset, self.row_id)
+        return self.record.encode_into(buf, offset)
+
+@dataclass
+class Level:
+    """
+    Level is the node being filled on one level of the tree, the cells so far
+    with the child each cell points to and the separator pushed up past it
+    """
+    cells: List[bytes] = field(default_factory=list)
+    # (child page, separator) for each cell of interior levels
+    children: List[Tuple[int, any]] = field(default_factory=list)
+    size: int = 0
+    # whether a node of this level was written, the top level is not
+    flushed: bool = False
+
+class BTreeBuilder:
+    """
+    BTreeBuilder writes a b-tree bottom up from entries added in key order.
+    Leaves are filled to fill_factor of the usable space and written as soon
+    as the next entry does not fit, the keys that separate them are pushed
+    into the level above, which is filled and written the same way. The node
+    left on the top level is written to root_page, so the tree can replace
+    the contents of an existing root page. Pages for the other nodes and
+    for overflow chains come from allocate.
+
+    Table trees take (rowid, payload) pairs, or records with add_record.
+    Index trees take payloads only, an index entry separating two leaves
+    moves up into the interior node rather than being copied.
+    """
+    def __init__(
+        self,
+        pager,
+        root_page: int,
+        allocate: Callable[[], int],
+        usable_size: int,
+        table: bool = True,
+        fill_factor: float = 1.0,
+    ):
+        if not 0 < fill_factor <= 1:
+            raise ValueError('fill_factor must be in (0, 1]')
+
+        self.pager = pager
+        self.root_page = root_page
+        self.allocate = allocate
+        self.usable_size = usable_size
+        self.page_size = pager.page_size
+        self.table = table
+        self.fill_factor = fill_factor
+
+        # the database header takes the first 100 bytes of page 1, every
+        # node is sized as if it could end up on page 1
+        self.header_offset = 100 if root_page == 1 else 0
+        self.space = usable_size - self.header_offset
+
+        self.levels = [Level()]
+        self.last_key = None
+        self.entries = 0
+        self.pages_written = 0
+
+    def entry(self, payload: bytes, is_table_leaf: bool) -> Entry:
+        """
+        entry keeps as much of a payload as fits in a cell and writes the
+        rest to a chain of overflow pages
+        """
+        local_size = local_payload_size(len(payload), self.usable_size, is_table_leaf)
+        if local_size == len(payload):
+            return Entry(len(payload), payload)
+
+        chunk = self.usable_size - 4
+        rest = payload[local_size:]
+        pages = [self.allocate() for _ in range(0, len(rest), chunk)]
+        for i, page_number in enumerate(pages):
+            next_page = pages[i + 1] if i + 1 < len(pages) else 0
+            data = next_page.to_bytes(4) + rest[i * chunk:(i + 1) * chunk]
+            self.write(page_number, data + bytes(self.page_size - len(data)))
+        return Entry(len(payload), payload[:local_size], pages[0])
+
+    def add(self, payload: bytes, row_id: int = None):
+        if self.table:
+            if self.last_key is not None and row_id <= self.last_key:
+                raise ValueError(f'rowid {row_id} is not greater than {self.last_key}')
+            entry = self.entry(payload, True)
+            cell = to_varint(entry.payload_size) + to_varint(row_id) + \
+                entry.local
+            if entry.overflow_page:
+                cell += entry.overflow_page.to_bytes(4)
+            self.add_leaf_cell(cell, row_id)
+        else:
+            entry = self.entry(payload, False)
+            self.add_leaf_cell(entry.payload_bytes(), entry)
+        self.last_key = row_id
+        self.entries += 1
+
+    def add_record(self, record: Record, row_id: int):
+        """
+        add_record adds a table row from its record. A record that fits in
+        its cell is encoded once, into the page of its leaf, others go
+        through add.
+        """
+        size = record.size()
+        if local_payload_size(size, self.usable_size, True) < size:
+            return self.add(record.to_bytes(), row_id)
+        if self.last_key is not None and row_id <= self.last_key:
+            raise ValueError(f'rowid {row_id} is not greater than {self.last_key}')
+        self.add_leaf_cell(RecordCell(record, row_id), row_id)
+        self.last_key = row_id
+        self.entries += 1
+
+    def fits(self, level: Level, cell: bytes, leaf: bool) -> bool:
+        header = LEAF_HEADER_SIZE if leaf else INTERIOR_HEADER_SIZE
+        space = self.space * self.fill_factor if leaf else self.space
+        size = header + level.size + len(cell) + 2 * (len(level.cells) + 1)
+        return size <= space
+
+    def add_leaf_cell(self, cell: bytes, key: any):
+        level = self.levels[0]
+        # an index leaf gives up an entry when it is written, so it needs two
+        minimum = 1 if self.table else 2
+        if len(level.cells) >= minimum and not self.fits(level, cell, True):
+            if self.table:
+                # the largest rowid of a leaf separates it from the next one
+                page_number = self.write_node(level, 0)
+                self.add_child(1, page_number, level.children[-1][1])
+                self.reset(level)
+            else:
+                # the last entry of the leaf moves up between the two leaves,
+                # so both leaves keep at least one entry
+                separator = level.children.pop()[1]
+                level.size -= len(level.cells.pop())
+                page_number = self.write_node(level, 0)
+                self.add_child(1, page_number, separator)
+                self.reset(level)
+
+        level.cells.append(cell)
+        level.children.append((None, key))
+        level.size += len(cell)
+
+    def interior_cell(self, child: int, separator: any) -> bytes:
+        if self.table:
+            return child.to_bytes(4) + to_varint(separator)
+        return child.to_bytes(4) + separator.payload_bytes()
+
+    def add_child(self, depth: int, child: int, separator: any):
+        """
+        add_child adds a node written on the level below to the node being
+        filled on this level, writing this node out first when the new cell
+        does not fit. A written interior node keeps its last child as the
+        right pointer and its separator moves up.
+        """
+        if depth == len(self.levels):
+            self.levels.append(Level())
+        level = self.levels[depth]
+
+        cell = self.interior_cell(child, separator)
+        if len(level.cells) > 1 and not self.fits(level, cell, False):
+            right_child, right_separator = level.children.pop()
+            level.size -= len(level.cells.pop())
+            page_number = self.write_node(level, depth, right_child)
+            self.add_child(depth + 1, page_number, right_separator)
+            self.reset(level)
+
+        level.cells.append(cell)
+        level.children.append((child, separator))
+        level.size += len(cell)
+
+    def reset(self, level: Level):
+        level.cells = []
+        level.children = []
+        level.size = 0
+        level.flushed = True
+
+    def finish(self) -> int:
+        """
+        finish writes the nodes still being filled from the leaves up, the
+        last node of each level becoming the right pointer of the node above,
+        and returns the root page. The first level that never had to write a
+        node holds the root.
+        """
+        right_child = None
+        for depth, level in enumerate(self.levels):
+            if not level.flushed:
+                return self.write_node(level, depth, right_child, self.root_page)
+            right_child = self.write_node(level, depth, right_child)
+
+        raise AssertionError('the top level of a b-tree is never written early')
+
+    def write_node(
+        self,
+        level: Level,
+        depth: int,
+        right_child: int = None,
+        page_number: int = None,
+    ) -> int:
+        """
+        write_node lays out a node with its cell pointers after the header
+        and its cells packed at the end of the usable space
+        """
+        if page_number is None:
+            page_number = self.allocate()
+
+        leaf = depth == 0
+        if self.table:
+            node_type = NodeType.TABLE_LEAF if leaf else NodeType.TABLE_INTERIOR
+        else:
+            node_type = NodeType.INDEX_LEAF if leaf else NodeType.INDEX_INTERIOR
+
+        page = bytearray(self.page_size)
+        offset = 100 if page_number == 1 else 0
+        if page_number == 1:
+            page[:100] = self.pager.get_page(1)[:100]
+
+        content = self.usable_size
+        pointers = bytearray()
+        for cell in level.cells:
+            content -= len(cell)
+            if isinstance(cell, RecordCell):
+                cell.encode_into(page, content)
+            else:
+                page[content:content + len(cell)] = cell
+            pointers += content.to_bytes(2)
+
+        header = bytearray(node_type.value.to_bytes(1))
+        header += (0).to_bytes(2)
+        header += len(level.cells).to_bytes(2)
+        header += (content % 65536).to_bytes(2)
+        header += (0).to_bytes(1)
+        if not leaf:
+            header += right_child.to_bytes(4)
+
+        page[offset:offset + len(header)] = header
+        start = offset + len(header)
+        page[start:start + len(pointers)] = pointers
+
+        self.write(page_number, bytes(page))
+        return page_number
+
+    def write(self, page_number: int, data: bytes):
+        self.pager.write_page(page_number, data)
+        self.pages_written += 1
@@ -0,0 +1,361 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Union
+
+# the first byte of the b-tree page header of interior table and index pages
+INTERIOR_PAGE_TYPES = (0x05, 0x02)
+
+# memory parsed nodes are budgeted for besides their page, about 16 MiB
+DEFAULT_NODE_CACHE_SIZE = 16 * 1024 * 1024
+# memory assumed for a parsed node and for each of its cell pointers; cells
+# parsed by the few callers asking for Node.cells are not counted
+NODE_OVERHEAD = 200
+POINTER_OVERHEAD = 40
+
+# share of the capacity pinned pages may take before the least recently
+# used of them are handed to the policy as ordinary pages
+DEFAULT_PIN_FRACTION = 0.25
+
+def is_pinned(page_number: int, data: bytes) -> bool:
+    """
+    is_pinned tells whether a page is kept apart from the pages a scan runs
+    through: page 1, holding the header and the root of sqlite_schema, and
+    the interior pages of every b-tree, which each lookup descends through
+    """
+    return page_number == 1 or (len(data) > 0 and data[0] in INTERIOR_PAGE_TYPES)
+
+class CachePolicy:
+    """
+    CachePolicy decides which of the pages loaded by a Pager stay in memory,
+    holding at most capacity of them. The pager calls it holding its mutex.
+
+    Page 1 and interior b-tree pages are pinned: they are kept in a region
+    of their own, taking up to pin_fraction of the capacity, and never
+    evicted for the other pages. Only when the pinned pages outgrow their
+    region is the least recently used of them handed to the policy like any
+    other page. Subclasses implement the policy for the remaining pages with
+    get_page, insert, remove, resident and reset.
+    """
+    pin_fraction = 0.0
+
+    def __init__(self, capacity: int, pin_fraction: float = None):
+        if pin_fraction is None:
+            pin_fraction = self.pin_fraction
+        if not 0 <= pin_fraction < 1:
+            raise ValueError('pin_fraction must be in [0, 1)')
+        self.capacity = capacity
+        self.pin_limit = int(capacity * pin_fraction)
+        self.pinned = OrderedDict()
+
+    def room(self) -> int:
+        # the pages the policy itself may hold
+        return self.capacity - len(self.pinned)
+
+    def get(self, page_number: int) -> bytes:
+        """
+        get returns a cached page, counting the access, or None
+        """
+        data = self.pinned.get(page_number)
+        if data is not None:
+            self.pinned.move_to_end(page_number)
+            return data
+        return self.get_page(page_number)
+
+    def peek(self, page_number: int) -> bytes:
+        """
+        peek returns a cached page without counting the access
+        """
+        data = self.pinned.get(page_number)
+        if data is None:
+            data = self.resident().get(page_number)
+        return data
+
+    def put(self, page_number: int, data: bytes):
+        self.pop(page_number)
+        if self.pin_limit == 0 or not is_pinned(page_number, data):
+            self.insert(page_number, data)
+            return
+
+        self.pinned[page_number] = data
+        if len(self.pinned) > self.pin_limit:
+            demoted, demoted_data = self.pinned.popitem(last=False)
+            self.insert(demoted, demoted_data)
+        else:
+            # the region grew into the room of the policy
+            self.shrink()
+
+    def pop(self, page_number: int):
+        if self.pinned.pop(page_number, None) is None:
+            self.remove(page_number)
+
+    def clear(self):
+        self.pinned.clear()
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self.pinned) + len(self.resident())
+
+    def __contains__(self, page_number: int) -> bool:
+        return page_number in self.pinned or page_number in self.resident()
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self.pinned
+        yield from self.resident()
+
+    def get_page(self, page_number: int) -> bytes:
+        raise NotImplementedError
+
+    def insert(self, page_number: int, data: bytes):
+        raise NotImplementedError
+
+    def remove(self, page_number: int):
+        raise NotImplementedError
+
+    def shrink(self):
+        raise NotImplementedError
+
+    def resident(self) -> Dict[int, bytes]:
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+class LRUCache(CachePolicy):
+    """
+    LRUCache evicts the least recently used page. A scan longer than the
+    cache pushes out every other page, so it pins nothing by default.
+    """
+    def __init__(self, capacity: int, pin_fraction: float = None):
+        super().__init__(capacity, pin_fraction)
+        self.pages = OrderedDict()
+
+    def get_page(self, page_number: int) -> bytes:
+        data = self.pages.get(page_number)
+        if data is not None:
+            self.pages.move_to_end(page_number)
+        return data
+
+    def insert(self, page_number: int, data: bytes):
+        self.pages[page_number] = data
+        self.shrink()
+
+    def remove(self, page_number: int):
+        self.pages.pop(page_number, None)
+
+    def shrink(self):
+        while self.pages and len(self.pages) > self.room():
+            self.pages.popitem(last=False)
+
+    def resident(self) -> Dict[int, bytes]:
+        return self.pages
+
+    def reset(self):
+        self.pages.clear()
+
+class ARCCache(CachePolicy):
+    """
+    ARCCache is an adaptive replacement cache. Pages seen once are kept in
+    t1 and pages seen again in t2, both in recency order, while b1 and b2
+    remember the numbers of the pages recently evicted from each. A miss on
+    a page remembered in b1 shows t1 was evicting too early and grows its
+    target size p, a miss remembered in b2 shrinks it. A scan only ever
+    passes through t1, so the pages used again and again stay in t2, and
+    interior pages and page 1 are pinned besides.
+    """
+    pin_fraction = DEFAULT_PIN_FRACTION
+
+    def __init__(self, capacity: int, pin_fraction: float = None):
+        super().__init__(capacity, pin_fraction)
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.p = 0
+
+    def get_page(self, page_number: int) -> bytes:
+        data = self.t1.pop(page_number, None)
+        if data is not None:
+            self.t2[page_number] = data
+            return data
+        data = self.t2.get(page_number)
+        if data is not None:
+            self.t2.move_to_end(page_number)
+        return data
+
+    def insert(self, page_number: int, data: bytes):
+        room = self.room()
+        if room <= 0:
+            return
+
+        if page_number in self.b1:
+            self.p = min(room, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[page_number]
+            self.evict(room - 1, False)
+            self.t2[page_number] = data
+        elif page_number in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[page_number]
+            self.evict(room - 1, True)
+            self.t2[page_number] = data
+        else:
+            self.evict(room - 1, False)
+            self.t1[page_number] = data
+
+        # t1 and b1 together remember at most room pages, all four lists
+        # twice that
+        while self.b1 and len(self.t1) + len(self.b1) > room:
+            self.b1.popitem(last=False)
+        while self.b2 and len(self.t1) + len(self.t2) + len(self.b1) + \
+                len(self.b2) > 2 * room:
+            self.b2.popitem(last=False)
+
+    def evict(self, limit: int, in_b2: bool):
+        """
+        evict moves pages from the lru end of t1 or t2 to their ghost list
+        until at most limit pages are cached, taking from t1 while it is
+        larger than its target
+        """
+        while len(self.t1) + len(self.t2) > limit:
+            t1 = len(self.t1)
+            if self.t1 and (t1 > self.p or (in_b2 and t1 == self.p) or not self.t2):
+                page_number, _ = self.t1.popitem(last=False)
+                self.b1[page_number] = None
+            else:
+                page_number, _ = self.t2.popitem(last=False)
+                self.b2[page_number] = None
+
+    def remove(self, page_number: int):
+        if self.t1.pop(page_number, None) is None:
+            self.t2.pop(page_number, None)
+
+    def shrink(self):
+        self.evict(self.room(), False)
+
+    def resident(self) -> Dict[int, bytes]:
+        return ResidentPages(self.t1, self.t2)
+
+    def reset(self):
+        for pages in (self.t1, self.t2, self.b1, self.b2):
+            pages.clear()
+        self.p = 0
+
+class ResidentPages:
+    """
+    ResidentPages is a read only view of the cached pages of an ARCCache, in
+    t1 and then in t2
+    """
+    def __init__(self, t1: OrderedDict, t2: OrderedDict):
+        self.t1 = t1
+        self.t2 = t2
+
+    def get(self, page_number: int) -> bytes:
+        data = self.t1.get(page_number)
+        return self.t2.get(page_number) if data is None else data
+
+    def __len__(self) -> int:
+        return len(self.t1) + len(self.t2)
+
+    def __contains__(self, page_number: int) -> bool:
+        return page_number in self.t1 or page_number in self.t2
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self.t1
+        yield from self.t2
+
+CACHE_POLICIES: Dict[str, Callable[[int], CachePolicy]] = {
+    'lru': LRUCache,
+    'arc': ARCCache,
+}
+
+def make_cache(policy: Union[str, Callable[[int], CachePolicy]], capacity: int):
+    """
+    make_cache builds the cache of a pager from the name of a policy or a
+    callable taking the capacity
+    """
+    if isinstance(policy, str):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f'unknown cache policy {policy}')
+        policy = CACHE_POLICIES[policy]
+    return policy(capacity)
+
+class NodeCache:
+    """
+    NodeCache keeps the Node parsed from each page, so that b-tree visits to
+    hot pages skip parsing the page header, the cell pointers and, once they
+    have been read, the cells. An entry is only used for the page bytes it
+    was parsed from: a reader resolving a page to another version of it, as
+    a snapshot reader does, parses that version afresh. The pager discards
+    the entry of every page it writes, so that no node outlives the page it
+    describes.
+
+    Entries are evicted least recently used first once their estimated size,
+    page included, passes budget bytes. hits and misses count the nodes
+    found and parsed, invalidations the entries discarded by writes and
+    evictions the entries dropped for room.
+    """
+    def __init__(self, budget: int = DEFAULT_NODE_CACHE_SIZE):
+        self.budget = budget
+        self.size = 0
+        # page number to (node, estimated size)
+        self.nodes = OrderedDict()
+        self.mutex = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, page_number: int, data: bytes) -> any:
+        """
+        get returns the node parsed from data for the page, or None
+        """
+        with self.mutex:
+            entry = self.nodes.get(page_number)
+            if entry is not None:
+                node = entry[0]
+                # pages reread from the file are equal but not the same bytes
+                if node.data is data or node.data == data:
+                    self.nodes.move_to_end(page_number)
+                    self.hits += 1
+                    return node
+            self.misses += 1
+            return None
+
+    def put(self, page_number: int, node: any):
+        cost = len(node.data) + NODE_OVERHEAD + node.num_cells * POINTER_OVERHEAD
+        if cost > self.budget:
+            return
+        with self.mutex:
+            self.remove(page_number)
+            self.nodes[page_number] = (node, cost)
+            self.size += cost
+            while self.size > self.budget:
+                _, (_, evicted) = self.nodes.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def remove(self, page_number: int) -> bool:
+        # called holding the mutex
+        entry = self.nodes.pop(page_number, None)
+        if entry is None:
+            return False
+        self.size -= entry[1]
+        return True
+
+    def discard(self, first: int, last: int = None):
+        """
+        discard drops the nodes of the pages first to last, written since
+        they were parsed
+        """
+        with self.mutex:
+            for page_number in range(first, (first if last is None else last) + 1):
+                if self.remove(page_number):
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.mutex:
+            self.nodes.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.nodes)
@@ -1,30 +1,325 @@
+from struct import Struct
+from typing import List, Tuple
+
 from src.backend.record import Record
-from src.util import to_varint, varint
+from src.util import b2i, varint, varint_size, write_varint
+
+# page numbers within cells, the left child and the first overflow page
+UINT32 = Struct('>I')
+
+def local_payload_size(
+    payload_size: int,
+    usable_size: int,
+    is_table_leaf: bool,
+) -> int:
+    """
+    local_payload_size calculates how many bytes of a payload are stored on
+    the b-tree page itself, the remainder spills onto overflow pages
+
+    it takes the following parameters
+     - payload_size: total size of the payload in bytes
+     - usable_size: page size less the reserved space at the end of each page
+     - is_table_leaf: table leaf pages use a different maximum than index pages
+
+    and returns the number of payload bytes stored locally
+    """
+    if is_table_leaf:
+        max_local = usable_size - 35
+    else:
+        max_local = ((usable_size - 12) * 64 // 255) - 23
+
+    if payload_size <= max_local:
+        return payload_size
+
+    min_local = ((usable_size - 12) * 32 // 255) - 23
+    k = min_local + ((payload_size - min_local) % (usable_size - 4))
+    return k if k <= max_local else min_local
+
+def read_overflow(
+    pager,
+    page_number: int,
+    size: int,
+    usable_size: int,
+) -> Tuple[bytes, List[int]]:
+    """
+    read_overflow follows a chain of overflow pages
+
+    it takes the following parameters
+     - pager: pager to read the overflow pages from
+     - page_number: the first overflow page of the chain
+     - size: number of payload bytes stored on the overflow pages
+     - usable_size: page size less the reserved space at the end of each page
+
+    and returns a tuple containing
+    - the payload bytes stored on the overflow pages
+    - the page numbers of the chain in the order they were visited
+    """
+    content = bytearray()
+    pages = []
+
+    while size > 0:
+        if page_number == 0:
+            raise ValueError(f'overflow chain ends with {size} bytes remaining')
+
+        data = pager.get_page(page_number)
+        pages.append(page_number)
+
+        length = min(size, usable_size - 4)
+        content += data[4:4 + length]
+        size -= length
+        page_number = b2i(data[0:4])
+
+    return bytes(content), pages
+
+def encode(cell: any) -> bytes:
+    """
+    encode returns the bytes of a cell, sized exactly before it is written
+    """
+    data = bytearray(cell.size())
+    cell.encode_into(data, 0)
+    return bytes(data)
+
+class PayloadCell:
+    """
+    PayloadCell holds the parsing shared by the cell types that carry a record
+    payload, which may spill onto overflow pages when usable_size is known.
+    When usable_size is not provided the payload is assumed to be fully local.
+    The local part of the payload is not copied out of the page, payload
+    slices it when asked for.
+    """
+    __slots__ = (
+        'pointer', 'cursor', 'payload_size', 'overflow_page', 'encoding',
+        'data', 'payload_start', 'local_size', 'record',
+    )
+
+    def read_payload(
+        self,
+        data: bytes,
+        cursor: int,
+        usable_size: int,
+        is_table_leaf: bool,
+        encoding: str,
+    ) -> int:
+        self.overflow_page = None
+        self.encoding = encoding
+        local_size = self.payload_size
+
+        if usable_size is not None:
+            local_size = local_payload_size(
+                self.payload_size,
+                usable_size,
+                is_table_leaf,
+            )
+
+        self.data = data
+        self.payload_start = cursor
+        self.local_size = local_size
+        end = cursor + local_size
+
+        if local_size < self.payload_size:
+            self.overflow_page = b2i(data[end:end + 4])
+            self.record = None
+            end += 4
+        else:
+            self.record = Record(data, cursor, encoding)
+
+        return end
+
+    @property
+    def payload(self) -> bytes:
+        return bytes(self.data[self.payload_start:self.payload_start + self.local_size])
+
+    def has_overflow(self) -> bool:
+        return self.overflow_page is not None
+
+    def load_overflow(self, pager, usable_size: int) -> List[int]:
+        """
+        load_overflow reads the overflowing part of the payload, after which
+        the record is available. It returns the overflow page numbers read.
+        """
+        if not self.has_overflow() or self.record is not None:
+            return []
+
+        payload, pages = self.full_payload(pager, usable_size)
+        self.record = Record(payload, 0, self.encoding)
+        return pages
+
+    def full_payload(self, pager, usable_size: int) -> Tuple[bytes, List[int]]:
+        """
+        full_payload returns the whole payload, including the part stored on
+        overflow pages, along with the overflow page numbers read
+        """
+        if not self.has_overflow():
+            return self.payload, []
+
+        remaining = self.payload_size - self.local_size
+        content, pages = read_overflow(
+            pager,
+            self.overflow_page,
+            remaining,
+            usable_size,
+        )
+        return self.payload + content, pages
+
+    def payload_length(self) -> int:
+        # a fully local payload is written from its record, which may encode
+        # to a different size than it was read with
+        return self.payload_size if self.has_overflow() else self.record.size()
+
+    def local_length(self) -> int:
+        if self.has_overflow():
+            # the cell is written back unchanged with its overflow pointer
+            return self.local_size + 4
+        return self.record.size()
+
+    def encode_payload_into(self, buf: bytearray, offset: int) -> int:
+        if self.has_overflow():
+            start, end = self.payload_start, offset + self.local_size
+            buf[offset:end] = self.data[start:start + self.local_size]
+            UINT32.pack_into(buf, end, self.overflow_page)
+            return end + 4
+        return self.record.encode_into(buf, offset)
+
+    def to_bytes(self) -> bytes:
+        return encode(self)
+
+class TableLeafCell(PayloadCell):
+    __slots__ = ('row_id',)
 
-class TableLeafCell:
     def __init__(
         self,
         data: bytes,
         pointer: int,
+        usable_size: int = None,
+        encoding: str = 'utf-8',
     ):
         self.pointer = pointer
         cursor = pointer
         self.payload_size, cursor = varint(data, cursor)
         self.row_id, cursor = varint(data, cursor)
 
-        self.payload = data[cursor:cursor+self.payload_size]
-        self.record = Record(data, cursor)
-        self.cursor = cursor + self.payload_size
+        self.cursor = self.read_payload(
+            data,
+            cursor,
+            usable_size,
+            True,
+            encoding,
+        )
+
+    def size(self) -> int:
+        return varint_size(self.payload_length()) + varint_size(self.row_id) + \
+            self.local_length()
 
-    def to_bytes(self):
-        payload = self.record.to_bytes()
-        payload_size_bytes = to_varint(len(payload))
-        row_id_bytes = to_varint(self.row_id)
-        return payload_size_bytes + row_id_bytes + payload
+    def encode_into(self, buf: bytearray, offset: int) -> int:
+        offset = write_varint(buf, offset, self.payload_length())
+        offset = write_varint(buf, offset, self.row_id)
+        return self.encode_payload_into(buf, offset)
 
     def _debug(self):
         print('cell at index', self.pointer)
         print('payload size', self.payload_size)
         print('row id', self.row_id)
-        self.record._debug()
+        if self.record is not None:
+            self.record._debug()
+        print('\n')
+
+class TableInteriorCell:
+    __slots__ = ('pointer', 'left_child', 'row_id', 'cursor')
+
+    def __init__(
+        self,
+        data: bytes,
+        pointer: int,
+    ):
+        self.pointer = pointer
+        self.left_child = b2i(data[pointer:pointer + 4])
+        self.row_id, self.cursor = varint(data, pointer + 4)
+
+    def size(self) -> int:
+        return 4 + varint_size(self.row_id)
+
+    def encode_into(self, buf: bytearray, offset: int) -> int:
+        UINT32.pack_into(buf, offset, self.left_child)
+        return write_varint(buf, offset + 4, self.row_id)
+
+    def to_bytes(self) -> bytes:
+        return encode(self)
+
+    def _debug(self):
+        print('cell at index', self.pointer)
+        print('left child', self.left_child)
+        print('row id', self.row_id)
+        print('\n')
+
+class IndexLeafCell(PayloadCell):
+    __slots__ = ()
+
+    def __init__(
+        self,
+        data: bytes,
+        pointer: int,
+        usable_size: int = None,
+        encoding: str = 'utf-8',
+    ):
+        self.pointer = pointer
+        self.payload_size, cursor = varint(data, pointer)
+
+        self.cursor = self.read_payload(
+            data,
+            cursor,
+            usable_size,
+            False,
+            encoding,
+        )
+
+    def size(self) -> int:
+        return varint_size(self.payload_length()) + self.local_length()
+
+    def encode_into(self, buf: bytearray, offset: int) -> int:
+        offset = write_varint(buf, offset, self.payload_length())
+        return self.encode_payload_into(buf, offset)
+
+    def _debug(self):
+        print('cell at index', self.pointer)
+        print('payload size', self.payload_size)
+        if self.record is not None:
+            self.record._debug()
+        print('\n')
+
+class IndexInteriorCell(PayloadCell):
+    __slots__ = ('left_child',)
+
+    def __init__(
+        self,
+        data: bytes,
+        pointer: int,
+        usable_size: int = None,
+        encoding: str = 'utf-8',
+    ):
+        self.pointer = pointer
+        self.left_child = b2i(data[pointer:pointer + 4])
+        self.payload_size, cursor = varint(data, pointer + 4)
+
+        self.cursor = self.read_payload(
+            data,
+            cursor,
+            usable_size,
+            False,
+            encoding,
+        )
+
+    def size(self) -> int:
+        return 4 + varint_size(self.payload_length()) + self.local_length()
+
+    def encode_into(self, buf: bytearray, offset: int) -> int:
+        UINT32.pack_into(buf, offset, self.left_child)
+        offset = write_varint(buf, offset + 4, self.payload_length())
+        return self.encode_payload_into(buf, offset)
+
+    def _debug(self):
+        print('cell at index', self.pointer)
+        print('left child', self.left_child)
+        print('payload size', self.payload_size)
+        if self.record is not None:
+            self.record._debug()
         print('\n')
@@ -0,0 +1,317 @@
+import lzma
+import os
+import struct
+import threading
+import zlib
+from array import array
+from typing import Callable, Dict, Tuple
+
+from src.backend.pager import CHANGE_COUNTER, DEFAULT_CACHE_SIZE, OpenFile, Pager
+from src.dbinfo import DBInfo
+
+DB_HEADER_SIZE = 100
+
+# the data file starts with this magic, so that sqlite refuses the file
+# rather than reading compressed pages as a database
+DATA_MAGIC = b'SQLite zpages 1\0'
+MAP_MAGIC = b'SQLite zpagemap\0'
+PAGE_MAP_SUFFIX = '-pagemap'
+
+# magic, page size, codec, level and page count of the page map, followed by
+# an (offset, length) extent for every page
+MAP_HEADER = struct.Struct('>16sIBBxxQ')
+EXTENT = struct.Struct('>QI')
+PAGE_COUNT = struct.Struct('>Q')
+PAGE_COUNT_OFFSET = MAP_HEADER.size - PAGE_COUNT.size
+
+# an extent with this bit set in its length holds the page uncompressed, as
+# compressing it did not make it smaller; a length of 0 is a page of zeros
+STORED = 0x80000000
+
+DEFAULT_CODEC = 'zlib'
+DEFAULT_LEVEL = 6
+
+def lzma_filters(level: int):
+    # raw LZMA2 without the container, whose headers would cost more than
+    # some pages compress to
+    return [{'id': lzma.FILTER_LZMA2, 'preset': level}]
+
+# codec id in the page map, compress(data, level) and decompress(data)
+CODECS: Dict[str, Tuple[int, Callable, Callable]] = {
+    'zlib': (
+        1,
+        lambda data, level: zlib.compress(data, level),
+        zlib.decompress,
+    ),
+    'lzma': (
+        2,
+        lambda data, level: lzma.compress(
+            data, lzma.FORMAT_RAW, filters=lzma_filters(level),
+        ),
+        lambda data: lzma.decompress(
+            data, lzma.FORMAT_RAW, filters=lzma_filters(0),
+        ),
+    ),
+}
+CODEC_NAMES = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+class CompressionError(Exception):
+    pass
+
+def is_compressed(file_name: str) -> bool:
+    try:
+        with open(file_name, 'rb') as f:
+            return f.read(len(DATA_MAGIC)) == DATA_MAGIC
+    except FileNotFoundError:
+        return False
+
+class CompressedPager(Pager):
+    """
+    CompressedPager stores each page compressed, with zlib or lzma, as an
+    extent of a data file. A sidecar page map, the data file name with
+    -pagemap appended, gives the offset and length of the extent of every
+    page. Pages are compressed and decompressed as they pass through the
+    file hooks of Pager, so the cache, snapshots and locking work as they do
+    for a plain file and the cache holds decompressed pages.
+
+    A page rewritten to no more than the length of its extent is written in
+    place, otherwise it is appended to the data file and the space it held
+    is lost until the file is converted again. Threads writing at once
+    compress their pages in parallel, then place, write and map them one at
+    a time under the map mutex. The data file is locked as a plain database
+    is; the page map of another process's writes is read again when the
+    lock shows the file changed.
+    """
+    def __init__(
+        self,
+        file_name: str,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        locking: bool = True,
+        cache_policy: str = 'lru',
+    ):
+        self.map_name = file_name + PAGE_MAP_SUFFIX
+        self.map_fd = os.open(self.map_name, os.O_RDWR)
+        self.map_stat = None
+        # guards the extents, the page map and the end of the data file
+        self.map_mutex = threading.Lock()
+        # where the next appended extent goes, found from the file when unset
+        self.data_end = None
+        self.read_map()
+        super().__init__(
+            file_name,
+            self.map_page_size,
+            cache_size,
+            locking,
+            cache_policy,
+        )
+
+        # compressed bytes read from the data file and pages decompressed
+        self.bytes_read = 0
+        self.pages_decompressed = 0
+
+    @classmethod
+    def create(
+        cls,
+        file_name: str,
+        page_size: int,
+        codec: str = DEFAULT_CODEC,
+        level: int = DEFAULT_LEVEL,
+        **kwargs,
+    ) -> 'CompressedPager':
+        """
+        create writes an empty compressed database and returns its pager
+        """
+        if codec not in CODECS:
+            raise CompressionError(f'unknown codec {codec}')
+        with open(file_name, 'wb') as f:
+            f.write(DATA_MAGIC)
+        with open(file_name + PAGE_MAP_SUFFIX, 'wb') as f:
+            f.write(MAP_HEADER.pack(MAP_MAGIC, page_size, CODECS[codec][0], level, 0))
+        return cls(file_name, **kwargs)
+
+    def read_map(self):
+        stat = os.fstat(self.map_fd)
+        if self.map_stat == (stat.st_mtime_ns, stat.st_size):
+            return
+
+        data = os.pread(self.map_fd, stat.st_size, 0)
+        magic, page_size, codec_id, level, count = MAP_HEADER.unpack_from(data)
+        if magic != MAP_MAGIC:
+            raise CompressionError(f'{self.map_name} is not a page map')
+        if codec_id not in CODEC_NAMES:
+            raise CompressionError(f'unknown codec {codec_id} in {self.map_name}')
+
+        self.map_page_size = page_size
+        self.codec = CODEC_NAMES[codec_id]
+        self.level = level
+        _, self.compress, self.decompress = CODECS[self.codec]
+        self.offsets = array('Q')
+        self.lengths = array('L')
+        for offset, length in EXTENT.iter_unpack(
+            data[MAP_HEADER.size:MAP_HEADER.size + count * EXTENT.size]
+        ):
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        self.map_pages = count
+        self.map_stat = (stat.st_mtime_ns, stat.st_size)
+        # another process may have appended to the data file
+        self.data_end = None
+
+    def close(self):
+        super().close()
+        if self.map_fd is not None:
+            os.close(self.map_fd)
+            self.map_fd = None
+
+    def validate(self):
+        with self.map_mutex:
+            self.read_map()
+        super().validate()
+
+    def read_counter(self, file: OpenFile) -> bytes:
+        return self.read_page_data(file, 1)[CHANGE_COUNTER]
+
+    def num_pages(self) -> int:
+        return len(self.lengths)
+
+    def read_page_data(self, file: OpenFile, page_number: int) -> bytes:
+        if page_number > len(self.lengths):
+            return b''
+        length = self.lengths[page_number - 1]
+        if length == 0:
+            return bytes(self.page_size)
+
+        size = length & ~STORED
+        data = os.pread(file.fd, size, self.offsets[page_number - 1])
+        self.bytes_read += size
+        if length & STORED:
+            return data
+        self.pages_decompressed += 1
+        return self.decompress(data)
+
+    def read_file(self, file: OpenFile, size: int, offset: int) -> bytes:
+        # reads are of whole pages at page boundaries, pages past the last
+        # one end the read short as they would in a plain file
+        first = offset // self.page_size + 1
+        last = (offset + size - 1) // self.page_size + 1
+        data = b''.join(
+            self.read_page_data(file, page_number)
+            for page_number in range(first, last + 1)
+        )
+        start = offset - (first - 1) * self.page_size
+        return data[start:start + size]
+
+    def write_file(self, file: OpenFile, data: bytes, offset: int):
+        page_number = offset // self.page_size + 1
+        if len(data) < self.page_size:
+            # a short write leaves the rest of the page as it was
+            page = bytearray(self.read_page_data(file, page_number).ljust(
+                self.page_size, b'\0',
+            ))
+            page[:len(data)] = data
+            data = bytes(page)
+
+        compressed, length = None, 0
+        if data.count(0) != len(data):
+            compressed = self.compress(data, self.level)
+            length = len(compressed)
+            if length >= self.page_size:
+                compressed, length = data, self.page_size | STORED
+
+        with self.map_mutex:
+            self.write_extent(file, page_number, compressed, length)
+
+    def write_extent(
+        self,
+        file: OpenFile,
+        page_number: int,
+        compressed: bytes,
+        length: int,
+    ):
+        # called holding the map mutex
+        extent = (0, 0)
+        if compressed is not None:
+            extent = (self.place(file, page_number, len(compressed)), length)
+            os.pwrite(file.fd, compressed, extent[0])
+
+        count = len(self.lengths)
+        while count < page_number:
+            # pages skipped over read as zeros, as in a sparse file
+            self.offsets.append(0)
+            self.lengths.append(0)
+            count += 1
+        self.offsets[page_number - 1], self.lengths[page_number - 1] = extent
+
+        # the extents of the pages skipped over are written too, and the
+        # page count once the extents are in place
+        first = min(page_number, self.map_pages + 1)
+        entries = bytearray()
+        for i in range(first, page_number + 1):
+            entries += EXTENT.pack(self.offsets[i - 1], self.lengths[i - 1])
+        os.pwrite(self.map_fd, entries, MAP_HEADER.size + (first - 1) * EXTENT.size)
+        if count > self.map_pages:
+            os.pwrite(self.map_fd, PAGE_COUNT.pack(count), PAGE_COUNT_OFFSET)
+            self.map_pages = count
+        stat = os.fstat(self.map_fd)
+        self.map_stat = (stat.st_mtime_ns, stat.st_size)
+
+    def place(self, file: OpenFile, page_number: int, size: int) -> int:
+        """
+        place returns the offset to write a compressed page of size bytes at,
+        its old extent when that is large enough and the end of the data
+        file otherwise, claiming the space up to the new end. It is called
+        holding the map mutex.
+        """
+        if page_number <= len(self.lengths):
+            length = self.lengths[page_number - 1] & ~STORED
+            if length >= size:
+                return self.offsets[page_number - 1]
+        if self.data_end is None:
+            self.data_end = max(os.fstat(file.fd).st_size, len(DATA_MAGIC))
+        offset = self.data_end
+        self.data_end += size
+        return offset
+
+def compress_file(
+    source: str,
+    destination: str,
+    codec: str = DEFAULT_CODEC,
+    level: int = DEFAULT_LEVEL,
+    batch_pages: int = 256,
+) -> CompressedPager:
+    """
+    compress_file converts a plain database file to the compressed format,
+    returning the pager of the new file, which the caller closes
+    """
+    with open(source, 'rb') as f:
+        page_size = DBInfo(f.read(DB_HEADER_SIZE)).page_size
+
+    plain = Pager(source, page_size, cache_size=0)
+    compressed = CompressedPager.create(destination, page_size, codec, level)
+    plain.begin_read()
+    try:
+        count = plain.num_pages()
+        for first in range(1, count + 1, batch_pages):
+            for i, data in enumerate(plain.get_pages(first, batch_pages)):
+                compressed.write_page(first + i, data)
+    finally:
+        plain.end_read()
+        plain.close()
+    return compressed
+
+def decompress_file(source: str, destination: str, batch_pages: int = 256) -> int:
+    """
+    decompress_file converts a compressed database back to a plain file
+    sqlite can open, returning the number of pages written
+    """
+    compressed = CompressedPager(source, cache_size=0)
+    compressed.begin_read()
+    try:
+        count = compressed.num_pages()
+        with open(destination, 'wb') as out:
+            for first in range(1, count + 1, batch_pages):
+                out.write(b''.join(compressed.get_pages(first, batch_pages)))
+    finally:
+        compressed.end_read()
+        compressed.close()
+    return count
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from enum import IntEnum
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks on this platform, locking only coordinates threads
+    fcntl = None
+
+# the byte ranges sqlite locks, all on the page holding the byte at 2^30 which
+# is never used for data
+PENDING_BYTE = 0x40000000
+RESERVED_BYTE = PENDING_BYTE + 1
+SHARED_FIRST = PENDING_BYTE + 2
+SHARED_SIZE = 510
+
+DEFAULT_BUSY_TIMEOUT = 5.0
+
+# the rollback journal of a database is the file name with this appended
+JOURNAL_SUFFIX = '-journal'
+
+class LockLevel(IntEnum):
+    NONE = 0
+    SHARED = 1
+    RESERVED = 2
+    PENDING = 3
+    EXCLUSIVE = 4
+
+class BusyError(Exception):
+    """
+    BusyError is raised when another process holds a lock that conflicts with
+    the one asked for past the busy timeout, SQLITE_BUSY in sqlite
+    """
+
+class HotJournalError(BusyError):
+    """
+    HotJournalError is raised when a shared lock finds a hot journal, left by
+    a sqlite writer that died part way through a transaction. The file may
+    hold half written pages until sqlite plays the journal back, which we do
+    not do, so opening the file with sqlite once rolls it back.
+    """
+
+class FileLock:
+    """
+    FileLock takes the locks of sqlite's rollback journal protocol on a
+    database file with POSIX advisory record locks, so that sqlite processes
+    see our readers and writers and we see theirs:
+
+    - SHARED is a read lock on the shared range, taken while holding a read
+      lock on the pending byte so that no reader starts once a writer waits
+    - RESERVED is a write lock on the reserved byte, one writer at a time
+    - PENDING is a write lock on the pending byte, keeping new readers out
+    - EXCLUSIVE is a write lock on the whole shared range, granted once the
+      last reader has gone
+
+    POSIX locks belong to the process and are dropped when any descriptor of
+    the file is closed, so there is one FileLock per open file, shared by
+    every Pager of the process and counting the threads reading through it.
+
+    Given the name of the rollback journal as journal_name, taking SHARED
+    checks for a hot journal as sqlite does and raises HotJournalError
+    rather than reading the file a crashed writer left behind.
+    """
+    def __init__(
+        self,
+        fd: int,
+        busy_timeout: float = DEFAULT_BUSY_TIMEOUT,
+        journal_name: str = None,
+    ):
+        self.fd = fd
+        self.busy_timeout = busy_timeout
+        self.journal_name = journal_name
+        self.level = LockLevel.NONE
+        self.mutex = threading.RLock()
+
+        # threads of this process inside a read transaction
+        self.readers = 0
+        # bumped whenever the shared lock is taken afresh, caches filled
+        # under an older generation must be checked against the file
+        self.generation = 0
+
+    def lock_range(self, kind: int, start: int, length: int = 1):
+        if fcntl is None:
+            return
+        deadline = time.monotonic() + self.busy_timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.lockf(self.fd, kind | fcntl.LOCK_NB, length, start, os.SEEK_SET)
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise BusyError('database is locked')
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def unlock_range(self, start: int, length: int = 1):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start, os.SEEK_SET)
+
+    def reserved_by_other(self) -> bool:
+        if fcntl is None:
+            return False
+        # F_TEST ignores our own locks and, unlike F_GETLK through lockf,
+        # never drops them; the offset is free as pages are read with pread
+        os.lseek(self.fd, RESERVED_BYTE, os.SEEK_SET)
+        try:
+            os.lockf(self.fd, os.F_TEST, 1)
+        except OSError:
+            return True
+        return False
+
+    def hot_journal(self) -> bool:
+        """
+        hot_journal tells whether the journal is hot: it exists and its header
+        was not zeroed, the database is not empty and no writer holds
+        RESERVED, so the writer that made it is gone
+        """
+        if self.journal_name is None:
+            return False
+        try:
+            with open(self.journal_name, 'rb') as f:
+                first = f.read(1)
+        except FileNotFoundError:
+            return False
+        if first in (b'', b'\0') or os.fstat(self.fd).st_size == 0:
+            return False
+        return not self.reserved_by_other()
+
+    def lock(self, level: LockLevel):
+        """
+        lock raises the lock of the file to level, passing through the levels
+        in between as sqlite does
+        """
+        with self.mutex:
+            if level <= self.level:
+                return
+
+            if self.level == LockLevel.NONE:
+                read = fcntl.LOCK_SH if fcntl else 0
+                self.lock_range(read, PENDING_BYTE)
+                try:
+                    self.lock_range(read, SHARED_FIRST, SHARED_SIZE)
+                finally:
+                    self.unlock_range(PENDING_BYTE)
+                self.level = LockLevel.SHARED
+                if self.hot_journal():
+                    self.unlock(LockLevel.NONE)
+                    raise HotJournalError(
+                        f'{self.journal_name} is a hot journal, open the '
+                        'database with sqlite to roll it back'
+                    )
+                self.generation += 1
+
+            write = fcntl.LOCK_EX if fcntl else 0
+            if level >= LockLevel.RESERVED and self.level < LockLevel.RESERVED:
+                self.lock_range(write, RESERVED_BYTE)
+                self.level = LockLevel.RESERVED
+
+            if level >= LockLevel.PENDING and self.level < LockLevel.PENDING:
+                self.lock_range(write, PENDING_BYTE)
+                self.level = LockLevel.PENDING
+
+            if level == LockLevel.EXCLUSIVE:
+                self.lock_range(write, SHARED_FIRST, SHARED_SIZE)
+                self.level = LockLevel.EXCLUSIVE
+
+    def unlock(self, level: LockLevel = LockLevel.NONE):
+        """
+        unlock lowers the lock of the file to SHARED or NONE
+        """
+        with self.mutex:
+            if level >= self.level:
+                return
+
+            if level == LockLevel.SHARED:
+                if self.level == LockLevel.EXCLUSIVE and fcntl is not None:
+                    # downgrading keeps the range locked throughout
+                    fcntl.lockf(
+                        self.fd,
+                        fcntl.LOCK_SH,
+                        SHARED_SIZE,
+                        SHARED_FIRST,
+                        os.SEEK_SET,
+                    )
+                self.unlock_range(PENDING_BYTE, 2)
+            else:
+                self.unlock_range(PENDING_BYTE, 2 + SHARED_SIZE)
+            self.level = level
+
+    def begin_read(self):
+        with self.mutex:
+            if self.readers == 0:
+                self.lock(LockLevel.SHARED)
+            self.readers += 1
+
+    def end_read(self):
+        with self.mutex:
+            self.readers -= 1
+            if self.readers == 0 and self.level == LockLevel.SHARED:
+                self.unlock(LockLevel.NONE)
@@ -0,0 +1,321 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Tuple
+
+from src.backend.btree import BTree
+from src.backend.compression import CompressedPager
+from src.backend.pager import MemoryPager, OpenFile, Pager
+from src.backend.record import RecordView
+
+# upper bounds of the timing histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+# the counters kept for every query, with their help text
+COUNTERS = {
+    'pages_read': 'Pages asked of the pager.',
+    'pages_written': 'Pages written by the pager.',
+    'cache_hits': 'Page reads served from the page cache.',
+    'cache_misses': 'Page reads that went to the file.',
+    'bytes_read': 'Bytes read from the database file.',
+    'bytes_written': 'Bytes written to the database file.',
+    'cells_parsed': 'B-tree cells parsed.',
+    'columns_decoded': 'Record columns decoded into values.',
+    'overflow_pages': 'Overflow pages followed.',
+}
+
+TIMINGS = {
+    'page_read': 'Time taken by reads from the database file.',
+    'query': 'Time from the first row of a query until its rows are done.',
+}
+
+class Histogram:
+    """
+    Histogram counts observations by the smallest bucket bound they fit
+    under, as a Prometheus histogram does, with a final bucket for the rest
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: 'Histogram'):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield str(bound), total
+
+class QueryStats:
+    """
+    QueryStats holds the counters of one query, or of a whole process once
+    merged, and the timing histograms when timing is on
+    """
+    __slots__ = tuple(COUNTERS) + ('timings',)
+
+    def __init__(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.timings = {}
+
+    def observe(self, name: str, seconds: float, buckets=DEFAULT_BUCKETS):
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram(buckets)
+        histogram.observe(seconds)
+
+    def merge(self, other: 'QueryStats'):
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, histogram in other.timings.items():
+            if name not in self.timings:
+                self.timings[name] = Histogram(histogram.buckets)
+            self.timings[name].merge(histogram)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in COUNTERS}
+
+    def __repr__(self) -> str:
+        counters = ', '.join(
+            f'{name}={value}' for name, value in self.as_dict().items()
+        )
+        return f'QueryStats({counters})'
+
+# the stats of the query running in the current context, counts made outside
+# of a query go to the process wide stats
+current_stats = ContextVar('current_stats', default=None)
+
+class Metrics:
+    """
+    Metrics collects the counters of every query run against databases
+    opened with it and exposes their totals in the Prometheus text format.
+    Instrumentation costs nothing unless a Metrics is given: the pager and
+    the b-trees of such a database are the instrumented subclasses below,
+    picked when the database is opened, and the plain classes carry no
+    checks. With timing set, file reads and queries are also timed into
+    histograms. Counts go to the stats of the running query or of the
+    calling thread, never shared between threads, and are merged under a
+    lock when the totals are read.
+    """
+    def __init__(self, timing: bool = False, buckets=DEFAULT_BUCKETS):
+        self.timing = timing
+        self.buckets = buckets
+        self.mutex = threading.Lock()
+        # the counts of finished queries, merged under the mutex
+        self.finished = QueryStats()
+        self.queries = 0
+        # counts made outside of a query go to stats of the thread's own,
+        # kept once the thread ends so that the totals never go back
+        self.local = threading.local()
+        self.thread_stats: List[QueryStats] = []
+
+        # records read by the instrumented b-trees count their columns here
+        self.view_class = type(
+            'CountingRecordView',
+            (CountingRecordView,),
+            {'__slots__': (), 'metrics': self},
+        )
+
+    def stats(self) -> QueryStats:
+        """
+        stats returns the stats counts are made into: those of the query
+        running in the current context, or else those of the calling thread,
+        so that threads never bump the same counter
+        """
+        stats = current_stats.get()
+        if stats is not None:
+            return stats
+        stats = getattr(self.local, 'stats', None)
+        if stats is None:
+            stats = self.local.stats = QueryStats()
+            with self.mutex:
+                self.thread_stats.append(stats)
+        return stats
+
+    def end_query(self, stats: QueryStats, seconds: float):
+        if self.timing:
+            stats.observe('query', seconds, self.buckets)
+        with self.mutex:
+            self.finished.merge(stats)
+            self.queries += 1
+
+    @property
+    def totals(self) -> QueryStats:
+        """
+        totals are the counts of finished queries and of every thread outside
+        of a query, merged afresh on each call
+        """
+        with self.mutex:
+            return self.merge_totals()
+
+    def merge_totals(self) -> QueryStats:
+        # called holding the mutex
+        totals = QueryStats()
+        totals.merge(self.finished)
+        for stats in self.thread_stats:
+            totals.merge(stats)
+        return totals
+
+    def to_prometheus(self, prefix: str = 'sqlite') -> str:
+        with self.mutex:
+            totals = self.merge_totals()
+            queries = self.queries
+
+        lines = [
+            f'# HELP {prefix}_queries_total Queries run to completion.',
+            f'# TYPE {prefix}_queries_total counter',
+            f'{prefix}_queries_total {queries}',
+        ]
+        for name, text in COUNTERS.items():
+            lines += [
+                f'# HELP {prefix}_{name}_total {text}',
+                f'# TYPE {prefix}_{name}_total counter',
+                f'{prefix}_{name}_total {getattr(totals, name)}',
+            ]
+        for name, histogram in totals.timings.items():
+            metric = f'{prefix}_{name}_seconds'
+            lines += [
+                f'# HELP {metric} {TIMINGS[name]}',
+                f'# TYPE {metric} histogram',
+            ]
+            for bound, count in histogram.cumulative():
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines += [
+                f'{metric}_sum {histogram.sum}',
+                f'{metric}_count {histogram.count}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+class InstrumentedPager(Pager):
+    """
+    InstrumentedPager is a Pager counting the pages asked of it, the cache
+    misses among them and the bytes moved to and from the file
+    """
+    def __init__(self, *args, metrics: Metrics, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    def get_page(self, page_number: int) -> bytes:
+        stats = self.metrics.stats()
+        stats.pages_read += 1
+        misses = stats.cache_misses
+        data = super().get_page(page_number)
+        if stats.cache_misses == misses:
+            stats.cache_hits += 1
+        return data
+
+    def get_pages(self, page_number: int, count: int) -> List[bytes]:
+        pages = super().get_pages(page_number, count)
+        self.metrics.stats().pages_read += len(pages)
+        return pages
+
+    def read_file(self, file: OpenFile, size: int, offset: int) -> bytes:
+        metrics = self.metrics
+        if metrics.timing:
+            started = time.perf_counter()
+            data = super().read_file(file, size, offset)
+            stats = metrics.stats()
+            stats.observe('page_read', time.perf_counter() - started, metrics.buckets)
+        else:
+            data = super().read_file(file, size, offset)
+            stats = metrics.stats()
+        stats.cache_misses += max(1, len(data) // self.page_size)
+        stats.bytes_read += len(data)
+        return data
+
+    def write_page(self, page_number: int, data: bytes):
+        super().write_page(page_number, data)
+        stats = self.metrics.stats()
+        stats.pages_written += 1
+        stats.bytes_written += len(data)
+
+class InstrumentedCompressedPager(InstrumentedPager, CompressedPager):
+    """
+    InstrumentedCompressedPager counts the work of a CompressedPager as
+    InstrumentedPager does. Its bytes read and written are those of the
+    pages before compression.
+    """
+
+class InstrumentedMemoryPager(MemoryPager):
+    """
+    InstrumentedMemoryPager is a MemoryPager counting the pages asked of it,
+    every one a cache hit as all pages are in memory, and the pages and
+    bytes written. Loading the file counts the bytes read.
+    """
+    def __init__(self, *args, metrics: Metrics, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    def load(self, file_name: str) -> 'InstrumentedMemoryPager':
+        super().load(file_name)
+        self.metrics.stats().bytes_read += os.path.getsize(file_name)
+        return self
+
+    def get_page(self, page_number: int) -> memoryview:
+        stats = self.metrics.stats()
+        stats.pages_read += 1
+        stats.cache_hits += 1
+        return super().get_page(page_number)
+
+    def write_page(self, page_number: int, data: bytes):
+        super().write_page(page_number, data)
+        stats = self.metrics.stats()
+        stats.pages_written += 1
+        stats.bytes_written += len(data)
+
+class CountingRecordView(RecordView):
+    __slots__ = ()
+
+    # set on the subclass made by each Metrics
+    metrics = None
+
+    def value(self, i: int) -> any:
+        self.metrics.stats().columns_decoded += 1
+        return super().value(i)
+
+class InstrumentedBTree(BTree):
+    """
+    InstrumentedBTree is a BTree counting the cells it parses, the columns
+    decoded from their records and the overflow pages followed. Columns are
+    counted as views decode them one at a time, and all at once for the
+    records of cells loaded in full.
+    """
+    def __init__(self, *args, metrics: Metrics, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+        self.view_class = metrics.view_class
+
+    def cell_payload(self, node, pointer: int) -> Tuple[int, bytes, int]:
+        self.metrics.stats().cells_parsed += 1
+        return super().cell_payload(node, pointer)
+
+    def full_payload(self, cell: any) -> bytes:
+        payload, pages = cell.full_payload(self.pager, self.usable_size)
+        self.metrics.stats().overflow_pages += len(pages)
+        return payload
+
+    def load(self, cell: any) -> any:
+        stats = self.metrics.stats()
+        stats.cells_parsed += 1
+        if getattr(cell, 'overflow_page', None) is not None:
+            pages = cell.load_overflow(self.pager, self.usable_size)
+            stats.overflow_pages += len(pages)
+        record = getattr(cell, 'record', None)
+        if record is not None:
+            stats.columns_decoded += len(record.values)
+        return cell
@@ -1,10 +1,19 @@
 from enum import Enum
+from struct import Struct
 from typing import Tuple, List
 
-from src.backend.cell import TableLeafCell
+from src.backend.cell import (
+    IndexInteriorCell,
+    IndexLeafCell,
+    TableInteriorCell,
+    TableLeafCell,
+)
 from src.dbinfo import DBInfo
 from src.util import b2i
 
+# cell pointers
+UINT16 = Struct('>H')
+
 class NodeType(Enum):
     INDEX_INTERIOR = 2
     TABLE_INTERIOR = 5
@@ -12,14 +21,24 @@ class NodeType(Enum):
     TABLE_LEAF = 13
 
 class Node:
+    __slots__ = (
+        'data', 'page_size', 'usable_size', 'encoding', 'node_type',
+        'cell_offset', 'num_cells', 'right_pointer', 'first_freeblock',
+        'num_fragmented_bytes', 'has_db_header', '_cells', '_pointers',
+    )
+
     def __init__(
         self,
         data: bytes,
         db_header: bool=False,
+        usable_size: int=None,
+        encoding: str='utf-8',
     ):
 
         self.data = data
         self.page_size = len(data)
+        self.usable_size = usable_size
+        self.encoding = encoding
         
         self.node_type, \
         self.cell_offset, \
@@ -29,7 +48,20 @@ class Node:
         self.num_fragmented_bytes = self.read_header_bytes(data, db_header)
         self.has_db_header = db_header
 
-        self.cells = self.read_cells(data, db_header)
+        # cells are parsed on first use, scans that work on the raw cell
+        # content only need the cell pointers, which are read once
+        self._cells = None
+        self._pointers = None
+
+    @property
+    def cells(self) -> List[any]:
+        if self._cells is None:
+            self._cells = self.read_cells(self.data, self.has_db_header)
+        return self._cells
+
+    @cells.setter
+    def cells(self, cells: List[any]):
+        self._cells = cells
 
     def read_header_bytes(
         self,
@@ -51,7 +83,7 @@ class Node:
 
         num_cells = b2i(data[offset + 3: offset + 5])
 
-        cell_offset = b2i(data[offset + 5: offset + 7])
+        cell_offset = b2i(data[offset + 5: offset + 7]) or 65536
 
         num_fragmented_bytes = data[offset + 7]
 
@@ -74,18 +106,62 @@ class Node:
         data: bytes,
         db_header: bool=False,
     ) -> List[any]:
-        page_header_len = 8 if self.is_leaf() else 12
-        db_header_len = 100 if db_header else 0
-
-        cells = []
+        return [
+            self.read_cell(data, p) for p in self.cell_pointers(data, db_header)
+        ]
 
-        for i in range(self.num_cells):
-            offset = db_header_len + page_header_len + (i * 2)
-            p = b2i(data[offset:offset + 2])
-            cell = TableLeafCell(data, p)
-            cells.append(cell)
+    def cell_pointers(
+        self,
+        data: bytes = None,
+        db_header: bool = None,
+    ) -> List[int]:
+        own = data is None and db_header is None
+        if own and self._pointers is not None:
+            return self._pointers
+        data = self.data if data is None else data
+        db_header = self.has_db_header if db_header is None else db_header
 
-        return cells
+        page_header_len = 8 if self.is_leaf() else 12
+        db_header_len = 100 if db_header else 0
+        start = db_header_len + page_header_len
+
+        pointers = [
+            b2i(data[offset:offset + 2])
+            for offset in range(start, start + (self.num_cells * 2), 2)
+        ]
+        if own:
+            self._pointers = pointers
+        return pointers
+
+    def read_cell(self, data: bytes, pointer: int) -> any:
+        if self.node_type == NodeType.TABLE_LEAF:
+            return TableLeafCell(data, pointer, self.usable_size, self.encoding)
+        elif self.node_type == NodeType.TABLE_INTERIOR:
+            return TableInteriorCell(data, pointer)
+        elif self.node_type == NodeType.INDEX_LEAF:
+            return IndexLeafCell(data, pointer, self.usable_size, self.encoding)
+        else:
+            return IndexInteriorCell(
+                data,
+                pointer,
+                self.usable_size,
+                self.encoding,
+            )
+
+    def is_table(self) -> bool:
+        return self.node_type in (NodeType.TABLE_LEAF, NodeType.TABLE_INTERIOR)
+
+    def children(self) -> List[int]:
+        """
+        children returns the child page numbers of an interior node in key
+        order, ending with the right pointer. Leaf nodes have no children.
+        """
+        if self.is_leaf():
+            return []
+        # every interior cell starts with its left child, no need to parse it
+        return [
+            b2i(self.data[pointer:pointer + 4]) for pointer in self.cell_pointers()
+        ] + [self.right_pointer]
 
     def is_leaf(self, node_type: NodeType = None) -> bool:
         node_type = node_type or self.node_type
@@ -95,56 +171,52 @@ class Node:
         node_type_bytes = self.node_type.value.to_bytes(1)
         first_freeblock_bytes = (0).to_bytes(2)
         num_cells_bytes = len(self.cells).to_bytes(2)
-        cell_offset_bytes = cell_offset.to_bytes(2)
+        # a cell content area starting at 65536 is recorded as zero
+        cell_offset_bytes = (cell_offset % 65536).to_bytes(2)
         num_fragmented_bytes = (0).to_bytes(1)
 
-        return node_type_bytes + \
-               first_freeblock_bytes + \
-               num_cells_bytes + \
-               cell_offset_bytes + \
-               num_fragmented_bytes
-
-    def cells_bytes(self, reserved_bytes=0) -> Tuple[
-        bytes, # cell pointer bytes
-        bytes, # cell content bytes
-        int, # cell content start pointer
-    ]:
-        cell_pointer_bytes = bytes([])
-        cell_content_bytes = bytes([])
-
-        pointer = self.page_size - reserved_bytes
-        for cell in self.cells:
-            content_bytes = cell.to_bytes()
-            pointer = pointer - len(content_bytes)
-            pointer_bytes = pointer.to_bytes(2)
-
-            cell_pointer_bytes += pointer_bytes
-            # cell content grows leftward
-            cell_content_bytes = content_bytes + cell_content_bytes
+        header = node_type_bytes + \
+                 first_freeblock_bytes + \
+                 num_cells_bytes + \
+                 cell_offset_bytes + \
+                 num_fragmented_bytes
 
-        cell_content_bytes += bytes([0x00] * reserved_bytes)
+        if not self.is_leaf():
+            header += self.right_pointer.to_bytes(4)
 
-        return (cell_pointer_bytes, cell_content_bytes, pointer)
+        return header
 
     def to_bytes(self, dbinfo: DBInfo) -> bytes:
+        """
+        to_bytes lays out the node from its cells, sized up front and encoded
+        straight into a single page buffer. Page 1 is returned without the
+        database header in front.
+        """
         db_header_len = 100 if self.has_db_header else 0
+        header_len = 8 if self.is_leaf() else 12
+        reserved = dbinfo.page_end_reserved_space
 
-        cell_pointer_bytes, cell_content_bytes, cell_content_start = \
-                self.cells_bytes(dbinfo.page_end_reserved_space)
-
-        header_bytes = self.header_bytes(cell_content_start)
-
-        total_content_len = db_header_len + len(header_bytes) + \
-                len(cell_pointer_bytes) + len(cell_content_bytes)
-
-        num_null_bytes = self.page_size - total_content_len
+        cells = self.cells
+        sizes = [cell.size() for cell in cells]
+        content_start = self.page_size - reserved - sum(sizes)
 
+        num_null_bytes = content_start - db_header_len - header_len - 2 * len(cells)
         if num_null_bytes < 0:
             raise ValueError(f'node page overflows by {abs(num_null_bytes)} bytes')
 
-        null_bytes = bytes([0x00] * num_null_bytes)
+        page = bytearray(self.page_size - db_header_len)
+        page[:header_len] = self.header_bytes(content_start)
+
+        # cell content grows leftward from the reserved space
+        pointer = self.page_size - reserved
+        position = header_len
+        for cell, size in zip(cells, sizes):
+            pointer -= size
+            cell.encode_into(page, pointer - db_header_len)
+            UINT16.pack_into(page, position, pointer)
+            position += 2
 
-        return header_bytes + cell_pointer_bytes + null_bytes + cell_content_bytes
+        return bytes(page)
 
     def _debug(self):
         print('node type', self.node_type)
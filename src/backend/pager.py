@@ -1,35 +1,509 @@
 import os
+import threading
+import weakref
+from collections import Counter
+from typing import Callable, List, Tuple, Union
+
+from src.backend.cache import CachePolicy, NodeCache, make_cache
+from src.backend.lock import JOURNAL_SUFFIX, FileLock, LockLevel
+from src.backend.trace import READ, SCAN, WRITE, PageTrace
+
+# pages kept by the cache of a Pager, about 8 MiB of 4 KiB pages
+DEFAULT_CACHE_SIZE = 2000
+
+# the number of latches guarding page loads, pages share the latch of their
+# number modulo this
+LATCH_STRIPES = 64
+
+# the file change counter of the database header, bumped by every sqlite
+# transaction that changes the file
+CHANGE_COUNTER = slice(24, 28)
+
+class OpenFile:
+    """
+    OpenFile is the single descriptor the process keeps for a file, with the
+    FileLock taken through it. Closing any descriptor of a file drops every
+    POSIX lock the process holds on it, so Pagers of the same file share one
+    OpenFile instead of opening their own.
+    """
+    registry = {}
+    registry_mutex = threading.Lock()
+
+    def __init__(self, key, fd: int, file_name: str):
+        self.key = key
+        self.fd = fd
+        self.lock = FileLock(fd, journal_name=file_name + JOURNAL_SUFFIX)
+        self.references = 0
+        self.pagers = weakref.WeakSet()
+        # bumped by every write through a pager of the process
+        self.writes = 0
+
+    @classmethod
+    def open(cls, file_name: str, create: bool = False) -> 'OpenFile':
+        with cls.registry_mutex:
+            key = None
+            if os.path.exists(file_name):
+                stat = os.stat(file_name)
+                key = (stat.st_dev, stat.st_ino)
+                shared = cls.registry.get(key)
+                # a removed file may leave its inode number to a new one
+                if shared is not None and os.fstat(shared.fd).st_nlink > 0:
+                    shared.references += 1
+                    return shared
+
+            flags = os.O_RDWR | (os.O_CREAT if create else 0)
+            try:
+                fd = os.open(file_name, flags, 0o644)
+            except PermissionError:
+                fd = os.open(file_name, os.O_RDONLY)
+            if key is None:
+                stat = os.fstat(fd)
+                key = (stat.st_dev, stat.st_ino)
+
+            shared = cls(key, fd, file_name)
+            shared.references = 1
+            cls.registry[key] = shared
+            return shared
+
+    def wrote(self):
+        with self.lock.mutex:
+            self.writes += 1
+
+    def close(self):
+        with self.registry_mutex:
+            self.references -= 1
+            if self.references > 0:
+                return
+            if self.registry.get(self.key) is self:
+                del self.registry[self.key]
+            os.close(self.fd)
+
+class ReadState(threading.local):
+    """
+    ReadState is the read transaction of one thread, nested begin_read calls
+    share the snapshot of the outermost
+    """
+    def __init__(self):
+        self.depth = 0
+        self.version = None
 
 class Pager:
+    """
+    Pager reads and writes the pages of a file, keeping cache_size pages in
+    memory as chosen by cache_policy, the name of a policy in CACHE_POLICIES
+    or a callable building one: 'lru' keeps the most recently used pages and
+    'arc' resists scans, pinning interior pages. It may be shared by
+    threads: the cache
+    is guarded by a mutex held only to look pages up, and loading a page
+    from the file holds the latch of that page alone, so threads missing on
+    different pages read in parallel and threads missing on the same page
+    read it once.
+
+    A read transaction, from begin_read to end_read, sees the pages as they
+    were when it began. Every write, or every write transaction from
+    begin_write to end_write, makes a new version of the file. Before a page
+    is overwritten its pre-image is kept, tagged with the version that
+    replaced it, for as long as a reader began before that version; a reader
+    resolves each page to the first pre-image tagged past its snapshot, or
+    to the page itself when there is none. Readers and the writer thus never
+    wait for each other, and the pre-images are dropped as the last reader
+    needing them ends. The thread inside a write transaction reads its own
+    writes, and reads outside a transaction see the latest pages. Snapshots
+    cover the writes made through this pager.
+
+    With locking set the pager also follows sqlite's locking protocol. Reads
+    happen under a SHARED lock, held for a read transaction or taken for a
+    single read outside of one, and writers hold EXCLUSIVE from begin_write
+    to end_write. Each time the shared lock is taken afresh the cache is
+    dropped if the file change counter moved, as another process wrote to
+    the file. Files private to the process, such as temporary files, need
+    no locking. No rollback journal is ever written or played back: a hot
+    journal left by a sqlite writer that crashed makes reads raise
+    HotJournalError rather than see its half written pages.
+
+    Given a PageTrace as trace, every page asked of the pager, read by
+    get_pages or written is recorded into it, for python -m src.cachesim to
+    replay against caches of other sizes and policies.
+    """
     def __init__(
         self,
         file_name: str,
         page_size: int = 4096,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        locking: bool = True,
+        cache_policy: Union[str, Callable[[int], CachePolicy]] = 'lru',
     ):
         self.file_name = file_name
         self.page_size = page_size
+        self.cache_size = cache_size
+        self.locking = locking
+
+        self.file = None
+        self.cache = make_cache(cache_policy, cache_size)
+        # the parsed nodes of the pages, kept by b-trees reading through the
+        # pager when set
+        self.node_cache: NodeCache = None
+        # records the pages read and written when set
+        self.trace: PageTrace = None
+        self.mutex = threading.Lock()
+        self.latches = [threading.Lock() for _ in range(LATCH_STRIPES)]
+
+        # the change counter the cache was filled under
+        self.change_counter = None
+        self.generation = None
+
+        # the last committed version, the version being written by the open
+        # write transaction and the thread writing it
+        self.version = 0
+        self.writing = None
+        self.writer = None
+        self.write_mutex = threading.Lock()
+
+        # the snapshot versions of the open read transactions, with their
+        # number of readers, and the pre-images of the pages by page number
+        # as (version, data) in the order written
+        self.snapshots = Counter()
+        self.versions = {}
+        self.reads = ReadState()
+
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, create: bool = False) -> OpenFile:
+        if self.file is None:
+            with self.mutex:
+                if self.file is None:
+                    file = OpenFile.open(self.file_name, create)
+                    file.pagers.add(self)
+                    self.file = file
+        return self.file
+
+    def close(self):
+        with self.mutex:
+            file, self.file = self.file, None
+            self.cache.clear()
+        if self.node_cache is not None:
+            self.node_cache.clear()
+        if self.trace is not None:
+            self.trace.flush()
+        if file is not None:
+            file.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def snapshot(self) -> int:
+        """
+        snapshot returns the version the calling thread reads at, None for
+        the latest pages
+        """
+        reads = self.reads
+        if reads.depth == 0 or self.writer == threading.get_ident():
+            return None
+        return reads.version
 
     def get_page(
         self,
         page_number: int,
     ) -> bytes:
-        with open(self.file_name, 'rb+') as file:
-            file.seek(self.get_offset(page_number))
-            return file.read(self.page_size)
+        file = self.open()
+        lock = file.lock
+        if not self.locking:
+            data = self.read_page(file, page_number, self.snapshot())
+        elif self.reads.depth > 0:
+            # the transaction of this thread holds the shared lock
+            if self.generation != lock.generation:
+                self.validate()
+            data = self.read_page(file, page_number, self.snapshot())
+        else:
+            # a read outside of a transaction counts as a reader of its own,
+            # so the shared lock is held until the read is done even if the
+            # transactions of other threads end meanwhile
+            lock.begin_read()
+            try:
+                if self.generation != lock.generation:
+                    self.validate()
+                data = self.read_page(file, page_number, None)
+            finally:
+                lock.end_read()
+
+        if self.trace is not None:
+            self.trace.record(page_number, READ, data)
+        return data
+
+    def read_page(self, file: OpenFile, page_number: int, version: int) -> bytes:
+        if version is None and self.cache_size <= 0:
+            return self.read_file(file, self.page_size, self.get_offset(page_number))
+
+        with self.mutex:
+            data = self.lookup(page_number, version)
+            if data is not None:
+                self.hits += 1
+                return data
+
+        with self.latches[page_number % LATCH_STRIPES]:
+            # another thread may have loaded or written the page while this
+            # one waited
+            with self.mutex:
+                data = self.lookup(page_number, version)
+            if data is not None:
+                return data
+
+            data = self.read_file(file, self.page_size, self.get_offset(page_number))
+            with self.mutex:
+                self.misses += 1
+                # pages cut short by the end of the file are not kept
+                if self.cache_size > 0 and len(data) == self.page_size:
+                    self.store(page_number, data)
+            return data
+
+    def read_file(self, file: OpenFile, size: int, offset: int) -> bytes:
+        # every read of page content from the file goes through here
+        return os.pread(file.fd, size, offset)
+
+    def write_file(self, file: OpenFile, data: bytes, offset: int):
+        # and every write
+        os.pwrite(file.fd, data, offset)
+
+    def read_counter(self, file: OpenFile) -> bytes:
+        return os.pread(file.fd, 4, CHANGE_COUNTER.start)
+
+    def lookup(self, page_number: int, version: int) -> bytes:
+        # called holding the mutex
+        if version is not None:
+            for written, data in self.versions.get(page_number, ()):
+                if written > version:
+                    return data
+        return self.cache.get(page_number)
+
+    def store(self, page_number: int, data: bytes):
+        # called holding the mutex
+        self.cache.put(page_number, data)
+
+    def discard(self, offset: int, length: int):
+        """
+        discard drops the cached pages overlapping a range of bytes written
+        through another pager of the same file
+        """
+        first = offset // self.page_size + 1
+        last = (offset + length - 1) // self.page_size + 1
+        with self.mutex:
+            for page_number in range(first, last + 1):
+                self.cache.pop(page_number)
+        if self.node_cache is not None:
+            self.node_cache.discard(first, last)
+
+    def validate(self):
+        """
+        validate drops the cache when the file changed since it was filled,
+        as told by the change counter of the database header
+        """
+        file = self.open()
+        counter = self.read_counter(file)
+        with self.mutex:
+            if counter != self.change_counter:
+                self.cache.clear()
+                if self.node_cache is not None:
+                    self.node_cache.clear()
+                self.change_counter = counter
+            self.generation = file.lock.generation
+
+    def file_version(self) -> Tuple[int, int]:
+        """
+        file_version changes whenever the file may have changed since it was
+        last asked for: the shared lock was taken afresh, so another process
+        may have written, or a pager of this process wrote. It is None while
+        the process holds no lock, when another process may write at any time.
+        """
+        file = self.open()
+        lock = file.lock
+        with lock.mutex:
+            if self.locking and lock.level == LockLevel.NONE:
+                return None
+            return lock.generation, file.writes
+
+    def get_pages(
+        self,
+        page_number: int,
+        count: int,
+    ) -> List[bytes]:
+        """
+        get_pages reads a run of consecutive pages with a single read, pages
+        past the end of the file are omitted. The pages bypass the cache, so
+        long sequential reads do not push out the pages worth keeping.
+        """
+        file = self.open()
+        if self.locking:
+            self.begin_read()
+        try:
+            version = self.snapshot()
+            data = self.read_file(
+                file,
+                self.page_size * count,
+                self.get_offset(page_number),
+            )
+            pages = [
+                data[i:i + self.page_size]
+                for i in range(0, len(data) - self.page_size + 1, self.page_size)
+            ]
+            if version is not None and self.versions:
+                # pre-images are kept before the page is written, so any
+                # page the read saw written has one by now
+                with self.mutex:
+                    for i in range(len(pages)):
+                        for written, image in self.versions.get(page_number + i, ()):
+                            if written > version:
+                                pages[i] = image
+                                break
+        finally:
+            if self.locking:
+                self.end_read()
+        if self.trace is not None:
+            for i, data in enumerate(pages):
+                self.trace.record(page_number + i, SCAN, data)
+        return pages
+
+    def num_pages(self) -> int:
+        if self.file is None and not os.path.exists(self.file_name):
+            return 0
+        return os.fstat(self.open().fd).st_size // self.page_size
 
     def write_page(
         self,
         page_number: int,
         data: bytes,
     ):
-        # create the file if it doesn't exist
-        if not os.path.exists(self.file_name):
-            with open(self.file_name, 'w'):
-                pass
+        # the file is created if it doesn't exist
+        file = self.open(create=True)
+        offset = self.get_offset(page_number)
+
+        with self.latches[page_number % LATCH_STRIPES]:
+            with self.mutex:
+                keep = self.keeps_image(page_number)
+                image = self.cache.peek(page_number)
+            if keep and image is None:
+                image = self.read_file(file, self.page_size, offset)
+
+            with self.mutex:
+                if self.writing is None:
+                    # a write outside of a transaction is a version of its own
+                    self.version += 1
+                    written = self.version
+                else:
+                    written = self.writing
+                # a reader may have begun since
+                if not keep and self.keeps_image(page_number):
+                    keep = True
+                    image = self.cache.peek(page_number)
+                    if image is None:
+                        image = self.read_file(file, self.page_size, offset)
+                if keep:
+                    self.versions.setdefault(page_number, []).append((written, image))
+                self.cache.pop(page_number)
+
+            self.write_file(file, data, offset)
+            file.wrote()
+            if self.node_cache is not None:
+                self.node_cache.discard(page_number)
+            if self.cache_size > 0 and len(data) == self.page_size:
+                with self.mutex:
+                    self.store(page_number, bytes(data))
+
+        for pager in list(file.pagers):
+            if pager is not self:
+                pager.discard(offset, len(data))
+        if self.trace is not None:
+            self.trace.record(page_number, WRITE, data)
+
+    def keeps_image(self, page_number: int) -> bool:
+        # called holding the mutex, a write transaction keeps the first
+        # pre-image of each page for the readers that begin while it runs
+        if self.writing is None:
+            return bool(self.snapshots)
+        images = self.versions.get(page_number)
+        return not images or images[-1][0] != self.writing
+
+    def collect(self):
+        # called holding the mutex, drops the pre-images no reader needs
+        oldest = min(self.snapshots, default=None)
+        for page_number in list(self.versions):
+            images = [
+                (written, image)
+                for written, image in self.versions[page_number]
+                if written == self.writing
+                or (oldest is not None and written > oldest)
+            ]
+            if images:
+                self.versions[page_number] = images
+            else:
+                del self.versions[page_number]
+
+    def begin_read(self):
+        """
+        begin_read starts a read transaction for the calling thread, holding
+        a SHARED lock until the matching end_read so that no other process
+        changes the file, and pinning the last committed version
+        """
+        file = self.open()
+        file.lock.begin_read()
+        if self.generation != file.lock.generation:
+            self.validate()
 
-        with open(self.file_name, 'rb+') as file:
-            file.seek(self.get_offset(page_number))
-            file.write(data)
+        reads = self.reads
+        if reads.depth == 0:
+            with self.mutex:
+                reads.version = self.version
+                self.snapshots[self.version] += 1
+        reads.depth += 1
+
+    def end_read(self):
+        reads = self.reads
+        reads.depth -= 1
+        if reads.depth == 0:
+            with self.mutex:
+                self.snapshots[reads.version] -= 1
+                if self.snapshots[reads.version] == 0:
+                    del self.snapshots[reads.version]
+                if self.versions:
+                    self.collect()
+            reads.version = None
+        self.file.lock.end_read()
+
+    def begin_write(self):
+        """
+        begin_write starts a write transaction, one at a time in the process,
+        and takes an EXCLUSIVE lock, raising BusyError when other processes
+        still read or write past the busy timeout
+        """
+        self.write_mutex.acquire()
+        try:
+            self.begin_read()
+            try:
+                self.file.lock.lock(LockLevel.EXCLUSIVE)
+            except BaseException:
+                self.file.lock.unlock(LockLevel.SHARED)
+                self.end_read()
+                raise
+        except BaseException:
+            self.write_mutex.release()
+            raise
+
+        with self.mutex:
+            self.writing = self.version + 1
+            self.writer = threading.get_ident()
+
+    def end_write(self):
+        with self.mutex:
+            self.version = self.writing
+            self.writing = None
+            self.writer = None
+            self.collect()
+        self.file.lock.unlock(LockLevel.SHARED)
+        self.end_read()
+        self.write_mutex.release()
 
     def get_offset(
         self,
@@ -37,28 +511,152 @@ class Pager:
     ):
         return (page_number - 1) * self.page_size
 
+class Arena:
+    """
+    Arena is the memory of a MemoryPager, one bytearray holding its pages
+    back to back. Snapshots share the arena of their pager until either
+    side writes.
+    """
+    __slots__ = ('data', 'owners')
+
+    def __init__(self, data: bytearray):
+        self.data = data
+        self.owners = 1
+
 class MemoryPager:
+    """
+    MemoryPager keeps a database in memory, in a single arena grown as pages
+    are written, and hands out pages as read-only memoryviews of the arena
+    rather than copies. A page shows writes made to it afterwards, so a
+    caller keeping a page across writes should copy it. Reading a page past
+    the end grows the database by zeroed pages.
+
+    load reads a whole database file in one read and dump writes it back in
+    one write. snapshot returns a copy of the pager that shares its arena,
+    the arena being copied by whichever side writes first.
+    """
     def __init__(
         self,
         page_size: int = 4096,
     ):
         self.page_size = page_size
-        self.pages = {}
+        self.count = 0
+        self.node_cache: NodeCache = None
+        # bumped by every write, as file_version
+        self.writes = 0
+        self.set_arena(Arena(bytearray()))
+
+    def set_arena(self, arena: Arena):
+        self.arena = arena
+        self.view = memoryview(arena.data).toreadonly()
+
+    def load(self, file_name: str) -> 'MemoryPager':
+        size = os.path.getsize(file_name)
+        self.count = -(-size // self.page_size)
+        data = bytearray(self.count * self.page_size)
+        with open(file_name, 'rb', buffering=0) as f:
+            read = f.readinto(data)
+        if read != size:
+            raise OSError(f'short read of {file_name}, {read} of {size} bytes')
+        self.release()
+        self.set_arena(Arena(data))
+        return self
+
+    def dump(self, file_name: str):
+        with open(file_name, 'wb', buffering=0) as f:
+            f.write(self.view[:self.count * self.page_size])
+
+    def snapshot(self) -> 'MemoryPager':
+        copy = type(self).__new__(type(self))
+        # the page size, count, arena, view and caches, and the attributes
+        # of subclasses
+        copy.__dict__.update(self.__dict__)
+        self.arena.owners += 1
+        return copy
+
+    def release(self):
+        self.arena.owners -= 1
+
+    def reserve(self, count: int):
+        """
+        reserve makes the arena this pager's own and large enough for count
+        pages, doubling it as it grows. The bytearray is replaced rather than
+        resized, pages handed out keep the old one alive.
+        """
+        size = count * self.page_size
+        if self.arena.owners == 1 and size <= len(self.arena.data):
+            return
+
+        used = self.count * self.page_size
+        capacity = max(size, len(self.arena.data))
+        if size > len(self.arena.data):
+            capacity = max(size, 2 * len(self.arena.data))
+        data = bytearray(capacity)
+        data[:used] = self.view[:used]
+        self.release()
+        self.set_arena(Arena(data))
 
     def get_page(
         self,
         page_number: int,
-    ) -> bytes:
-        if page_number not in self.pages:
-            self.pages[page_number] = self.new_page()
-        return self.pages[page_number]
+    ) -> memoryview:
+        if page_number > self.count:
+            self.reserve(page_number)
+            self.count = page_number
+        offset = (page_number - 1) * self.page_size
+        return self.view[offset:offset + self.page_size]
+
+    def get_pages(
+        self,
+        page_number: int,
+        count: int,
+    ) -> List[memoryview]:
+        return [self.get_page(page_number + i) for i in range(count)]
+
+    def num_pages(self) -> int:
+        return self.count
 
     def write_page(
         self,
         page_number: int,
         data: bytes,
     ):
-        self.pages[page_number] = data
+        self.reserve(max(page_number, self.count))
+        self.count = max(page_number, self.count)
+        offset = (page_number - 1) * self.page_size
+        end = offset + len(data)
+        arena = self.arena.data
+        arena[offset:end] = data
+        # a short write replaces the whole page
+        arena[end:offset + self.page_size] = bytes(offset + self.page_size - end)
+        self.writes += 1
+        # pages are written in place, a node parsed from one would still
+        # compare equal to it
+        if self.node_cache is not None:
+            self.node_cache.discard(page_number)
 
     def new_page(self) -> bytes:
-        return bytes([0x00] * self.page_size)
+        return bytes(self.page_size)
+
+    def file_version(self) -> Tuple[int, int]:
+        return 0, self.writes
+
+    # memory is private to the process, there is nothing to lock
+
+    def begin_read(self):
+        pass
+
+    def end_read(self):
+        pass
+
+    def begin_write(self):
+        pass
+
+    def end_write(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __del__(self):
+        self.release()
@@ -0,0 +1,184 @@
+import operator
+from typing import Set
+
+from src.backend.record import RecordView, storage_class
+from src.backend.text import LazyText
+
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<>': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+def value_class(value: any) -> int:
+    """
+    value_class returns the storage class rank of a python value, matching
+    storage_class for serial types
+    """
+    if value is None:
+        return 0
+    elif isinstance(value, (int, float)):
+        return 1
+    elif isinstance(value, (str, LazyText)):
+        return 2
+    return 3
+
+class Predicate:
+    """
+    Predicate is a filter evaluated against the raw bytes of a record through
+    a RecordView, decoding as few values as possible. Comparisons follow
+    sqlite's ordering of storage classes and the BINARY collation, without
+    applying column affinity to the constant.
+    """
+    def evaluate(self, view: RecordView) -> bool:
+        raise NotImplementedError
+
+    def columns(self) -> Set[int]:
+        raise NotImplementedError
+
+    def bind(self):
+        """
+        bind is called before each scan, for predicates whose values are only
+        known once the query runs
+        """
+
+    def __and__(self, other: 'Predicate') -> 'Predicate':
+        return And(self, other)
+
+    def __or__(self, other: 'Predicate') -> 'Predicate':
+        return Or(self, other)
+
+class Comparison(Predicate):
+    def __init__(self, column: int, op: str, value: any):
+        if op not in OPERATORS:
+            raise ValueError(f'unsupported comparison operator {op}')
+
+        self.column = column
+        self.op = op
+        self.value = value
+        self.compare = OPERATORS[op]
+        self.value_class = value_class(value)
+        self.is_equality = self.compare in (operator.eq, operator.ne)
+
+        # text constants are encoded once per database encoding
+        self.encoded = {}
+
+    def encoded_value(self, encoding: str) -> bytes:
+        if self.value_class == 3:
+            return bytes(self.value)
+        if encoding not in self.encoded:
+            self.encoded[encoding] = self.value.encode(encoding)
+        return self.encoded[encoding]
+
+    def evaluate(self, view: RecordView) -> bool:
+        serial_type = view.serial_type(self.column)
+
+        # comparisons with NULL are never true
+        if serial_type == 0 or self.value_class == 0:
+            return False
+
+        column_class = storage_class(serial_type)
+        if column_class != self.value_class:
+            return self.compare(column_class, self.value_class)
+
+        if column_class == 1:
+            return self.compare(view.value(self.column), self.value)
+
+        # text and blobs compare raw, the serial type holds the length so
+        # equality is settled without touching the body when lengths differ
+        value = self.encoded_value(view.encoding)
+        if self.is_equality and view.size(self.column) != len(value):
+            return self.compare is operator.ne
+        return self.compare(view.raw(self.column), value)
+
+    def columns(self) -> Set[int]:
+        return {self.column}
+
+    def __repr__(self) -> str:
+        return f'column {self.column} {self.op} {self.value!r}'
+
+class IsNull(Predicate):
+    def __init__(self, column: int, negated: bool=False):
+        self.column = column
+        self.negated = negated
+
+    def evaluate(self, view: RecordView) -> bool:
+        return (view.serial_type(self.column) == 0) != self.negated
+
+    def columns(self) -> Set[int]:
+        return {self.column}
+
+    def __repr__(self) -> str:
+        return f'column {self.column} IS {"NOT " if self.negated else ""}NULL'
+
+class Prefix(Predicate):
+    """
+    Prefix matches text or blob columns starting with the given prefix
+    """
+    def __init__(self, column: int, prefix: any):
+        self.column = column
+        self.prefix = prefix
+        self.is_text = isinstance(prefix, (str, LazyText))
+        self.encoded = {}
+
+    def encoded_prefix(self, encoding: str) -> bytes:
+        if not self.is_text:
+            return bytes(self.prefix)
+        if encoding not in self.encoded:
+            self.encoded[encoding] = self.prefix.encode(encoding)
+        return self.encoded[encoding]
+
+    def evaluate(self, view: RecordView) -> bool:
+        serial_type = view.serial_type(self.column)
+        if serial_type < 12 or bool(serial_type % 2) != self.is_text:
+            return False
+
+        prefix = self.encoded_prefix(view.encoding)
+        if view.size(self.column) < len(prefix):
+            return False
+        return view.raw(self.column).startswith(prefix)
+
+    def columns(self) -> Set[int]:
+        return {self.column}
+
+    def __repr__(self) -> str:
+        return f'column {self.column} LIKE {self.prefix!r} || %'
+
+class And(Predicate):
+    def __init__(self, *predicates: Predicate):
+        self.predicates = predicates
+
+    def evaluate(self, view: RecordView) -> bool:
+        return all(predicate.evaluate(view) for predicate in self.predicates)
+
+    def bind(self):
+        for predicate in self.predicates:
+            predicate.bind()
+
+    def columns(self) -> Set[int]:
+        return set().union(*(p.columns() for p in self.predicates))
+
+    def __repr__(self) -> str:
+        return '(' + ' AND '.join(repr(p) for p in self.predicates) + ')'
+
+class Or(Predicate):
+    def __init__(self, *predicates: Predicate):
+        self.predicates = predicates
+
+    def evaluate(self, view: RecordView) -> bool:
+        return any(predicate.evaluate(view) for predicate in self.predicates)
+
+    def bind(self):
+        for predicate in self.predicates:
+            predicate.bind()
+
+    def columns(self) -> Set[int]:
+        return set().union(*(p.columns() for p in self.predicates))
+
+    def __repr__(self) -> str:
+        return '(' + ' OR '.join(repr(p) for p in self.predicates) + ')'
@@ -1,8 +1,19 @@
 from enum import Enum
+from struct import Struct
 from typing import List, Tuple
-from dataclasses import dataclass
 
-from src.util import b2i, to_varint, varint
+from src.backend.text import LazyText
+from src.util import to_varint, varint, varint_size, write_varint
+
+# big-endian two's complement integers and doubles, the 24 and 48 bit widths
+# are split into a signed high part and an unsigned low part
+INT8 = Struct('>b')
+INT16 = Struct('>h')
+INT24 = Struct('>bH')
+INT32 = Struct('>i')
+INT48 = Struct('>hI')
+INT64 = Struct('>q')
+FLOAT64 = Struct('>d')
 
 class ColumnType(Enum):
     UNKNOWN = -1
@@ -30,27 +41,117 @@ class ColumnType(Enum):
         else:
             return cls(13)
 
-@dataclass
+def serial_type_size(serial_type: int) -> int:
+    """
+    serial_type_size returns the number of bytes a value of the given serial
+    type occupies in the body of a record
+    """
+    if serial_type >= 12:
+        return (serial_type - 12) // 2
+    return SERIAL_TYPE_SIZES[serial_type]
+
+# sizes of the fixed width serial types 0-11, reserved types take no space
+SERIAL_TYPE_SIZES = (0, 1, 2, 3, 4, 6, 8, 8, 0, 0, 0, 0)
+
+def storage_class(serial_type: int) -> int:
+    """
+    storage_class returns the rank of the storage class of a serial type in
+    sqlite's ordering, 0 for NULL, 1 for numbers, 2 for text and 3 for blobs
+    """
+    if serial_type >= 12:
+        return 2 if serial_type % 2 else 3
+    return 0 if serial_type == 0 else 1
+
+def sort_key(value: any) -> Tuple[int, any]:
+    """
+    sort_key maps a value onto a tuple that orders the way sqlite orders
+    values of mixed types with the BINARY collation, where NULL sorts before
+    numbers, numbers before text and text before blobs
+    """
+    if value is None:
+        return (0, 0)
+    elif isinstance(value, (int, float)):
+        return (1, value)
+    elif isinstance(value, (str, LazyText)):
+        return (2, value)
+    return (3, bytes(value))
+
+# serial types below this are interned, covering every fixed width type and
+# text and blobs of up to 32 KiB
+INTERNED_SERIAL_TYPES = 65536
+
 class Column:
+    """
+    Column is the serial type of a value in a record. Columns are immutable
+    and shared: from_int and for_value hand out one instance per serial type
+    instead of allocating a Column for every value of every row.
+    """
+    __slots__ = ('type', 'length', 'serial_type')
+
     def __init__(self, column_type: ColumnType, length: int=None):
         self.type = column_type
         self.length = length
+        if column_type.value < 12:
+            self.serial_type = column_type.value
+        else:
+            self.serial_type = length * 2 + column_type.value
 
     def __repr__(self) -> str:
         return f'column: {self.type}, {self.length}'
 
-    def to_int(self) -> int:
-        if self.type.value < 12:
-            return self.type.value
+    def __eq__(self, other: any) -> bool:
+        if not isinstance(other, Column):
+            return NotImplemented
+        return self.type == other.type and self.length == other.length
+
+    def __hash__(self) -> int:
+        return hash((self.type, self.length))
 
-        modifier = self.type.value
-        return (self.length * 2) + modifier
+    def to_int(self) -> int:
+        return self.serial_type
 
     def to_bytes(self) -> bytes:
         return to_varint(self.to_int())
 
     @classmethod
-    def from_int(cls, value: int):
+    def for_value(
+        cls,
+        value: any,
+        allow_constants: bool=True,
+        encoding: str='utf-8',
+    ):
+        """
+        for_value picks the smallest serial type able to hold a value. The
+        constant types for 0 and 1 need schema format 4, so they can be
+        disabled with allow_constants.
+        """
+        if value is None:
+            return cls.from_int(0)
+        elif isinstance(value, int):
+            if allow_constants and value in (0, 1):
+                return cls.from_int(8 + value)
+
+            # the magnitude of -128 is 127, matching the range of a signed byte
+            magnitude = value if value >= 0 else ~value
+            for limit, column_type in INTEGER_LIMITS:
+                if magnitude <= limit:
+                    return cls.from_int(column_type.value)
+            raise ValueError(f'integer {value} does not fit in 64 bits')
+        elif isinstance(value, float):
+            return cls.from_int(ColumnType.IEEE754INT.value)
+        elif isinstance(value, (str, LazyText)):
+            return cls.from_int(13 + 2 * len(value.encode(encoding)))
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            return cls.from_int(12 + 2 * len(value))
+
+        raise ValueError(f'cannot store value of type {type(value).__name__}')
+
+    @classmethod
+    def from_int(cls, value: int) -> 'Column':
+        column = INTERNED_COLUMNS.get(value)
+        if column is not None:
+            return column
+
         column_type = ColumnType(value)
         length = None
 
@@ -60,21 +161,92 @@ class Column:
         elif column_type == ColumnType.TEXT:
             length = (value - 13) // 2
 
-        return cls(column_type, length)
+        column = cls(column_type, length)
+        if value < INTERNED_SERIAL_TYPES:
+            INTERNED_COLUMNS[value] = column
+        return column
+
+# the shared Column of each serial type seen so far
+INTERNED_COLUMNS = {}
+
+# largest positive value held by each integer serial type, narrowest first
+INTEGER_LIMITS = (
+    (0x7f, ColumnType.TINYINT),
+    (0x7fff, ColumnType.SMALLINT),
+    (0x7fffff, ColumnType.SMALLISHINT),
+    (0x7fffffff, ColumnType.INTEGER),
+    (0x7fffffffffff, ColumnType.BIGGISHINT),
+    (0x7fffffffffffffff, ColumnType.LONG),
+)
+
+# header size, total size, serial types and text and blob bodies of a record
+Layout = Tuple[int, int, List[int], List[bytes]]
+
+# the struct writing each fixed width serial type, by serial type
+PACKERS = {
+    1: INT8,
+    2: INT16,
+    4: INT32,
+    6: INT64,
+    7: FLOAT64,
+}
 
 class Record:
+    """
+    Record is a row decoded in full from the record format, or built from
+    values for writing. A record to write is laid out once: its serial
+    types, the size of its header and the encoded bodies of its text
+    values, after which encode_into writes it straight into a buffer.
+    """
+    __slots__ = ('data', 'encoding', 'columns', 'values', 'cursor', '_layout')
+
     def __init__(
         self,
         data: bytes,
         cursor: int,
+        encoding: str='utf-8',
     ):
         self.data = data
+        self.encoding = encoding
+        self._layout = None
 
         self.columns, cursor = self.read_column_types(data, cursor)
         self.values, cursor = self.read_values(data, cursor)
 
         self.cursor = cursor
 
+    @classmethod
+    def from_values(
+        cls,
+        values: List[any],
+        allow_constants: bool=True,
+        encoding: str='utf-8',
+    ):
+        """
+        from_values builds a record for writing, storing each value with the
+        smallest serial type that holds it
+        """
+        record = cls.__new__(cls)
+        record.data = None
+        record.encoding = encoding
+        record.values = list(values)
+        record.cursor = None
+
+        # text is encoded once, for both its serial type and the layout
+        columns = []
+        texts = []
+        for value in record.values:
+            if isinstance(value, (str, LazyText)):
+                text = value.encode(encoding)
+                columns.append(Column.from_int(13 + 2 * len(text)))
+            else:
+                text = None
+                columns.append(Column.for_value(value, allow_constants, encoding))
+            texts.append(text)
+        record.columns = columns
+        record._layout = record.measure(texts)
+        return record
+
     def read_column_types(
         self,
         data: bytes,
@@ -97,7 +269,13 @@ class Record:
     ) -> Tuple[List[any], int]:
         values = []
         for column in self.columns:
-            value, cursor = self.read_value(column.type, data, cursor, column.length)
+            value, cursor = self.read_value(
+                column.type,
+                data,
+                cursor,
+                column.length,
+                self.encoding,
+            )
             values.append(value)
         return values, cursor
 
@@ -107,62 +285,143 @@ class Record:
         data: bytes,
         cursor: int,
         length: int = None,
+        encoding: str = 'utf-8',
     ) -> Tuple[any, int]:
         if column_type == ColumnType.NULL:
             return None, cursor
         elif column_type == ColumnType.TINYINT:
-            return int(data[cursor]), cursor + 1
+            return INT8.unpack_from(data, cursor)[0], cursor + 1
         elif column_type == ColumnType.SMALLINT:
-            return b2i(data[cursor: cursor + 2]), cursor + 2
+            return INT16.unpack_from(data, cursor)[0], cursor + 2
         elif column_type == ColumnType.SMALLISHINT:
-            return b2i(data[cursor: cursor + 3]), cursor + 3
+            high, low = INT24.unpack_from(data, cursor)
+            return (high << 16) | low, cursor + 3
         elif column_type == ColumnType.INTEGER:
-            return b2i(data[cursor: cursor + 4]), cursor + 4
+            return INT32.unpack_from(data, cursor)[0], cursor + 4
         elif column_type == ColumnType.BIGGISHINT:
-            return b2i(data[cursor: cursor + 6]), cursor + 6
+            high, low = INT48.unpack_from(data, cursor)
+            return (high << 32) | low, cursor + 6
         elif column_type == ColumnType.LONG:
-            return b2i(data[cursor: cursor + 8]), cursor + 8
+            return INT64.unpack_from(data, cursor)[0], cursor + 8
+        elif column_type == ColumnType.IEEE754INT:
+            return FLOAT64.unpack_from(data, cursor)[0], cursor + 8
         elif column_type == ColumnType.ZERO:
             return 0, cursor
         elif column_type == ColumnType.ONE:
             return 1, cursor
         elif column_type == ColumnType.BLOB:
-            return data[cursor: cursor + length], cursor + length
+            return bytes(data[cursor: cursor + length]), cursor + length
         elif column_type == ColumnType.TEXT:
-            return data[cursor: cursor + length].decode('utf-8'), cursor + length
+            raw = bytes(data[cursor: cursor + length])
+            return LazyText(raw, encoding), cursor + length
         else:
             raise Exception(f'cannot parse column type {column_type}')
 
-    def header_bytes(self) -> bytes:
-        payload = bytearray()
+    def layout(self) -> Layout:
+        """
+        layout returns the header size, the total size, the serial type of
+        each column and the bodies of the text and blob columns, None for
+        the others. Header sizes take as many varint bytes as they need, so
+        records may have any number of columns.
+        """
+        if self._layout is None:
+            self._layout = self.measure()
+        return self._layout
 
-        for column in self.columns:
-            payload += column.to_bytes()
+    def measure(self, texts: List[bytes] = None) -> Layout:
+        # texts holds the text values already encoded, by column
+        serial_types = []
+        bodies = []
+        header_size = 0
+        body_size = 0
+        for i, (column, value) in enumerate(zip(self.columns, self.values)):
+            serial_type = column.serial_type
+            serial_types.append(serial_type)
+            header_size += 1 if serial_type <= 0x7f else varint_size(serial_type)
+            if serial_type >= 12:
+                if serial_type % 2 == 0:
+                    body = value
+                elif texts is not None and texts[i] is not None:
+                    body = texts[i]
+                else:
+                    body = value.encode(self.encoding)
+                bodies.append(body)
+                body_size += len(body)
+            else:
+                bodies.append(None)
+                body_size += SERIAL_TYPE_SIZES[serial_type]
+
+        # the header size counts its own varint
+        size_length = 1
+        while varint_size(header_size + size_length) > size_length:
+            size_length += 1
+        header_size += size_length
 
-        payload_size = len(payload)
-        if payload_size > 32765:
-            raise Exception(f'unexpected header payload size {payload_size}')
+        return header_size, header_size + body_size, serial_types, bodies
 
-        expected_varint_length = 1 if payload_size < 127 else 2
-        header_size_bytes = to_varint(payload_size + expected_varint_length)
-        return bytes(header_size_bytes + payload)
+    def size(self) -> int:
+        return self.layout()[1]
+
+    def encode_into(self, buf: bytearray, offset: int) -> int:
+        """
+        encode_into writes the record into buf at offset, a bytearray or a
+        writable memoryview with room for size() bytes, and returns the
+        offset past its end. Nothing is allocated beyond the layout.
+        """
+        header_size, _, serial_types, bodies = self.layout()
+        cursor = write_varint(buf, offset, header_size)
+        for serial_type in serial_types:
+            if serial_type <= 0x7f:
+                buf[cursor] = serial_type
+                cursor += 1
+            else:
+                cursor = write_varint(buf, cursor, serial_type)
+
+        for serial_type, value, body in zip(serial_types, self.values, bodies):
+            if body is not None:
+                end = cursor + len(body)
+                buf[cursor:end] = body
+                cursor = end
+            elif serial_type < 8:
+                packer = PACKERS.get(serial_type)
+                if packer is not None:
+                    packer.pack_into(buf, cursor, value)
+                    cursor += packer.size
+                elif serial_type == 3:
+                    INT24.pack_into(buf, cursor, value >> 16, value & 0xffff)
+                    cursor += 3
+                elif serial_type == 5:
+                    INT48.pack_into(buf, cursor, value >> 32, value & 0xffffffff)
+                    cursor += 6
+            # NULL and the constants 0 and 1 have no body
+        return cursor
+
+    def header_bytes(self) -> bytes:
+        header_size = self.layout()[0]
+        header = bytearray(header_size)
+        cursor = write_varint(header, 0, header_size)
+        for serial_type in self.layout()[2]:
+            cursor = write_varint(header, cursor, serial_type)
+        return bytes(header)
 
     @staticmethod
-    def value_bytes(column: Column, value: any) -> bytes:
+    def value_bytes(column: Column, value: any, encoding: str='utf-8') -> bytes:
         if column.type == ColumnType.NULL:
             return bytes([])
         elif column.type == ColumnType.TINYINT:
-            return value.to_bytes(1)
+            return INT8.pack(value)
         elif column.type == ColumnType.SMALLINT:
-            return value.to_bytes(2)
+            return INT16.pack(value)
         elif column.type == ColumnType.SMALLISHINT:
-            return value.to_bytes(3)
+            return INT24.pack(value >> 16, value & 0xffff)
         elif column.type == ColumnType.INTEGER:
-            return value.to_bytes(4)
+            return INT32.pack(value)
         elif column.type == ColumnType.BIGGISHINT:
-            return value.to_bytes(6)
+            return INT48.pack(value >> 32, value & 0xffffffff)
         elif column.type == ColumnType.LONG:
-            return value.to_bytes(8)
+            return INT64.pack(value)
+        elif column.type == ColumnType.IEEE754INT:
+            return FLOAT64.pack(value)
         elif column.type == ColumnType.ZERO:
             return bytes([])
         elif column.type == ColumnType.ONE:
@@ -170,7 +429,7 @@ class Record:
         elif column.type == ColumnType.BLOB:
             return value
         elif column.type == ColumnType.TEXT:
-            return bytes(value, 'utf-8')
+            return value.encode(encoding)
         else:
             raise Exception(f'cannot parse column type { column.type }')
 
@@ -178,18 +437,110 @@ class Record:
         body = bytearray()
 
         for i, column in enumerate(self.columns):
-            body += self.value_bytes(column, self.values[i])
+            body += self.value_bytes(column, self.values[i], self.encoding)
 
         return bytes(body)
 
     def to_bytes(self) -> bytes:
-        header_bytes = self.header_bytes()
-        values_bytes = self.values_bytes()
-
-        return header_bytes + values_bytes
+        data = bytearray(self.size())
+        self.encode_into(data, 0)
+        return bytes(data)
 
     def _debug(self):
         for i, column in enumerate(self.columns):
             print('column type', column.type)
             print('value', self.values[i])
 
+class RecordView:
+    """
+    RecordView reads the serial types of a record but leaves the values in
+    place, so a column is only decoded when it is asked for. Columns past the
+    end of the record read as NULL, as they do for rows written before an
+    ALTER TABLE ADD COLUMN.
+    """
+    __slots__ = ('data', 'encoding', 'body', 'serial_types', '_offsets')
+
+    def __init__(
+        self,
+        data: bytes,
+        cursor: int = 0,
+        encoding: str = 'utf-8',
+    ):
+        self.encoding = encoding
+        self.reset(data, cursor)
+
+    def reset(self, data: bytes, cursor: int = 0):
+        """
+        reset points the view at another record, so that a scan reads all
+        its rows through one view
+        """
+        self.data = data
+        header_size, position = varint(data, cursor)
+        self.body = cursor + header_size
+
+        serial_types = []
+        while position < self.body:
+            # most serial types fit in a single byte varint
+            byte = data[position]
+            if byte < 0x80:
+                serial_types.append(byte)
+                position += 1
+            else:
+                serial_type, position = varint(data, position)
+                serial_types.append(serial_type)
+
+        self.serial_types = serial_types
+        self._offsets = None
+
+    @property
+    def offsets(self) -> List[int]:
+        # value offsets are only worked out once a value is read
+        if self._offsets is None:
+            offsets = []
+            offset = self.body
+            for serial_type in self.serial_types:
+                offsets.append(offset)
+                if serial_type >= 12:
+                    offset += (serial_type - 12) >> 1
+                else:
+                    offset += SERIAL_TYPE_SIZES[serial_type]
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.serial_types)
+
+    def serial_type(self, i: int) -> int:
+        if i >= len(self.serial_types):
+            return 0
+        return self.serial_types[i]
+
+    def size(self, i: int) -> int:
+        return serial_type_size(self.serial_type(i))
+
+    def raw(self, i: int) -> bytes:
+        if i >= len(self.serial_types):
+            return b''
+        offset = self.offsets[i]
+        # bytes, pages of a MemoryPager are memoryviews
+        return bytes(self.data[offset:offset + serial_type_size(self.serial_types[i])])
+
+    def value(self, i: int) -> any:
+        serial_type = self.serial_type(i)
+        if serial_type == 0:
+            return None
+        elif serial_type >= 12:
+            raw = self.raw(i)
+            return LazyText(raw, self.encoding) if serial_type % 2 else raw
+
+        value, _ = Record.read_value(
+            ColumnType(serial_type),
+            self.data,
+            self.offsets[i],
+        )
+        return value
+
+    def values(self, columns: List[int] = None) -> List[any]:
+        if columns is None:
+            columns = range(len(self.serial_types))
+        return [self.value(i) for i in columns]
@@ -0,0 +1,233 @@
+import heapq
+import os
+import tempfile
+from operator import itemgetter
+from struct import Struct
+from typing import Callable, Iterator, List, Tuple
+
+from src.backend.pager import Pager
+from src.backend.record import Record, RecordView
+
+# every record in a run is preceded by its length
+LENGTH = Struct('>I')
+
+# rough size of the python objects kept per buffered record besides its bytes
+RECORD_OVERHEAD = 120
+
+DEFAULT_SORT_MEMORY = 64 * 1024 * 1024
+
+class Descending:
+    """
+    Descending wraps a sort key to reverse its order, so keys mixing
+    ascending and descending parts can be compared as a single tuple
+    """
+    __slots__ = ('key',)
+
+    def __init__(self, key: any):
+        self.key = key
+
+    def __eq__(self, other: 'Descending') -> bool:
+        return self.key == other.key
+
+    def __lt__(self, other: 'Descending') -> bool:
+        return other.key < self.key
+
+    def __repr__(self) -> str:
+        return f'Descending({self.key!r})'
+
+# a run of sorted records in the spill file, its first page and byte length
+Run = Tuple[int, int]
+
+class ExternalSorter:
+    """
+    ExternalSorter sorts rows of values that may not fit in memory. Rows are
+    kept encoded as records until the buffered records use up the memory
+    budget, then the buffer is sorted and spilled as a run of pages to a
+    temporary file through a Pager. sorted() merges the runs with a heap,
+    at most fan_in runs at a time, yielding rows in key order. The sort is
+    stable.
+
+    Keys are computed again from rows read back from a run, where text is
+    LazyText in the sorter's encoding, so text given to add should be
+    LazyText too for both keys to order alike.
+    """
+    def __init__(
+        self,
+        key: Callable[[List[any]], any],
+        memory: int = DEFAULT_SORT_MEMORY,
+        page_size: int = 4096,
+        encoding: str = 'utf-8',
+        directory: str = None,
+        fan_in: int = 64,
+        read_pages: int = 8,
+    ):
+        if fan_in < 2:
+            raise ValueError('fan_in must be at least 2')
+
+        self.key = key
+        self.memory = memory
+        self.page_size = page_size
+        self.encoding = encoding
+        self.directory = directory
+        self.fan_in = fan_in
+        self.read_pages = read_pages
+
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+        self.pager = None
+        self.next_page = 1
+
+        # statistics of the sort, for tuning the budget
+        self.rows = 0
+        self.spilled_runs = 0
+        self.pages_written = 0
+
+    def add(self, values: List[any]):
+        data = Record.from_values(values, encoding=self.encoding).to_bytes()
+        self.buffer.append((self.key(values), data))
+        self.buffered += len(data) + RECORD_OVERHEAD
+        self.rows += 1
+
+        if self.buffered >= self.memory:
+            self.spill()
+
+    def extend(self, rows: Iterator[List[any]]):
+        for values in rows:
+            self.add(values)
+
+    def decode(self, data: bytes) -> List[any]:
+        return RecordView(data, 0, self.encoding).values()
+
+    def spill(self):
+        if not self.buffer:
+            return
+        self.buffer.sort(key=itemgetter(0))
+        self.runs.append(self.write_run(data for _, data in self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def write_run(self, records: Iterator[bytes]) -> Run:
+        """
+        write_run appends records to the spill file starting on a fresh page,
+        writing whole pages as they fill up
+        """
+        if self.pager is None:
+            fd, path = tempfile.mkstemp(suffix='.sort', dir=self.directory)
+            os.close(fd)
+            # the file is private to the sort, it needs neither caching nor
+            # locking
+            self.pager = Pager(path, self.page_size, cache_size=0, locking=False)
+
+        first_page = self.next_page
+        pending = bytearray()
+        length = 0
+
+        for data in records:
+            pending += LENGTH.pack(len(data))
+            pending += data
+            length += LENGTH.size + len(data)
+
+            full = len(pending) - len(pending) % self.page_size
+            if full:
+                self.write_pages(pending[:full])
+                del pending[:full]
+
+        if pending:
+            pending += bytes(self.page_size - len(pending))
+            self.write_pages(pending)
+
+        self.spilled_runs += 1
+        return first_page, length
+
+    def write_pages(self, data: bytearray):
+        self.pager.write_page(self.next_page, bytes(data))
+        count = len(data) // self.page_size
+        self.next_page += count
+        self.pages_written += count
+
+    def read_run(self, run: Run) -> Iterator[Tuple[any, List[any], bytes]]:
+        """
+        read_run yields the (key, values, record) triples of a run, reading a
+        few pages at a time so that memory stays bounded however long the run
+        is
+        """
+        page_number, remaining = run
+        pending = bytearray()
+        cursor = 0
+
+        while remaining:
+            if len(pending) - cursor < LENGTH.size:
+                pending, cursor, page_number = self.refill(pending, cursor, page_number)
+                continue
+            (size,) = LENGTH.unpack_from(pending, cursor)
+            end = cursor + LENGTH.size + size
+            if len(pending) < end:
+                pending, cursor, page_number = self.refill(pending, cursor, page_number)
+                continue
+
+            data = bytes(pending[cursor + LENGTH.size:end])
+            values = self.decode(data)
+            remaining -= end - cursor
+            cursor = end
+            yield self.key(values), values, data
+
+    def refill(self, pending: bytearray, cursor: int, page_number: int):
+        pages = self.pager.get_pages(page_number, self.read_pages)
+        if not pages:
+            raise EOFError(f'sort run truncated at page {page_number}')
+        pending = pending[cursor:] + b''.join(pages)
+        return pending, 0, page_number + len(pages)
+
+    def merge(self, runs: List[Run]) -> Iterator[Tuple[any, List[any], bytes]]:
+        # heapq.merge keeps equal keys in run order, so the merge is stable
+        return heapq.merge(*(self.read_run(run) for run in runs), key=itemgetter(0))
+
+    def sorted(self) -> Iterator[List[any]]:
+        """
+        sorted yields every added row in key order. Once nothing has been
+        spilled the rows are sorted in memory, otherwise the runs are merged
+        down to fan_in runs and then streamed through a final merge. The
+        spill file is removed when the generator finishes or is closed.
+        """
+        for _, values, data in self.entries():
+            yield self.decode(data) if values is None else values
+
+    def records(self) -> Iterator[Tuple[any, bytes]]:
+        """
+        records yields the (key, record) pair of every added row in key
+        order, for callers wanting the rows encoded as the sorter holds them
+        """
+        for key, _, data in self.entries():
+            yield key, data
+
+    def entries(self) -> Iterator[Tuple[any, List[any], bytes]]:
+        # rows sorted in memory are not decoded, their values are None
+        try:
+            if not self.runs:
+                self.buffer.sort(key=itemgetter(0))
+                for key, data in self.buffer:
+                    yield key, None, data
+                return
+
+            self.spill()
+            while len(self.runs) > self.fan_in:
+                merged = self.merge(self.runs[:self.fan_in])
+                # intermediate merges copy the records without encoding them
+                run = self.write_run(data for _, _, data in merged)
+                self.runs = [run] + self.runs[self.fan_in:]
+
+            yield from self.merge(self.runs)
+        finally:
+            self.close()
+
+    def close(self):
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+        if self.pager is not None:
+            self.pager.close()
+            if os.path.exists(self.pager.file_name):
+                os.remove(self.pager.file_name)
+            self.pager = None
+            self.next_page = 1
@@ -0,0 +1,79 @@
+from typing import Tuple
+
+class LazyText:
+    """
+    LazyText is a TEXT value as stored in the database. The raw bytes are kept
+    in the database encoding and only decoded when the string is needed, so
+    equality and prefix tests against a constant can run on the raw bytes.
+    """
+    __slots__ = ('raw', 'encoding', 'value')
+
+    def __init__(self, raw: bytes, encoding: str='utf-8'):
+        self.raw = raw
+        self.encoding = encoding
+        self.value = None
+
+    def decode(self) -> str:
+        if self.value is None:
+            self.value = self.raw.decode(self.encoding)
+        return self.value
+
+    def encode(self, encoding: str='utf-8') -> bytes:
+        if encoding == self.encoding:
+            return self.raw
+        return self.decode().encode(encoding)
+
+    def startswith(self, prefix: any) -> bool:
+        return self.raw.startswith(prefix.encode(self.encoding))
+
+    def ordering_keys(self, other: any) -> Tuple[bytes, bytes]:
+        # the BINARY collation compares the bytes of the database encoding
+        return self.raw, other.encode(self.encoding)
+
+    def __eq__(self, other: any) -> bool:
+        if isinstance(other, LazyText):
+            if other.encoding == self.encoding:
+                return self.raw == other.raw
+            return self.decode() == other.decode()
+        elif isinstance(other, str):
+            if self.value is not None:
+                return self.value == other
+            return self.raw == other.encode(self.encoding)
+        return NotImplemented
+
+    def __lt__(self, other: any) -> bool:
+        if not isinstance(other, (LazyText, str)):
+            return NotImplemented
+        a, b = self.ordering_keys(other)
+        return a < b
+
+    def __le__(self, other: any) -> bool:
+        if not isinstance(other, (LazyText, str)):
+            return NotImplemented
+        a, b = self.ordering_keys(other)
+        return a <= b
+
+    def __gt__(self, other: any) -> bool:
+        if not isinstance(other, (LazyText, str)):
+            return NotImplemented
+        a, b = self.ordering_keys(other)
+        return a > b
+
+    def __ge__(self, other: any) -> bool:
+        if not isinstance(other, (LazyText, str)):
+            return NotImplemented
+        a, b = self.ordering_keys(other)
+        return a >= b
+
+    def __hash__(self) -> int:
+        # hashes like the decoded string so both can be used as the same key
+        return hash(self.decode())
+
+    def __len__(self) -> int:
+        return len(self.decode())
+
+    def __str__(self) -> str:
+        return self.decode()
+
+    def __repr__(self) -> str:
+        return repr(self.decode())
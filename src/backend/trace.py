@@ -0,0 +1,113 @@
+import struct
+import threading
+import time
+from typing import Iterator, Tuple
+
+TRACE_MAGIC = b'SQLite pagetrace'
+# magic, page size and the wall clock time the trace started at
+TRACE_HEADER = struct.Struct('>16sId')
+# page number, access, page type and nanoseconds since the trace started
+RECORD = struct.Struct('>IBBQ')
+
+# a page asked of the pager, written through it, or read by get_pages,
+# which bypasses the cache
+READ = 0
+WRITE = 1
+SCAN = 2
+ACCESS_NAMES = {READ: 'read', WRITE: 'write', SCAN: 'scan'}
+
+# records are buffered and written 64 KiB at a time
+DEFAULT_BUFFER_SIZE = 64 * 1024
+# records read from a trace at a time
+READ_BATCH = 4096
+
+class TraceError(Exception):
+    pass
+
+def page_type(page_number: int, data: bytes) -> int:
+    """
+    page_type returns the first byte of the b-tree page header, 0 for pages
+    that are not b-tree pages. The header of page 1 follows the database
+    header.
+    """
+    offset = 100 if page_number == 1 else 0
+    return data[offset] if len(data) > offset else 0
+
+class PageTrace:
+    """
+    PageTrace records the page accesses of a pager into a file, a fixed size
+    binary record per access after a header. Records are packed into a
+    buffer written out once it fills, so tracing costs a struct pack and a
+    lock per access. The pager calls record when its trace is set; the
+    trace is flushed when the pager closes.
+    """
+    def __init__(
+        self,
+        file_name: str,
+        page_size: int,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ):
+        self.file_name = file_name
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.mutex = threading.Lock()
+        self.records = 0
+
+        self.file = open(file_name, 'wb')
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, page_size, time.time()))
+        self.started = time.perf_counter_ns()
+
+    def record(self, page_number: int, access: int, data: bytes):
+        kind = page_type(page_number, data)
+        with self.mutex:
+            # timed holding the mutex, so records are in time order
+            self.buffer += RECORD.pack(
+                page_number,
+                access,
+                kind,
+                time.perf_counter_ns() - self.started,
+            )
+            self.records += 1
+            if len(self.buffer) >= self.buffer_size and self.file is not None:
+                self.file.write(self.buffer)
+                self.buffer.clear()
+
+    def flush(self):
+        with self.mutex:
+            if self.file is not None:
+                self.file.write(self.buffer)
+                self.buffer.clear()
+                self.file.flush()
+
+    def close(self):
+        self.flush()
+        with self.mutex:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class TraceReader:
+    """
+    TraceReader reads a trace written by PageTrace, yielding its records as
+    (page number, access, page type, nanoseconds) tuples. A record cut short
+    by a process ending mid-write ends the trace.
+    """
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        with open(file_name, 'rb') as f:
+            header = f.read(TRACE_HEADER.size)
+        if len(header) < TRACE_HEADER.size:
+            raise TraceError(f'{file_name} is not a page trace')
+        magic, self.page_size, self.started = TRACE_HEADER.unpack(header)
+        if magic != TRACE_MAGIC:
+            raise TraceError(f'{file_name} is not a page trace')
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int, int]]:
+        with open(self.file_name, 'rb') as f:
+            f.seek(TRACE_HEADER.size)
+            while True:
+                data = f.read(RECORD.size * READ_BATCH)
+                whole = len(data) - len(data) % RECORD.size
+                yield from RECORD.iter_unpack(data[:whole])
+                if len(data) < RECORD.size * READ_BATCH:
+                    return
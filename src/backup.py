@@ -0,0 +1,406 @@
+"""
+Incremental page-level backups of a database file. A backup directory holds
+a chain of increments, each the pages that changed since the run before, and
+a manifest with a hash of every page of the file as of the last run:
+
+    python -m src.backup backup db.sqlite backups/db
+    python -m src.backup restore backups/db restored.sqlite
+    python -m src.backup verify backups/db restored.sqlite
+
+A run whose file still carries the change counter recorded in the manifest
+copies nothing. Otherwise the file is read in large sequential batches and
+only the pages whose hash differs are written to a new increment. In WAL
+mode the pages of transactions committed to the -wal file but not yet
+checkpointed are read from it in place of those of the file, so the backup
+holds every committed transaction.
+"""
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from src.backend.pager import Pager
+from src.database import DB_HEADER_SIZE
+from src.dbinfo import DBInfo, FileFormatVersion
+
+MANIFEST = 'manifest'
+MANIFEST_MAGIC = b'SQLite backup manifest\0\0'
+INCREMENT_MAGIC = b'SQLite backup pages\0\0\0\0\0'
+
+# magic, page size, page count, change counter, base increment and latest
+# increment; the page hashes follow
+MANIFEST_HEADER = struct.Struct('>24sIIIII')
+# magic, page size, page count of the file and pages in the increment; each
+# page follows as its page number and content
+INCREMENT_HEADER = struct.Struct('>24sIII')
+PAGE_NUMBER = struct.Struct('>I')
+
+# the write-ahead log of a database is the file name with this appended
+WAL_SUFFIX = '-wal'
+# magic, format version, page size, checkpoint sequence, two salts and the
+# checksum of the header
+WAL_HEADER = struct.Struct('>IIIIIIII')
+# page number, page count after a commit or 0, two salts and the checksum
+# of the frame and every frame before it
+WAL_FRAME_HEADER = struct.Struct('>IIIIII')
+# checksums are computed on big-endian words when the low bit is set
+WAL_MAGIC = 0x377f0682
+
+DIGEST_SIZE = 16
+# pages read from the database with each read, 16 MiB of 4 KiB pages
+DEFAULT_BATCH_PAGES = 4096
+
+class BackupError(Exception):
+    pass
+
+def page_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+def increment_path(directory: str, number: int) -> str:
+    return os.path.join(directory, f'{number:06}.pages')
+
+@dataclass
+class Manifest:
+    """
+    Manifest is the state of the file at the last backup, the hash of each
+    of its pages, and the increments that rebuild it: base, a full copy,
+    through latest
+    """
+    page_size: int
+    change_counter: int
+    base: int
+    latest: int
+    digests: bytearray
+
+    @property
+    def page_count(self) -> int:
+        return len(self.digests) // DIGEST_SIZE
+
+    def digest(self, page_number: int) -> bytes:
+        offset = (page_number - 1) * DIGEST_SIZE
+        return bytes(self.digests[offset:offset + DIGEST_SIZE])
+
+    @classmethod
+    def read(cls, directory: str) -> 'Manifest':
+        path = os.path.join(directory, MANIFEST)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, page_size, page_count, change_counter, base, latest = \
+            MANIFEST_HEADER.unpack_from(data)
+        if magic != MANIFEST_MAGIC:
+            raise BackupError(f'{path} is not a backup manifest')
+        digests = bytearray(data[MANIFEST_HEADER.size:])
+        if len(digests) != page_count * DIGEST_SIZE:
+            raise BackupError(f'{path} holds {len(digests) // DIGEST_SIZE} '
+                              f'page hashes, expected {page_count}')
+        return cls(page_size, change_counter, base, latest, digests)
+
+    def write(self, directory: str):
+        # replaced in one step, so a run that fails leaves the last manifest
+        path = os.path.join(directory, MANIFEST)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(MANIFEST_HEADER.pack(
+                MANIFEST_MAGIC,
+                self.page_size,
+                self.page_count,
+                self.change_counter,
+                self.base,
+                self.latest,
+            ))
+            f.write(self.digests)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+@dataclass
+class BackupReport:
+    pages: int = 0
+    copied: int = 0
+    # set when the change counter showed the file unchanged
+    skipped: bool = False
+    increment: int = None
+    elapsed: float = 0.0
+
+def wal_checksum(data: bytes, big_endian: bool, s0: int, s1: int) -> Tuple[int, int]:
+    words = array('I', data)
+    if big_endian != (sys.byteorder == 'big'):
+        words.byteswap()
+    for i in range(0, len(words), 2):
+        s0 = (s0 + words[i] + s1) & 0xffffffff
+        s1 = (s1 + words[i + 1] + s0) & 0xffffffff
+    return s0, s1
+
+def read_wal(file_name: str, page_size: int) -> Tuple[Dict[int, bytes], int]:
+    """
+    read_wal returns the pages of the transactions committed to the WAL of
+    file_name, the latest copy of each, and the page count of the database
+    as of the last commit, None when no transaction is in the WAL. Frames
+    are read up to the first one whose salts or running checksum do not
+    match, left from before the WAL was last restarted or cut short, and
+    those past the last commit are dropped.
+    """
+    path = file_name + WAL_SUFFIX
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}, None
+    if len(data) < WAL_HEADER.size:
+        return {}, None
+    magic, _, wal_page_size, _, salt1, salt2, sum0, sum1 = \
+        WAL_HEADER.unpack_from(data)
+    if magic & ~1 != WAL_MAGIC or wal_page_size != page_size:
+        return {}, None
+    big_endian = bool(magic & 1)
+    s0, s1 = wal_checksum(data[:WAL_HEADER.size - 8], big_endian, 0, 0)
+    if (s0, s1) != (sum0, sum1):
+        return {}, None
+
+    pages, committed, page_count = {}, {}, None
+    frame_size = WAL_FRAME_HEADER.size + page_size
+    for offset in range(WAL_HEADER.size, len(data) - frame_size + 1, frame_size):
+        page_number, commit, frame_salt1, frame_salt2, sum0, sum1 = \
+            WAL_FRAME_HEADER.unpack_from(data, offset)
+        if (frame_salt1, frame_salt2) != (salt1, salt2):
+            break
+        page = data[offset + WAL_FRAME_HEADER.size:offset + frame_size]
+        s0, s1 = wal_checksum(data[offset:offset + 8], big_endian, s0, s1)
+        s0, s1 = wal_checksum(page, big_endian, s0, s1)
+        if (s0, s1) != (sum0, sum1):
+            break
+        pages[page_number] = page
+        if commit:
+            committed.update(pages)
+            pages.clear()
+            page_count = commit
+    return committed, page_count
+
+def read_header(pager: Pager) -> DBInfo:
+    return DBInfo(pager.get_pages(1, 1)[0][:DB_HEADER_SIZE])
+
+def backup(
+    file_name: str,
+    directory: str,
+    batch_pages: int = DEFAULT_BATCH_PAGES,
+    full: bool = False,
+) -> BackupReport:
+    """
+    backup adds an increment to the backup in directory holding the pages of
+    file_name changed since the last run, or every page when there is no
+    earlier backup or full is set. A shared lock is held throughout so the
+    backup is of one committed state of the file.
+
+    The change counter settles that nothing changed without reading the
+    file, except in WAL mode where sqlite does not keep it up to date.
+    A full backup starts a new chain and removes the increments before it.
+
+    In WAL mode the committed pages of the WAL replace those of the file.
+    sqlite checkpoints under locks of the -shm file that are not taken, so a
+    checkpoint running alongside the backup can mix in pages of later
+    transactions; back up between checkpoints for a consistent copy.
+    """
+    report = BackupReport()
+    start = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    manifest = Manifest.read(directory)
+
+    with open(file_name, 'rb') as f:
+        page_size = DBInfo(f.read(DB_HEADER_SIZE)).page_size
+    pager = Pager(file_name, page_size, cache_size=0)
+    pager.begin_read()
+    try:
+        dbinfo = read_header(pager)
+        page_count = pager.num_pages()
+        wal = {}
+        if dbinfo.file_format_write_version == FileFormatVersion.WAL:
+            wal, wal_page_count = read_wal(file_name, page_size)
+            if wal_page_count is not None:
+                page_count = wal_page_count
+                if 1 in wal:
+                    dbinfo = DBInfo(wal[1][:DB_HEADER_SIZE])
+        file_page_count = min(page_count, pager.num_pages())
+        report.pages = page_count
+
+        if manifest is not None and manifest.page_size != page_size:
+            full = True
+        if manifest is not None and not full and (
+            dbinfo.file_format_write_version != FileFormatVersion.WAL and
+            dbinfo.file_change_counter == manifest.change_counter and
+            page_count == manifest.page_count
+        ):
+            report.skipped = True
+            report.elapsed = time.perf_counter() - start
+            return report
+
+        number = 1 if manifest is None else manifest.latest + 1
+        previous = bytearray() if manifest is None or full else manifest.digests
+        digests = bytearray(page_count * DIGEST_SIZE)
+        path = increment_path(directory, number)
+
+        with open(path + '.tmp', 'wb') as out:
+            out.write(INCREMENT_HEADER.pack(INCREMENT_MAGIC, page_size, page_count, 0))
+            for first in range(1, page_count + 1, batch_pages):
+                count = min(batch_pages, page_count - first + 1)
+                in_file = max(0, min(count, file_page_count - first + 1))
+                pages = pager.get_pages(first, in_file) if in_file else []
+                for i in range(count):
+                    page_number = first + i
+                    data = wal.get(page_number)
+                    if data is None:
+                        # a page past the file and not in the WAL was never
+                        # written
+                        data = pages[i] if i < len(pages) else bytes(page_size)
+                    digest = page_digest(data)
+                    offset = (page_number - 1) * DIGEST_SIZE
+                    digests[offset:offset + DIGEST_SIZE] = digest
+                    if previous[offset:offset + DIGEST_SIZE] != digest:
+                        out.write(PAGE_NUMBER.pack(page_number))
+                        out.write(data)
+                        report.copied += 1
+
+            # the count of pages is only known at the end
+            out.seek(0)
+            out.write(INCREMENT_HEADER.pack(
+                INCREMENT_MAGIC,
+                page_size,
+                page_count,
+                report.copied,
+            ))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(path + '.tmp', path)
+    finally:
+        pager.end_read()
+        pager.close()
+
+    base = number if manifest is None or full else manifest.base
+    Manifest(page_size, dbinfo.file_change_counter, base, number, digests) \
+        .write(directory)
+    if manifest is not None and full:
+        for old in range(manifest.base, manifest.latest + 1):
+            os.remove(increment_path(directory, old))
+
+    report.increment = number
+    report.elapsed = time.perf_counter() - start
+    return report
+
+def restore(directory: str, file_name: str) -> int:
+    """
+    restore writes the file as of the last backup to file_name, applying
+    the increments from the last full copy on, and verifies it against the
+    manifest. It returns the number of pages restored.
+    """
+    manifest = Manifest.read(directory)
+    if manifest is None:
+        raise BackupError(f'no backup in {directory}')
+    page_size = manifest.page_size
+
+    with open(file_name, 'wb') as out:
+        for number in range(manifest.base, manifest.latest + 1):
+            path = increment_path(directory, number)
+            with open(path, 'rb') as f:
+                magic, size, _, count = INCREMENT_HEADER.unpack(
+                    f.read(INCREMENT_HEADER.size),
+                )
+                if magic != INCREMENT_MAGIC or size != page_size:
+                    raise BackupError(f'{path} is not an increment of this backup')
+                for _ in range(count):
+                    record = f.read(PAGE_NUMBER.size + page_size)
+                    if len(record) != PAGE_NUMBER.size + page_size:
+                        raise BackupError(f'{path} is truncated')
+                    page_number, = PAGE_NUMBER.unpack_from(record)
+                    out.seek((page_number - 1) * page_size)
+                    out.write(memoryview(record)[PAGE_NUMBER.size:])
+        # the file may have shrunk since earlier increments
+        out.truncate(manifest.page_count * page_size)
+        out.flush()
+        os.fsync(out.fileno())
+
+    errors = verify(directory, file_name)
+    if errors:
+        raise BackupError(f'restored file does not match the backup: {errors[0]}')
+    return manifest.page_count
+
+def verify(
+    directory: str,
+    file_name: str,
+    batch_pages: int = DEFAULT_BATCH_PAGES,
+) -> List[str]:
+    """
+    verify compares every page of file_name with its hash in the manifest,
+    returning the differences found
+    """
+    manifest = Manifest.read(directory)
+    if manifest is None:
+        raise BackupError(f'no backup in {directory}')
+
+    errors = []
+    pager = Pager(file_name, manifest.page_size, cache_size=0)
+    try:
+        page_count = pager.num_pages()
+        if page_count != manifest.page_count:
+            errors.append(f'file holds {page_count} pages, '
+                          f'backup {manifest.page_count}')
+        last = min(page_count, manifest.page_count)
+        for first in range(1, last + 1, batch_pages):
+            count = min(batch_pages, last - first + 1)
+            for i, data in enumerate(pager.get_pages(first, count)):
+                if page_digest(data) != manifest.digest(first + i):
+                    errors.append(f'page {first + i} differs')
+    finally:
+        pager.close()
+    return errors
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.backup',
+        description='incremental page-level backups of a sqlite database file',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('backup', help='back up changed pages')
+    command.add_argument('file_name')
+    command.add_argument('directory')
+    command.add_argument('--full', action='store_true',
+                         help='copy every page and start a new chain')
+    command.add_argument('--batch-pages', type=int, default=DEFAULT_BATCH_PAGES)
+    command = commands.add_parser('restore', help='rebuild the file from a backup')
+    command.add_argument('directory')
+    command.add_argument('file_name')
+    command = commands.add_parser('verify', help='compare a file with a backup')
+    command.add_argument('directory')
+    command.add_argument('file_name')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'backup':
+            report = backup(args.file_name, args.directory, args.batch_pages, args.full)
+            if report.skipped:
+                print(f'unchanged, {report.pages} pages')
+            else:
+                print(f'increment {report.increment}: {report.copied} of '
+                      f'{report.pages} pages copied in {report.elapsed:.3f}s')
+        elif args.command == 'restore':
+            pages = restore(args.directory, args.file_name)
+            print(f'{pages} pages restored')
+        else:
+            errors = verify(args.directory, args.file_name)
+            for error in errors:
+                print(error)
+            if errors:
+                return 1
+            print('ok')
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
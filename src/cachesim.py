@@ -0,0 +1,292 @@
+"""
+Replays a page trace, recorded by opening a Database with trace_file,
+against simulated page caches of many sizes, to size the cache of a pager
+and choose its policy from the accesses of a real workload:
+
+    python -m src.cachesim trace.bin
+    python -m src.cachesim trace.bin --sizes 64,256,1024 --policies lru,arc
+    python -m src.cachesim trace.bin --hot 20 --heatmap
+
+The trace is replayed once for every size and policy. LRU is a stack
+algorithm, a cache of n pages holds the n most recently used pages, so the
+hit ratio of every size follows from the stack distance of each access,
+counted with a Fenwick tree. Other policies run a cache of each size side
+by side. Reads by get_pages bypass the cache and are only counted in the
+hot pages and the heatmap.
+"""
+import argparse
+import math
+import sys
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+from src.backend.cache import CACHE_POLICIES, make_cache
+from src.backend.trace import READ, SCAN, WRITE, TraceError, TraceReader
+
+# a page holding just its type, which is all policies look at to pin pages
+TYPE_PAGES = [bytes([page_type]) for page_type in range(256)]
+
+PAGE_TYPE_NAMES = {
+    0x02: 'index interior',
+    0x05: 'table interior',
+    0x0a: 'index leaf',
+    0x0d: 'table leaf',
+}
+
+# heatmap cells from no access to the most accessed, on a log scale
+SHADES = ' .:-=+*#%@'
+
+class Trace:
+    """
+    Trace holds the records of a trace file in arrays, the page number,
+    access, page type and nanoseconds of each
+    """
+    def __init__(self, file_name: str):
+        reader = TraceReader(file_name)
+        self.page_size = reader.page_size
+        self.pages = array('L')
+        self.accesses = bytearray()
+        self.types = bytearray()
+        self.times = array('Q')
+        for page_number, access, page_type, nanoseconds in reader:
+            self.pages.append(page_number)
+            self.accesses.append(access)
+            self.types.append(page_type)
+            self.times.append(nanoseconds)
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def distinct_pages(self) -> int:
+        return len(set(self.pages))
+
+    def duration(self) -> float:
+        # traces from other writers need not be in time order
+        return max(self.times) / 1e9 if self.times else 0.0
+
+class StackDistances:
+    """
+    StackDistances gives the LRU stack depth of each access, the number of
+    distinct pages used since the last access to the page, that page
+    included. A Fenwick tree over the access times marks the time of the
+    latest access to each page, so the depth is the count of marks since
+    the previous access to the page.
+    """
+    def __init__(self, size: int):
+        self.tree = [0] * (size + 1)
+        self.last = {}
+        self.time = 0
+
+    def add(self, position: int, delta: int):
+        tree = self.tree
+        position += 1
+        while position < len(tree):
+            tree[position] += delta
+            position += position & -position
+
+    def prefix(self, position: int) -> int:
+        # the marks before position
+        tree = self.tree
+        total = 0
+        while position > 0:
+            total += tree[position]
+            position -= position & -position
+        return total
+
+    def access(self, page_number: int) -> int:
+        """
+        access returns the stack depth of an access to the page, 0 for its
+        first access
+        """
+        now = self.time
+        self.time += 1
+        previous = self.last.get(page_number)
+        self.last[page_number] = now
+        self.add(now, 1)
+        if previous is None:
+            return 0
+        depth = self.prefix(now) - self.prefix(previous + 1) + 1
+        self.add(previous, -1)
+        return depth
+
+@dataclass
+class HitCurve:
+    """
+    HitCurve is the hits of a policy for cache sizes in pages, out of reads
+    page reads
+    """
+    policy: str
+    sizes: List[int]
+    hits: List[int]
+    reads: int
+
+    def ratios(self) -> List[float]:
+        return [hits / self.reads if self.reads else 0.0 for hits in self.hits]
+
+def simulate(
+    trace: Trace,
+    sizes: Sequence[int],
+    policies: Sequence[str] = ('lru', 'arc'),
+) -> Dict[str, HitCurve]:
+    """
+    simulate replays the reads and writes of the trace against caches of
+    each size for each policy, returning the hit curve of every policy.
+    Writes put the page in the cache as the pager does, without counting as
+    hits or misses.
+    """
+    for policy in policies:
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f'unknown cache policy {policy}')
+    sizes = sorted(set(sizes))
+    cached = [
+        (policy, [make_cache(policy, size) for size in sizes])
+        for policy in policies
+        if policy != 'lru'
+    ]
+    cached_hits = {policy: [0] * len(sizes) for policy, _ in cached}
+    stack = StackDistances(len(trace)) if 'lru' in policies else None
+    depths = Counter()
+    reads = 0
+
+    for page_number, access, page_type in zip(trace.pages, trace.accesses, trace.types):
+        if access == SCAN:
+            continue
+        depth = stack.access(page_number) if stack is not None else 0
+        if access == READ:
+            reads += 1
+            depths[depth] += 1
+
+        page = TYPE_PAGES[page_type]
+        for policy, caches in cached:
+            hits = cached_hits[policy]
+            for i, cache in enumerate(caches):
+                if access == WRITE:
+                    cache.pop(page_number)
+                    cache.put(page_number, page)
+                elif cache.get(page_number) is not None:
+                    hits[i] += 1
+                else:
+                    cache.put(page_number, page)
+
+    curves = {}
+    for policy in policies:
+        if policy == 'lru':
+            # a read hits every cache at least as deep as its stack depth
+            hits = [
+                sum(count for depth, count in depths.items() if 0 < depth <= size)
+                for size in sizes
+            ]
+        else:
+            hits = cached_hits[policy]
+        curves[policy] = HitCurve(policy, sizes, hits, reads)
+    return curves
+
+def default_sizes(trace: Trace) -> List[int]:
+    """
+    default_sizes are powers of two from 16 pages up to the first size
+    holding every page of the trace
+    """
+    sizes = [16]
+    while sizes[-1] < trace.distinct_pages():
+        sizes.append(sizes[-1] * 2)
+    return sizes
+
+def hot_pages(trace: Trace, count: int) -> List[Tuple[int, int, Counter]]:
+    """
+    hot_pages returns the count most accessed pages as (page number, page
+    type, accesses by kind), most accessed first
+    """
+    accesses = {}
+    types = {}
+    for page_number, access, page_type in zip(trace.pages, trace.accesses, trace.types):
+        counts = accesses.get(page_number)
+        if counts is None:
+            counts = accesses[page_number] = Counter()
+        counts[access] += 1
+        types[page_number] = page_type
+    ranked = sorted(accesses, key=lambda page: (-sum(accesses[page].values()), page))
+    return [(page, types[page], accesses[page]) for page in ranked[:count]]
+
+def heatmap(trace: Trace, rows: int = 16, columns: int = 64) -> List[List[int]]:
+    """
+    heatmap counts the accesses to ranges of pages, across, over periods of
+    the trace, down
+    """
+    grid = [[0] * columns for _ in range(rows)]
+    if not len(trace):
+        return grid
+    last_page = max(trace.pages)
+    duration = max(trace.times) + 1
+    for page_number, nanoseconds in zip(trace.pages, trace.times):
+        row = nanoseconds * rows // duration
+        column = (page_number - 1) * columns // last_page
+        grid[row][column] += 1
+    return grid
+
+def render_heatmap(grid: List[List[int]]) -> List[str]:
+    most = max((count for row in grid for count in row), default=0)
+    if most == 0:
+        return [''.join(SHADES[0] for _ in row) for row in grid]
+    scale = (len(SHADES) - 1) / math.log1p(most)
+    return [
+        ''.join(
+            SHADES[max(1, round(math.log1p(count) * scale))] if count else SHADES[0]
+            for count in row
+        )
+        for row in grid
+    ]
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.cachesim',
+        description='replay a page trace against simulated page caches',
+    )
+    parser.add_argument('trace')
+    parser.add_argument('--sizes', help='comma separated cache sizes in pages')
+    parser.add_argument('--policies', default='lru,arc',
+                        help=f'comma separated, of {", ".join(sorted(CACHE_POLICIES))}')
+    parser.add_argument('--hot', type=int, default=0, metavar='N',
+                        help='list the N most accessed pages')
+    parser.add_argument('--heatmap', action='store_true',
+                        help='draw accesses by page range and time')
+    args = parser.parse_args(argv)
+
+    try:
+        trace = Trace(args.trace)
+        sizes = default_sizes(trace)
+        if args.sizes:
+            sizes = [int(size) for size in args.sizes.split(',')]
+        curves = simulate(trace, sizes, args.policies.split(','))
+    except (TraceError, ValueError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print(f'{len(trace)} accesses to {trace.distinct_pages()} pages of '
+          f'{trace.page_size} bytes over {trace.duration():.3f}s')
+    print(f'{"pages":>8} {"MiB":>9}' + ''.join(f' {policy:>7}' for policy in curves))
+    ratios = [curve.ratios() for curve in curves.values()]
+    for i, size in enumerate(next(iter(curves.values())).sizes):
+        mib = size * trace.page_size / (1024 * 1024)
+        print(f'{size:>8} {mib:>9.2f}' + ''.join(f' {r[i]:>7.1%}' for r in ratios))
+
+    if args.hot:
+        print()
+        print(f'{"page":>8}  {"type":<15}{"reads":>9}{"writes":>9}{"scans":>9}')
+        for page_number, page_type, counts in hot_pages(trace, args.hot):
+            name = PAGE_TYPE_NAMES.get(page_type, 'other')
+            print(f'{page_number:>8}  {name:<15}{counts[READ]:>9}'
+                  f'{counts[WRITE]:>9}{counts[SCAN]:>9}')
+
+    if args.heatmap and len(trace):
+        grid = heatmap(trace)
+        period = trace.duration() / len(grid)
+        print()
+        print(f'pages 1 to {max(trace.pages)} across, time down')
+        for i, line in enumerate(render_heatmap(grid)):
+            print(f'{i * period:>9.3f}s |{line}|')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
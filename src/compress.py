@@ -0,0 +1,75 @@
+"""
+Converts a database file to and from the compressed format read by
+CompressedPager, a data file of compressed pages with a -pagemap sidecar:
+
+    python -m src.compress compress db.sqlite db.zpages --codec lzma --level 9
+    python -m src.compress decompress db.zpages db.sqlite
+    python -m src.compress stats db.zpages
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+from src.backend.compression import (
+    CODECS,
+    DEFAULT_CODEC,
+    DEFAULT_LEVEL,
+    PAGE_MAP_SUFFIX,
+    CompressedPager,
+    CompressionError,
+    compress_file,
+    decompress_file,
+    is_compressed,
+)
+
+def file_size(file_name: str) -> int:
+    size = os.path.getsize(file_name)
+    if is_compressed(file_name):
+        size += os.path.getsize(file_name + PAGE_MAP_SUFFIX)
+    return size
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.compress',
+        description='convert a sqlite database to and from compressed pages',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('compress', help='compress a database file')
+    command.add_argument('source')
+    command.add_argument('destination')
+    command.add_argument('--codec', choices=sorted(CODECS), default=DEFAULT_CODEC)
+    command.add_argument('--level', type=int, default=DEFAULT_LEVEL)
+    command = commands.add_parser('decompress', help='write a plain database file')
+    command.add_argument('source')
+    command.add_argument('destination')
+    command = commands.add_parser('stats', help='describe a compressed file')
+    command.add_argument('file_name')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        if args.command == 'compress':
+            compress_file(args.source, args.destination, args.codec, args.level).close()
+            source, destination = file_size(args.source), file_size(args.destination)
+            print(f'{source} bytes compressed to {destination} '
+                  f'({destination / source:.1%}) in {time.perf_counter() - start:.3f}s')
+        elif args.command == 'decompress':
+            pages = decompress_file(args.source, args.destination)
+            print(f'{pages} pages written in {time.perf_counter() - start:.3f}s')
+        else:
+            pager = CompressedPager(args.file_name, cache_size=0)
+            pages, page_size = pager.num_pages(), pager.page_size
+            print(f'{pages} pages of {page_size} bytes, {pager.codec} '
+                  f'level {pager.level}')
+            print(f'{file_size(args.file_name)} bytes on disk, '
+                  f'{pages * page_size} uncompressed')
+            pager.close()
+    except (CompressionError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import weakref
+from typing import Iterator, List, Tuple
+
+from src.backend.btree import BTree
+from src.backend.cache import DEFAULT_NODE_CACHE_SIZE, NodeCache
+from src.backend.compression import CompressedPager, is_compressed
+from src.backend.metrics import (
+    InstrumentedBTree,
+    InstrumentedCompressedPager,
+    InstrumentedMemoryPager,
+    InstrumentedPager,
+    Metrics,
+)
+from src.backend.pager import MemoryPager, Pager
+from src.backend.sorter import DEFAULT_SORT_MEMORY
+from src.backend.trace import PageTrace
+from src.dbinfo import DBInfo
+from src.schema import Schema
+from src.sql.catalog import Catalog
+from src.sql.expression import Parameters
+from src.sql.operators import Operator
+from src.sql.parser import parse_select
+from src.sql.planner import Planner
+from src.sql.statement import DEFAULT_CACHE_SIZE, Statement, StatementCache
+from src.stats import STAT_TABLE, STAT_TABLE_SQL, Analyzer, Statistics
+from src.util import b2i
+from src.writer import DatabaseWriter
+
+# the database header is read before the page size is known
+DB_HEADER_SIZE = 100
+# the schema cookie of the header, bumped by every schema change
+SCHEMA_COOKIE = slice(40, 44)
+
+class Database:
+    """
+    Database opens a file written by sqlite, reading the header to size the
+    pager and then loading the schema. Queries run through execute are
+    planned once and kept in a cache of statement_cache_size statements.
+    Given metrics, the work of every query is counted into it and into the
+    stats of its statement. With in_memory set the whole file is read into a
+    MemoryPager up front and nothing is read from disk afterwards, dump
+    writes it back. Files converted by src.compress are read and written
+    through a CompressedPager, and cannot be loaded in memory. cache_policy
+    picks how the pager chooses the pages it keeps, 'arc' keeping interior
+    pages cached through large scans.
+    Parsed b-tree nodes are kept in a NodeCache of node_cache_size bytes,
+    none when it is 0. Given trace_file, the page accesses of the pager are
+    recorded into it for src.cachesim.
+    """
+    def __init__(
+        self,
+        file_name: str,
+        sort_memory: int = DEFAULT_SORT_MEMORY,
+        statement_cache_size: int = DEFAULT_CACHE_SIZE,
+        metrics: Metrics = None,
+        in_memory: bool = False,
+        cache_policy: str = 'lru',
+        node_cache_size: int = DEFAULT_NODE_CACHE_SIZE,
+        trace_file: str = None,
+    ):
+        self.file_name = file_name
+        self.metrics = metrics
+        # memory an ORDER BY may use before spilling to a temporary file
+        self.sort_memory = sort_memory
+        self.statements = StatementCache(statement_cache_size)
+        # every statement prepared, so that close can end their runs
+        self.prepared = weakref.WeakSet()
+        if in_memory and trace_file is not None:
+            raise ValueError('an in-memory database has no pager to trace')
+
+        if is_compressed(file_name):
+            if in_memory:
+                raise ValueError('a compressed database cannot be loaded in memory')
+            # the header is compressed with the rest of page 1, the page size
+            # comes from the page map
+            if metrics is None:
+                self.pager = CompressedPager(file_name, cache_policy=cache_policy)
+            else:
+                self.pager = InstrumentedCompressedPager(
+                    file_name,
+                    cache_policy=cache_policy,
+                    metrics=metrics,
+                )
+            self.dbinfo = DBInfo(self.pager.get_page(1))
+        else:
+            header = Pager(file_name, DB_HEADER_SIZE, cache_size=0)
+            self.dbinfo = DBInfo(header.get_page(1))
+            header.close()
+            if in_memory and metrics is None:
+                self.pager = MemoryPager(self.dbinfo.page_size).load(file_name)
+            elif in_memory:
+                self.pager = InstrumentedMemoryPager(
+                    self.dbinfo.page_size,
+                    metrics=metrics,
+                ).load(file_name)
+            elif metrics is None:
+                self.pager = Pager(
+                    file_name,
+                    self.dbinfo.page_size,
+                    cache_policy=cache_policy,
+                )
+            else:
+                self.pager = InstrumentedPager(
+                    file_name,
+                    self.dbinfo.page_size,
+                    cache_policy=cache_policy,
+                    metrics=metrics,
+                )
+        if node_cache_size > 0:
+            self.pager.node_cache = NodeCache(node_cache_size)
+        if trace_file is not None:
+            self.pager.trace = PageTrace(trace_file, self.dbinfo.page_size)
+        self.encoding = self.dbinfo.text_encoding.codec
+        # the file version the schema cookie was last checked at
+        self.schema_version = None
+        self.reload_schema()
+
+    def reload_schema(self):
+        """
+        reload_schema reads sqlite_schema again after it changed, dropping
+        the cached statistics
+        """
+        self.schema = Schema(self.pager, self.dbinfo.usable_size, self.encoding)
+        self.catalog = Catalog(self.schema)
+        self._statistics = None
+        self.statements.clear()
+
+    def check_schema(self) -> int:
+        """
+        check_schema reloads the schema when another connection changed it,
+        as told by the schema cookie of the header, and returns the cookie.
+        The cookie is only read again once the file may have changed, and
+        the header only parsed again once the cookie moved.
+        """
+        version = self.pager.file_version()
+        if version is not None and version == self.schema_version:
+            return self.dbinfo.schema_cookie
+        page = self.pager.get_page(1)
+        cookie = b2i(page[SCHEMA_COOKIE])
+        if cookie != self.dbinfo.schema_cookie:
+            self.dbinfo = DBInfo(page)
+            self.reload_schema()
+        # taken before the read, a change since shows at the next check
+        self.schema_version = version
+        return cookie
+
+    @property
+    def statistics(self) -> Statistics:
+        # sqlite_stat1 is read once and cached until the schema is reloaded
+        if self._statistics is None:
+            self._statistics = Statistics.read(self)
+        return self._statistics
+
+    def analyze(self, samples: int = None, write: bool = True) -> Statistics:
+        """
+        analyze gathers table and index statistics for the planner, reading
+        every tree in full or, with samples set, estimating from that many
+        random descents per tree. With write set the statistics are stored
+        in sqlite_stat1, where sqlite reads them too.
+        """
+        statistics = Analyzer(self, samples).analyze()
+
+        if write:
+            rows = statistics.rows(self.catalog)
+            writer = DatabaseWriter(self)
+            try:
+                entry = self.schema.find(STAT_TABLE)
+                if entry is None:
+                    writer.create_table(STAT_TABLE, STAT_TABLE_SQL, rows)
+                else:
+                    writer.write_table(entry.rootpage, enumerate(rows, 1))
+                # as sqlite does, so cached statements are planned again with
+                # the new statistics
+                writer.schema_changed = True
+                writer.commit()
+            finally:
+                writer.close()
+
+        self._statistics = statistics
+        return statistics
+
+    def create_index(self, sql: str, fill_factor: float = 1.0) -> int:
+        """
+        create_index builds the index of a CREATE INDEX statement by sorting
+        the entries of its table and loading them bottom up, returning its
+        root page
+        """
+        writer = DatabaseWriter(self)
+        try:
+            root_page = writer.create_index(sql, fill_factor)
+            writer.commit()
+        finally:
+            writer.close()
+        return root_page
+
+    def btree(self, root_page: int) -> BTree:
+        if self.metrics is not None:
+            return InstrumentedBTree(
+                self.pager,
+                root_page,
+                self.dbinfo.usable_size,
+                self.encoding,
+                metrics=self.metrics,
+            )
+        return BTree(
+            self.pager,
+            root_page,
+            self.dbinfo.usable_size,
+            self.encoding,
+        )
+
+    def prepare(self, sql: str) -> Statement:
+        """
+        prepare parses and plans a SELECT statement, which can then be run
+        with different values for its ? parameters
+        """
+        select = parse_select(sql)
+        parameters = Parameters(select.parameters)
+        planner = Planner(self.catalog, self.btree, self.sort_memory, self.statistics)
+        plan = planner.plan(select, parameters)
+        statement = Statement(sql, plan, parameters, self.pager, self.metrics)
+        self.prepared.add(statement)
+        return statement
+
+    def plan(self, sql: str) -> Operator:
+        return self.prepare(sql).plan
+
+    def statement(self, sql: str) -> Statement:
+        """
+        statement returns a prepared statement for sql, taken from the cache
+        when the same sql ran before, unless its last run is still being read
+        """
+        schema_cookie = self.check_schema()
+        statement = self.statements.get(sql, schema_cookie)
+        if statement is None or statement.busy():
+            statement = self.prepare(sql)
+            self.statements.put(statement)
+        return statement
+
+    def execute(
+        self,
+        sql: str,
+        parameters: List[any] = (),
+    ) -> Iterator[Tuple[any, ...]]:
+        """
+        execute runs a SELECT statement with values for its ? parameters,
+        yielding its rows as tuples as they are produced
+        """
+        return self.statement(sql).execute(parameters)
+
+    def dump(self, file_name: str = None):
+        """
+        dump writes an in-memory database to file_name, by default the file
+        it was loaded from
+        """
+        if not isinstance(self.pager, MemoryPager):
+            raise ValueError('only an in-memory database can be dumped')
+        self.pager.dump(file_name or self.file_name)
+
+    def close(self):
+        # rows still being read end their read transactions while the pager
+        # is open
+        for statement in list(self.prepared):
+            if statement.busy():
+                statement.running().close()
+        self.statements.clear()
+        self.pager.close()
+        trace = getattr(self.pager, 'trace', None)
+        if trace is not None:
+            trace.close()
@@ -0,0 +1,293 @@
+"""
+A PEP 249 interface over Database, so the library can stand in for other
+DB-API drivers:
+
+    connection = connect('db.sqlite')
+    cursor = connection.cursor()
+    cursor.execute('SELECT a, b FROM t WHERE a > ?', [10])
+    while rows := cursor.fetchmany(500):
+        ...
+
+Cursors run SELECT and CREATE INDEX statements, with qmark parameters.
+The statement runs batched, its scans decoding the rows of a leaf page in
+one pass into a list of tuples, and fetchmany hands out slices of those
+lists, so no work is done per row between the leaf and the caller.
+"""
+import datetime
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from src.backend.lock import BusyError
+from src.database import Database
+from src.sql.catalog import CatalogError
+from src.sql.expression import ExpressionError
+from src.sql.lexer import SQLSyntaxError, tokenize
+from src.sql.statement import Statement
+from src.writer import WriterError
+
+apilevel = '2.0'
+# threads may share the module but not connections, the statement cache of
+# a Database is not locked
+threadsafety = 1
+paramstyle = 'qmark'
+
+class Warning(Exception):
+    pass
+
+class Error(Exception):
+    pass
+
+class InterfaceError(Error):
+    pass
+
+class DatabaseError(Error):
+    pass
+
+class DataError(DatabaseError):
+    pass
+
+class OperationalError(DatabaseError):
+    pass
+
+class IntegrityError(DatabaseError):
+    pass
+
+class InternalError(DatabaseError):
+    pass
+
+class ProgrammingError(DatabaseError):
+    pass
+
+class NotSupportedError(DatabaseError):
+    pass
+
+Date = datetime.date
+Time = datetime.time
+Timestamp = datetime.datetime
+Binary = bytes
+
+def DateFromTicks(ticks: float) -> datetime.date:
+    return Date(*time.localtime(ticks)[:3])
+
+def TimeFromTicks(ticks: float) -> datetime.time:
+    return Time(*time.localtime(ticks)[3:6])
+
+def TimestampFromTicks(ticks: float) -> datetime.datetime:
+    return Timestamp(*time.localtime(ticks)[:6])
+
+class DBAPITypeObject:
+    """
+    DBAPITypeObject compares equal to each of the type codes it groups. The
+    type codes of description are None, as sqlite columns have no fixed type.
+    """
+    def __init__(self, *values: str):
+        self.values = frozenset(values)
+
+    def __eq__(self, other: any) -> bool:
+        return other in self.values
+
+    def __hash__(self) -> int:
+        return hash(self.values)
+
+STRING = DBAPITypeObject('TEXT')
+BINARY = DBAPITypeObject('BLOB')
+NUMBER = DBAPITypeObject('INTEGER', 'REAL', 'NUMERIC')
+DATETIME = DBAPITypeObject()
+ROWID = DBAPITypeObject('INTEGER')
+
+@contextmanager
+def translate_errors():
+    """
+    translate_errors raises the errors of the library as their PEP 249
+    counterparts, keeping the original as the cause
+    """
+    try:
+        yield
+    except (SQLSyntaxError, CatalogError, ExpressionError) as e:
+        raise ProgrammingError(str(e)) from e
+    except BusyError as e:
+        raise OperationalError(str(e)) from e
+    except WriterError as e:
+        if 'constraint failed' in str(e):
+            raise IntegrityError(str(e)) from e
+        raise OperationalError(str(e)) from e
+    except OSError as e:
+        raise OperationalError(str(e)) from e
+
+def is_create_index(sql: str) -> bool:
+    tokens = tokenize(sql)[:3]
+    return len(tokens) > 1 and tokens[0].is_keyword('CREATE') and \
+        any(token.is_keyword('INDEX') for token in tokens[1:])
+
+def connect(database: str, **kwargs) -> 'Connection':
+    """
+    connect opens a database file, the keyword arguments are passed on to
+    Database
+    """
+    with translate_errors():
+        return Connection(Database(database, **kwargs))
+
+class Connection:
+    """
+    Connection is an open database. Every statement runs in a read
+    transaction of its own and CREATE INDEX commits as it completes, so
+    commit has nothing to do and rollback is not supported. Closing the
+    connection closes its cursors, ending the statements they run.
+    """
+    def __init__(self, db: Database):
+        self.db = db
+        self.cursors = weakref.WeakSet()
+
+    def check(self) -> Database:
+        if self.db is None:
+            raise ProgrammingError('cannot operate on a closed database')
+        return self.db
+
+    def cursor(self) -> 'Cursor':
+        self.check()
+        cursor = Cursor(self)
+        self.cursors.add(cursor)
+        return cursor
+
+    def execute(self, sql: str, parameters: Sequence[any] = ()) -> 'Cursor':
+        """
+        execute is a shortcut running sql on a new cursor
+        """
+        return self.cursor().execute(sql, parameters)
+
+    def commit(self):
+        self.check()
+
+    def rollback(self):
+        self.check()
+        raise NotSupportedError('transactions are committed as statements run')
+
+    def close(self):
+        if self.db is not None:
+            for cursor in list(self.cursors):
+                cursor.close()
+            self.db.close()
+            self.db = None
+
+class Cursor:
+    """
+    Cursor runs statements on a connection and fetches their rows. The rows
+    of a SELECT are produced by its plan as they are fetched, and the read
+    transaction of the statement ends once they are all fetched or the
+    cursor runs another statement or is closed.
+    """
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self.arraysize = 1
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self.statement: Optional[Statement] = None
+        # the batches of the running statement, the current batch and the
+        # position of the next row in it
+        self.rows: Optional[Iterator[List[Tuple[any, ...]]]] = None
+        self.batch = []
+        self.position = 0
+        self.closed = False
+
+    def check(self) -> Database:
+        if self.closed:
+            raise ProgrammingError('cannot operate on a closed cursor')
+        return self.connection.check()
+
+    @property
+    def stats(self):
+        """
+        stats is the QueryStats of the last SELECT, when the database was
+        opened with metrics
+        """
+        return self.statement.stats if self.statement is not None else None
+
+    def reset(self):
+        if self.rows is not None:
+            self.rows.close()
+        self.rows = None
+        self.batch, self.position = [], 0
+        self.statement = None
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql: str, parameters: Sequence[any] = ()) -> 'Cursor':
+        db = self.check()
+        self.reset()
+        with translate_errors():
+            if is_create_index(sql):
+                if parameters:
+                    raise ProgrammingError('CREATE INDEX takes no parameters')
+                db.create_index(sql)
+                return self
+
+            statement = db.statement(sql)
+            self.rows = statement.execute(list(parameters), batched=True)
+        self.statement = statement
+        self.description = [
+            (name, None, None, None, None, None, None)
+            for name in statement.plan.names
+        ]
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Sequence[Sequence[any]]):
+        raise NotSupportedError('executemany needs statements changing rows, '
+                                'which are not supported')
+
+    def fetch(self, size: Optional[int]) -> List[Tuple[any, ...]]:
+        self.check()
+        if self.rows is None:
+            raise ProgrammingError('no statement with rows was executed')
+        fetched = []
+        with translate_errors():
+            while size is None or len(fetched) < size:
+                batch, position = self.batch, self.position
+                if position == len(batch):
+                    batch, position = next(self.rows, None), 0
+                    if batch is None:
+                        self.batch, self.position = [], 0
+                        break
+                end = len(batch)
+                if size is not None:
+                    end = min(end, position + size - len(fetched))
+                if position == 0 and end == len(batch) and not fetched:
+                    # a whole batch is handed out as it is
+                    fetched = batch
+                else:
+                    fetched.extend(batch[position:end])
+                self.batch, self.position = batch, end
+        return fetched
+
+    def fetchone(self) -> Optional[Tuple[any, ...]]:
+        rows = self.fetch(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size: int = None) -> List[Tuple[any, ...]]:
+        """
+        fetchmany returns the next size rows, by default arraysize, fewer
+        when the statement runs out of rows
+        """
+        return self.fetch(self.arraysize if size is None else size)
+
+    def fetchall(self) -> List[Tuple[any, ...]]:
+        return self.fetch(None)
+
+    def setinputsizes(self, sizes: Sequence[any]):
+        pass
+
+    def setoutputsize(self, size: int, column: int = None):
+        pass
+
+    def close(self):
+        self.reset()
+        self.closed = True
+
+    def __iter__(self) -> Iterator[Tuple[any, ...]]:
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
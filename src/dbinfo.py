@@ -20,6 +20,17 @@ class TextEncoding(Enum):
     UTF_16le = 2
     UTF_16be = 3
 
+    @property
+    def codec(self) -> str:
+        return TEXT_CODECS[self]
+
+# python codecs used to read and write text in each database encoding
+TEXT_CODECS = {
+    TextEncoding.UTF_8: 'utf-8',
+    TextEncoding.UTF_16le: 'utf-16-le',
+    TextEncoding.UTF_16be: 'utf-16-be',
+}
+
 @dataclass
 class Version:
     major: int
@@ -51,7 +62,10 @@ class DBInfo:
         if header_str != DB_HEADER_PREFIX:
             raise Exception('header string not found, result is ', header_str)
 
+        # a page size of 65536 does not fit in two bytes and is stored as 1
         self.page_size = b2i(data[16:18])
+        if self.page_size == 1:
+            self.page_size = 65536
 
         self.file_format_write_version = FileFormatVersion(data[18])
         self.file_format_read_version = FileFormatVersion(data[19])
@@ -81,10 +95,14 @@ class DBInfo:
         self.version_valid_for = b2i(data[92:96])
         self.version = Version.from_bytes(data[96:100])
 
+    @property
+    def usable_size(self) -> int:
+        return self.page_size - self.page_end_reserved_space
+
     def to_bytes(self) -> bytes:
         data = DB_HEADER_PREFIX
 
-        data += self.page_size.to_bytes(2)
+        data += (1 if self.page_size == 65536 else self.page_size).to_bytes(2)
 
         data += self.file_format_write_version.value.to_bytes(1)
         data += self.file_format_read_version.value.to_bytes(1)
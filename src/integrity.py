@@ -0,0 +1,618 @@
+import argparse
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from struct import Struct
+from typing import Dict, List, Set, Tuple
+
+from src.backend.node import Node, NodeType
+from src.backend.pager import Pager
+from src.backend.record import Record, sort_key, serial_type_size
+from src.database import DB_HEADER_SIZE
+from src.dbinfo import DBInfo
+from src.schema import Schema
+from src.util import b2i, varint
+
+BTREE_PAGE_TYPES = {node_type.value for node_type in NodeType}
+
+# sqlite never stores data on the page holding the byte at this offset
+PENDING_BYTE = 0x40000000
+
+# stop collecting errors past this point, as sqlite's integrity_check does
+DEFAULT_MAX_ERRORS = 100
+
+# the first and last rowid of a table leaf page
+ROWID_BOUNDS = Struct('>qq')
+
+# the size of the first key of an index leaf page, which the last key follows
+INDEX_KEY_SIZE = Struct('>I')
+
+@dataclass
+class PageFacts:
+    """
+    PageFacts holds what the checks across pages need to know about a run of
+    pages, in arrays indexed by position in the run so that memory stays a
+    few bytes per page on large files. Only interior pages, a small fraction
+    of any b-tree, keep their children and separator keys in full.
+    """
+    # the first four bytes of every page, chaining overflow and freelist pages
+    next_pointers: array = field(default_factory=lambda: array('L'))
+    # the b-tree page type of every page, 0 for pages that are not one
+    page_types: bytearray = field(default_factory=bytearray)
+    # leaf pages keep their first and last key encoded in key_data, each
+    # page ending at its entry of key_ends
+    key_ends: array = field(default_factory=lambda: array('Q'))
+    key_data: bytearray = field(default_factory=bytearray)
+    # the page, first overflow page and number of overflow bytes of each
+    # overflowing cell, in page order
+    overflow_owners: array = field(default_factory=lambda: array('L'))
+    overflow_chains: array = field(default_factory=lambda: array('L'))
+    # the children and separator keys of each interior page
+    interiors: Dict[int, Tuple[array, list]] = field(default_factory=dict)
+    # pages whose keys are not in ascending order
+    unordered: Set[int] = field(default_factory=set)
+    errors: Dict[int, List[str]] = field(default_factory=dict)
+
+    def extend(self, other: 'PageFacts'):
+        """
+        extend appends the facts of the pages following those already held
+        """
+        base = len(self.key_data)
+        self.next_pointers.extend(other.next_pointers)
+        self.page_types.extend(other.page_types)
+        self.key_ends.extend(base + end for end in other.key_ends)
+        self.key_data.extend(other.key_data)
+        self.overflow_owners.extend(other.overflow_owners)
+        self.overflow_chains.extend(other.overflow_chains)
+        self.interiors.update(other.interiors)
+        self.unordered.update(other.unordered)
+        self.errors.update(other.errors)
+
+@dataclass
+class IntegrityReport:
+    errors: List[str] = field(default_factory=list)
+    pages: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+    @property
+    def pages_per_second(self) -> float:
+        if self.elapsed == 0:
+            return 0.0
+        return self.pages / self.elapsed
+
+def check_record_header(payload: bytes, payload_size: int) -> str:
+    """
+    check_record_header checks that the serial types of a record account for
+    exactly the bytes of its payload. Only the local part of the payload is
+    needed as long as the header itself does not overflow.
+
+    it returns an error message, or None when the header is consistent
+    """
+    header_size, cursor = varint(payload, 0)
+
+    if header_size < cursor or header_size > payload_size:
+        return f'record header size {header_size} out of range'
+    if header_size > len(payload):
+        return None
+
+    body_size = 0
+    while cursor < header_size:
+        serial_type, cursor = varint(payload, cursor)
+        if serial_type in (10, 11):
+            return f'record uses reserved serial type {serial_type}'
+        body_size += serial_type_size(serial_type)
+
+    if cursor != header_size:
+        return 'record serial types overrun the record header'
+    if header_size + body_size != payload_size:
+        return f'record of {header_size + body_size} bytes in payload of ' \
+               f'{payload_size} bytes'
+    return None
+
+def index_key(payload: bytes, encoding: str) -> Tuple:
+    return tuple(sort_key(value) for value in Record(payload, 0, encoding).values)
+
+def check_page(
+    pager,
+    facts: PageFacts,
+    page_number: int,
+    data: bytes,
+    usable_size: int,
+    db_size: int,
+    encoding: str,
+) -> List[str]:
+    """
+    check_page runs the checks that only need the page itself, cell bounds,
+    freeblocks, record headers and key order within the page, and records
+    the page in the last entry of facts
+    """
+    errors = []
+
+    try:
+        node = Node(data, page_number == 1, usable_size, encoding)
+        cells = node.cells
+    except Exception as e:
+        return [f'cannot parse b-tree page: {e}']
+
+    header_start = DB_HEADER_SIZE if page_number == 1 else 0
+    header_len = 8 if node.is_leaf() else 12
+    pointers_end = header_start + header_len + (node.num_cells * 2)
+
+    if node.cell_offset < pointers_end or node.cell_offset > usable_size:
+        errors.append(f'cell content area starts at {node.cell_offset}')
+
+    # each extent is a (start, end, description) of used content space
+    extents = []
+    for i, cell in enumerate(cells):
+        end = max(cell.cursor, cell.pointer + 4)
+        if cell.pointer < node.cell_offset or end > usable_size:
+            errors.append(f'cell {i} at {cell.pointer} outside content area')
+        extents.append((cell.pointer, end, f'cell {i}'))
+
+        if hasattr(cell, 'payload'):
+            try:
+                error = check_record_header(cell.payload, cell.payload_size)
+            except IndexError:
+                error = 'record header runs past the end of the payload'
+            if error is not None:
+                errors.append(f'cell {i}: {error}')
+
+    freeblock = node.first_freeblock
+    while freeblock:
+        if freeblock < node.cell_offset or freeblock + 4 > usable_size:
+            errors.append(f'freeblock at {freeblock} outside content area')
+            break
+        next_freeblock = b2i(data[freeblock:freeblock + 2])
+        size = b2i(data[freeblock + 2:freeblock + 4])
+        extents.append((freeblock, freeblock + size, 'freeblock'))
+        if next_freeblock and next_freeblock <= freeblock + size:
+            errors.append(f'freeblock at {freeblock} is not followed in order')
+            break
+        freeblock = next_freeblock
+
+    extents.sort()
+    used = 0
+    for i, (start, end, name) in enumerate(extents):
+        used += end - start
+        if i > 0 and start < extents[i - 1][1]:
+            errors.append(f'{name} at {start} overlaps {extents[i - 1][2]}')
+
+    expected = usable_size - node.cell_offset
+    if not errors and used + node.num_fragmented_bytes != expected:
+        errors.append(
+            f'content area of {expected} bytes holds {used} bytes of cells '
+            f'and freeblocks and {node.num_fragmented_bytes} fragmented bytes'
+        )
+
+    for child in node.children():
+        if child < 1 or child > db_size:
+            errors.append(f'child page {child} out of range')
+
+    for cell in node.cells:
+        if getattr(cell, 'overflow_page', None) is not None:
+            facts.overflow_owners.append(page_number)
+            facts.overflow_chains.append(cell.overflow_page)
+            facts.overflow_chains.append(cell.payload_size - len(cell.payload))
+
+    payloads = []
+    if node.is_table():
+        all_keys = [cell.row_id for cell in node.cells]
+    else:
+        all_keys = []
+        for cell in node.cells:
+            try:
+                payload, _ = cell.full_payload(pager, usable_size)
+                all_keys.append(index_key(payload, encoding))
+                payloads.append(payload)
+            except Exception as e:
+                errors.append(f'cannot read index key: {e}')
+                all_keys = []
+                break
+
+    if not all(a < b for a, b in zip(all_keys, all_keys[1:])):
+        facts.unordered.add(page_number)
+        if node.is_table():
+            errors.append('rowids out of order within page')
+
+    facts.page_types[-1] = node.node_type.value
+    if not node.is_leaf():
+        facts.interiors[page_number] = (array('L', node.children()), all_keys)
+    elif node.is_table() and all_keys:
+        facts.key_data += ROWID_BOUNDS.pack(all_keys[0], all_keys[-1])
+    elif all_keys:
+        first, last = payloads[0], payloads[-1]
+        facts.key_data += INDEX_KEY_SIZE.pack(len(first)) + first + last
+    facts.key_ends[-1] = len(facts.key_data)
+
+    return errors
+
+def check_page_range(
+    file_name: str,
+    page_size: int,
+    usable_size: int,
+    db_size: int,
+    encoding: str,
+    first_page: int,
+    count: int,
+) -> PageFacts:
+    """
+    check_page_range checks a run of consecutive pages with its own pager so
+    that ranges can be checked in separate processes
+    """
+    pager = Pager(file_name, page_size)
+    facts = PageFacts()
+
+    for i, data in enumerate(pager.get_pages(first_page, count)):
+        page_number = first_page + i
+        facts.next_pointers.append(b2i(data[0:4]))
+        facts.page_types.append(0)
+        facts.key_ends.append(len(facts.key_data))
+
+        header_start = DB_HEADER_SIZE if page_number == 1 else 0
+        if data[header_start] not in BTREE_PAGE_TYPES:
+            continue
+
+        page_errors = check_page(
+            pager,
+            facts,
+            page_number,
+            data,
+            usable_size,
+            db_size,
+            encoding,
+        )
+        if page_errors:
+            facts.errors[page_number] = page_errors
+
+    return facts
+
+class IntegrityChecker:
+    """
+    IntegrityChecker validates a database file without sqlite. Pages are
+    checked on their own in parallel over page ranges, then the b-trees,
+    overflow chains and freelist are walked to check that every page is used
+    exactly once and that keys are ordered across pages.
+    """
+    def __init__(
+        self,
+        file_name: str,
+        workers: int = None,
+        batch_pages: int = 4096,
+        max_errors: int = DEFAULT_MAX_ERRORS,
+    ):
+        self.file_name = file_name
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_pages = batch_pages
+        self.max_errors = max_errors
+
+    def check(self) -> IntegrityReport:
+        report = IntegrityReport()
+        self.errors = report.errors
+        start = time.perf_counter()
+
+        if self.check_header():
+            self.check_pages()
+            self.check_structure()
+            report.pages = self.db_size
+
+        report.elapsed = time.perf_counter() - start
+        del report.errors[self.max_errors:]
+        return report
+
+    def error(self, message: str):
+        self.errors.append(message)
+
+    def check_header(self) -> bool:
+        header = Pager(self.file_name, DB_HEADER_SIZE).get_page(1)
+
+        try:
+            self.dbinfo = DBInfo(header)
+        except Exception as e:
+            self.error(f'invalid database header: {e}')
+            return False
+
+        page_size = self.dbinfo.page_size
+        if page_size < 512 or page_size & (page_size - 1):
+            self.error(f'invalid page size {page_size}')
+            return False
+
+        if self.dbinfo.usable_size < 480:
+            self.error(f'usable size {self.dbinfo.usable_size} below 480')
+            return False
+
+        fractions = (
+            self.dbinfo.maximum_embedded_payload_fraction,
+            self.dbinfo.minimum_embedded_payload_fraction,
+            self.dbinfo.leaf_payload_fraction,
+        )
+        if fractions != (64, 32, 32):
+            self.error(f'invalid payload fractions {fractions}')
+
+        self.pager = Pager(self.file_name, page_size)
+        file_size = os.path.getsize(self.file_name)
+        if file_size % page_size:
+            self.error(f'file size {file_size} is not a multiple of the page size')
+
+        self.db_size = self.pager.num_pages()
+        header_valid = self.dbinfo.version_valid_for == \
+            self.dbinfo.file_change_counter
+        if header_valid and self.dbinfo.db_size_in_pages:
+            if self.dbinfo.db_size_in_pages != self.db_size:
+                self.error(
+                    f'header records {self.dbinfo.db_size_in_pages} pages, '
+                    f'file holds {self.db_size}'
+                )
+                self.db_size = min(self.db_size, self.dbinfo.db_size_in_pages)
+
+        return True
+
+    def page_ranges(self) -> List[Tuple[int, int]]:
+        return [
+            (first_page, min(self.batch_pages, self.db_size - first_page + 1))
+            for first_page in range(1, self.db_size + 1, self.batch_pages)
+        ]
+
+    def check_pages(self):
+        # page 0 does not exist, the arrays are indexed by page number
+        self.facts = PageFacts(array('L', [0]), bytearray(1), array('Q', [0]))
+
+        args = (
+            self.file_name,
+            self.dbinfo.page_size,
+            self.dbinfo.usable_size,
+            self.db_size,
+            self.dbinfo.text_encoding.codec,
+        )
+        ranges = self.page_ranges()
+
+        # results are taken in page order so the arrays line up
+        if self.workers == 1 or len(ranges) == 1:
+            for r in ranges:
+                self.facts.extend(check_page_range(*args, *r))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(check_page_range, *args, *r) for r in ranges]
+                for future in futures:
+                    self.facts.extend(future.result())
+
+    def check_structure(self):
+        self.references = bytearray(self.db_size + 1)
+
+        self.mark_reserved_pages()
+
+        # the schema is only read once its own b-tree is known to be sound
+        num_errors = len(self.errors)
+        self.check_tree(1, True)
+        if len(self.errors) > num_errors:
+            self.error('cannot read sqlite_schema')
+            return
+
+        try:
+            schema = Schema(
+                self.pager,
+                self.dbinfo.usable_size,
+                self.dbinfo.text_encoding.codec,
+            )
+        except Exception as e:
+            self.error(f'cannot read sqlite_schema: {e}')
+            return
+
+        for entry in schema.entries:
+            if entry.rootpage:
+                self.check_tree(entry.rootpage, self.is_ordered_tree(entry, schema))
+
+        self.check_freelist()
+
+        for page_number in range(1, self.db_size + 1):
+            if not self.references[page_number]:
+                self.error(f'page {page_number} is never used')
+
+    def is_ordered_tree(self, entry, schema: Schema) -> bool:
+        """
+        keys are compared with the BINARY collation in ascending order, so
+        the order of an index or WITHOUT ROWID table is only checked when no
+        other collation or DESC columns could be in use
+        """
+        if entry.type != 'index' and 'without rowid' not in (entry.sql or '').lower():
+            return True
+        table = schema.find(entry.tbl_name)
+        sql = ' '.join(e.sql or '' for e in (entry, table) if e is not None).lower()
+        return 'collate' not in sql and ' desc' not in sql
+
+    def reference(self, page_number: int, description: str) -> bool:
+        if page_number < 1 or page_number > self.db_size:
+            self.error(f'{description} refers to page {page_number} out of range')
+            return False
+        if self.references[page_number]:
+            self.error(f'page {page_number} is referenced more than once, '
+                       f'again by {description}')
+            return False
+        self.references[page_number] = 1
+        return True
+
+    def mark_reserved_pages(self):
+        pending_page = PENDING_BYTE // self.dbinfo.page_size + 1
+        if pending_page <= self.db_size:
+            self.references[pending_page] = 1
+
+        # auto-vacuum files keep pointer map pages after page 1
+        if self.dbinfo.largest_btree_root_page:
+            entries = self.dbinfo.usable_size // 5
+            for page_number in range(2, self.db_size + 1, entries + 1):
+                self.references[page_number] = 1
+
+    def check_tree(self, root_page: int, ordered: bool):
+        # entries are (page, lower bound, upper bound, depth, referrer)
+        stack = [(root_page, None, None, 0, f'tree rooted at {root_page}')]
+        is_table = None
+        leaf_depth = None
+
+        while stack:
+            page_number, lower, upper, depth, referrer = stack.pop()
+            if not self.reference(page_number, referrer):
+                continue
+
+            page_type = self.facts.page_types[page_number]
+            if not page_type:
+                self.error(f'page {page_number} from {referrer} is not a b-tree page')
+                continue
+
+            for error in self.facts.errors.get(page_number, []):
+                self.error(f'page {page_number}: {error}')
+
+            page_is_table = page_type in (
+                NodeType.TABLE_LEAF.value,
+                NodeType.TABLE_INTERIOR.value,
+            )
+            if is_table is None:
+                is_table = page_is_table
+            elif is_table != page_is_table:
+                self.error(f'page {page_number} mixes table and index pages')
+                continue
+
+            if ordered and page_number in self.facts.unordered and not page_is_table:
+                self.error(f'page {page_number}: index keys out of order')
+
+            self.check_overflows(page_number)
+
+            interior = self.facts.interiors.get(page_number)
+            if ordered:
+                keys = interior[1] if interior else self.leaf_keys(page_number)
+                self.check_key_bounds(page_number, keys, lower, upper, is_table)
+
+            if interior is None:
+                if leaf_depth is None:
+                    leaf_depth = depth
+                elif leaf_depth != depth:
+                    self.error(f'page {page_number}: leaf at depth {depth}, '
+                               f'expected {leaf_depth}')
+                continue
+
+            children, keys = interior
+            bounds = [lower] + keys + [upper]
+            for i, child in enumerate(children):
+                stack.append((
+                    child,
+                    bounds[i],
+                    bounds[i + 1],
+                    depth + 1,
+                    f'page {page_number}',
+                ))
+
+    def leaf_keys(self, page_number: int) -> List[any]:
+        """
+        leaf_keys decodes the first and last key of a leaf page, or returns
+        an empty list when they could not be read
+        """
+        start = self.facts.key_ends[page_number - 1]
+        data = bytes(self.facts.key_data[start:self.facts.key_ends[page_number]])
+        if not data:
+            return []
+        if self.facts.page_types[page_number] == NodeType.TABLE_LEAF.value:
+            return list(ROWID_BOUNDS.unpack(data))
+
+        split = INDEX_KEY_SIZE.size + INDEX_KEY_SIZE.unpack_from(data)[0]
+        encoding = self.dbinfo.text_encoding.codec
+        return [
+            index_key(data[INDEX_KEY_SIZE.size:split], encoding),
+            index_key(data[split:], encoding),
+        ]
+
+    def check_key_bounds(self, page_number, keys, lower, upper, is_table):
+        if not keys:
+            return
+
+        first, last = keys[0], keys[-1]
+
+        # table keys are bounded by (lower, upper], index keys by (lower, upper)
+        below = lower is not None and first <= lower
+        above = upper is not None and (last > upper or (not is_table and last == upper))
+        if below or above:
+            self.error(f'page {page_number}: keys outside the range of parent')
+
+    def check_overflows(self, page_number: int):
+        owners = self.facts.overflow_owners
+        chains = self.facts.overflow_chains
+        i = bisect_left(owners, page_number)
+        while i < len(owners) and owners[i] == page_number:
+            self.check_overflow(page_number, chains[2 * i], chains[2 * i + 1])
+            i += 1
+
+    def check_overflow(self, page_number: int, first_page: int, size: int):
+        content_per_page = self.dbinfo.usable_size - 4
+        num_pages = (size + content_per_page - 1) // content_per_page
+
+        overflow_page = first_page
+        for i in range(num_pages):
+            description = f'overflow chain of page {page_number}'
+            if not self.reference(overflow_page, description):
+                return
+            overflow_page = self.facts.next_pointers[overflow_page]
+
+        if overflow_page != 0:
+            self.error(f'overflow chain of page {page_number} is too long')
+
+    def check_freelist(self):
+        trunk = self.dbinfo.first_freelist_trunk_page
+        max_leaves = (self.dbinfo.usable_size // 4) - 2
+        count = 0
+
+        while trunk:
+            if not self.reference(trunk, 'freelist trunk'):
+                break
+
+            data = self.pager.get_page(trunk)
+            num_leaves = b2i(data[4:8])
+            if num_leaves > max_leaves:
+                self.error(f'freelist trunk {trunk} lists {num_leaves} leaves')
+                num_leaves = max_leaves
+
+            for i in range(num_leaves):
+                leaf = b2i(data[8 + (i * 4):12 + (i * 4)])
+                self.reference(leaf, f'freelist trunk {trunk}')
+
+            count += 1 + num_leaves
+            trunk = b2i(data[0:4])
+
+        if count != self.dbinfo.num_freelist_pages:
+            self.error(f'freelist holds {count} pages, header records '
+                       f'{self.dbinfo.num_freelist_pages}')
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.integrity',
+        description='check the integrity of a sqlite database file',
+    )
+    parser.add_argument('file_name')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-pages', type=int, default=4096)
+    parser.add_argument('--max-errors', type=int, default=DEFAULT_MAX_ERRORS)
+    args = parser.parse_args(argv)
+
+    checker = IntegrityChecker(
+        args.file_name,
+        args.workers,
+        args.batch_pages,
+        args.max_errors,
+    )
+    report = checker.check()
+
+    for error in report.errors:
+        print(error)
+    if report.ok:
+        print('ok')
+
+    print(f'{report.pages} pages in {report.elapsed:.3f}s '
+          f'({report.pages_per_second:.0f} pages/sec)', file=sys.stderr)
+    return 0 if report.ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
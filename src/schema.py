@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+from typing import List
+
+from src.backend.btree import BTree
+
+@dataclass
+class SchemaEntry:
+    type: str
+    name: str
+    tbl_name: str
+    rootpage: int
+    sql: str
+
+    @classmethod
+    def from_values(cls, values: List[any]):
+        entry_type, name, tbl_name, rootpage, sql = values
+        return cls(
+            str(entry_type),
+            str(name),
+            str(tbl_name),
+            rootpage or 0,
+            None if sql is None else str(sql),
+        )
+
+class Schema:
+    """
+    Schema holds the rows of the sqlite_schema table, which is always the
+    b-tree rooted at page 1
+    """
+    def __init__(
+        self,
+        pager,
+        usable_size: int = None,
+        encoding: str = 'utf-8',
+    ):
+        self.entries = []
+
+        for cell in BTree(pager, 1, usable_size, encoding).cells():
+            self.entries.append(SchemaEntry.from_values(cell.record.values))
+
+    def tables(self) -> List[SchemaEntry]:
+        return [entry for entry in self.entries if entry.type == 'table']
+
+    def indexes(self, tbl_name: str = None) -> List[SchemaEntry]:
+        return [
+            entry for entry in self.entries
+            if entry.type == 'index' and tbl_name in (None, entry.tbl_name)
+        ]
+
+    def find(self, name: str) -> SchemaEntry:
+        for entry in self.entries:
+            if entry.name.lower() == name.lower():
+                return entry
+        return None
+
+    def root_pages(self) -> List[int]:
+        """
+        root_pages returns the root page of every b-tree in the file, views
+        and triggers have a root page of zero and are skipped
+        """
+        return [1] + [entry.rootpage for entry in self.entries if entry.rootpage]
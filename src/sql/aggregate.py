@@ -0,0 +1,223 @@
+from typing import Callable, Iterator, List, Tuple
+
+from src.backend.btree import BTree
+from src.backend.node import NodeType
+from src.backend.record import sort_key
+from src.backend.text import LazyText
+from src.sql.operators import Operator
+from src.util import b2i
+
+def count_rows(tree: BTree) -> int:
+    """
+    count_rows counts the entries of a tree from the num_cells field of the
+    page headers without parsing a cell. Table trees keep every row in a
+    leaf, index trees also keep entries in their interior pages.
+    """
+    count = 0
+    stack = [tree.root_page]
+
+    while stack:
+        node = tree.node(stack.pop())
+        if node.is_leaf() or node.node_type == NodeType.INDEX_INTERIOR:
+            count += node.num_cells
+        stack.extend(node.children())
+    return count
+
+def edge_rowid(tree: BTree, last: bool = False) -> int:
+    """
+    edge_rowid finds the smallest rowid of a table tree by following the
+    leftmost child down to a leaf, or the largest by following right
+    pointers, reading one page per level. It returns None for an empty
+    table.
+    """
+    node = tree.node(tree.root_page)
+
+    while not node.is_leaf():
+        if last:
+            child = node.right_pointer
+        else:
+            pointer = node.cell_pointers()[0]
+            child = b2i(node.data[pointer:pointer + 4])
+        node = tree.node(child)
+
+    pointers = node.cell_pointers()
+    if not pointers:
+        return None
+    return tree.cell_key(node, pointers[-1] if last else pointers[0])
+
+def numeric(value: any) -> any:
+    """
+    numeric converts a value for SUM and AVG, text holding a number counts
+    as that number and anything else as 0
+    """
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, (str, LazyText)):
+        text = str(value).strip()
+        for convert in (int, float):
+            try:
+                return convert(text)
+            except ValueError:
+                pass
+    return 0
+
+class Count:
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def step(self, value: any):
+        if value is not None:
+            self.count += 1
+
+    def result(self) -> int:
+        return self.count
+
+class CountStar(Count):
+    __slots__ = ()
+
+    def step(self, value: any):
+        self.count += 1
+
+class Sum:
+    """
+    Sum adds the non NULL values, the result is an integer while every value
+    is an integer and NULL when there are no values
+    """
+    __slots__ = ('total', 'count', 'integer')
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+        self.integer = True
+
+    def step(self, value: any):
+        if value is None:
+            return
+        if not isinstance(value, int):
+            self.integer = False
+        self.total += numeric(value)
+        self.count += 1
+
+    def result(self) -> any:
+        if not self.count:
+            return None
+        return self.total if self.integer else float(self.total)
+
+class Total(Sum):
+    __slots__ = ()
+
+    def result(self) -> float:
+        return float(self.total)
+
+class Avg(Sum):
+    __slots__ = ()
+
+    def result(self) -> float:
+        return self.total / self.count if self.count else None
+
+class Min:
+    __slots__ = ('value', 'key')
+
+    def __init__(self):
+        self.value = None
+        self.key = None
+
+    def better(self, key: tuple) -> bool:
+        return key < self.key
+
+    def step(self, value: any):
+        if value is None:
+            return
+        key = sort_key(value)
+        if self.key is None or self.better(key):
+            self.value, self.key = value, key
+
+    def result(self) -> any:
+        return self.value
+
+class Max(Min):
+    __slots__ = ()
+
+    def better(self, key: tuple) -> bool:
+        return key > self.key
+
+AGGREGATES = {
+    'COUNT': Count,
+    'SUM': Sum,
+    'TOTAL': Total,
+    'AVG': Avg,
+    'MIN': Min,
+    'MAX': Max,
+}
+
+# an aggregate of a query, its accumulator class and argument, None for COUNT(*)
+Aggregate = Tuple[type, Callable]
+
+class HashAggregate(Operator):
+    """
+    HashAggregate groups the rows of its child by the values of the group
+    expressions in a dictionary, updating the accumulators of each group as
+    rows stream past, so only the groups are held in memory. It produces a
+    row per group, the group values followed by the aggregate results, in
+    group order as sqlite does. Without group expressions there is exactly
+    one group, even for no rows.
+    """
+    def __init__(
+        self,
+        child: Operator,
+        groups: List[Callable],
+        aggregates: List[Aggregate],
+        text: str,
+    ):
+        self.child = child
+        self.groups = groups
+        self.aggregates = aggregates
+        self.text = text
+
+    def __iter__(self) -> Iterator[List[any]]:
+        groups = {}
+        aggregates = self.aggregates
+
+        for row in self.child:
+            key = tuple(group(row) for group in self.groups)
+            accumulators = groups.get(key)
+            if accumulators is None:
+                accumulators = [accumulator() for accumulator, _ in aggregates]
+                groups[key] = accumulators
+            for accumulator, (_, argument) in zip(accumulators, aggregates):
+                accumulator.step(None if argument is None else argument(row))
+
+        if not self.groups and not groups:
+            groups[()] = [accumulator() for accumulator, _ in aggregates]
+
+        keys = sorted(groups, key=lambda key: tuple(sort_key(v) for v in key))
+        for key in keys:
+            yield list(key) + [accumulator.result() for accumulator in groups[key]]
+
+    def describe(self) -> str:
+        return f'AGGREGATE {self.text}'
+
+class TreeAggregate(Operator):
+    """
+    TreeAggregate answers COUNT(*), MIN(rowid) and MAX(rowid) over a whole
+    table from the shape of its b-tree, never decoding a record
+    """
+    def __init__(self, tree: BTree, table_name: str, functions: List[str]):
+        self.tree = tree
+        self.table_name = table_name
+        self.functions = functions
+
+    def __iter__(self) -> Iterator[List[any]]:
+        row = []
+        for function in self.functions:
+            if function == 'COUNT':
+                row.append(count_rows(self.tree))
+            else:
+                row.append(edge_rowid(self.tree, last=function == 'MAX'))
+        yield row
+
+    def describe(self) -> str:
+        return f'AGGREGATE {self.table_name} USING B-TREE ' \
+            f'({", ".join(self.functions)})'
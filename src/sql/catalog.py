@@ -0,0 +1,262 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import List
+
+from src.backend.text import LazyText
+from src.schema import Schema
+from src.sql.parser import parse_create_index, parse_create_table
+
+# column position used for the rowid of a table
+ROWID = -1
+
+ROWID_NAMES = ('rowid', 'oid', '_rowid_')
+
+class Affinity(Enum):
+    TEXT = 1
+    NUMERIC = 2
+    INTEGER = 3
+    REAL = 4
+    BLOB = 5
+
+def type_affinity(declared_type: str) -> Affinity:
+    """
+    type_affinity derives the affinity of a column from its declared type
+    with the rules sqlite applies, checked in order
+    """
+    declared_type = declared_type.upper()
+    if 'INT' in declared_type:
+        return Affinity.INTEGER
+    elif any(name in declared_type for name in ('CHAR', 'CLOB', 'TEXT')):
+        return Affinity.TEXT
+    elif 'BLOB' in declared_type or declared_type == '':
+        return Affinity.BLOB
+    elif any(name in declared_type for name in ('REAL', 'FLOA', 'DOUB')):
+        return Affinity.REAL
+    return Affinity.NUMERIC
+
+def apply_affinity(affinity: Affinity, value: any) -> any:
+    """
+    apply_affinity converts a constant compared with a column the way sqlite
+    does, text becomes a number for numeric columns and numbers become text
+    for text columns
+    """
+    if affinity in (Affinity.NUMERIC, Affinity.INTEGER, Affinity.REAL):
+        if isinstance(value, (str, LazyText)):
+            text = str(value).strip()
+            try:
+                return int(text)
+            except ValueError:
+                pass
+            try:
+                number = float(text)
+            except ValueError:
+                return value
+            return int(number) if number.is_integer() else number
+    elif affinity == Affinity.TEXT and isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+class CatalogError(Exception):
+    pass
+
+@dataclass
+class IndexInfo:
+    name: str
+    table: str
+    root_page: int
+    # positions of the indexed columns in the table
+    columns: List[int]
+    unique: bool = False
+    # indexes with DESC or collated columns, or a WHERE clause, are not used
+    # for seeks since their order or contents differ from the plain columns
+    seekable: bool = True
+    # positions of the columns each entry holds after the indexed ones, the
+    # rowid, or for a WITHOUT ROWID table the primary key columns not indexed
+    extra: List[int] = field(default_factory=lambda: [ROWID])
+
+@dataclass
+class TableInfo:
+    name: str
+    root_page: int
+    columns: List[str]
+    affinities: List[Affinity]
+    # position of the INTEGER PRIMARY KEY column that aliases the rowid
+    rowid_alias: int = None
+    without_rowid: bool = False
+    indexes: List[IndexInfo] = field(default_factory=list)
+    # column names of each UNIQUE constraint, in automatic index order
+    unique_constraints: List[List[str]] = field(default_factory=list)
+    # the primary key of a WITHOUT ROWID table, an index whose tree is the
+    # table itself and whose entries hold every column
+    primary_index: IndexInfo = None
+    # positions of the columns with REAL affinity
+    real_columns: List[int] = field(init=False, default_factory=list)
+
+    def __post_init__(self):
+        self.real_columns = [
+            i for i, affinity in enumerate(self.affinities)
+            if affinity == Affinity.REAL
+        ]
+
+    def column_index(self, name: str) -> int:
+        lower = name.lower()
+        for i, column in enumerate(self.columns):
+            if column.lower() == lower:
+                return i
+        if lower in ROWID_NAMES and not self.without_rowid:
+            return ROWID
+        raise CatalogError(f'no such column: {name}')
+
+    def is_rowid(self, column: int) -> bool:
+        return column == ROWID or (
+            column is not None and column == self.rowid_alias
+        )
+
+    def affinity(self, column: int) -> Affinity:
+        if self.is_rowid(column):
+            return Affinity.INTEGER
+        return self.affinities[column]
+
+    def row(self, row_id: int, values: List[any]) -> List[any]:
+        """
+        row lays out a record as a row of the table, padding columns missing
+        from older records with NULL, filling in the rowid alias and appending
+        the rowid so that ROWID indexes it. sqlite stores REAL values with no
+        fractional part as integers, they are read back as floats.
+        """
+        width = len(self.columns)
+        if len(values) < width:
+            values = values + [None] * (width - len(values))
+        elif len(values) > width:
+            values = values[:width]
+        for column in self.real_columns:
+            if type(values[column]) is int:
+                values[column] = float(values[column])
+        if self.rowid_alias is not None:
+            values[self.rowid_alias] = row_id
+        values.append(row_id)
+        return values
+
+    def extra_columns(self, columns: List[int]) -> List[int]:
+        # entries of an index on a WITHOUT ROWID table end with the primary
+        # key columns they do not already hold instead of a rowid
+        if self.primary_index is None:
+            return [ROWID]
+        return [c for c in self.primary_index.columns if c not in columns]
+
+    def record_positions(self) -> List[int]:
+        """
+        record_positions gives the position in the record of each column of a
+        WITHOUT ROWID table, which stores the primary key columns first, and
+        None for tables whose records follow the column order
+        """
+        if self.primary_index is None:
+            return None
+        order = self.primary_index.columns + self.primary_index.extra
+        positions = [None] * len(self.columns)
+        for i, column in enumerate(order):
+            positions[column] = i
+        return positions
+
+class Catalog:
+    """
+    Catalog describes the tables and indexes in sqlite_schema, parsing the
+    CREATE statements for column names, rowid aliases and indexed columns
+    """
+    def __init__(self, schema: Schema):
+        self.tables = {}
+
+        for entry in schema.tables():
+            if entry.sql is None or entry.name.startswith('sqlite_'):
+                continue
+            self.tables[entry.name.lower()] = self.read_table(entry)
+
+        for entry in schema.indexes():
+            table = self.tables.get(entry.tbl_name.lower())
+            if table is None or not entry.rootpage:
+                continue
+            index = self.read_index(entry, table)
+            if index is not None:
+                table.indexes.append(index)
+
+    def read_table(self, entry) -> TableInfo:
+        create = parse_create_table(entry.sql)
+        table = TableInfo(
+            entry.name,
+            entry.rootpage,
+            [column.name for column in create.columns],
+            [type_affinity(column.type) for column in create.columns],
+            without_rowid=create.without_rowid,
+        )
+
+        if len(create.primary_key) == 1 and not create.without_rowid:
+            position = table.column_index(create.primary_key[0])
+            column = create.columns[position]
+            if column.type.upper() == 'INTEGER' and not column.descending:
+                table.rowid_alias = position
+
+        if create.without_rowid:
+            if not create.primary_key:
+                raise CatalogError(f'PRIMARY KEY missing on table {table.name}')
+            key = []
+            for name in create.primary_key:
+                position = table.column_index(name)
+                if position not in key:
+                    key.append(position)
+            table.primary_index = IndexInfo(
+                f'sqlite_autoindex_{table.name}_1',
+                table.name,
+                table.root_page,
+                key,
+                True,
+                create.primary_key_plain,
+                [i for i in range(len(table.columns)) if i not in key],
+            )
+
+        # automatic indexes are numbered by their constraint, skipping the
+        # primary key when it is the rowid
+        for columns in create.unique:
+            alias = table.rowid_alias
+            if alias is not None and len(columns) == 1 and \
+                    table.column_index(columns[0]) == alias:
+                continue
+            table.unique_constraints.append(columns)
+        return table
+
+    def read_index(self, entry, table: TableInfo) -> IndexInfo:
+        if entry.sql is None:
+            # sqlite_autoindex_<table>_<n> backs the n-th unique constraint
+            number = int(entry.name.rsplit('_', 1)[1])
+            if number > len(table.unique_constraints):
+                return None
+            names = table.unique_constraints[number - 1]
+            columns = [table.column_index(name) for name in names]
+            return IndexInfo(
+                entry.name,
+                table.name,
+                entry.rootpage,
+                columns,
+                True,
+                extra=table.extra_columns(columns),
+            )
+
+        create = parse_create_index(entry.sql)
+        columns = [table.column_index(column.name) for column in create.columns]
+        seekable = not create.partial and not any(
+            column.descending or column.collation for column in create.columns
+        )
+        return IndexInfo(
+            entry.name,
+            table.name,
+            entry.rootpage,
+            columns,
+            create.unique,
+            seekable,
+            table.extra_columns(columns),
+        )
+
+    def table(self, name: str) -> TableInfo:
+        table = self.tables.get(name.lower())
+        if table is None:
+            raise CatalogError(f'no such table: {name}')
+        return table
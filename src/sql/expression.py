@@ -0,0 +1,466 @@
+import operator
+import re
+from dataclasses import dataclass, fields, is_dataclass, replace
+from fnmatch import translate
+from typing import Callable, List, Set
+
+from src.backend.predicate import And, Comparison, IsNull, Or, Predicate, Prefix
+from src.backend.record import RecordView, sort_key
+from src.backend.text import LazyText
+from src.sql.catalog import ROWID, Affinity, TableInfo, apply_affinity
+from src.sql.parser import (
+    Between,
+    BinaryOp,
+    ColumnRef,
+    FunctionCall,
+    InList,
+    Like,
+    Literal,
+    Not,
+    Parameter,
+)
+from src.sql.parser import IsNull as IsNullExpr
+
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<>': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# the operator that gives the same result with its operands swapped
+FLIPPED = {
+    '=': '=', '==': '==', '!=': '!=', '<>': '<>',
+    '<': '>', '<=': '>=', '>': '<', '>=': '<=',
+}
+
+class ExpressionError(Exception):
+    pass
+
+@dataclass
+class Slot:
+    """
+    Slot refers to a value by its position in a row, standing in for the
+    group and aggregate expressions of a query once rows are aggregated
+    """
+    position: int
+    name: str
+
+class Parameters:
+    """
+    Parameters holds the values bound to the ? placeholders of a prepared
+    statement. Plans read them each time they run, so one plan serves every
+    set of values. Values converted to a column affinity are kept until the
+    next bind.
+    """
+    def __init__(self, count: int = 0):
+        self.count = count
+        self.values = [None] * count
+        self.converted = {}
+
+    def bind(self, values: List[any]):
+        values = list(values)
+        if len(values) != self.count:
+            raise ExpressionError(
+                f'{self.count} parameters expected, {len(values)} supplied'
+            )
+        self.values = values
+        self.converted = {}
+
+    def value(self, index: int, affinity: Affinity = None) -> any:
+        if affinity is None:
+            return self.values[index]
+        key = (index, affinity)
+        if key not in self.converted:
+            self.converted[key] = apply_affinity(affinity, self.values[index])
+        return self.converted[key]
+
+@dataclass
+class Placeholder:
+    """
+    Placeholder stands for a parameter in a planned query. Compared with a
+    column it carries the affinity of that column, applied to the bound value
+    as sqlite applies it to a literal.
+    """
+    parameters: Parameters
+    index: int
+    affinity: Affinity = None
+
+    def get(self) -> any:
+        return self.parameters.value(self.index, self.affinity)
+
+def resolve(value: any) -> any:
+    """
+    resolve returns the bound value of a placeholder, and any other value as
+    it is
+    """
+    return value.get() if isinstance(value, Placeholder) else value
+
+def bind_parameters(node: any, parameters: Parameters) -> any:
+    """
+    bind_parameters rewrites a parsed statement, replacing its ? parameters
+    with placeholders reading from parameters
+    """
+    if isinstance(node, Parameter):
+        return Placeholder(parameters, node.index)
+    if isinstance(node, list):
+        return [bind_parameters(item, parameters) for item in node]
+    if not is_dataclass(node) or isinstance(node, (Literal, Placeholder)):
+        return node
+    changes = {
+        item.name: bind_parameters(getattr(node, item.name), parameters)
+        for item in fields(node)
+    }
+    return replace(node, **changes)
+
+def split_and(expr: any) -> List[any]:
+    """
+    split_and breaks a WHERE clause into the terms joined by AND
+    """
+    if expr is None:
+        return []
+    if isinstance(expr, BinaryOp) and expr.op == 'AND':
+        return split_and(expr.left) + split_and(expr.right)
+    return [expr]
+
+def column_comparison(expr: any, table: TableInfo):
+    """
+    column_comparison matches a term comparing a column with a constant,
+    returning (column, operator, value) with the column on the left and the
+    column affinity applied to the value, or None for any other term
+    """
+    if not isinstance(expr, BinaryOp) or expr.op not in FLIPPED:
+        return None
+
+    constants = (Literal, Placeholder)
+    if isinstance(expr.left, ColumnRef) and isinstance(expr.right, constants):
+        column, op, value = expr.left, expr.op, expr.right
+    elif isinstance(expr.right, ColumnRef) and isinstance(expr.left, constants):
+        column, op, value = expr.right, FLIPPED[expr.op], expr.left
+    else:
+        return None
+
+    position = table.column_index(column.name)
+    affinity = table.affinity(position)
+    if isinstance(value, Placeholder):
+        # the affinity is applied once the value is bound
+        return position, op, replace(value, affinity=affinity)
+    return position, op, apply_affinity(affinity, value.value)
+
+def compare(a: any, b: any, op: str) -> bool:
+    # comparisons with NULL are NULL
+    if a is None or b is None:
+        return None
+    return OPERATORS[op](sort_key(a), sort_key(b))
+
+def is_true(value: any) -> bool:
+    return value is not None and value != 0 and value is not False
+
+def like_pattern(pattern: str, op: str) -> re.Pattern:
+    """
+    like_pattern compiles a LIKE pattern, case insensitive for ASCII letters
+    as in sqlite, or a case sensitive GLOB pattern to a regular expression
+    """
+    if op == 'GLOB':
+        return re.compile(translate(pattern.replace('[^', '[!')), re.DOTALL)
+
+    regex = ''.join(
+        '.*' if char == '%' else '.' if char == '_' else re.escape(char)
+        for char in pattern
+    )
+    return re.compile(regex + r'\Z', re.DOTALL | re.IGNORECASE | re.ASCII)
+
+def as_text(value: any) -> str:
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+def compile_expr(expr: any, table: TableInfo) -> Callable[[List[any]], any]:
+    """
+    compile_expr turns an expression into a function of a table row as laid
+    out by TableInfo.row, following sqlite's three valued logic
+    """
+    if isinstance(expr, Literal):
+        value = expr.value
+        return lambda row: value
+
+    elif isinstance(expr, Placeholder):
+        return lambda row: expr.get()
+
+    elif isinstance(expr, ColumnRef):
+        position = row_position(table, table.column_index(expr.name))
+        return lambda row: row[position]
+
+    elif isinstance(expr, Slot):
+        position = expr.position
+        return lambda row: row[position]
+
+    elif isinstance(expr, FunctionCall):
+        raise ExpressionError(f'misuse of function {expr.name}()')
+
+    elif isinstance(expr, BinaryOp) and expr.op == 'AND':
+        left = compile_expr(expr.left, table)
+        right = compile_expr(expr.right, table)
+
+        def evaluate_and(row):
+            a = left(row)
+            if a is not None and not is_true(a):
+                return False
+            b = right(row)
+            if b is not None and not is_true(b):
+                return False
+            return None if a is None or b is None else True
+        return evaluate_and
+
+    elif isinstance(expr, BinaryOp) and expr.op == 'OR':
+        left = compile_expr(expr.left, table)
+        right = compile_expr(expr.right, table)
+
+        def evaluate_or(row):
+            a = left(row)
+            if is_true(a):
+                return True
+            b = right(row)
+            if is_true(b):
+                return True
+            return None if a is None or b is None else False
+        return evaluate_or
+
+    elif isinstance(expr, BinaryOp):
+        matched = column_comparison(expr, table)
+        if matched is not None:
+            # compare against the constant after applying column affinity
+            position, op, value = matched
+            position = row_position(table, position)
+            if isinstance(value, Placeholder):
+                return lambda row: compare(row[position], value.get(), op)
+            return lambda row: compare(row[position], value, op)
+
+        left = compile_expr(expr.left, table)
+        right = compile_expr(expr.right, table)
+        op = expr.op
+        return lambda row: compare(left(row), right(row), op)
+
+    elif isinstance(expr, Not):
+        operand = compile_expr(expr.operand, table)
+
+        def evaluate_not(row):
+            value = operand(row)
+            return None if value is None else not is_true(value)
+        return evaluate_not
+
+    elif isinstance(expr, IsNullExpr):
+        operand = compile_expr(expr.operand, table)
+        negated = expr.negated
+        return lambda row: (operand(row) is None) != negated
+
+    elif isinstance(expr, Like):
+        operand = compile_expr(expr.operand, table)
+        pattern = compile_expr(expr.pattern, table)
+        op, negated = expr.op, expr.negated
+        patterns = {}
+
+        def evaluate_like(row):
+            value, text = operand(row), pattern(row)
+            if value is None or text is None:
+                return None
+            text = as_text(text)
+            if text not in patterns:
+                patterns[text] = like_pattern(text, op)
+            return (patterns[text].match(as_text(value)) is not None) != negated
+        return evaluate_like
+
+    elif isinstance(expr, Between):
+        low = BinaryOp('>=', expr.operand, expr.low)
+        high = BinaryOp('<=', expr.operand, expr.high)
+        between = BinaryOp('AND', low, high)
+        return compile_expr(Not(between) if expr.negated else between, table)
+
+    elif isinstance(expr, InList):
+        terms = [BinaryOp('=', expr.operand, value) for value in expr.values]
+        any_equal = terms[0]
+        for term in terms[1:]:
+            any_equal = BinaryOp('OR', any_equal, term)
+        return compile_expr(Not(any_equal) if expr.negated else any_equal, table)
+
+    raise ExpressionError(f'unsupported expression {expr}')
+
+def row_position(table: TableInfo, column: int) -> int:
+    # the rowid is appended after the columns of a row
+    return len(table.columns) if column == ROWID else column
+
+def literal_prefix(pattern: any, op: str) -> str:
+    """
+    literal_prefix returns the fixed text a LIKE or GLOB pattern starts with
+    when the pattern is that text followed by a single trailing wildcard, and
+    None otherwise. LIKE is case insensitive, so only patterns without
+    letters qualify.
+    """
+    if not isinstance(pattern, str):
+        return None
+
+    wildcard = '*' if op == 'GLOB' else '%'
+    specials = '*?[' if op == 'GLOB' else '%_'
+    prefix = pattern[:-1]
+
+    if not pattern.endswith(wildcard) or any(c in specials for c in prefix):
+        return None
+    if op == 'LIKE' and any(c.isascii() and c.isalpha() for c in prefix):
+        return None
+    return prefix
+
+def to_predicate(expr: any, table: TableInfo) -> Predicate:
+    """
+    to_predicate converts a term to a backend predicate that runs against
+    the raw record, or returns None when the term cannot be pushed down.
+    Terms on the rowid are left out, the rowid alias is stored as NULL.
+    """
+    if isinstance(expr, BinaryOp) and expr.op in ('AND', 'OR'):
+        left = to_predicate(expr.left, table)
+        right = to_predicate(expr.right, table)
+        if left is None or right is None:
+            return None
+        return And(left, right) if expr.op == 'AND' else Or(left, right)
+
+    elif isinstance(expr, BinaryOp):
+        matched = column_comparison(expr, table)
+        if matched is None or table.is_rowid(matched[0]):
+            return None
+        position, op, value = matched
+        if isinstance(value, Placeholder):
+            return ParameterComparison(position, op, value)
+        return Comparison(position, op, value)
+
+    elif isinstance(expr, IsNullExpr):
+        if not isinstance(expr.operand, ColumnRef):
+            return None
+        position = table.column_index(expr.operand.name)
+        if table.is_rowid(position):
+            return None
+        return IsNull(position, expr.negated)
+
+    elif isinstance(expr, Like):
+        if expr.negated or not isinstance(expr.operand, ColumnRef) or \
+                not isinstance(expr.pattern, Literal):
+            return None
+        position = table.column_index(expr.operand.name)
+        if table.is_rowid(position) or table.affinity(position) != Affinity.TEXT:
+            return None
+        prefix = literal_prefix(expr.pattern.value, expr.op)
+        return None if prefix is None else Prefix(position, prefix)
+
+    elif isinstance(expr, Between) and not expr.negated:
+        return to_predicate(BinaryOp(
+            'AND',
+            BinaryOp('>=', expr.operand, expr.low),
+            BinaryOp('<=', expr.operand, expr.high),
+        ), table)
+
+    elif isinstance(expr, InList) and not expr.negated:
+        predicates = [
+            to_predicate(BinaryOp('=', expr.operand, value), table)
+            for value in expr.values
+        ]
+        if any(predicate is None for predicate in predicates):
+            return None
+        return Or(*predicates)
+
+    return None
+
+class ParameterComparison(Predicate):
+    """
+    ParameterComparison compares a column with a parameter, building the
+    Comparison for the bound value when the plan starts to run
+    """
+    def __init__(self, column: int, op: str, placeholder: Placeholder):
+        self.column = column
+        self.op = op
+        self.placeholder = placeholder
+        self.comparison = None
+
+    def bind(self):
+        self.comparison = Comparison(self.column, self.op, self.placeholder.get())
+
+    def evaluate(self, view: RecordView) -> bool:
+        return self.comparison.evaluate(view)
+
+    def columns(self) -> Set[int]:
+        return {self.column}
+
+    def __repr__(self) -> str:
+        return f'column {self.column} {self.op} ?'
+
+def columns_of(expr: any) -> List[str]:
+    """
+    columns_of lists the names of the columns an expression refers to
+    """
+    if isinstance(expr, ColumnRef):
+        return [expr.name]
+    elif isinstance(expr, BinaryOp):
+        return columns_of(expr.left) + columns_of(expr.right)
+    elif isinstance(expr, (Not, IsNullExpr)):
+        return columns_of(expr.operand)
+    elif isinstance(expr, Like):
+        return columns_of(expr.operand) + columns_of(expr.pattern)
+    elif isinstance(expr, Between):
+        return columns_of(expr.operand) + columns_of(expr.low) + \
+            columns_of(expr.high)
+    elif isinstance(expr, InList):
+        return columns_of(expr.operand) + \
+            [name for value in expr.values for name in columns_of(value)]
+    elif isinstance(expr, FunctionCall):
+        return [name for arg in expr.args for name in columns_of(arg)]
+    return []
+
+def describe(expr: any) -> str:
+    """
+    describe renders an expression back to sql, used for the names of result
+    columns and in query plans
+    """
+    if isinstance(expr, ColumnRef):
+        return expr.name
+    elif isinstance(expr, Literal):
+        if expr.value is None:
+            return 'NULL'
+        elif isinstance(expr.value, str):
+            return "'" + expr.value.replace("'", "''") + "'"
+        elif isinstance(expr.value, bytes):
+            return "X'" + expr.value.hex().upper() + "'"
+        return repr(expr.value)
+    elif isinstance(expr, BinaryOp):
+        return f'{describe(expr.left)} {expr.op} {describe(expr.right)}'
+    elif isinstance(expr, Not):
+        return f'NOT {describe(expr.operand)}'
+    elif isinstance(expr, IsNullExpr):
+        return f'{describe(expr.operand)} IS {"NOT " if expr.negated else ""}NULL'
+    elif isinstance(expr, Like):
+        op = f'NOT {expr.op}' if expr.negated else expr.op
+        return f'{describe(expr.operand)} {op} {describe(expr.pattern)}'
+    elif isinstance(expr, Between):
+        op = 'NOT BETWEEN' if expr.negated else 'BETWEEN'
+        return f'{describe(expr.operand)} {op} {describe(expr.low)} ' \
+            f'AND {describe(expr.high)}'
+    elif isinstance(expr, InList):
+        op = 'NOT IN' if expr.negated else 'IN'
+        values = ', '.join(describe(value) for value in expr.values)
+        return f'{describe(expr.operand)} {op} ({values})'
+    elif isinstance(expr, FunctionCall):
+        args = '*' if expr.star else ', '.join(describe(arg) for arg in expr.args)
+        return f'{expr.name}({args})'
+    elif isinstance(expr, Slot):
+        return expr.name
+    elif isinstance(expr, (Parameter, Placeholder)):
+        return '?'
+    return str(expr)
+
+def output_value(value: any) -> any:
+    # text is decoded once it leaves the executor, truth values are integers
+    if isinstance(value, LazyText):
+        return value.decode()
+    elif isinstance(value, bool):
+        return int(value)
+    return value
@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import List
+
+class TokenType(Enum):
+    KEYWORD = 1
+    IDENTIFIER = 2
+    INTEGER = 3
+    FLOAT = 4
+    STRING = 5
+    BLOB = 6
+    OPERATOR = 7
+    END = 8
+
+KEYWORDS = {
+    'AND', 'AS', 'ASC', 'BETWEEN', 'BY', 'CREATE', 'DESC', 'DISTINCT', 'FROM',
+    'GLOB', 'GROUP', 'HAVING', 'IN', 'INDEX', 'IS', 'LIKE', 'LIMIT', 'NOT',
+    'NULL', 'OFFSET', 'ON', 'OR', 'ORDER', 'SELECT', 'UNIQUE', 'WHERE',
+}
+
+# longest operators first so that '<=' is not read as '<' then '='
+OPERATORS = (
+    '<=', '>=', '==', '!=', '<>', '||',
+    '<', '>', '=', '*', ',', '(', ')', '.', '+', '-', '/', '%', ';', '?',
+)
+
+QUOTES = {'"': '"', '`': '`', '[': ']'}
+
+@dataclass
+class Token:
+    type: TokenType
+    value: any
+    position: int
+
+    def is_keyword(self, *keywords: str) -> bool:
+        return self.type == TokenType.KEYWORD and self.value in keywords
+
+    def is_operator(self, *operators: str) -> bool:
+        return self.type == TokenType.OPERATOR and self.value in operators
+
+class SQLSyntaxError(Exception):
+    pass
+
+def tokenize(sql: str) -> List[Token]:
+    """
+    tokenize splits a statement into tokens. Keywords are upper cased,
+    quoted identifiers and string literals are unquoted, and numeric and blob
+    literals are converted to their values.
+    """
+    tokens = []
+    i = 0
+
+    while i < len(sql):
+        char = sql[i]
+        start = i
+
+        if char.isspace():
+            i += 1
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+        elif char in "xX" and sql.startswith("'", i + 1):
+            end = sql.find("'", i + 2)
+            if end == -1:
+                raise SQLSyntaxError(f'unterminated blob literal at {start}')
+            try:
+                value = bytes.fromhex(sql[i + 2:end])
+            except ValueError:
+                raise SQLSyntaxError(f'malformed blob literal at {start}')
+            tokens.append(Token(TokenType.BLOB, value, start))
+            i = end + 1
+        elif char.isalpha() or char == '_':
+            while i < len(sql) and (sql[i].isalnum() or sql[i] in '_$'):
+                i += 1
+            word = sql[start:i]
+            if word.upper() in KEYWORDS:
+                tokens.append(Token(TokenType.KEYWORD, word.upper(), start))
+            else:
+                tokens.append(Token(TokenType.IDENTIFIER, word, start))
+        elif char.isdigit() or (char == '.' and sql[i + 1:i + 2].isdigit()):
+            i = read_number(sql, i)
+            text = sql[start:i]
+            if any(c in text for c in '.eE'):
+                tokens.append(Token(TokenType.FLOAT, float(text), start))
+            else:
+                tokens.append(Token(TokenType.INTEGER, int(text), start))
+        elif char == "'":
+            value, i = read_quoted(sql, i, "'")
+            tokens.append(Token(TokenType.STRING, value, start))
+        elif char in QUOTES:
+            value, i = read_quoted(sql, i, QUOTES[char])
+            tokens.append(Token(TokenType.IDENTIFIER, value, start))
+        else:
+            for operator in OPERATORS:
+                if sql.startswith(operator, i):
+                    tokens.append(Token(TokenType.OPERATOR, operator, start))
+                    i += len(operator)
+                    break
+            else:
+                raise SQLSyntaxError(f'unexpected character {char!r} at {start}')
+
+    tokens.append(Token(TokenType.END, None, len(sql)))
+    return tokens
+
+def read_number(sql: str, i: int) -> int:
+    while i < len(sql) and (sql[i].isdigit() or sql[i] == '.'):
+        i += 1
+    if i < len(sql) and sql[i] in 'eE':
+        i += 1
+        if i < len(sql) and sql[i] in '+-':
+            i += 1
+        while i < len(sql) and sql[i].isdigit():
+            i += 1
+    return i
+
+def read_quoted(sql: str, i: int, quote: str):
+    """
+    read_quoted reads a quoted string starting at i, where a doubled quote
+    stands for a single quote character, and returns the unquoted string and
+    the index after the closing quote
+    """
+    value = []
+    i += 1
+
+    while i < len(sql):
+        if sql[i] == quote:
+            if sql.startswith(quote * 2, i) and quote != ']':
+                value.append(quote)
+                i += 2
+                continue
+            return ''.join(value), i + 1
+        value.append(sql[i])
+        i += 1
+
+    raise SQLSyntaxError('unterminated quoted string')
@@ -0,0 +1,408 @@
+import math
+from itertools import islice
+from typing import Callable, Iterator, List, Tuple
+
+from src.backend.btree import BTree
+from src.backend.predicate import Predicate
+from src.backend.record import sort_key
+from src.backend.sorter import DEFAULT_SORT_MEMORY, Descending, ExternalSorter
+from src.sql.catalog import ROWID, IndexInfo, TableInfo
+from src.sql.expression import (
+    ExpressionError,
+    Placeholder,
+    compare,
+    is_true,
+    output_value,
+    resolve,
+)
+
+# rows in each batch of operators producing their rows one at a time
+BATCH_ROWS = 256
+
+class Operator:
+    """
+    Operator is a node of a query plan. Iterating an operator pulls rows from
+    its child one at a time, so a plan only does the work needed for the
+    rows its consumer asks for. Rows are laid out by TableInfo.row until the
+    final Project.
+
+    batches pulls the same rows as lists. Scans produce a list per leaf and
+    Filter and Project work through each list in one loop, which saves a
+    generator step per row and operator; the others group their rows into
+    lists of BATCH_ROWS.
+    """
+    child = None
+
+    def __iter__(self) -> Iterator[List[any]]:
+        raise NotImplementedError
+
+    def batches(self) -> Iterator[List[List[any]]]:
+        rows = iter(self)
+        while True:
+            batch = list(islice(rows, BATCH_ROWS))
+            if not batch:
+                return
+            yield batch
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+    def explain(self) -> List[str]:
+        """
+        explain lists the operators of the plan from the root down
+        """
+        lines = []
+        operator, depth = self, 0
+        while operator is not None:
+            lines.append('  ' * depth + operator.describe())
+            operator, depth = operator.child, depth + 1
+        return lines
+
+def scatter(table: TableInfo, row_id: int, values: List[any], columns: List[int]):
+    """
+    scatter places values decoded for only some columns at their positions in
+    a table row
+    """
+    if columns is None:
+        return table.row(row_id, values)
+    row = [None] * len(table.columns)
+    for column, value in zip(columns, values):
+        row[column] = value
+    return table.row(row_id, row)
+
+def describe_predicate(table: TableInfo, predicate: Predicate) -> str:
+    text = repr(predicate)
+    for column in sorted(predicate.columns(), reverse=True):
+        text = text.replace(f'column {column} ', f'{table.columns[column]} ')
+    return text
+
+class TableScan(Operator):
+    """
+    TableScan reads every row of a table in rowid order, evaluating the
+    predicate on the raw records and decoding only the listed columns
+    """
+    def __init__(
+        self,
+        tree: BTree,
+        table: TableInfo,
+        predicate: Predicate = None,
+        columns: List[int] = None,
+    ):
+        self.tree = tree
+        self.table = table
+        self.predicate = predicate
+        self.columns = columns
+
+    def __iter__(self) -> Iterator[List[any]]:
+        if self.predicate is not None:
+            self.predicate.bind()
+        for row_id, values in self.tree.scan(self.predicate, self.columns):
+            yield scatter(self.table, row_id, values, self.columns)
+
+    def batches(self) -> Iterator[List[List[any]]]:
+        if self.predicate is not None:
+            self.predicate.bind()
+        table, columns = self.table, self.columns
+        for batch in self.tree.scan_batches(self.predicate, columns):
+            yield [scatter(table, row_id, values, columns) for row_id, values in batch]
+
+    def describe(self) -> str:
+        text = f'SCAN {self.table.name}'
+        if self.predicate is not None:
+            text += f' WHERE {describe_predicate(self.table, self.predicate)}'
+        return text
+
+# a bound of a range, the value and whether the value itself is included
+Bound = Tuple[any, bool]
+
+def resolve_bound(bound: Bound) -> Bound:
+    return None if bound is None else (resolve(bound[0]), bound[1])
+
+def is_null_bound(bound: Bound) -> bool:
+    # a comparison with NULL matches nothing
+    return bound is not None and bound[0] is None
+
+def within_low(value: any, low: Bound) -> bool:
+    return low is None or compare(value, low[0], '>=' if low[1] else '>')
+
+def within_high(value: any, high: Bound) -> bool:
+    return high is None or compare(value, high[0], '<=' if high[1] else '<')
+
+def describe_range(name: str, low: Bound, high: Bound) -> str:
+    if low is not None and high is not None and low[0] == high[0]:
+        return f'{name}=?'
+    terms = []
+    if low is not None:
+        terms.append(f'{name}>{"=" if low[1] else ""}?')
+    if high is not None:
+        terms.append(f'{name}<{"=" if high[1] else ""}?')
+    return ' AND '.join(terms)
+
+class RowidRange(Operator):
+    """
+    RowidRange descends a table tree straight to the lowest rowid in range
+    and stops at the first rowid past the upper bound. Bounds may be
+    parameters, resolved when the scan starts.
+    """
+    def __init__(
+        self,
+        tree: BTree,
+        table: TableInfo,
+        low: Bound = None,
+        high: Bound = None,
+        predicate: Predicate = None,
+        columns: List[int] = None,
+    ):
+        self.tree = tree
+        self.table = table
+        self.low = low
+        self.high = high
+        self.predicate = predicate
+        self.columns = columns
+
+    def __iter__(self) -> Iterator[List[any]]:
+        low, high = resolve_bound(self.low), resolve_bound(self.high)
+        if is_null_bound(low) or is_null_bound(high):
+            return
+        if self.predicate is not None:
+            self.predicate.bind()
+
+        start = None
+        if low is not None and isinstance(low[0], (int, float)):
+            start = math.floor(low[0])
+        rows = self.tree.scan(self.predicate, self.columns, start)
+        for row_id, values in rows:
+            if not within_low(row_id, low):
+                continue
+            if not within_high(row_id, high):
+                return
+            yield scatter(self.table, row_id, values, self.columns)
+
+    def describe(self) -> str:
+        text = f'SEARCH {self.table.name} USING INTEGER PRIMARY KEY ' \
+            f'({describe_range("rowid", self.low, self.high)})'
+        if self.predicate is not None:
+            text += f' WHERE {describe_predicate(self.table, self.predicate)}'
+        return text
+
+class IndexScan(Operator):
+    """
+    IndexScan seeks an index to the entries equal to the given values on its
+    leading columns, optionally within a range on the next column, and looks
+    up the table row of each entry by rowid, or by primary key for a WITHOUT
+    ROWID table. The scan stops at the first entry past the range. A covering
+    scan builds the rows from the index entries instead, never reading the
+    table, as a seek on the primary key of a WITHOUT ROWID table always is.
+    """
+    def __init__(
+        self,
+        index_tree: BTree,
+        table_tree: BTree,
+        table: TableInfo,
+        index: IndexInfo,
+        equal: List[any],
+        low: Bound = None,
+        high: Bound = None,
+        predicate: Predicate = None,
+        columns: List[int] = None,
+        covering: bool = False,
+    ):
+        self.index_tree = index_tree
+        self.table_tree = table_tree
+        self.table = table
+        self.index = index
+        self.equal = equal
+        self.low = low
+        self.high = high
+        self.predicate = predicate
+        self.columns = columns
+        self.covering = covering
+
+    def entries(self) -> Iterator[List[any]]:
+        """
+        entries yields the values of the index entries in range, the indexed
+        columns followed by the extra columns of the index
+        """
+        equal = [resolve(value) for value in self.equal]
+        low, high = resolve_bound(self.low), resolve_bound(self.high)
+        if any(value is None for value in equal):
+            return
+        if is_null_bound(low) or is_null_bound(high):
+            return
+
+        prefix = tuple(sort_key(value) for value in equal)
+        start = prefix
+        if low is not None:
+            start = prefix + (sort_key(low[0]),)
+
+        length = len(equal)
+        ranged = low is not None or high is not None
+
+        for _, values in self.index_tree.scan(start=start):
+            if tuple(sort_key(value) for value in values[:length]) != prefix:
+                return
+            if ranged:
+                value = values[length]
+                # NULL sorts first and is never in range
+                if value is None or not within_low(value, low):
+                    continue
+                if not within_high(value, high):
+                    return
+            yield values
+
+    def __iter__(self) -> Iterator[List[any]]:
+        if self.covering:
+            # the columns the index does not hold are left NULL, the planner
+            # only makes a scan covering when nothing reads them
+            positions = self.index.columns + self.index.extra
+            for values in self.entries():
+                row = [None] * len(self.table.columns)
+                row_id = None
+                for position, value in zip(positions, values):
+                    if position == ROWID:
+                        row_id = value
+                    else:
+                        row[position] = value
+                yield self.table.row(row_id, row)
+            return
+
+        if self.predicate is not None:
+            self.predicate.bind()
+        key_slots = None
+        if self.table.primary_index is not None:
+            # where the entries hold each primary key column
+            positions = self.index.columns + self.index.extra
+            key_slots = [
+                positions.index(column)
+                for column in self.table.primary_index.columns
+            ]
+        for values in self.entries():
+            if key_slots is None:
+                row_id = key = values[-1]
+            else:
+                row_id = None
+                key = tuple(sort_key(values[slot]) for slot in key_slots)
+            found = self.table_tree.lookup(key, self.predicate, self.columns)
+            if found is not None:
+                yield scatter(self.table, row_id, found, self.columns)
+
+    def describe(self) -> str:
+        names = [self.table.columns[column] for column in self.index.columns]
+        terms = [f'{name}=?' for name in names[:len(self.equal)]]
+        if self.low is not None or self.high is not None:
+            terms.append(describe_range(names[len(self.equal)], self.low, self.high))
+        if self.index is self.table.primary_index:
+            text = f'SEARCH {self.table.name} USING PRIMARY KEY'
+        else:
+            kind = 'COVERING INDEX' if self.covering else 'INDEX'
+            text = f'SEARCH {self.table.name} USING {kind} {self.index.name}'
+        text += f' ({" AND ".join(terms)})'
+        if self.predicate is not None:
+            text += f' WHERE {describe_predicate(self.table, self.predicate)}'
+        return text
+
+class Filter(Operator):
+    def __init__(self, child: Operator, condition: Callable, text: str):
+        self.child = child
+        self.condition = condition
+        self.text = text
+
+    def __iter__(self) -> Iterator[List[any]]:
+        condition = self.condition
+        for row in self.child:
+            if is_true(condition(row)):
+                yield row
+
+    def batches(self) -> Iterator[List[List[any]]]:
+        condition = self.condition
+        for batch in self.child.batches():
+            batch = [row for row in batch if is_true(condition(row))]
+            if batch:
+                yield batch
+
+    def describe(self) -> str:
+        return f'FILTER {self.text}'
+
+class Sort(Operator):
+    """
+    Sort orders all the rows of its child by a list of (key function,
+    descending) pairs with an ExternalSorter, spilling to a temporary file
+    once the rows outgrow the memory budget
+    """
+    def __init__(
+        self,
+        child: Operator,
+        keys: List[Tuple[Callable, bool]],
+        text: str,
+        memory: int = DEFAULT_SORT_MEMORY,
+        encoding: str = 'utf-8',
+    ):
+        self.child = child
+        self.keys = keys
+        self.text = text
+        self.memory = memory
+        self.encoding = encoding
+        self.sorter = None
+
+    def key(self, row: List[any]) -> tuple:
+        return tuple(
+            Descending(sort_key(key(row))) if descending else sort_key(key(row))
+            for key, descending in self.keys
+        )
+
+    def __iter__(self) -> Iterator[List[any]]:
+        self.sorter = ExternalSorter(self.key, self.memory, encoding=self.encoding)
+        self.sorter.extend(self.child)
+        return self.sorter.sorted()
+
+    def describe(self) -> str:
+        return f'SORT BY {self.text}'
+
+class Limit(Operator):
+    """
+    Limit stops pulling rows from its child once limit rows past offset have
+    been produced. A negative limit means no limit, as in sqlite. Either may
+    be a parameter, read when the rows are first asked for.
+    """
+    def __init__(self, child: Operator, limit: int, offset: int = 0):
+        self.child = child
+        self.limit = limit
+        self.offset = offset
+
+    def __iter__(self) -> Iterator[List[any]]:
+        limit, offset = resolve(self.limit), resolve(self.offset)
+        if not isinstance(limit, int) or not isinstance(offset, int):
+            raise ExpressionError('datatype mismatch in LIMIT or OFFSET')
+        offset = max(offset, 0)
+        stop = None if limit < 0 else offset + limit
+        return islice(self.child, offset, stop)
+
+    def describe(self) -> str:
+        limit, offset = (
+            '?' if isinstance(value, Placeholder) else value
+            for value in (self.limit, self.offset)
+        )
+        return f'LIMIT {limit} OFFSET {offset}'
+
+class Project(Operator):
+    """
+    Project evaluates the result columns of each row, producing tuples of
+    python values
+    """
+    def __init__(self, child: Operator, exprs: List[Callable], names: List[str]):
+        self.child = child
+        self.exprs = exprs
+        self.names = names
+
+    def __iter__(self) -> Iterator[Tuple[any, ...]]:
+        exprs = self.exprs
+        for row in self.child:
+            yield tuple(output_value(expr(row)) for expr in exprs)
+
+    def batches(self) -> Iterator[List[Tuple[any, ...]]]:
+        exprs = self.exprs
+        for batch in self.child.batches():
+            yield [tuple(output_value(expr(row)) for expr in exprs) for row in batch]
+
+    def describe(self) -> str:
+        return f'PROJECT {", ".join(self.names)}'
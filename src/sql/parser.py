@@ -0,0 +1,538 @@
+from dataclasses import dataclass, field
+from typing import List
+
+from src.sql.lexer import SQLSyntaxError, Token, TokenType, tokenize
+
+@dataclass
+class ColumnRef:
+    name: str
+    table: str = None
+
+@dataclass
+class Literal:
+    value: any
+
+@dataclass
+class Parameter:
+    # the position of a ? placeholder in the statement, counting from 0
+    index: int
+
+@dataclass
+class Star:
+    pass
+
+@dataclass
+class BinaryOp:
+    # comparison operators, AND and OR
+    op: str
+    left: any
+    right: any
+
+@dataclass
+class Not:
+    operand: any
+
+@dataclass
+class IsNull:
+    operand: any
+    negated: bool = False
+
+@dataclass
+class Like:
+    # op is LIKE or GLOB
+    op: str
+    operand: any
+    pattern: any
+    negated: bool = False
+
+@dataclass
+class Between:
+    operand: any
+    low: any
+    high: any
+    negated: bool = False
+
+@dataclass
+class InList:
+    operand: any
+    values: List[any]
+    negated: bool = False
+
+@dataclass
+class FunctionCall:
+    # the name is upper cased, star is set for COUNT(*)
+    name: str
+    args: List[any] = field(default_factory=list)
+    star: bool = False
+
+@dataclass
+class ResultColumn:
+    expr: any
+    alias: str = None
+
+@dataclass
+class OrderingTerm:
+    expr: any
+    descending: bool = False
+
+@dataclass
+class Select:
+    columns: List[ResultColumn]
+    table: str
+    where: any = None
+    group_by: List[any] = field(default_factory=list)
+    having: any = None
+    order_by: List[OrderingTerm] = field(default_factory=list)
+    limit: any = None
+    offset: any = None
+    # the number of ? placeholders
+    parameters: int = 0
+
+@dataclass
+class IndexedColumn:
+    name: str
+    descending: bool = False
+    collation: str = None
+
+@dataclass
+class CreateIndex:
+    name: str
+    table: str
+    columns: List[IndexedColumn]
+    unique: bool = False
+    # partial indexes only cover rows matching their WHERE clause
+    partial: bool = False
+
+@dataclass
+class ColumnDef:
+    name: str
+    type: str = ''
+    primary_key: bool = False
+    descending: bool = False
+    unique: bool = False
+    collation: str = None
+
+@dataclass
+class CreateTable:
+    name: str
+    columns: List[ColumnDef]
+    # primary key columns, whether declared on a column or the table
+    primary_key: List[str] = field(default_factory=list)
+    # column lists of the UNIQUE and non rowid PRIMARY KEY constraints in the
+    # order sqlite numbers their automatic indexes
+    unique: List[List[str]] = field(default_factory=list)
+    without_rowid: bool = False
+    # whether the primary key sorts ascending with the BINARY collation, the
+    # order a WITHOUT ROWID table is seeked in
+    primary_key_plain: bool = True
+
+COMPARISON_OPERATORS = ('=', '==', '!=', '<>', '<', '<=', '>', '>=')
+
+class Parser:
+    """
+    Parser is a recursive descent parser for the subset of sql understood by
+    the query layer, SELECT statements and the CREATE statements stored in
+    sqlite_schema
+    """
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.position = 0
+        self.parameters = 0
+
+    def peek(self, offset: int = 0) -> Token:
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)]
+
+    def advance(self) -> Token:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def error(self, message: str):
+        token = self.peek()
+        near = 'end of input' if token.type == TokenType.END else repr(token.value)
+        raise SQLSyntaxError(f'{message} near {near}')
+
+    def accept_keyword(self, *keywords: str) -> bool:
+        if self.peek().is_keyword(*keywords):
+            self.advance()
+            return True
+        return False
+
+    def accept_word(self, *words: str) -> bool:
+        """
+        accept_word accepts keywords and the words only meaningful inside a
+        CREATE statement, which are tokenized as identifiers
+        """
+        token = self.peek()
+        is_word = token.type in (TokenType.KEYWORD, TokenType.IDENTIFIER)
+        if is_word and token.value.upper() in words:
+            self.advance()
+            return True
+        return False
+
+    def accept_operator(self, *operators: str) -> bool:
+        if self.peek().is_operator(*operators):
+            self.advance()
+            return True
+        return False
+
+    def expect_keyword(self, keyword: str):
+        if not self.accept_keyword(keyword):
+            self.error(f'expected {keyword}')
+
+    def expect_operator(self, operator: str):
+        if not self.accept_operator(operator):
+            self.error(f'expected {operator!r}')
+
+    def expect_identifier(self) -> str:
+        token = self.peek()
+        if token.type not in (TokenType.IDENTIFIER, TokenType.STRING):
+            self.error('expected a name')
+        return self.advance().value
+
+    def expect_end(self):
+        self.accept_operator(';')
+        if self.peek().type != TokenType.END:
+            self.error('unexpected input')
+
+    def parse_select(self) -> Select:
+        self.expect_keyword('SELECT')
+
+        columns = [self.parse_result_column()]
+        while self.accept_operator(','):
+            columns.append(self.parse_result_column())
+
+        self.expect_keyword('FROM')
+        table = self.parse_qualified_name()
+
+        select = Select(columns, table)
+
+        if self.accept_keyword('WHERE'):
+            select.where = self.parse_expr()
+
+        if self.accept_keyword('GROUP'):
+            self.expect_keyword('BY')
+            select.group_by.append(self.parse_expr())
+            while self.accept_operator(','):
+                select.group_by.append(self.parse_expr())
+            if self.accept_keyword('HAVING'):
+                select.having = self.parse_expr()
+
+        if self.accept_keyword('ORDER'):
+            self.expect_keyword('BY')
+            select.order_by.append(self.parse_ordering_term())
+            while self.accept_operator(','):
+                select.order_by.append(self.parse_ordering_term())
+
+        if self.accept_keyword('LIMIT'):
+            select.limit = self.parse_expr()
+            if self.accept_keyword('OFFSET'):
+                select.offset = self.parse_expr()
+            elif self.accept_operator(','):
+                # LIMIT offset, count
+                select.offset, select.limit = select.limit, self.parse_expr()
+
+        self.expect_end()
+        select.parameters = self.parameters
+        return select
+
+    def parse_qualified_name(self) -> str:
+        name = self.expect_identifier()
+        # the schema name of main.table is dropped
+        if self.accept_operator('.'):
+            name = self.expect_identifier()
+        return name
+
+    def parse_result_column(self) -> ResultColumn:
+        if self.accept_operator('*'):
+            return ResultColumn(Star())
+
+        expr = self.parse_expr()
+        alias = None
+        if self.accept_keyword('AS'):
+            alias = self.expect_identifier()
+        elif self.peek().type == TokenType.IDENTIFIER:
+            alias = self.advance().value
+        return ResultColumn(expr, alias)
+
+    def parse_ordering_term(self) -> OrderingTerm:
+        expr = self.parse_expr()
+        if self.accept_keyword('DESC'):
+            return OrderingTerm(expr, True)
+        self.accept_keyword('ASC')
+        return OrderingTerm(expr)
+
+    def parse_expr(self) -> any:
+        return self.parse_or()
+
+    def parse_or(self) -> any:
+        expr = self.parse_and()
+        while self.accept_keyword('OR'):
+            expr = BinaryOp('OR', expr, self.parse_and())
+        return expr
+
+    def parse_and(self) -> any:
+        expr = self.parse_not()
+        while self.accept_keyword('AND'):
+            expr = BinaryOp('AND', expr, self.parse_not())
+        return expr
+
+    def parse_not(self) -> any:
+        if self.accept_keyword('NOT'):
+            return Not(self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> any:
+        expr = self.parse_unary()
+
+        while True:
+            token = self.peek()
+            if token.is_operator(*COMPARISON_OPERATORS):
+                self.advance()
+                expr = BinaryOp(token.value, expr, self.parse_unary())
+            elif token.is_keyword('IS'):
+                self.advance()
+                negated = self.accept_keyword('NOT')
+                self.expect_keyword('NULL')
+                expr = IsNull(expr, negated)
+            else:
+                negated = token.is_keyword('NOT') and \
+                    self.peek(1).is_keyword('LIKE', 'GLOB', 'BETWEEN', 'IN')
+                if negated:
+                    self.advance()
+
+                if self.accept_keyword('LIKE', 'GLOB'):
+                    op = self.tokens[self.position - 1].value
+                    expr = Like(op, expr, self.parse_unary(), negated)
+                elif self.accept_keyword('BETWEEN'):
+                    low = self.parse_unary()
+                    self.expect_keyword('AND')
+                    expr = Between(expr, low, self.parse_unary(), negated)
+                elif self.accept_keyword('IN'):
+                    expr = InList(expr, self.parse_expr_list(), negated)
+                else:
+                    return expr
+
+    def parse_expr_list(self) -> List[any]:
+        self.expect_operator('(')
+        values = [self.parse_expr()]
+        while self.accept_operator(','):
+            values.append(self.parse_expr())
+        self.expect_operator(')')
+        return values
+
+    def parse_unary(self) -> any:
+        if self.accept_operator('-'):
+            operand = self.parse_unary()
+            if isinstance(operand, Literal) and isinstance(operand.value, (int, float)):
+                return Literal(-operand.value)
+            self.error('expected a number after unary minus')
+        if self.accept_operator('+'):
+            return self.parse_unary()
+        return self.parse_primary()
+
+    def parse_primary(self) -> any:
+        token = self.peek()
+
+        if token.type in (
+            TokenType.INTEGER,
+            TokenType.FLOAT,
+            TokenType.STRING,
+            TokenType.BLOB,
+        ):
+            self.advance()
+            return Literal(token.value)
+        elif token.is_keyword('NULL'):
+            self.advance()
+            return Literal(None)
+        elif self.accept_operator('?'):
+            self.parameters += 1
+            return Parameter(self.parameters - 1)
+        elif token.type == TokenType.IDENTIFIER:
+            self.advance()
+            if self.peek().is_operator('('):
+                return self.parse_function_call(token.value)
+            if self.accept_operator('.'):
+                return ColumnRef(self.expect_identifier(), token.value)
+            return ColumnRef(token.value)
+        elif self.accept_operator('('):
+            expr = self.parse_expr()
+            self.expect_operator(')')
+            return expr
+
+        self.error('expected an expression')
+
+    def parse_function_call(self, name: str) -> FunctionCall:
+        self.expect_operator('(')
+        call = FunctionCall(name.upper())
+        if self.peek().is_keyword('DISTINCT'):
+            self.error('DISTINCT arguments are not supported')
+
+        if self.accept_operator('*'):
+            call.star = True
+        elif not self.peek().is_operator(')'):
+            call.args.append(self.parse_expr())
+            while self.accept_operator(','):
+                call.args.append(self.parse_expr())
+        self.expect_operator(')')
+        return call
+
+    def parse_create_index(self) -> CreateIndex:
+        self.expect_keyword('CREATE')
+        unique = self.accept_keyword('UNIQUE')
+        self.expect_keyword('INDEX')
+        if self.accept_word('IF'):
+            self.expect_keyword('NOT')
+            self.accept_word('EXISTS')
+
+        name = self.parse_qualified_name()
+        self.expect_keyword('ON')
+        table = self.parse_qualified_name()
+
+        self.expect_operator('(')
+        columns = [self.parse_indexed_column()]
+        while self.accept_operator(','):
+            columns.append(self.parse_indexed_column())
+        self.expect_operator(')')
+
+        partial = self.accept_keyword('WHERE')
+        return CreateIndex(name, table, columns, unique, partial)
+
+    def parse_indexed_column(self) -> IndexedColumn:
+        column = IndexedColumn(self.expect_identifier())
+        if self.accept_word('COLLATE'):
+            column.collation = self.expect_identifier()
+        if self.accept_keyword('DESC'):
+            column.descending = True
+        else:
+            self.accept_keyword('ASC')
+        return column
+
+    def parse_create_table(self) -> CreateTable:
+        self.expect_keyword('CREATE')
+        self.accept_word('TEMP', 'TEMPORARY')
+        if not self.accept_word('TABLE'):
+            self.error('expected TABLE')
+        if self.accept_word('IF'):
+            self.expect_keyword('NOT')
+            self.accept_word('EXISTS')
+
+        table = CreateTable(self.parse_qualified_name(), [])
+        self.expect_operator('(')
+
+        while True:
+            if str(self.peek().value).upper() in TABLE_CONSTRAINTS:
+                self.parse_table_constraint(table)
+            else:
+                self.parse_column_def(table)
+            if not self.accept_operator(','):
+                break
+
+        self.expect_operator(')')
+        if self.accept_word('WITHOUT'):
+            self.accept_word('ROWID')
+            table.without_rowid = True
+
+        # the collation of a column applies to its primary key too
+        for column in table.columns:
+            if column.primary_key and (column.descending or column.collation):
+                table.primary_key_plain = False
+        return table
+
+    def parse_column_def(self, table: CreateTable):
+        column = ColumnDef(self.expect_identifier())
+        table.columns.append(column)
+
+        type_words = []
+        while self.peek().type == TokenType.IDENTIFIER and \
+                self.peek().value.upper() not in COLUMN_CONSTRAINTS:
+            type_words.append(self.advance().value)
+        if type_words and self.peek().is_operator('('):
+            self.skip_parenthesized()
+        column.type = ' '.join(type_words)
+
+        while not self.peek().is_operator(',', ')'):
+            if self.peek().type == TokenType.END:
+                self.error('unterminated column definition')
+            elif self.accept_word('PRIMARY'):
+                self.accept_word('KEY')
+                column.primary_key = True
+                column.descending = self.accept_keyword('DESC')
+                table.primary_key = [column.name]
+                table.unique.append([column.name])
+            elif self.accept_keyword('UNIQUE'):
+                column.unique = True
+                table.unique.append([column.name])
+            elif self.accept_word('COLLATE'):
+                column.collation = self.expect_identifier()
+            elif self.peek().is_operator('('):
+                self.skip_parenthesized()
+            else:
+                self.advance()
+
+    def parse_table_constraint(self, table: CreateTable):
+        if self.accept_word('CONSTRAINT'):
+            self.expect_identifier()
+
+        if self.accept_word('PRIMARY'):
+            self.accept_word('KEY')
+            indexed = self.parse_constraint_columns()
+            columns = [column.name for column in indexed]
+            table.primary_key = columns
+            table.unique.append(columns)
+            if any(column.descending or column.collation for column in indexed):
+                table.primary_key_plain = False
+            for column in table.columns:
+                if column.name.lower() in (c.lower() for c in columns):
+                    column.primary_key = True
+        elif self.accept_keyword('UNIQUE'):
+            table.unique.append([
+                column.name for column in self.parse_constraint_columns()
+            ])
+
+        # skip the rest of the constraint, CHECK and FOREIGN KEY included
+        while not self.peek().is_operator(',', ')'):
+            if self.peek().type == TokenType.END:
+                self.error('unterminated table constraint')
+            elif self.peek().is_operator('('):
+                self.skip_parenthesized()
+            else:
+                self.advance()
+
+    def parse_constraint_columns(self) -> List[IndexedColumn]:
+        self.expect_operator('(')
+        columns = [self.parse_indexed_column()]
+        while self.accept_operator(','):
+            columns.append(self.parse_indexed_column())
+        self.expect_operator(')')
+        return columns
+
+    def skip_parenthesized(self):
+        self.expect_operator('(')
+        depth = 1
+        while depth:
+            token = self.advance()
+            if token.type == TokenType.END:
+                self.error('unbalanced parentheses')
+            elif token.is_operator('('):
+                depth += 1
+            elif token.is_operator(')'):
+                depth -= 1
+
+# words that end a column type and start a column constraint
+COLUMN_CONSTRAINTS = {
+    'CONSTRAINT', 'PRIMARY', 'NOT', 'NULL', 'UNIQUE', 'CHECK', 'DEFAULT',
+    'COLLATE', 'REFERENCES', 'GENERATED', 'AS',
+}
+
+TABLE_CONSTRAINTS = {'CONSTRAINT', 'PRIMARY', 'UNIQUE', 'CHECK', 'FOREIGN'}
+
+def parse_select(sql: str) -> Select:
+    return Parser(sql).parse_select()
+
+def parse_create_table(sql: str) -> CreateTable:
+    return Parser(sql).parse_create_table()
+
+def parse_create_index(sql: str) -> CreateIndex:
+    return Parser(sql).parse_create_index()
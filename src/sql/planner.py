@@ -0,0 +1,622 @@
+import math
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from typing import Callable, List
+
+from src.backend.btree import BTree
+from src.backend.predicate import And
+from src.backend.sorter import DEFAULT_SORT_MEMORY
+from src.sql.aggregate import AGGREGATES, CountStar, HashAggregate, TreeAggregate
+from src.sql.catalog import (
+    ROWID,
+    Affinity,
+    Catalog,
+    IndexInfo,
+    TableInfo,
+)
+from src.sql.expression import (
+    ExpressionError,
+    Parameters,
+    Placeholder,
+    Slot,
+    bind_parameters,
+    column_comparison,
+    columns_of,
+    compile_expr,
+    describe,
+    split_and,
+    to_predicate,
+)
+from src.sql.operators import (
+    Filter,
+    IndexScan,
+    Limit,
+    Operator,
+    Project,
+    RowidRange,
+    Sort,
+    TableScan,
+)
+from src.sql.parser import (
+    Between,
+    BinaryOp,
+    ColumnRef,
+    FunctionCall,
+    Literal,
+    Select,
+    Star,
+    parse_select,
+)
+from src.stats import Statistics, TreeStats
+
+RANGE_OPERATORS = ('<', '<=', '>', '>=')
+EQUALITY_OPERATORS = ('=', '==')
+
+# payload sizes assumed for pages counts when sqlite_stat1 has no sz= option
+DEFAULT_ROW_SIZE = 100
+DEFAULT_INDEX_ENTRY_SIZE = 20
+
+# fraction of rows a range with one or two bounds is assumed to select, the
+# guesses sqlite makes without histograms
+ONE_BOUND_SELECTIVITY = 1 / 4
+TWO_BOUND_SELECTIVITY = 1 / 64
+
+@dataclass
+class Term:
+    """
+    Term is one of the conditions joined by AND in a WHERE clause, with the
+    column, operator and constant when it compares a column with a constant
+    """
+    expr: any
+    column: int = None
+    op: str = None
+    value: any = None
+
+    def is_equality(self) -> bool:
+        # column = NULL is never true and cannot be used for a seek
+        return self.op in EQUALITY_OPERATORS and self.value is not None
+
+    def is_range(self) -> bool:
+        return self.op in RANGE_OPERATORS and self.value is not None
+
+@dataclass
+class Access:
+    """
+    Access is a candidate way to reach the rows of a table, the terms it
+    consumes and a rank, lower ranks being preferred
+    """
+    rank: int
+    kind: str
+    terms: List[Term] = field(default_factory=list)
+    index: IndexInfo = None
+    equal: List[any] = field(default_factory=list)
+    low: tuple = None
+    high: tuple = None
+    # whether the index holds every column the query reads, so the table is
+    # never visited
+    covering: bool = False
+
+    def range_selectivity(self) -> float:
+        bounds = (self.low is not None) + (self.high is not None)
+        if bounds == 2:
+            return TWO_BOUND_SELECTIVITY
+        if bounds == 1:
+            return ONE_BOUND_SELECTIVITY
+        return 1
+
+def split_terms(where: any, table: TableInfo) -> List[Term]:
+    """
+    split_terms breaks a WHERE clause into terms, rewriting BETWEEN into a
+    pair of comparisons so that either bound can be used for a seek
+    """
+    terms = []
+    for expr in split_and(where):
+        if isinstance(expr, Between) and not expr.negated:
+            terms.extend(split_terms(BinaryOp(
+                'AND',
+                BinaryOp('>=', expr.operand, expr.low),
+                BinaryOp('<=', expr.operand, expr.high),
+            ), table))
+            continue
+
+        term = Term(expr)
+        matched = column_comparison(expr, table)
+        if matched is not None:
+            term.column, term.op, term.value = matched
+        terms.append(term)
+    return terms
+
+def range_bounds(terms: List[Term]):
+    """
+    range_bounds picks a lower and an upper bound from range terms on a
+    column, returning the bounds and the terms they consume
+    """
+    low = high = None
+    used = []
+    for term in terms:
+        bound = (term.value, term.op in ('<=', '>='))
+        if term.op in ('>', '>=') and low is None:
+            low = bound
+            used.append(term)
+        elif term.op in ('<', '<=') and high is None:
+            high = bound
+            used.append(term)
+    return low, high, used
+
+def is_number(value: any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def tree_depth(pages: int, usable_size: int) -> int:
+    """
+    tree_depth estimates the levels of a b-tree of pages leaves, an interior
+    page holding about one child per 8 bytes of usable space
+    """
+    fan_out = max(usable_size // 8, 2)
+    depth = 1
+    while pages > 1:
+        pages = math.ceil(pages / fan_out)
+        depth += 1
+    return depth
+
+class Planner:
+    """
+    Planner turns a SELECT statement into a tree of operators. Without
+    statistics for the table the access path is chosen from the WHERE terms
+    by rule: a rowid lookup, then an index seek on the longest prefix of
+    equal columns, then a rowid range, then an index range and finally a
+    full scan. With statistics the candidate touching the fewest pages is
+    chosen instead. The remaining terms are pushed down into the scan when
+    they can run on the raw records, and evaluated by a Filter otherwise.
+    """
+    def __init__(
+        self,
+        catalog: Catalog,
+        btree: Callable[[int], BTree],
+        sort_memory: int = DEFAULT_SORT_MEMORY,
+        statistics: Statistics = None,
+    ):
+        self.catalog = catalog
+        self.btree = btree
+        self.sort_memory = sort_memory
+        self.statistics = statistics or Statistics()
+
+    def plan(self, select: Select, parameters: Parameters = None) -> Operator:
+        """
+        plan builds the operators of a query. Its ? parameters read their
+        values from parameters, which can be bound again before each run of
+        the plan.
+        """
+        if parameters is None:
+            parameters = Parameters(select.parameters)
+        select = bind_parameters(select, parameters)
+
+        table = self.catalog.table(select.table)
+        names, exprs = self.result_columns(select, table)
+        order_by = [
+            (self.resolve(term.expr, select, exprs), term.descending)
+            for term in select.order_by
+        ]
+
+        if select.group_by or select.having is not None or \
+                any(contains_aggregate(expr) for expr in exprs):
+            operator, exprs, order_by = self.aggregate(select, table, exprs, order_by)
+            ordered = self.is_grouped_order(order_by)
+        else:
+            used = exprs + [expr for expr, _ in order_by]
+            operator, access = self.access_path(table, select.where, used)
+            ordered = self.is_ordered(table, access, order_by)
+
+        if order_by and not ordered:
+            keys = [(compile_expr(expr, table), desc) for expr, desc in order_by]
+            text = ', '.join(
+                describe(expr) + (' DESC' if desc else '') for expr, desc in order_by
+            )
+            encoding = self.btree(table.root_page).encoding
+            operator = Sort(operator, keys, text, self.sort_memory, encoding)
+
+        if select.limit is not None:
+            limit = self.integer(select.limit, 'LIMIT')
+            offset = 0
+            if select.offset is not None:
+                offset = self.integer(select.offset, 'OFFSET')
+            operator = Limit(operator, limit, offset)
+
+        compiled = [compile_expr(expr, table) for expr in exprs]
+        return Project(operator, compiled, names)
+
+    def access_path(self, table: TableInfo, where: any, used: List[any]):
+        """
+        access_path builds the operators reading the rows matching where, the
+        chosen access with the pushed down predicate and a Filter for each
+        term that cannot run on raw records, decoding only the columns that
+        used and the filters refer to
+        """
+        terms = split_terms(where, table)
+        access = self.choose_access(table, terms, used)
+        remaining = [
+            term for term in terms
+            if not any(term is used for used in access.terms)
+        ]
+
+        pushed, filtered = [], []
+        for term in remaining:
+            # a covering scan has no table record for a predicate to run on,
+            # its terms are checked on the rows built from the index entries
+            predicate = None
+            if not access.covering:
+                predicate = to_predicate(term.expr, table)
+            if predicate is None:
+                filtered.append(term.expr)
+            else:
+                pushed.append(predicate)
+        predicate = None
+        if pushed:
+            predicate = pushed[0] if len(pushed) == 1 else And(*pushed)
+
+        columns = self.decoded_columns(table, used + filtered)
+        operator = self.access_operator(table, access, predicate, columns)
+
+        for expr in filtered:
+            operator = Filter(operator, compile_expr(expr, table), describe(expr))
+        return operator, access
+
+    def aggregate(self, select: Select, table: TableInfo, exprs, order_by):
+        """
+        aggregate plans a query with aggregate functions or GROUP BY. Whole
+        table COUNT(*), MIN(rowid) and MAX(rowid) are read from the b-tree,
+        anything else is grouped by a HashAggregate. The result columns and
+        ORDER BY terms are returned rewritten to refer to the slots of the
+        aggregated rows.
+        """
+        functions = tree_functions(select, table, exprs)
+        if functions is not None:
+            tree = self.btree(table.root_page)
+            slots = [Slot(i, describe(expr)) for i, expr in enumerate(exprs)]
+            return TreeAggregate(tree, table.name, functions), slots, []
+
+        groups = [self.resolve(expr, select, exprs) for expr in select.group_by]
+        if any(contains_aggregate(group) for group in groups):
+            raise ExpressionError('aggregate functions are not allowed in GROUP BY')
+
+        calls = []
+        exprs = [bind_aggregates(expr, table, groups, calls) for expr in exprs]
+        order_by = [
+            (bind_aggregates(expr, table, groups, calls), descending)
+            for expr, descending in order_by
+        ]
+        having = None
+        if select.having is not None:
+            having = bind_aggregates(select.having, table, groups, calls)
+
+        arguments = [arg for call in calls for arg in call.args]
+        operator, _ = self.access_path(table, select.where, groups + arguments)
+
+        aggregates = [
+            (
+                CountStar if call.star else AGGREGATES[call.name],
+                None if call.star else compile_expr(call.args[0], table),
+            )
+            for call in calls
+        ]
+        text = ', '.join(describe(call) for call in calls)
+        if groups:
+            text += ' GROUP BY ' + ', '.join(describe(group) for group in groups)
+        operator = HashAggregate(
+            operator,
+            [compile_expr(group, table) for group in groups],
+            aggregates,
+            text,
+        )
+
+        if having is not None:
+            operator = Filter(operator, compile_expr(having, table), describe(having))
+        return operator, exprs, order_by
+
+    def is_grouped_order(self, order_by) -> bool:
+        # aggregated rows come out in the order of their groups
+        return all(
+            isinstance(expr, Slot) and expr.position == i and not descending
+            for i, (expr, descending) in enumerate(order_by)
+        )
+
+    def result_columns(self, select: Select, table: TableInfo):
+        names, exprs = [], []
+        for column in select.columns:
+            if isinstance(column.expr, Star):
+                for name in table.columns:
+                    names.append(name)
+                    exprs.append(ColumnRef(name))
+                continue
+            names.append(column.alias or describe(column.expr))
+            exprs.append(column.expr)
+        return names, exprs
+
+    def resolve(self, expr: any, select: Select, exprs: List[any]) -> any:
+        """
+        resolve turns an ORDER BY or GROUP BY term naming a result column by
+        its alias or its position into the expression of that column
+        """
+        if isinstance(expr, Literal) and isinstance(expr.value, int):
+            if not 1 <= expr.value <= len(exprs):
+                raise ExpressionError(f'term out of range: {expr.value}')
+            return exprs[expr.value - 1]
+
+        if isinstance(expr, ColumnRef):
+            for column in select.columns:
+                if column.alias and column.alias.lower() == expr.name.lower():
+                    return column.expr
+        return expr
+
+    def choose_access(
+        self,
+        table: TableInfo,
+        terms: List[Term],
+        used: List[any] = (),
+    ) -> Access:
+        """
+        choose_access picks the access path for the terms of a WHERE clause,
+        used being the other expressions the query reads from each row
+        """
+        candidates = [Access(5, 'scan')]
+        needed = set(self.decoded_columns(table, list(used) + [t.expr for t in terms]))
+
+        rowid_terms = [
+            term for term in terms
+            if term.column is not None and table.is_rowid(term.column)
+            and (is_number(term.value) or isinstance(term.value, Placeholder))
+        ]
+        for term in rowid_terms:
+            if term.is_equality():
+                candidates.append(Access(
+                    0, 'rowid', [term], low=(term.value, True),
+                    high=(term.value, True),
+                ))
+        low, high, used = range_bounds([t for t in rowid_terms if t.is_range()])
+        if used:
+            candidates.append(Access(3, 'rowid', used, low=low, high=high))
+
+        indexes = table.indexes
+        if table.primary_index is not None:
+            indexes = [table.primary_index] + indexes
+        for index in indexes:
+            access = self.index_access(table, index, terms)
+            if access is not None:
+                access.covering = needed <= set(index.columns + index.extra)
+                candidates.append(access)
+
+        stats = self.statistics.table(table.name)
+        if stats is None:
+            return min(candidates, key=lambda access: access.rank)
+        return min(
+            candidates,
+            key=lambda access: (self.cost(table, stats, access), access.rank),
+        )
+
+    def cost(self, table: TableInfo, stats: TreeStats, access: Access) -> float:
+        """
+        cost estimates the pages an access reads: every leaf for a scan, one
+        path down the tree for a rowid lookup and the leaves in range for a
+        rowid range. An index seek reads the index leaves holding the
+        matching entries and then the table pages of their rows, at most
+        every page once, unless the index covers the query.
+        """
+        usable_size = self.btree(table.root_page).usable_size
+        pages = stats.pages(usable_size, DEFAULT_ROW_SIZE)
+        depth = tree_depth(pages, usable_size)
+
+        if access.kind == 'scan':
+            return pages
+        if access.kind == 'rowid':
+            if access.low == access.high and access.low[1]:
+                return depth
+            return depth + pages * access.range_selectivity()
+
+        if access.index is table.primary_index:
+            # the table of a WITHOUT ROWID table is its primary key index
+            index_stats = stats
+        else:
+            index_stats = self.statistics.index(access.index.name) or \
+                TreeStats(stats.rows)
+        index_pages = index_stats.pages(usable_size, DEFAULT_INDEX_ENTRY_SIZE)
+        matched = index_stats.rows
+        if access.equal:
+            matched = index_stats.rows_per_key(len(access.equal))
+        matched *= access.range_selectivity()
+
+        per_page = max(index_stats.rows / index_pages, 1)
+        index_cost = tree_depth(index_pages, usable_size) + matched / per_page
+        if access.covering:
+            return index_cost
+        return index_cost + min(matched, pages) + depth
+
+    def index_access(self, table: TableInfo, index: IndexInfo, terms: List[Term]):
+        """
+        index_access matches terms to the leading columns of an index, equal
+        terms first and then a range on the next column
+        """
+        if not index.seekable or any(table.is_rowid(c) for c in index.columns):
+            return None
+
+        used, equal = [], []
+        for column in index.columns:
+            term = next(
+                (t for t in terms if t.column == column and t.is_equality()),
+                None,
+            )
+            if term is None:
+                break
+            used.append(term)
+            equal.append(term.value)
+
+        low = high = None
+        if len(equal) < len(index.columns):
+            column = index.columns[len(equal)]
+            low, high, ranged = range_bounds(
+                [t for t in terms if t.column == column and t.is_range()]
+            )
+            used.extend(ranged)
+
+        if equal:
+            full = index.unique and len(equal) == len(index.columns)
+            rank = 1 if full else 2
+        elif low is not None or high is not None:
+            rank = 4
+        else:
+            return None
+        return Access(rank, 'index', used, index, equal, low, high)
+
+    def access_operator(self, table: TableInfo, access: Access, predicate, columns):
+        tree = self.btree(table.root_page).reordered(table.record_positions())
+        if access.kind == 'rowid':
+            return RowidRange(tree, table, access.low, access.high, predicate, columns)
+        elif access.kind == 'index':
+            return IndexScan(
+                self.btree(access.index.root_page),
+                tree,
+                table,
+                access.index,
+                access.equal,
+                access.low,
+                access.high,
+                predicate,
+                columns,
+                access.covering,
+            )
+        return TableScan(tree, table, predicate, columns)
+
+    def decoded_columns(self, table: TableInfo, exprs: List[any]) -> List[int]:
+        positions = set()
+        for expr in exprs:
+            for name in columns_of(expr):
+                position = table.column_index(name)
+                if not table.is_rowid(position):
+                    positions.add(position)
+        return sorted(positions)
+
+    def is_ordered(self, table: TableInfo, access: Access, order_by) -> bool:
+        """
+        is_ordered tells whether the access path already yields rows in the
+        ORDER BY order, rowid order for scans and index order for index seeks
+        """
+        if not order_by:
+            return True
+
+        positions = []
+        for expr, descending in order_by:
+            if not isinstance(expr, ColumnRef) or descending:
+                return False
+            positions.append(table.column_index(expr.name))
+
+        primary = table.primary_index
+        if access.kind in ('scan', 'rowid'):
+            if primary is not None and primary.seekable:
+                # a WITHOUT ROWID table is stored in primary key order
+                return positions == primary.columns[:len(positions)]
+            return table.is_rowid(positions[0])
+
+        # the equal columns are constant, the rest follow the index and ties
+        # are in rowid or primary key order
+        equal = set(access.index.columns[:len(access.equal)])
+        positions = [p for p in positions if p not in equal]
+        order = access.index.columns[len(access.equal):]
+        if primary is None or primary.seekable:
+            order = order + access.index.extra
+        positions = [ROWID if table.is_rowid(p) else p for p in positions]
+        return positions == order[:len(positions)]
+
+    def integer(self, expr: any, clause: str) -> int:
+        if isinstance(expr, Placeholder):
+            return replace(expr, affinity=Affinity.INTEGER)
+        if not isinstance(expr, Literal) or not isinstance(expr.value, int):
+            raise ExpressionError(f'{clause} must be an integer')
+        return expr.value
+
+def contains_aggregate(expr: any) -> bool:
+    if isinstance(expr, FunctionCall):
+        return True
+    if is_dataclass(expr):
+        return any(contains_aggregate(child) for child in children(expr))
+    return False
+
+def children(expr: any) -> List[any]:
+    values = []
+    for item in fields(expr):
+        value = getattr(expr, item.name)
+        values.extend(value if isinstance(value, list) else [value])
+    return values
+
+def same_expr(a: any, b: any, table: TableInfo) -> bool:
+    if isinstance(a, ColumnRef) and isinstance(b, ColumnRef):
+        return table.column_index(a.name) == table.column_index(b.name)
+    return a == b
+
+def bind_aggregates(expr: any, table: TableInfo, groups: List[any], calls: List[any]):
+    """
+    bind_aggregates rewrites an expression over aggregated rows, replacing
+    group expressions and aggregate calls with the slots holding their
+    values. New aggregate calls are appended to calls.
+    """
+    for i, group in enumerate(groups):
+        if same_expr(expr, group, table):
+            return Slot(i, describe(expr))
+
+    if isinstance(expr, FunctionCall):
+        if expr.name not in AGGREGATES:
+            raise ExpressionError(f'no such function: {expr.name}')
+        if expr.star and expr.name != 'COUNT' or \
+                not expr.star and len(expr.args) != 1:
+            raise ExpressionError(f'wrong number of arguments to {expr.name}()')
+        if any(contains_aggregate(arg) for arg in expr.args):
+            raise ExpressionError(f'misuse of aggregate function {expr.name}()')
+        if expr not in calls:
+            calls.append(expr)
+        return Slot(len(groups) + calls.index(expr), describe(expr))
+
+    if isinstance(expr, ColumnRef):
+        raise ExpressionError(
+            f'column {expr.name} must appear in GROUP BY or in an aggregate'
+        )
+
+    if is_dataclass(expr) and not isinstance(expr, Literal):
+        changes = {}
+        for item in fields(expr):
+            value = getattr(expr, item.name)
+            if isinstance(value, list):
+                value = [bind_aggregates(v, table, groups, calls) for v in value]
+            elif is_dataclass(value):
+                value = bind_aggregates(value, table, groups, calls)
+            changes[item.name] = value
+        return replace(expr, **changes)
+    return expr
+
+def tree_functions(select: Select, table: TableInfo, exprs: List[any]) -> List[str]:
+    """
+    tree_functions returns the aggregate of each result column when the
+    query only asks for COUNT(*), MIN(rowid) or MAX(rowid) of a whole table,
+    and None otherwise
+    """
+    if select.where is not None or select.group_by or select.having is not None:
+        return None
+
+    functions = []
+    for expr in exprs:
+        if not isinstance(expr, FunctionCall):
+            return None
+        if expr.name == 'COUNT' and expr.star:
+            functions.append('COUNT')
+        elif expr.name in ('MIN', 'MAX') and len(expr.args) == 1 and \
+                isinstance(expr.args[0], ColumnRef) and \
+                table.is_rowid(table.column_index(expr.args[0].name)):
+            functions.append(expr.name)
+        else:
+            return None
+    return functions
+
+def plan_select(
+    sql: str,
+    catalog: Catalog,
+    btree: Callable[[int], BTree],
+    sort_memory: int = DEFAULT_SORT_MEMORY,
+    statistics: Statistics = None,
+) -> Operator:
+    planner = Planner(catalog, btree, sort_memory, statistics)
+    return planner.plan(parse_select(sql))
@@ -0,0 +1,145 @@
+import time
+import weakref
+from collections import OrderedDict
+from typing import Iterator, List, Tuple
+
+from src.backend.metrics import Metrics, QueryStats, current_stats
+from src.backend.pager import Pager
+from src.sql.expression import Parameters
+from src.sql.operators import Operator
+
+DEFAULT_CACHE_SIZE = 128
+
+class Statement:
+    """
+    Statement is a query parsed and planned once and run any number of
+    times with the values of its ? parameters bound at each run. As with a
+    sqlite statement only one run is active at a time, running it again
+    closes the rows of the previous run.
+
+    Given the pager of the database, each run is a read transaction holding
+    a SHARED lock from its first row until its rows are done, so that sqlite
+    cannot change the file under it. A batched run yields lists of rows from
+    Operator.batches instead of single rows.
+    """
+    def __init__(
+        self,
+        sql: str,
+        plan: Operator,
+        parameters: Parameters,
+        pager: Pager = None,
+        metrics: Metrics = None,
+    ):
+        self.sql = sql
+        self.plan = plan
+        self.parameters = parameters
+        self.pager = pager
+        self.running = None
+
+        # the counters of the last run, kept when metrics are collected
+        self.metrics = metrics
+        self.stats = None
+        if metrics is not None:
+            self.rows = self.measured_rows
+
+    def execute(
+        self,
+        values: List[any] = (),
+        batched: bool = False,
+    ) -> Iterator[Tuple[any, ...]]:
+        if self.busy():
+            self.running().close()
+        self.parameters.bind(values)
+        rows = self.rows(batched)
+        self.running = weakref.ref(rows)
+        return rows
+
+    def rows(self, batched: bool = False) -> Iterator[Tuple[any, ...]]:
+        rows = self.plan.batches() if batched else self.plan
+        if self.pager is None:
+            yield from rows
+            return
+        self.pager.begin_read()
+        try:
+            yield from rows
+        finally:
+            self.pager.end_read()
+
+    def measured_rows(self, batched: bool = False) -> Iterator[Tuple[any, ...]]:
+        """
+        measured_rows runs the plan as rows does, counting the work of each
+        step of the run into stats
+        """
+        stats = self.stats = QueryStats()
+        rows = Statement.rows(self, batched)
+        started = time.perf_counter()
+        try:
+            while True:
+                token = current_stats.set(stats)
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    current_stats.reset(token)
+                yield row
+        finally:
+            token = current_stats.set(stats)
+            try:
+                rows.close()
+            finally:
+                current_stats.reset(token)
+            self.metrics.end_query(stats, time.perf_counter() - started)
+
+    def busy(self) -> bool:
+        """
+        busy tells whether the rows of the last run may still be read, they
+        are done once exhausted, closed or garbage collected
+        """
+        rows = self.running() if self.running is not None else None
+        return rows is not None and rows.gi_frame is not None
+
+    def explain(self) -> List[str]:
+        return self.plan.explain()
+
+class StatementCache:
+    """
+    StatementCache keeps the most recently used statements by sql text. The
+    statements are planned against one version of the schema, identified by
+    the schema cookie of the database header, and are all dropped when the
+    cookie changes.
+    """
+    def __init__(self, capacity: int = DEFAULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.statements = OrderedDict()
+        self.schema_cookie = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql: str, schema_cookie: int) -> Statement:
+        if schema_cookie != self.schema_cookie:
+            self.clear()
+            self.schema_cookie = schema_cookie
+
+        statement = self.statements.get(sql)
+        if statement is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.statements.move_to_end(sql)
+        return statement
+
+    def put(self, statement: Statement):
+        if self.capacity <= 0:
+            return
+        self.statements[statement.sql] = statement
+        self.statements.move_to_end(statement.sql)
+        while len(self.statements) > self.capacity:
+            self.statements.popitem(last=False)
+
+    def clear(self):
+        self.statements.clear()
+
+    def __len__(self) -> int:
+        return len(self.statements)
@@ -0,0 +1,269 @@
+import math
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from src.backend.btree import BTree
+from src.backend.node import NodeType
+from src.backend.record import sort_key
+from src.util import b2i, varint
+
+STAT_TABLE = 'sqlite_stat1'
+STAT_TABLE_SQL = 'CREATE TABLE sqlite_stat1(tbl,idx,stat)'
+
+# rows assumed to share a value of an index column without statistics,
+# the default sqlite plans with
+DEFAULT_ROWS_PER_KEY = 10
+
+# bytes of a cell besides its payload, the pointer and the size varints
+CELL_OVERHEAD = 6
+
+@dataclass
+class TreeStats:
+    """
+    TreeStats holds a row of sqlite_stat1: the number of rows of a table or
+    index and, for an index, the average number of rows sharing the values
+    of its first 1, 2, ... columns. row_size is the average payload size,
+    written as the sz= option sqlite also reads.
+    """
+    rows: int
+    averages: List[int] = field(default_factory=list)
+    row_size: int = None
+
+    @classmethod
+    def parse(cls, stat: str) -> 'TreeStats':
+        """
+        parse reads the stat column of sqlite_stat1, ignoring options other
+        than sz= as sqlite does
+        """
+        numbers, row_size = [], None
+        for word in str(stat).split():
+            if word.isdigit():
+                numbers.append(int(word))
+            elif word.startswith('sz=') and word[3:].isdigit():
+                row_size = int(word[3:])
+        if not numbers:
+            raise ValueError(f'malformed sqlite_stat1 entry {stat!r}')
+        return cls(numbers[0], numbers[1:], row_size)
+
+    def to_stat(self) -> str:
+        words = [str(self.rows)] + [str(average) for average in self.averages]
+        if self.row_size is not None:
+            words.append(f'sz={self.row_size}')
+        return ' '.join(words)
+
+    def rows_per_key(self, columns: int) -> float:
+        """
+        rows_per_key estimates the rows matching equal values on the first
+        columns of an index
+        """
+        if columns <= len(self.averages):
+            return self.averages[columns - 1]
+        return max(self.rows / DEFAULT_ROWS_PER_KEY ** columns, 1)
+
+    def pages(self, usable_size: int, default_row_size: int) -> int:
+        row_size = self.row_size or default_row_size
+        per_page = max(usable_size // (row_size + CELL_OVERHEAD), 1)
+        return max(math.ceil(self.rows / per_page), 1)
+
+class Statistics:
+    """
+    Statistics caches the rows of sqlite_stat1 by table and index name. The
+    tree of a WITHOUT ROWID table is its primary key index, which sqlite
+    names after the table; its row holds the stats of the table.
+    """
+    def __init__(self):
+        self.tables: Dict[str, TreeStats] = {}
+        self.indexes: Dict[str, TreeStats] = {}
+
+    def table(self, name: str) -> TreeStats:
+        return self.tables.get(name.lower())
+
+    def index(self, name: str) -> TreeStats:
+        return self.indexes.get(name.lower())
+
+    def add(self, table: str, index: str, stats: TreeStats):
+        if index is None or index.lower() == table.lower():
+            self.tables[table.lower()] = stats
+        else:
+            self.indexes[index.lower()] = stats
+
+    def rows(self, catalog) -> List[List[any]]:
+        """
+        rows lays the statistics out as sqlite_stat1 rows, using the names
+        from the catalog
+        """
+        rows = []
+        for table in catalog.tables.values():
+            stats = self.table(table.name)
+            if stats is not None:
+                index = table.name if table.without_rowid else None
+                rows.append([table.name, index, stats.to_stat()])
+            for index in table.indexes:
+                stats = self.index(index.name)
+                if stats is not None:
+                    rows.append([table.name, index.name, stats.to_stat()])
+        return rows
+
+    @classmethod
+    def read(cls, db) -> 'Statistics':
+        """
+        read loads sqlite_stat1 when the database has one, entries that do
+        not parse are skipped as sqlite skips them
+        """
+        statistics = cls()
+        entry = db.schema.find(STAT_TABLE)
+        if entry is None or entry.type != 'table':
+            return statistics
+
+        for _, values in db.btree(entry.rootpage).scan():
+            values = values + [None] * (3 - len(values))
+            table, index, stat = values[:3]
+            if table is None or stat is None:
+                continue
+            try:
+                stats = TreeStats.parse(stat)
+            except ValueError:
+                continue
+            statistics.add(str(table), None if index is None else str(index), stats)
+        return statistics
+
+class Analyzer:
+    """
+    Analyzer gathers the statistics of every table and index. By default
+    each tree is read in full. With samples set, row counts are estimated
+    from that many random root to leaf descents, each multiplying the fan-out
+    of the pages on its path by the entries of those pages, and the distinct
+    keys of an index are estimated from how often neighbouring entries differ
+    on the leaves the descents reached.
+    """
+    def __init__(self, db, samples: int = None, seed: int = 0):
+        self.db = db
+        self.samples = samples
+        self.random = random.Random(seed)
+
+    def analyze(self) -> Statistics:
+        statistics = Statistics()
+        for table in self.db.catalog.tables.values():
+            # the tree of a WITHOUT ROWID table is keyed by its primary key
+            primary = table.primary_index
+            key_columns = 0 if primary is None else len(primary.columns)
+            stats = self.analyze_tree(self.db.btree(table.root_page), key_columns)
+            if stats.rows == 0:
+                # sqlite leaves empty tables out
+                continue
+            if stats.averages:
+                stats.averages[-1] = 1
+            statistics.add(table.name, None, stats)
+            for index in table.indexes:
+                tree = self.db.btree(index.root_page)
+                stats = self.analyze_tree(tree, len(index.columns))
+                if index.unique and stats.averages:
+                    stats.averages[-1] = 1
+                statistics.add(table.name, index.name, stats)
+        return statistics
+
+    def analyze_tree(self, tree: BTree, key_columns: int) -> TreeStats:
+        if self.samples is None:
+            return self.count_tree(tree, key_columns)
+        return self.sample_tree(tree, key_columns)
+
+    def count_tree(self, tree: BTree, key_columns: int) -> TreeStats:
+        rows, payload = 0, 0
+        changes = [0] * key_columns
+        previous = None
+
+        for node, pointer in tree.entries():
+            rows += 1
+            payload += payload_size(node, pointer)
+            if key_columns:
+                key = entry_key(tree, node, pointer, key_columns)
+                count_changes(changes, previous, key)
+                previous = key
+
+        return self.tree_stats(rows, payload / rows if rows else 0, changes, rows - 1)
+
+    def sample_tree(self, tree: BTree, key_columns: int) -> TreeStats:
+        estimates = []
+        leaves = {}
+
+        for _ in range(self.samples):
+            estimate, weight = 0, 1
+            page_number = tree.root_page
+            while True:
+                node = tree.node(page_number)
+                if node.is_leaf():
+                    estimate += weight * node.num_cells
+                    leaves[page_number] = node
+                    break
+                if node.node_type == NodeType.INDEX_INTERIOR:
+                    estimate += weight * node.num_cells
+                children = node.num_cells + 1
+                weight *= children
+                page_number = child_page(node, self.random.randrange(children))
+            estimates.append(estimate)
+
+        rows = round(sum(estimates) / len(estimates))
+
+        entries, payload, pairs = 0, 0, 0
+        changes = [0] * key_columns
+        for node in leaves.values():
+            previous = None
+            for pointer in node.cell_pointers():
+                entries += 1
+                payload += payload_size(node, pointer)
+                if key_columns:
+                    key = entry_key(tree, node, pointer, key_columns)
+                    count_changes(changes, previous, key)
+                    if previous is not None:
+                        pairs += 1
+                    previous = key
+
+        row_size = payload / entries if entries else 0
+        return self.tree_stats(rows, row_size, changes, pairs)
+
+    def tree_stats(
+        self,
+        rows: int,
+        row_size: float,
+        changes: List[int],
+        pairs: int,
+    ) -> TreeStats:
+        """
+        tree_stats turns the number of neighbouring entries that differ on
+        each key prefix, out of pairs compared, into average rows per key
+        """
+        averages = []
+        for changed in changes:
+            fraction = changed / pairs if pairs > 0 else 1
+            distinct = max(1 + fraction * (rows - 1), 1)
+            averages.append(max(math.ceil(rows / distinct), 1) if rows else 0)
+        return TreeStats(rows, averages, round(row_size) if rows else None)
+
+def child_page(node, i: int) -> int:
+    if i == node.num_cells:
+        return node.right_pointer
+    pointer = node.cell_pointers()[i]
+    return b2i(node.data[pointer:pointer + 4])
+
+def payload_size(node, pointer: int) -> int:
+    if node.node_type == NodeType.INDEX_INTERIOR:
+        pointer += 4
+    return varint(node.data, pointer)[0]
+
+def entry_key(tree: BTree, node, pointer: int, columns: int) -> Tuple:
+    _, view = tree.record_view(node, pointer)
+    return tuple(sort_key(value) for value in view.values(range(columns)))
+
+def count_changes(changes: List[int], previous: Tuple, key: Tuple):
+    """
+    count_changes adds one to the count of each key prefix on which key
+    differs from the entry before it
+    """
+    if previous is None:
+        return
+    for i in range(len(changes)):
+        if previous[i] != key[i]:
+            for j in range(i, len(changes)):
+                changes[j] += 1
+            return
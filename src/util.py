@@ -47,22 +47,50 @@ def to_varint(x: int) -> bytes:
 
     and returns a varint representation as a byte array
     """
-    result = bytearray()
-
-    first_7_bits = 0xfe00000000000000
-    requires_9_bytes = x & first_7_bits
-
-    # if any of the first 7 bits are filled, 9 bytes will be needed
-    first_shift_size = 8 if requires_9_bytes else 7
-    first_modulo = 256 if requires_9_bytes else 128
-
-    result.append(x % first_modulo)
-    x = x >> first_shift_size
+    result = bytearray(varint_size(x))
+    write_varint(result, 0, x)
+    return bytes(result)
 
-    while x > 0:
-        # pull first 7 bits, flip the first bit to signal carryover
-        byte = (x % 128) | 0x80
-        result.insert(0, byte)
-        x = x >> 7
+# varints hold 64 bit values, negative ones as two's complement
+MASK_64 = 0xffffffffffffffff
 
-    return bytes(result)
+def varint_size(x: int) -> int:
+    """
+    varint_size returns the number of bytes to_varint and write_varint use
+    for x, without encoding it
+    """
+    x &= MASK_64
+    if x > 0x00ffffffffffffff:
+        return 9
+    size = 1
+    while x > 0x7f:
+        x >>= 7
+        size += 1
+    return size
+
+def write_varint(buf: bytearray, offset: int, x: int) -> int:
+    """
+    write_varint encodes x in place into buf at offset, a bytearray or a
+    writable memoryview, and returns the offset after the last byte written
+    """
+    x &= MASK_64
+    if x <= 0x7f:
+        buf[offset] = x
+        return offset + 1
+
+    if x > 0x00ffffffffffffff:
+        # the ninth byte holds a full 8 bits
+        end = offset + 9
+        buf[end - 1] = x & 0xff
+        x >>= 8
+        last = end - 2
+    else:
+        end = offset + varint_size(x)
+        buf[end - 1] = x & 0x7f
+        x >>= 7
+        last = end - 2
+
+    for i in range(last, offset - 1, -1):
+        buf[i] = (x & 0x7f) | 0x80
+        x >>= 7
+    return end
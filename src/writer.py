@@ -0,0 +1,387 @@
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from src.backend.btree import BTree
+from src.backend.builder import BTreeBuilder
+from src.backend.record import Record, sort_key
+from src.backend.sorter import Descending, ExternalSorter
+from src.backend.text import LazyText
+from src.dbinfo import DBInfo, FileFormatVersion, SchemaFormat
+from src.sql.parser import CreateTable, parse_create_index, parse_create_table
+
+# sqlite never uses the page holding the byte at offset 2^30
+PENDING_BYTE = 0x40000000
+
+ASCII_LOWER = str.maketrans(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    'abcdefghijklmnopqrstuvwxyz',
+)
+
+# the collations an index can be built with, as functions of sort keys;
+# NOCASE folds ASCII letters only and RTRIM ignores trailing spaces
+COLLATIONS: Dict[str, Callable[[tuple], tuple]] = {
+    'BINARY': lambda key: key,
+    'NOCASE': lambda key: (2, str(key[1]).translate(ASCII_LOWER))
+    if key[0] == 2 else key,
+    'RTRIM': lambda key: (2, str(key[1]).rstrip(' ')) if key[0] == 2 else key,
+}
+
+# the sort key of NULL, NULLs in a unique index never clash
+NULL_KEY = sort_key(None)
+
+class WriterError(Exception):
+    pass
+
+def binary_key(entry: List[any], encoding: str = 'utf-8') -> tuple:
+    # text compares as the raw bytes the BINARY collation compares, in the
+    # database encoding, sparing LazyText comparisons in the sort; code
+    # points only order as the bytes of UTF-8 do
+    return tuple([
+        (2, value.raw) if isinstance(value, LazyText)
+        else (2, value.encode(encoding)) if isinstance(value, str)
+        else sort_key(value)
+        for value in entry
+    ])
+
+class DatabaseWriter:
+    """
+    DatabaseWriter makes whole-tree changes to a database file opened by
+    Database: building tables and rewriting sqlite_schema. New pages are
+    appended to the file, pages of replaced trees go on the freelist, and
+    commit updates the header so sqlite sees the change. There is no rollback
+    journal, so a crash part way through can leave the file corrupt, but the
+    writer holds an EXCLUSIVE lock from its creation until commit or close so
+    that no sqlite connection reads a half written file. WAL and auto-vacuum
+    databases are refused, their extra structures are not maintained.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.pager = db.pager
+        self.pager.begin_write()
+        try:
+            self.open()
+        except BaseException:
+            self.pager.end_write()
+            raise
+
+    def open(self):
+        self.dbinfo = DBInfo(self.pager.get_page(1))
+        self.usable_size = self.dbinfo.usable_size
+        self.encoding = self.db.encoding
+        self.schema_changed = False
+
+        if self.dbinfo.file_format_write_version == FileFormatVersion.WAL:
+            raise WriterError('cannot write to a database in WAL mode')
+        if self.dbinfo.largest_btree_root_page:
+            raise WriterError('cannot write to an auto-vacuum database')
+
+        self.size = self.dbinfo.db_size_in_pages
+        if self.dbinfo.version_valid_for != self.dbinfo.file_change_counter:
+            self.size = self.pager.num_pages()
+
+        self.pending_byte_page = PENDING_BYTE // self.pager.page_size + 1
+
+    def allocate(self) -> int:
+        self.size += 1
+        if self.size == self.pending_byte_page:
+            self.size += 1
+        return self.size
+
+    def encode(self, values: List[any]) -> bytes:
+        allow_constants = self.dbinfo.schema_format_number == SchemaFormat.FORMAT_4
+        return Record.from_values(values, allow_constants, self.encoding).to_bytes()
+
+    def tree_pages(self, root_page: int) -> List[int]:
+        """
+        tree_pages lists the pages of a tree other than its root, overflow
+        pages included
+        """
+        tree = BTree(self.pager, root_page, self.usable_size, self.encoding)
+        pages = []
+        for page_number, node in tree.pages():
+            if page_number != root_page:
+                pages.append(page_number)
+            if node.is_leaf() or not node.is_table():
+                for cell in node.cells:
+                    if getattr(cell, 'overflow_page', None) is not None:
+                        pages.extend(cell.load_overflow(self.pager, self.usable_size))
+        return pages
+
+    def write_table(
+        self,
+        root_page: int,
+        rows: Iterable[Tuple[int, List[any]]],
+        fill_factor: float = 1.0,
+    ) -> int:
+        """
+        write_table replaces the contents of the table rooted at root_page
+        with rows given in rowid order, freeing the pages of the old tree
+        """
+        old_pages = self.tree_pages(root_page)
+        self.build_table(root_page, rows, fill_factor)
+        self.free(old_pages)
+        return root_page
+
+    def build_table(
+        self,
+        root_page: int,
+        rows: Iterable[Tuple[int, List[any]]],
+        fill_factor: float = 1.0,
+    ):
+        builder = BTreeBuilder(
+            self.pager,
+            root_page,
+            self.allocate,
+            self.usable_size,
+            table=True,
+            fill_factor=fill_factor,
+        )
+        allow_constants = self.dbinfo.schema_format_number == SchemaFormat.FORMAT_4
+        for row_id, values in rows:
+            record = Record.from_values(values, allow_constants, self.encoding)
+            builder.add_record(record, row_id)
+        builder.finish()
+
+    def create_table(self, name: str, sql: str, rows: Iterable[List[any]]) -> int:
+        """
+        create_table writes a new table holding rows, numbered from 1, and
+        registers it in sqlite_schema. A WITHOUT ROWID table is written as
+        an index tree of its rows sorted by primary key.
+        """
+        create = parse_create_table(sql)
+        root_page = self.allocate()
+        if create.without_rowid:
+            self.build_clustered(root_page, create, rows)
+        else:
+            self.build_table(root_page, enumerate(rows, 1))
+        self.add_schema_entry(['table', name, name, root_page, sql])
+        return root_page
+
+    def build_clustered(
+        self,
+        root_page: int,
+        create: CreateTable,
+        rows: Iterable[List[any]],
+        fill_factor: float = 1.0,
+    ):
+        """
+        build_clustered writes the rows of a WITHOUT ROWID table, records
+        holding the primary key columns followed by the others, sorted by
+        primary key
+        """
+        if not create.primary_key:
+            raise WriterError(f'PRIMARY KEY missing on table {create.name}')
+        if not create.primary_key_plain:
+            raise WriterError('cannot write a WITHOUT ROWID table with a DESC or '
+                              'collated primary key')
+        if len(create.unique) > 1:
+            raise WriterError('cannot write a WITHOUT ROWID table with UNIQUE '
+                              'constraints')
+
+        names = [column.name.lower() for column in create.columns]
+        key = []
+        for name in create.primary_key:
+            if name.lower() not in names:
+                raise WriterError(f'no such column: {name}')
+            if names.index(name.lower()) not in key:
+                key.append(names.index(name.lower()))
+        order = key + [i for i in range(len(names)) if i not in key]
+
+        sorter = ExternalSorter(
+            lambda entry: binary_key(entry, self.encoding),
+            self.db.sort_memory,
+            self.pager.page_size,
+            self.encoding,
+        )
+        for values in rows:
+            values = list(values) + [None] * (len(names) - len(values))
+            sorter.add([values[i] for i in order])
+
+        key_names = ', '.join(f'{create.name}.{names[i]}' for i in key)
+        self.load_index(root_page, sorter, len(key), key_names, fill_factor, True)
+
+    def create_index(self, sql: str, fill_factor: float = 1.0) -> int:
+        """
+        create_index builds the index of a CREATE INDEX statement in one pass
+        over its table: the (key columns, rowid) entries, or the key columns
+        followed by the primary key for a WITHOUT ROWID table, are sorted,
+        spilling to disk past the sort memory of the database, and written
+        bottom up with leaves filled to fill_factor. The index is then
+        registered in sqlite_schema.
+        """
+        create = parse_create_index(sql)
+        if create.partial:
+            raise WriterError('partial indexes are not supported')
+        if self.db.schema.find(create.name) is not None:
+            raise WriterError(f'{create.name} already exists')
+        table = self.db.catalog.table(create.table)
+        if table.primary_index is not None and not table.primary_index.seekable:
+            raise WriterError(f'cannot index WITHOUT ROWID table {table.name} '
+                              'with a DESC or collated primary key')
+
+        positions = [table.column_index(column.name) for column in create.columns]
+        collations = []
+        for column in create.columns:
+            collation = (column.collation or 'BINARY').upper()
+            if collation not in COLLATIONS:
+                raise WriterError(f'no such collation sequence: {column.collation}')
+            collations.append(COLLATIONS[collation])
+        descending = [column.descending for column in create.columns]
+        width = len(positions)
+
+        if all(c is COLLATIONS['BINARY'] for c in collations) and not any(descending):
+            def key(entry: List[any]) -> tuple:
+                return binary_key(entry, self.encoding)
+        else:
+            def key(entry: List[any]) -> tuple:
+                parts = []
+                for value, collation, desc in zip(entry, collations, descending):
+                    part = collation(sort_key(value))
+                    parts.append(Descending(part) if desc else part)
+                parts.extend(sort_key(value) for value in entry[width:])
+                return tuple(parts)
+
+        sorter = ExternalSorter(
+            key,
+            self.db.sort_memory,
+            self.pager.page_size,
+            self.encoding,
+        )
+        # only the indexed columns are decoded, the rowid alias is stored as
+        # NULL in the record and taken from the rowid
+        stored = positions + table.extra_columns(positions)
+        decoded = sorted({p for p in stored if not table.is_rowid(p)})
+        tree = self.db.btree(table.root_page).reordered(table.record_positions())
+        for row_id, values in tree.scan(columns=decoded):
+            row = dict(zip(decoded, values))
+            sorter.add([row_id if table.is_rowid(p) else row[p] for p in stored])
+
+        root_page = self.allocate()
+        names = ', '.join(f'{table.name}.{column.name}' for column in create.columns)
+        self.load_index(
+            root_page,
+            sorter,
+            width,
+            names if create.unique else None,
+            fill_factor,
+        )
+
+        self.add_schema_entry([
+            'index',
+            create.name,
+            table.name,
+            root_page,
+            sql.strip().rstrip(';').rstrip(),
+        ])
+        return root_page
+
+    def load_index(
+        self,
+        root_page: int,
+        sorter: ExternalSorter,
+        width: int,
+        unique: str = None,
+        fill_factor: float = 1.0,
+        not_null: bool = False,
+    ):
+        """
+        load_index writes the sorted entries of sorter as an index tree
+        rooted at root_page. With unique, the names of the key columns, two
+        entries may not share their first width values unless one is NULL,
+        and with not_null none may be NULL.
+        """
+        # the sorter keeps entries encoded as records, which are the payloads
+        # of the index cells unless the schema format rules out the records
+        # sqlite uses for the integers 0 and 1
+        allow_constants = self.dbinfo.schema_format_number == SchemaFormat.FORMAT_4
+        builder = BTreeBuilder(
+            self.pager,
+            root_page,
+            self.allocate,
+            self.usable_size,
+            table=False,
+            fill_factor=fill_factor,
+        )
+        previous = None
+        records = sorter.records()
+        try:
+            for entry_key, record in records:
+                current = entry_key[:width]
+                has_null = any(
+                    getattr(part, 'key', part) == NULL_KEY for part in current
+                )
+                if not_null and has_null:
+                    raise WriterError(f'NOT NULL constraint failed: {unique}')
+                if unique is not None:
+                    if current == previous and not has_null:
+                        raise WriterError(f'UNIQUE constraint failed: {unique}')
+                    previous = current
+                if not allow_constants:
+                    record = self.encode(sorter.decode(record))
+                builder.add(record)
+        finally:
+            records.close()
+        builder.finish()
+
+    def add_schema_entry(self, values: List[any]):
+        tree = BTree(self.pager, 1, self.usable_size, self.encoding)
+        rows = list(tree.scan())
+        next_id = max((row_id for row_id, _ in rows), default=0) + 1
+        rows.append((next_id, values))
+        self.write_table(1, rows)
+        self.schema_changed = True
+
+    def free(self, pages: List[int]):
+        """
+        free puts pages on the freelist, as new trunk pages each listing as
+        many of the other pages as fit
+        """
+        # older sqlite versions reject trunks filled past usable_size / 4 - 8
+        per_trunk = self.usable_size // 4 - 8
+        while pages:
+            trunk, leaves = pages[0], pages[1:per_trunk + 1]
+            pages = pages[per_trunk + 1:]
+
+            data = bytearray(self.pager.page_size)
+            data[0:4] = self.dbinfo.first_freelist_trunk_page.to_bytes(4)
+            data[4:8] = len(leaves).to_bytes(4)
+            for i, leaf in enumerate(leaves):
+                data[8 + 4 * i:12 + 4 * i] = leaf.to_bytes(4)
+            self.pager.write_page(trunk, bytes(data))
+
+            self.dbinfo.first_freelist_trunk_page = trunk
+            self.dbinfo.num_freelist_pages += 1 + len(leaves)
+
+    def commit(self):
+        """
+        commit writes the database header, bumping the change counter and,
+        when sqlite_schema changed, the schema cookie so that connections
+        reload the schema
+        """
+        page = bytearray(self.pager.get_page(1))
+        self.dbinfo.file_change_counter += 1
+        self.dbinfo.version_valid_for = self.dbinfo.file_change_counter
+        self.dbinfo.db_size_in_pages = self.size
+        if self.schema_changed:
+            self.dbinfo.schema_cookie += 1
+        page[:100] = self.dbinfo.to_bytes()
+        self.pager.write_page(1, bytes(page))
+
+        # pages past the last one written are left as zeros by sqlite
+        if self.pager.num_pages() < self.size:
+            self.pager.write_page(self.size, bytes(self.pager.page_size))
+
+        self.close()
+
+        self.db.dbinfo = self.dbinfo
+        if self.schema_changed:
+            self.db.reload_schema()
+        self.schema_changed = False
+
+    def close(self):
+        """
+        close releases the write lock, changes not committed are left in the
+        file but unseen by sqlite, whose header still counts the old pages
+        """
+        if self.pager is not None:
+            self.pager.end_write()
+            self.pager = None
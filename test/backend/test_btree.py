@@ -0,0 +1,136 @@
+import os
+import unittest
+from unittest import TestCase
+
+from src.backend.predicate import Comparison, Prefix
+from src.backend.record import RecordView
+from src.database import Database
+from test.fixtures import create_database, series
+
+class TestBTree(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(a INTEGER PRIMARY KEY, b TEXT)',
+            'CREATE INDEX t_b ON t(b)',
+            series(1000) + \
+                "INSERT INTO t(b) SELECT printf('%04d', 1001 - value) FROM s",
+            "UPDATE t SET b = b || zeroblob(3000) WHERE a = 500",
+        ], page_size=1024)
+        self.db = Database(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_table_cells_in_order(self):
+        btree = self.db.btree(self.db.schema.find('t').rootpage)
+        cells = list(btree.cells())
+        self.assertEqual([cell.row_id for cell in cells], list(range(1, 1001)))
+        self.assertEqual(cells[0].record.values, [None, '1000'])
+        # the overflowing row is read in full
+        self.assertEqual(len(cells[499].record.values[1]), 3004)
+
+    def test_index_cells_in_order(self):
+        btree = self.db.btree(self.db.schema.find('t_b').rootpage)
+        keys = [cell.record.values for cell in btree.cells()]
+        self.assertEqual(len(keys), 1000)
+        self.assertEqual(keys[0], ['0001', 1000])
+        self.assertEqual(keys, sorted(keys))
+
+    def test_scan(self):
+        btree = self.db.btree(self.db.schema.find('t').rootpage)
+        rows = list(btree.scan(Prefix(1, '099') | Comparison(1, '=', '0005')))
+        self.assertEqual(
+            [row_id for row_id, _ in rows],
+            list(range(2, 12)) + [996],
+        )
+        self.assertEqual(rows[-1][1], [None, '0005'])
+
+        # only the requested columns are decoded
+        rows = list(btree.scan(Comparison(1, '<', '0003'), columns=[1]))
+        self.assertEqual(rows, [(999, ['0002']), (1000, ['0001'])])
+
+        # overflowing rows are scanned in full
+        rows = list(btree.scan(Prefix(1, '0501\x00')))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][0], 500)
+
+    def test_scan_index(self):
+        btree = self.db.btree(self.db.schema.find('t_b').rootpage)
+        rows = list(btree.scan(Comparison(0, '>=', '0998')))
+        self.assertEqual(rows, [
+            (None, ['0998', 3]),
+            (None, ['0999', 2]),
+            (None, ['1000', 1]),
+        ])
+
+    def test_scan_batches(self):
+        for name, predicate in (
+            ('t', None),
+            ('t', Comparison(1, '<', '0300')),
+            ('t_b', Comparison(0, '>=', '0400')),
+        ):
+            btree = self.db.btree(self.db.schema.find(name).rootpage)
+            batches = list(btree.scan_batches(predicate, columns=[0]))
+            self.assertEqual(
+                [row for batch in batches for row in batch],
+                list(btree.scan(predicate, columns=[0])),
+            )
+            self.assertTrue(all(batches))
+
+        # one view reads every row
+        views = []
+
+        class CountingView(RecordView):
+            __slots__ = ()
+
+            def __init__(self, *args):
+                views.append(self)
+                super().__init__(*args)
+
+        btree = self.db.btree(self.db.schema.find('t').rootpage)
+        btree.view_class = CountingView
+        rows = [row for batch in btree.scan_batches(Prefix(1, '05')) for row in batch]
+        self.assertEqual(len(rows), 100)
+        self.assertEqual(len(views), 1)
+
+        # a batch for each leaf
+        btree = self.db.btree(self.db.schema.find('t').rootpage)
+        self.assertEqual(
+            [len(batch) for batch in btree.scan_batches()],
+            [node.num_cells for _, node in btree.leaves()],
+        )
+
+    def test_pages(self):
+        btree = self.db.btree(self.db.schema.find('t').rootpage)
+        pages = list(btree.pages())
+        root_page, root = pages[0]
+        self.assertEqual(root_page, btree.root_page)
+        self.assertFalse(root.is_leaf())
+        self.assertEqual(len(set(p for p, _ in pages)), len(pages))
+        leaves = list(btree.leaves())
+        self.assertEqual(sum(node.num_cells for _, node in leaves), 1000)
+
+class TestBTreeEncoding(TestCase):
+    def test_utf16_database(self):
+        path = create_database([
+            'PRAGMA encoding = "UTF-16le"',
+            'CREATE TABLE t(a TEXT)',
+            "INSERT INTO t VALUES ('小战俘'), ('hello')",
+        ])
+        try:
+            db = Database(path)
+            self.assertEqual(db.encoding, 'utf-16-le')
+            self.assertEqual(db.schema.find('t').sql, 'CREATE TABLE t(a TEXT)')
+
+            cells = list(db.btree(db.schema.find('t').rootpage).cells())
+            values = [cell.record.values[0] for cell in cells]
+            self.assertEqual(values, ['小战俘', 'hello'])
+            self.assertEqual(values[0].raw, '小战俘'.encode('utf-16-le'))
+
+            # text is written back in the database encoding
+            self.assertEqual(cells[1].record.to_bytes(), cells[1].payload)
+        finally:
+            os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
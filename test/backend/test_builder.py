@@ -0,0 +1,95 @@
+import unittest
+from unittest import TestCase
+
+from src.backend.btree import BTree
+from src.backend.builder import BTreeBuilder
+from src.backend.pager import MemoryPager
+from src.backend.record import Record
+
+class TestBTreeBuilder(TestCase):
+    def setUp(self):
+        self.pager = MemoryPager(1024)
+        # page 1 is left alone, the trees are rooted at page 2
+        self.next_page = 2
+
+    def allocate(self) -> int:
+        self.next_page += 1
+        return self.next_page
+
+    def build(self, entries, table: bool = True, fill_factor: float = 1.0):
+        builder = BTreeBuilder(
+            self.pager, 2, self.allocate, 1024, table=table, fill_factor=fill_factor,
+        )
+        for values, row_id in entries:
+            payload = Record.from_values(values).to_bytes()
+            builder.add(payload, row_id)
+        builder.finish()
+        return builder, BTree(self.pager, 2, 1024)
+
+    def test_records(self):
+        rows = [(i, [i, f'row {i}', 'x' * (i % 700)]) for i in range(1, 2001)]
+        _, tree = self.build([(values, row_id) for row_id, values in rows])
+        expected = [self.pager.get_page(n) for n in range(2, self.next_page + 1)]
+
+        # records encoded straight into their pages give the same tree
+        self.pager = MemoryPager(1024)
+        self.next_page = 2
+        builder = BTreeBuilder(self.pager, 2, self.allocate, 1024)
+        for row_id, values in rows:
+            builder.add_record(Record.from_values(values), row_id)
+        builder.finish()
+        actual = [self.pager.get_page(n) for n in range(2, self.next_page + 1)]
+        self.assertEqual(actual, expected)
+
+    def test_empty_table(self):
+        _, tree = self.build([])
+        self.assertEqual(list(tree.scan()), [])
+
+    def test_table(self):
+        rows = [(i * 2, [i, f'row {i}', 'x' * (i % 50)]) for i in range(1, 3001)]
+        # a few rows spill into overflow chains
+        rows[10] = (22, [11, 'big', 'y' * 5000])
+        builder, tree = self.build([(values, row_id) for row_id, values in rows])
+
+        self.assertEqual(list(tree.scan()), rows)
+        self.assertEqual(tree.lookup(22)[2], 'y' * 5000)
+        self.assertIsNone(tree.lookup(23))
+        # more than two levels of interior pages
+        depth, node = 1, tree.node(2)
+        while not node.is_leaf():
+            node = tree.node(node.children()[0])
+            depth += 1
+        self.assertGreaterEqual(depth, 3)
+        self.assertEqual(builder.pages_written, self.next_page - 1)
+
+    def test_rowids_must_increase(self):
+        builder = BTreeBuilder(self.pager, 2, self.allocate, 1024)
+        builder.add(Record.from_values([1]).to_bytes(), 5)
+        with self.assertRaises(ValueError):
+            builder.add(Record.from_values([2]).to_bytes(), 5)
+
+    def test_index(self):
+        keys = sorted((f'key {i % 97:03d}', i) for i in range(1, 4001))
+        keys[5] = (keys[5][0] + 'z' * 3000, keys[5][1])
+        keys.sort()
+        _, tree = self.build([(list(key), None) for key in keys], table=False)
+
+        self.assertEqual([tuple(cell.record.values) for cell in tree.cells()], keys)
+        self.assertEqual(sum(1 for _ in tree.entries()), len(keys))
+
+    def test_fill_factor(self):
+        rows = [([i, 'value'], i) for i in range(1, 2001)]
+        _, tree = self.build(rows)
+        full = sum(1 for _ in tree.leaves())
+
+        self.pager = MemoryPager(1024)
+        self.next_page = 2
+        _, tree = self.build(rows, fill_factor=0.5)
+        self.assertEqual([row_id for row_id, _ in tree.scan()], list(range(1, 2001)))
+        self.assertGreater(sum(1 for _ in tree.leaves()), full * 1.8)
+
+        with self.assertRaises(ValueError):
+            BTreeBuilder(self.pager, 2, self.allocate, 1024, fill_factor=0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+import os
+import threading
+import unittest
+from unittest import TestCase
+
+from src.backend.btree import BTree
+from src.backend.cache import ARCCache, LRUCache, NodeCache, make_cache
+from src.backend.pager import MemoryPager, Pager
+from src.database import Database
+from test.fixtures import create_database, series
+
+LEAF = bytes([0x0d]) + bytes(15)
+INTERIOR = bytes([0x05]) + bytes(15)
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(3)
+        for page_number in range(2, 6):
+            cache.put(page_number, LEAF)
+        self.assertEqual(list(cache), [3, 4, 5])
+        cache.get(3)
+        cache.put(6, LEAF)
+        self.assertEqual(list(cache), [5, 3, 6])
+        cache.pop(5)
+        self.assertNotIn(5, cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_pinning(self):
+        cache = LRUCache(4, pin_fraction=0.5)
+        cache.put(1, LEAF)
+        cache.put(2, INTERIOR)
+        for page_number in range(10, 20):
+            cache.put(page_number, LEAF)
+        self.assertEqual(list(cache), [1, 2, 18, 19])
+
+        # a third pinned page overflows the region, the oldest is demoted
+        cache.put(3, INTERIOR)
+        self.assertEqual(list(cache), [2, 3, 19, 1])
+        cache.put(20, LEAF)
+        self.assertEqual(list(cache), [2, 3, 1, 20])
+
+class TestARCCache(TestCase):
+    def test_scan_resistance(self):
+        cache = ARCCache(8, pin_fraction=0)
+        hot = [100, 101, 102, 103]
+        for _ in range(2):
+            for page_number in hot:
+                if cache.get(page_number) is None:
+                    cache.put(page_number, LEAF)
+        for page_number in range(1000, 1100):
+            if cache.get(page_number) is None:
+                cache.put(page_number, LEAF)
+        self.assertTrue(all(page_number in cache for page_number in hot))
+        self.assertEqual(len(cache), 8)
+
+        lru = LRUCache(8)
+        for page_number in hot + hot + list(range(1000, 1100)):
+            if lru.get(page_number) is None:
+                lru.put(page_number, LEAF)
+        self.assertFalse(any(page_number in lru for page_number in hot))
+
+    def test_adapts(self):
+        cache = ARCCache(4, pin_fraction=0)
+        for page_number in (1, 2, 1, 2, 3, 4, 5, 6):
+            if cache.get(page_number) is None:
+                cache.put(page_number, LEAF)
+        self.assertEqual(cache.p, 0)
+        self.assertIn(3, cache.b1)
+        # 3 was evicted from t1 too early, so t1 is allowed to grow
+        cache.put(3, LEAF)
+        self.assertEqual(cache.p, 1)
+        self.assertIn(3, cache.t2)
+        self.assertLessEqual(len(cache), 4)
+
+    def test_pins_interior_pages(self):
+        cache = ARCCache(8)
+        cache.put(1, LEAF)
+        cache.put(2, INTERIOR)
+        for page_number in range(10, 100):
+            cache.put(page_number, LEAF)
+        self.assertIn(1, cache)
+        self.assertIn(2, cache)
+        self.assertEqual(len(cache), 8)
+        self.assertIs(cache.peek(2), INTERIOR)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_make_cache(self):
+        self.assertIsInstance(make_cache('arc', 10), ARCCache)
+        self.assertIsInstance(make_cache(LRUCache, 10), LRUCache)
+        with self.assertRaises(ValueError):
+            make_cache('clock', 10)
+
+class TestMixedWorkload(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(a INTEGER, b TEXT)',
+            series(20000) + "INSERT INTO t SELECT value, printf('%.50d', value) FROM s",
+        ], page_size=1024)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def lookup_misses(self, policy: str) -> int:
+        pager = Pager(self.path, 1024, cache_size=64, cache_policy=policy)
+        tree = BTree(pager, 2, 1024)
+        keys = range(1, 20000, 97)
+        for row_id in keys:
+            tree.lookup(row_id)
+
+        # a scan between two rounds of lookups
+        for _ in tree.scan():
+            pass
+        misses = pager.misses
+        for row_id in keys:
+            tree.lookup(row_id)
+        misses = pager.misses - misses
+        pager.close()
+        return misses
+
+    def test_interior_pages_survive_scan(self):
+        lru, arc = self.lookup_misses('lru'), self.lookup_misses('arc')
+        # the lookups only miss on leaves once interior pages stay cached
+        self.assertLess(arc, lru)
+        self.assertLessEqual(arc, len(range(1, 20000, 97)))
+
+class TestNodeCache(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(a INTEGER PRIMARY KEY, b TEXT)',
+            series(3000) + "INSERT INTO t(b) SELECT 'row ' || value FROM s",
+        ], page_size=1024)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def leaf(self, tree: BTree) -> int:
+        return next(page_number for page_number, _ in tree.leaves())
+
+    def test_hits(self):
+        db = Database(self.path)
+        cache = db.pager.node_cache
+        tree = db.btree(db.catalog.table('t').root_page)
+        for row_id in range(1, 3001, 50):
+            self.assertEqual(tree.lookup(row_id), [None, f'row {row_id}'])
+        hits, misses = cache.hits, cache.misses
+        for row_id in range(1, 3001, 50):
+            self.assertEqual(tree.lookup(row_id), [None, f'row {row_id}'])
+        # the second round parses nothing
+        self.assertEqual(cache.misses, misses)
+        self.assertEqual(cache.hits - hits, 60 * 2)
+        leaf = self.leaf(tree)
+        self.assertIs(tree.node(leaf), tree.node(leaf))
+        db.close()
+
+        db = Database(self.path, node_cache_size=0)
+        self.assertIsNone(db.pager.node_cache)
+        db.close()
+
+    def test_write_invalidates(self):
+        pager = Pager(self.path, 1024)
+        pager.node_cache = NodeCache()
+        tree = BTree(pager, 2, 1024)
+        leaf = self.leaf(tree)
+        node = tree.node(leaf)
+        self.assertGreater(node.num_cells, 0)
+
+        # an empty leaf
+        page = bytearray(1024)
+        page[0], page[5:7] = 0x0d, (1024).to_bytes(2)
+        pager.write_page(leaf, bytes(page))
+        self.assertEqual(pager.node_cache.invalidations, 1)
+        self.assertEqual(tree.node(leaf).num_cells, 0)
+
+        # a snapshot reader parses the page as it was
+        pager.node_cache.clear()
+        pager.begin_read()
+        try:
+            tree.node(leaf)
+            writer = threading.Thread(target=lambda: pager.write_page(leaf, node.data))
+            writer.start()
+            writer.join()
+            self.assertEqual(tree.node(leaf).num_cells, 0)
+        finally:
+            pager.end_read()
+        self.assertEqual(tree.node(leaf).num_cells, node.num_cells)
+        pager.close()
+
+    def test_memory_pager(self):
+        pager = MemoryPager(1024).load(self.path)
+        pager.node_cache = NodeCache()
+        tree = BTree(pager, 2, 1024)
+        leaf = self.leaf(tree)
+        node = tree.node(leaf)
+        snapshot = pager.snapshot()
+        # pages are written in place, so the write must drop the node
+        pager.write_page(leaf, b'\x0d' + bytes(4) + (1024).to_bytes(2))
+        self.assertEqual(tree.node(leaf).num_cells, 0)
+        self.assertEqual(BTree(snapshot, 2, 1024).node(leaf).num_cells, node.num_cells)
+        snapshot.release()
+
+    def test_budget(self):
+        db = Database(self.path, node_cache_size=8 * 1024)
+        cache = db.pager.node_cache
+        for _ in db.execute('SELECT * FROM t'):
+            pass
+        self.assertGreater(cache.evictions, 0)
+        self.assertLessEqual(cache.size, cache.budget)
+        self.assertGreater(len(cache), 1)
+        db.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
 import unittest
 from unittest import TestCase
 
-from src.backend.cell import TableLeafCell
+from src.backend.cell import (
+    IndexInteriorCell,
+    TableInteriorCell,
+    TableLeafCell,
+    local_payload_size,
+)
+from src.backend.pager import MemoryPager
 
 class TestCell(TestCase):
     def test_table_leaf_cell(self):
@@ -16,6 +22,63 @@ class TestCell(TestCase):
         self.assertEqual(cell.payload, data[2:])
         self.assertEqual(cell.cursor, 8)
         self.assertEqual(cell.to_bytes(), data)
+        self.assertFalse(cell.has_overflow())
+        # the payload is read from the page rather than kept as a copy
+        self.assertIs(cell.record.data, data)
+        self.assertFalse(hasattr(cell, '__dict__'))
+
+    def test_local_payload_size(self):
+        # fits on a 4096 byte page
+        self.assertEqual(local_payload_size(4061, 4096, True), 4061)
+        self.assertEqual(local_payload_size(1002, 4096, False), 1002)
+        # spills, keeping the minimum local size
+        self.assertEqual(local_payload_size(4062, 4096, True), 489)
+        # spills, keeping enough to fill the last overflow page exactly
+        self.assertEqual(local_payload_size(4092 + 600, 4096, True), 600)
+
+    def test_table_leaf_cell_overflow(self):
+        usable_size = 512
+        text = bytes(range(256)) * 4
+        payload = bytes([0x03, 0x90, 0x0c]) + text
+        local_size = local_payload_size(len(payload), usable_size, True)
+
+        pager = MemoryPager(usable_size)
+        overflow = payload[local_size:]
+        pager.write_page(2, (3).to_bytes(4) + overflow[:508])
+        pager.write_page(3, (0).to_bytes(4) + overflow[508:])
+
+        data = bytes([0x88, 0x03, 0x07]) + payload[:local_size] + (2).to_bytes(4)
+        cell = TableLeafCell(data, 0, usable_size)
+        self.assertEqual(cell.payload_size, 1027)
+        self.assertEqual(cell.row_id, 7)
+        self.assertTrue(cell.has_overflow())
+        self.assertEqual(cell.overflow_page, 2)
+        self.assertIsNone(cell.record)
+        self.assertEqual(cell.cursor, len(data))
+        self.assertEqual(cell.to_bytes(), data)
+
+        self.assertEqual(cell.load_overflow(pager, usable_size), [2, 3])
+        self.assertEqual(cell.record.values, [text])
+
+    def test_table_interior_cell(self):
+        data = bytes([0x00, 0x00, 0x00, 0x05, 0x81, 0x00])
+        cell = TableInteriorCell(data, 0)
+        self.assertEqual(cell.left_child, 5)
+        self.assertEqual(cell.row_id, 128)
+        self.assertEqual(cell.cursor, 6)
+        self.assertEqual(cell.to_bytes(), data)
+
+    def test_index_interior_cell(self):
+        data = bytes([
+            0x00, 0x00, 0x00, 0x09, # left child
+            0x05, # payload size
+            0x03, 0x0f, 0x01, 0x41, 0x02, # payload
+        ])
+        cell = IndexInteriorCell(data, 0, 4096)
+        self.assertEqual(cell.left_child, 9)
+        self.assertEqual(cell.payload_size, 5)
+        self.assertEqual(cell.record.values, ['A', 2])
+        self.assertEqual(cell.to_bytes(), data)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,175 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+
+from src.backend.compression import (
+    STORED,
+    CompressedPager,
+    compress_file,
+    decompress_file,
+    is_compressed,
+)
+from src.backend.metrics import Metrics
+from src.database import Database
+from test.fixtures import create_database, series
+
+class TestCompressedPager(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+            series(2000) + "INSERT INTO t(a, b) SELECT value % 10, "
+            "'some repetitive text ' || value FROM s",
+        ], page_size=1024)
+        self.directory = tempfile.mkdtemp()
+        self.compressed = os.path.join(self.directory, 'db.zpages')
+
+    def tearDown(self):
+        os.remove(self.path)
+        shutil.rmtree(self.directory)
+
+    def read(self, path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        for codec in ('zlib', 'lzma'):
+            with self.subTest(codec=codec):
+                pager = compress_file(self.path, self.compressed, codec, 1)
+                self.assertEqual(pager.num_pages(), os.path.getsize(self.path) // 1024)
+                pager.close()
+                self.assertTrue(is_compressed(self.compressed))
+                self.assertLess(os.path.getsize(self.compressed),
+                                os.path.getsize(self.path) // 2)
+
+                plain = os.path.join(self.directory, 'plain.db')
+                decompress_file(self.compressed, plain)
+                self.assertEqual(self.read(plain), self.read(self.path))
+
+    def test_sqlite_refuses_file(self):
+        compress_file(self.path, self.compressed).close()
+        connection = sqlite3.connect(self.compressed)
+        with self.assertRaises(sqlite3.DatabaseError):
+            connection.execute('SELECT * FROM t').fetchall()
+        connection.close()
+
+    def test_queries(self):
+        compress_file(self.path, self.compressed).close()
+        db = Database(self.compressed)
+        self.assertIsInstance(db.pager, CompressedPager)
+        connection = sqlite3.connect(self.path)
+        for sql in (
+            'SELECT * FROM t WHERE a = 3',
+            "SELECT id FROM t WHERE b LIKE '%99'",
+            'SELECT count(*) FROM t',
+        ):
+            self.assertEqual(
+                sorted(db.execute(sql)),
+                sorted(connection.execute(sql).fetchall()),
+                sql,
+            )
+        connection.close()
+        self.assertGreater(db.pager.pages_decompressed, 0)
+        self.assertLess(db.pager.bytes_read, os.path.getsize(self.path))
+        db.close()
+
+    def test_metrics(self):
+        compress_file(self.path, self.compressed).close()
+        metrics = Metrics()
+        db = Database(self.compressed, metrics=metrics)
+        self.assertIsInstance(db.pager, CompressedPager)
+        self.assertEqual(len(list(db.execute('SELECT * FROM t'))), 2000)
+        totals = metrics.totals
+        self.assertGreater(totals.pages_read, 0)
+        self.assertGreater(totals.cache_misses, 0)
+        self.assertEqual(totals.pages_read, totals.cache_hits + totals.cache_misses)
+        self.assertIn('sqlite_pages_read_total', metrics.to_prometheus())
+        db.close()
+
+        with self.assertRaises(ValueError):
+            Database(self.compressed, in_memory=True)
+
+    def test_writes(self):
+        compress_file(self.path, self.compressed).close()
+        db = Database(self.compressed)
+        db.create_index('CREATE INDEX t_a ON t(a)')
+        db.close()
+
+        plain = os.path.join(self.directory, 'plain.db')
+        decompress_file(self.compressed, plain)
+        connection = sqlite3.connect(plain)
+        self.assertEqual(connection.execute('PRAGMA integrity_check').fetchall(),
+                         [('ok',)])
+        self.assertEqual(
+            connection.execute('SELECT count(*) FROM t INDEXED BY t_a WHERE a = 3')
+            .fetchone(),
+            (200,),
+        )
+        connection.close()
+
+    def test_extents(self):
+        pager = CompressedPager.create(self.compressed, 1024, cache_size=0)
+        pager.write_page(3, b'x' * 1024)
+        self.assertEqual(pager.num_pages(), 3)
+        # pages skipped over are zeros and take no space
+        self.assertEqual(pager.get_page(1), bytes(1024))
+        self.assertEqual(list(pager.lengths[:2]), [0, 0])
+
+        # a page compressing no smaller is rewritten in place, a larger one
+        # is appended
+        size = os.path.getsize(self.compressed)
+        pager.write_page(3, b'y' * 1024)
+        self.assertEqual(os.path.getsize(self.compressed), size)
+        noise = os.urandom(1024)
+        pager.write_page(3, noise)
+        self.assertEqual(pager.get_page(3), noise)
+        self.assertGreater(os.path.getsize(self.compressed), size)
+
+        # a short write keeps the rest of the page
+        pager.write_page(3, b'z' * 10)
+        self.assertEqual(pager.get_page(3), b'z' * 10 + noise[10:])
+        pager.close()
+
+        reopened = CompressedPager(self.compressed)
+        self.assertEqual(reopened.num_pages(), 3)
+        self.assertEqual(reopened.get_page(3), b'z' * 10 + noise[10:])
+        reopened.close()
+
+    def test_concurrent_writes(self):
+        pager = CompressedPager.create(self.compressed, 1024, cache_size=0)
+        pages = {}
+
+        def write_pages(offset: int):
+            for page_number in range(offset + 1, 1201, 8):
+                # half the pages compress, the rest are stored as they are
+                data = os.urandom(1024 if page_number % 2 else 64).ljust(1024, b'p')
+                pages[page_number] = data
+                pager.write_page(page_number, data)
+
+        threads = [
+            threading.Thread(target=write_pages, args=(offset,))
+            for offset in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pager.close()
+
+        reopened = CompressedPager(self.compressed, cache_size=0)
+        self.assertEqual(reopened.num_pages(), 1200)
+        for page_number in range(1, 1201):
+            self.assertEqual(reopened.get_page(page_number), pages[page_number])
+        extents = sorted(
+            (offset, length & ~STORED)
+            for offset, length in zip(reopened.offsets, reopened.lengths)
+        )
+        for (offset, length), (following, _) in zip(extents, extents[1:]):
+            self.assertLessEqual(offset + length, following)
+        reopened.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import threading
+import unittest
+from unittest import TestCase
+
+from src.backend.btree import BTree
+from src.backend.metrics import (
+    Histogram,
+    InstrumentedBTree,
+    InstrumentedPager,
+    Metrics,
+)
+from src.backend.pager import Pager
+from src.database import Database
+from test.fixtures import create_database, series
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+            series(500) + "INSERT INTO t(a, b) SELECT value % 10, "
+            "printf('%.*c', 1500 * (value % 100 = 0), 'x') FROM s",
+        ], page_size=1024)
+        self.metrics = Metrics(timing=True)
+        self.db = Database(self.path, metrics=self.metrics)
+
+    def tearDown(self):
+        self.db.close()
+        os.remove(self.path)
+
+    def test_disabled(self):
+        db = Database(self.path)
+        self.assertIs(type(db.pager), Pager)
+        self.assertIs(type(db.btree(1)), BTree)
+        db.close()
+
+    def test_query_stats(self):
+        self.assertIsInstance(self.db.pager, InstrumentedPager)
+        self.assertIsInstance(self.db.btree(1), InstrumentedBTree)
+
+        statement = self.db.prepare('SELECT b FROM t WHERE a = 0')
+        rows = list(statement.execute())
+        self.assertEqual(len(rows), 50)
+
+        stats = statement.stats
+        self.assertEqual(stats.cells_parsed, 500)
+        # the predicate reads a from every row, b is decoded for the matches
+        self.assertEqual(stats.columns_decoded, 550)
+        # five rows spill their 1500 byte value onto an overflow page
+        self.assertEqual(stats.overflow_pages, 5)
+        self.assertEqual(stats.pages_read, stats.cache_hits + stats.cache_misses)
+        self.assertEqual(stats.bytes_read, stats.cache_misses * 1024)
+        self.assertEqual(stats.pages_written, 0)
+
+        # a second run finds its pages in the cache
+        list(statement.execute())
+        self.assertEqual(statement.stats.cache_misses, 0)
+        self.assertEqual(statement.stats.cache_hits, stats.pages_read)
+
+        self.assertEqual(self.metrics.queries, 2)
+        self.assertEqual(self.metrics.totals.timings['query'].count, 2)
+
+    def test_unfinished_query(self):
+        statement = self.db.prepare('SELECT id FROM t')
+        rows = statement.execute()
+        next(rows)
+        rows.close()
+        self.assertEqual(self.metrics.queries, 1)
+        self.assertGreater(statement.stats.cells_parsed, 0)
+
+    def test_decode_paths(self):
+        tree = self.db.btree(self.db.schema.find('t').rootpage)
+
+        # views decode the columns asked for
+        before = self.metrics.totals.columns_decoded
+        self.assertEqual(len(list(tree.scan(columns=[1]))), 500)
+        self.assertEqual(self.metrics.totals.columns_decoded - before, 500)
+
+        # cells decode their records in full, overflowing ones included
+        before = self.metrics.totals.columns_decoded
+        cells = list(tree.cells())
+        self.assertEqual(len(cells), 500)
+        self.assertEqual(
+            self.metrics.totals.columns_decoded - before,
+            sum(len(cell.record.values) for cell in cells),
+        )
+        self.assertEqual(sum(len(cell.record.values) for cell in cells), 1500)
+
+    def test_prometheus(self):
+        list(self.db.execute('SELECT count(*) FROM t'))
+        text = self.metrics.to_prometheus()
+        lines = text.splitlines()
+
+        self.assertIn('# TYPE sqlite_pages_read_total counter', lines)
+        self.assertIn('sqlite_queries_total 1', lines)
+        self.assertIn('# TYPE sqlite_query_seconds histogram', lines)
+        self.assertIn('sqlite_query_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('sqlite_query_seconds_count 1', lines)
+        for line in lines:
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                float(value)
+
+    def test_threads(self):
+        # a cache of four pages, so that threads miss while others hit
+        pager = InstrumentedPager(self.path, 1024, cache_size=4, metrics=self.metrics)
+        before = self.metrics.totals.as_dict()
+
+        def read_pages(offset: int):
+            for i in range(2000):
+                pager.get_page(1 + (i * 7 + offset) % 20)
+
+        threads = [
+            threading.Thread(target=read_pages, args=(offset,))
+            for offset in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pager.close()
+
+        # counts made by racing threads outside of a query are all kept
+        totals = self.metrics.totals
+        self.assertEqual(totals.pages_read - before['pages_read'], 16000)
+        self.assertEqual(
+            totals.cache_hits + totals.cache_misses
+            - before['cache_hits'] - before['cache_misses'],
+            16000,
+        )
+        self.assertIn(
+            f'sqlite_pages_read_total {totals.pages_read}',
+            self.metrics.to_prometheus(),
+        )
+
+    def test_histogram(self):
+        histogram = Histogram((1.0, 2.0))
+        for value in (0.5, 1.0, 1.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(
+            list(histogram.cumulative()),
+            [('1.0', 2), ('2.0', 3), ('+Inf', 4)],
+        )
+        self.assertEqual(histogram.sum, 6.0)
+
+if __name__ == '__main__':
+    unittest.main()
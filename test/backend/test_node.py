@@ -92,7 +92,7 @@ class TestNode(TestCase):
             Column(ColumnType.TEXT, 4),
             Column(ColumnType.TEXT, 4),
             Column(ColumnType.TINYINT),
-            Column(ColumnType.TEXT, 44),
+            Column(ColumnType.TEXT, 48),
         ])
         self.assertEqual(
             cell.record.values,
@@ -0,0 +1,426 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import unittest
+from unittest import TestCase
+
+from src.backend.lock import BusyError, HotJournalError, LockLevel
+from src.backend.metrics import Metrics
+from src.backend.pager import MemoryPager, OpenFile, Pager
+from src.database import Database
+from test.fixtures import create_database, series
+
+class TestPager(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t (a INTEGER, b TEXT)',
+            f'{series(2000)} INSERT INTO t SELECT value, "row " || value FROM s',
+        ], page_size=1024)
+        self.pager = Pager(self.path, 1024)
+
+    def tearDown(self):
+        self.pager.close()
+        os.remove(self.path)
+
+    def read_file(self, page_number: int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek((page_number - 1) * 1024)
+            return f.read(1024)
+
+    def test_cache_hits(self):
+        first = self.pager.get_page(2)
+        self.assertEqual(first, self.read_file(2))
+        self.assertIs(self.pager.get_page(2), first)
+        self.assertEqual((self.pager.hits, self.pager.misses), (1, 1))
+
+    def test_cache_size(self):
+        pager = Pager(self.path, 1024, cache_size=4)
+        for page_number in range(1, 11):
+            pager.get_page(page_number)
+        self.assertEqual(list(pager.cache), [7, 8, 9, 10])
+        pager.close()
+
+    def test_threads(self):
+        num_pages = self.pager.num_pages()
+        expected = {n: self.read_file(n) for n in range(1, num_pages + 1)}
+        errors = []
+
+        def read(offset: int):
+            for i in range(500):
+                page_number = (i * 7 + offset) % num_pages + 1
+                if self.pager.get_page(page_number) != expected[page_number]:
+                    errors.append(page_number)
+
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # each page was read from the file once
+        self.assertEqual(self.pager.misses, num_pages)
+
+    def test_shared_file(self):
+        other = Pager(self.path, 1024)
+        self.assertIs(other.open(), self.pager.open())
+        other.close()
+        # the descriptor stays open for the remaining pager
+        self.assertEqual(self.pager.get_page(1)[:16], b'SQLite format 3\0')
+
+    def test_write_discards_other_pagers(self):
+        other = Pager(self.path, 4096)
+        expected = b''.join(self.read_file(n) for n in range(1, 5))
+        self.assertEqual(other.get_page(1), expected)
+        self.pager.write_page(3, bytes(1024))
+        self.assertEqual(other.get_page(1)[2048:3072], bytes(1024))
+        other.close()
+
+    def test_external_change(self):
+        before = self.pager.get_page(1)
+        connection = sqlite3.connect(self.path)
+        connection.execute('UPDATE t SET b = "changed" WHERE a = 1')
+        connection.commit()
+        connection.close()
+
+        after = self.pager.get_page(1)
+        self.assertNotEqual(before[24:28], after[24:28])
+        self.assertEqual(after, self.read_file(1))
+
+    # POSIX locks only conflict between processes, sqlite runs in a child
+
+    def run_sqlite(self, sql: str) -> str:
+        script = (
+            'import sqlite3, sys\n'
+            'connection = sqlite3.connect(sys.argv[1], timeout=0)\n'
+            'try:\n'
+            '    connection.execute(sys.argv[2]).fetchall()\n'
+            '    connection.commit()\n'
+            '    print("ok")\n'
+            'except sqlite3.OperationalError as e:\n'
+            '    print(e)\n'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script, self.path, sql],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.strip()
+
+    def test_sqlite_blocked_by_reader(self):
+        self.pager.begin_read()
+        try:
+            self.assertEqual(self.run_sqlite('SELECT count(*) FROM t'), 'ok')
+            self.assertEqual(self.run_sqlite('DELETE FROM t'), 'database is locked')
+        finally:
+            self.pager.end_read()
+        self.assertEqual(self.run_sqlite('DELETE FROM t'), 'ok')
+
+    def test_sqlite_blocked_by_writer(self):
+        self.pager.begin_write()
+        try:
+            self.assertEqual(
+                self.run_sqlite('SELECT count(*) FROM t'),
+                'database is locked',
+            )
+        finally:
+            self.pager.end_write()
+        self.assertEqual(self.run_sqlite('SELECT count(*) FROM t'), 'ok')
+
+    def test_blocked_by_sqlite_writer(self):
+        script = (
+            'import sqlite3, sys\n'
+            'connection = sqlite3.connect(sys.argv[1], isolation_level=None)\n'
+            'connection.execute("BEGIN EXCLUSIVE")\n'
+            'print("locked", flush=True)\n'
+            'sys.stdin.readline()\n'
+            'connection.execute("COMMIT")\n'
+        )
+        child = subprocess.Popen(
+            [sys.executable, '-c', script, self.path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            self.assertEqual(child.stdout.readline().strip(), 'locked')
+            self.pager.open().lock.busy_timeout = 0.05
+            with self.assertRaises(BusyError):
+                self.pager.begin_read()
+            with self.assertRaises(BusyError):
+                self.pager.get_page(1)
+        finally:
+            child.communicate('\n')
+        self.assertEqual(self.pager.get_page(1)[:16], b'SQLite format 3\0')
+
+    def test_hot_journal(self):
+        # a writer dying mid transaction, having spilled pages to the file
+        script = (
+            'import os, sqlite3, sys\n'
+            'connection = sqlite3.connect(sys.argv[1], isolation_level=None)\n'
+            'connection.execute("PRAGMA cache_size = 1")\n'
+            'connection.execute("BEGIN")\n'
+            'connection.execute("UPDATE t SET b = b || b")\n'
+            'os._exit(0)\n'
+        )
+        subprocess.run([sys.executable, '-c', script, self.path], check=True)
+        self.assertTrue(os.path.exists(self.path + '-journal'))
+        with self.assertRaises(HotJournalError):
+            self.pager.get_page(1)
+        with self.assertRaises(HotJournalError):
+            self.pager.begin_read()
+        # the lock is let go, sqlite can roll the journal back
+        self.assertEqual(self.run_sqlite('SELECT count(*) FROM t'), 'ok')
+        self.assertFalse(os.path.exists(self.path + '-journal'))
+        self.assertEqual(self.pager.get_page(1), self.read_file(1))
+
+        # a zeroed journal is not hot
+        with open(self.path + '-journal', 'wb') as f:
+            f.write(b'\0' * 512)
+        self.pager.begin_read()
+        self.pager.end_read()
+
+    def test_live_journal(self):
+        # the journal of a writer still holding RESERVED is not hot
+        script = (
+            'import sqlite3, sys\n'
+            'connection = sqlite3.connect(sys.argv[1], isolation_level=None)\n'
+            'connection.execute("BEGIN")\n'
+            'connection.execute("UPDATE t SET b = \'changed\' WHERE a = 1")\n'
+            'print("locked", flush=True)\n'
+            'sys.stdin.readline()\n'
+            'connection.execute("COMMIT")\n'
+        )
+        child = subprocess.Popen(
+            [sys.executable, '-c', script, self.path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            self.assertEqual(child.stdout.readline().strip(), 'locked')
+            self.assertTrue(os.path.exists(self.path + '-journal'))
+            self.assertEqual(self.pager.get_page(1), self.read_file(1))
+        finally:
+            child.communicate('\n')
+
+    def test_read_outlives_other_transaction(self):
+        # another thread's transaction ends while a read outside of one is
+        # at the file, which must still be read under the shared lock
+        reading, ended = threading.Event(), threading.Event()
+        levels = []
+        read_page = self.pager.read_page
+
+        def paused_read(file, page_number, version):
+            reading.set()
+            ended.wait()
+            levels.append(file.lock.level)
+            return read_page(file, page_number, version)
+
+        self.pager.begin_read()
+        self.pager.read_page = paused_read
+        thread = threading.Thread(target=self.pager.get_page, args=(2,))
+        thread.start()
+        reading.wait()
+        self.pager.end_read()
+        ended.set()
+        thread.join()
+        self.assertEqual(levels, [LockLevel.SHARED])
+        self.assertEqual(self.pager.open().lock.level, LockLevel.NONE)
+
+    def in_thread(self, target):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(target()))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_snapshot(self):
+        original = self.pager.get_page(3)
+        self.pager.begin_read()
+        try:
+            # the writer is not held up by the reader
+            self.in_thread(lambda: self.pager.write_page(3, bytes(1024)))
+            self.assertEqual(self.pager.get_page(3), original)
+            self.assertEqual(self.pager.get_pages(2, 2)[1], original)
+            # readers beginning later see the write
+            latest = self.in_thread(lambda: self.pager.get_page(3))
+            self.assertEqual(latest, bytes(1024))
+        finally:
+            self.pager.end_read()
+
+        self.assertEqual(self.pager.get_page(3), bytes(1024))
+        self.assertEqual(self.pager.versions, {})
+
+    def test_snapshot_per_reader(self):
+        original = self.pager.get_page(3)
+        self.pager.begin_read()
+        self.pager.write_page(3, b'a' * 1024)
+        second = threading.Event()
+        done = threading.Event()
+        seen = []
+
+        def read():
+            self.pager.begin_read()
+            second.set()
+            done.wait()
+            seen.append(self.pager.get_page(3))
+            self.pager.end_read()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        second.wait()
+        self.pager.write_page(3, b'b' * 1024)
+        self.assertEqual(self.pager.get_page(3), original)
+        done.set()
+        thread.join()
+        self.pager.end_read()
+
+        self.assertEqual(seen, [b'a' * 1024])
+        self.assertEqual(self.pager.get_page(3), b'b' * 1024)
+        self.assertEqual(self.pager.versions, {})
+
+    def test_write_transaction(self):
+        original = self.pager.get_page(3)
+        self.pager.begin_write()
+        self.pager.write_page(3, b'a' * 1024)
+        self.pager.write_page(3, b'b' * 1024)
+        # the writer reads its own writes, readers the committed pages
+        self.assertEqual(self.pager.get_page(3), b'b' * 1024)
+
+        def read():
+            self.pager.begin_read()
+            try:
+                return self.pager.get_page(3)
+            finally:
+                self.pager.end_read()
+
+        self.assertEqual(self.in_thread(read), original)
+        self.pager.end_write()
+        self.assertEqual(self.in_thread(read), b'b' * 1024)
+        self.assertEqual(self.pager.versions, {})
+
+    def test_consistent_snapshots(self):
+        pages = range(2, 12)
+        for page_number in pages:
+            self.pager.write_page(page_number, bytes(1024))
+        stop = threading.Event()
+        errors = []
+
+        def write():
+            for version in range(1, 50):
+                self.pager.begin_write()
+                for page_number in pages:
+                    self.pager.write_page(page_number, bytes([version]) * 1024)
+                self.pager.end_write()
+            stop.set()
+
+        def read():
+            while not stop.is_set():
+                self.pager.begin_read()
+                seen = {self.pager.get_page(n)[0] for n in pages}
+                self.pager.end_read()
+                if len(seen) != 1:
+                    errors.append(seen)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(self.pager.versions, {})
+
+    def test_close(self):
+        file = self.pager.open()
+        self.pager.close()
+        self.assertNotIn(file.key, OpenFile.registry)
+
+class TestMemoryPager(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t (a INTEGER, b BLOB)',
+            f'{series(500)} INSERT INTO t SELECT value, randomblob(value % 5) FROM s',
+        ], page_size=1024)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_load_and_dump(self):
+        pager = MemoryPager(1024).load(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(pager.num_pages(), len(data) // 1024)
+        self.assertEqual(pager.get_page(2), data[1024:2048])
+        self.assertIsInstance(pager.get_page(2), memoryview)
+
+        copy = self.path + '.copy'
+        pager.dump(copy)
+        with open(copy, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        os.remove(copy)
+
+    def test_growth(self):
+        pager = MemoryPager(512)
+        self.assertEqual(pager.get_page(3), bytes(512))
+        self.assertEqual(pager.num_pages(), 3)
+        pager.write_page(10, b'\x01' * 100)
+        self.assertEqual(pager.num_pages(), 10)
+        self.assertEqual(pager.get_page(10), b'\x01' * 100 + bytes(412))
+        self.assertEqual(pager.get_page(3), bytes(512))
+
+    def test_snapshot(self):
+        pager = MemoryPager(1024).load(self.path)
+        before = bytes(pager.get_page(2))
+        snapshot = pager.snapshot()
+        self.assertIs(snapshot.arena, pager.arena)
+
+        pager.write_page(2, bytes(1024))
+        self.assertIsNot(snapshot.arena, pager.arena)
+        self.assertEqual(snapshot.get_page(2), before)
+        self.assertEqual(pager.get_page(2), bytes(1024))
+
+        # once the pager has its own copy the snapshot writes in place
+        arena = snapshot.arena
+        snapshot.write_page(3, bytes(1024))
+        self.assertIs(snapshot.arena, arena)
+
+    def test_in_memory_database(self):
+        db = Database(self.path, in_memory=True)
+        self.assertIsInstance(db.pager, MemoryPager)
+        connection = sqlite3.connect(self.path)
+        for sql in (
+            'SELECT * FROM t',
+            'SELECT a FROM t WHERE b = x\'\'',
+            'SELECT count(*), max(b) FROM t',
+        ):
+            expected = connection.execute(sql).fetchall()
+            self.assertEqual(sorted(db.execute(sql)), sorted(expected), sql)
+        connection.close()
+        db.close()
+
+    def test_in_memory_metrics(self):
+        metrics = Metrics()
+        db = Database(self.path, in_memory=True, metrics=metrics)
+        self.assertEqual(metrics.totals.bytes_read, os.path.getsize(self.path))
+        list(db.execute('SELECT * FROM t'))
+        totals = metrics.totals
+        self.assertGreater(totals.pages_read, 0)
+        self.assertEqual(totals.cache_hits, totals.pages_read)
+        self.assertEqual(totals.cache_misses, 0)
+
+        # snapshots count into the same metrics
+        pages_read = totals.pages_read
+        snapshot = db.pager.snapshot()
+        snapshot.get_page(2)
+        self.assertEqual(metrics.totals.pages_read, pages_read + 1)
+        snapshot.release()
+        db.close()
+
+if __name__ == '__main__':
+    unittest.main()
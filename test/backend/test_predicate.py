@@ -0,0 +1,72 @@
+import unittest
+from unittest import TestCase
+
+from src.backend.predicate import Comparison, IsNull, Or, Prefix
+from src.backend.record import Record, RecordView
+
+def view(values, encoding='utf-8'):
+    record = Record.from_values(values, encoding=encoding)
+    return RecordView(record.to_bytes(), 0, encoding)
+
+class TestPredicate(TestCase):
+    def test_record_view(self):
+        record_view = view([None, 7, 'hi', bytes([0x01]), -2.5])
+        self.assertEqual(len(record_view), 5)
+        self.assertEqual(record_view.serial_types, [0, 1, 17, 14, 7])
+        self.assertEqual(record_view.raw(2), b'hi')
+        self.assertEqual(record_view.values(), [None, 7, 'hi', bytes([0x01]), -2.5])
+        self.assertEqual(record_view.values([4, 1]), [-2.5, 7])
+        # columns past the end of the record are NULL
+        self.assertEqual(record_view.serial_type(9), 0)
+        self.assertIsNone(record_view.value(9))
+
+    def test_comparison(self):
+        record_view = view([None, 7, 'hello', bytes([0x01, 0x02]), 2.5])
+        tests = [
+            (Comparison(1, '=', 7), True),
+            (Comparison(1, '>', 7), False),
+            (Comparison(1, '<=', 7.5), True),
+            (Comparison(4, '>', 2), True),
+            (Comparison(2, '=', 'hello'), True),
+            (Comparison(2, '!=', 'help'), True),
+            (Comparison(2, '<', 'help'), True),
+            (Comparison(2, '>', 'hell'), True),
+            (Comparison(3, '=', bytes([0x01, 0x02])), True),
+            # numbers sort before text and text before blobs
+            (Comparison(1, '<', 'a'), True),
+            (Comparison(2, '<', bytes([0x00])), True),
+            (Comparison(2, '=', 5), False),
+            # comparisons with NULL are never true
+            (Comparison(0, '=', None), False),
+            (Comparison(0, '!=', 1), False),
+            (Comparison(1, '!=', None), False),
+        ]
+        for predicate, expected in tests:
+            with self.subTest(predicate=predicate):
+                self.assertEqual(predicate.evaluate(record_view), expected)
+
+        with self.assertRaises(ValueError):
+            Comparison(1, '~', 1)
+
+    def test_text_encoding(self):
+        record_view = view(['小战俘', 'hello'], 'utf-16-le')
+        self.assertTrue(Comparison(0, '=', '小战俘').evaluate(record_view))
+        self.assertTrue(Prefix(1, 'he').evaluate(record_view))
+        self.assertFalse(Prefix(1, 'lo').evaluate(record_view))
+
+    def test_is_null_prefix_and_or(self):
+        record_view = view([None, 'hello', bytes([0x01, 0x02])])
+        self.assertTrue(IsNull(0).evaluate(record_view))
+        self.assertFalse(IsNull(0, negated=True).evaluate(record_view))
+        self.assertTrue(Prefix(1, 'hel').evaluate(record_view))
+        self.assertFalse(Prefix(1, 'hello world').evaluate(record_view))
+        self.assertTrue(Prefix(2, bytes([0x01])).evaluate(record_view))
+        self.assertFalse(Prefix(2, 'a').evaluate(record_view))
+
+        predicate = IsNull(0) & Prefix(1, 'x') | Comparison(1, '=', 'hello')
+        self.assertTrue(predicate.evaluate(record_view))
+        self.assertIsInstance(predicate, Or)
+        self.assertEqual(predicate.columns(), {0, 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ from typing import Union
 from unittest import TestCase
 
 from src.backend.record import Record, ColumnType, Column
+from src.util import varint
 
 @dataclass
 class ColumnTestCase:
@@ -139,14 +140,63 @@ class TestRecord(TestCase):
                 9,
                 False,
             ),
-            # IEEE754 int unsupported
+            # negative values are two's complement
+            ReadValueTestCase(
+                Column.from_int(1),
+                bytes([0x12, 0xfe, 0x56]),
+                1,
+                -2,
+                2,
+                False,
+            ),
+            ReadValueTestCase(
+                Column.from_int(2),
+                bytes([0x80, 0x00]),
+                0,
+                -32768,
+                2,
+                False,
+            ),
+            ReadValueTestCase(
+                Column.from_int(3),
+                bytes([0xff, 0xfe, 0xff]),
+                0,
+                -257,
+                3,
+                False,
+            ),
+            ReadValueTestCase(
+                Column.from_int(4),
+                bytes([0xff, 0xff, 0xff, 0xff]),
+                0,
+                -1,
+                4,
+                False,
+            ),
+            ReadValueTestCase(
+                Column.from_int(5),
+                bytes([0x80, 0x00, 0x00, 0x00, 0x00, 0x01]),
+                0,
+                -140737488355327,
+                6,
+                False,
+            ),
+            ReadValueTestCase(
+                Column.from_int(6),
+                bytes([0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),
+                0,
+                -9223372036854775808,
+                8,
+                False,
+            ),
+            # big-endian IEEE754 double
             ReadValueTestCase(
                 Column.from_int(7),
-                bytes([0x12, 0x34, 0x56]),
+                bytes([0x12, 0xc0, 0x09, 0x21, 0xf9, 0xf0, 0x1b, 0x86, 0x6e]),
                 1,
-                None,
-                None,
-                True,
+                -3.14159,
+                9,
+                False,
             ),
             # constant value 0 
             ReadValueTestCase(
@@ -232,6 +282,83 @@ class TestRecord(TestCase):
                 if not test.throws_error:
                     self.fail(e)
 
+    def test_column_for_value(self):
+        tests = [
+            (None, ColumnType.NULL, None),
+            (0, ColumnType.ZERO, None),
+            (1, ColumnType.ONE, None),
+            (2, ColumnType.TINYINT, None),
+            (-128, ColumnType.TINYINT, None),
+            (127, ColumnType.TINYINT, None),
+            (128, ColumnType.SMALLINT, None),
+            (-129, ColumnType.SMALLINT, None),
+            (32768, ColumnType.SMALLISHINT, None),
+            (-8388608, ColumnType.SMALLISHINT, None),
+            (8388608, ColumnType.INTEGER, None),
+            (-2147483649, ColumnType.BIGGISHINT, None),
+            (140737488355328, ColumnType.LONG, None),
+            (-9223372036854775808, ColumnType.LONG, None),
+            (1.5, ColumnType.IEEE754INT, None),
+            ('小战俘', ColumnType.TEXT, 9),
+            (bytes([0x01, 0x02]), ColumnType.BLOB, 2),
+        ]
+        for value, expected, expected_length in tests:
+            with self.subTest(value=value):
+                column = Column.for_value(value)
+                self.assertEqual(column.type, expected)
+                self.assertEqual(column.length, expected_length)
+
+        self.assertEqual(Column.for_value(1, False).type, ColumnType.TINYINT)
+        with self.assertRaises(ValueError):
+            Column.for_value(1 << 63)
+        with self.assertRaises(ValueError):
+            Column.for_value(object())
+
+    def test_columns_are_shared(self):
+        first = Record(bytes.fromhex('0401041111001100114f49'), 0)
+        second = Record(bytes.fromhex('0401041111001100114f4a'), 0)
+        for a, b in zip(first.columns, second.columns):
+            self.assertIs(a, b)
+        self.assertIs(Column.for_value('OI'), first.columns[2])
+        self.assertIs(Column.for_value(None), Column.from_int(0))
+        self.assertFalse(hasattr(first.columns[0], '__dict__'))
+        self.assertFalse(hasattr(first, '__dict__'))
+
+        # serial types past the interned range still compare equal
+        self.assertEqual(Column.from_int(200013), Column(ColumnType.TEXT, 100000))
+        self.assertNotEqual(Column.from_int(23), Column.from_int(25))
+
+    def test_record_from_values(self):
+        values = [None, 0, 1, -5, 70000, -1.25, 'hi', bytes([0xff]), 1 << 40]
+        record = Record.from_values(values)
+        payload = record.to_bytes()
+        # one header size byte, nine serial types, then 0 + 0 + 0 + 1 + 3 + 8 +
+        # 2 + 1 + 6 bytes of values
+        self.assertEqual(len(payload), 1 + 9 + 21)
+        self.assertEqual(Record(payload, 0).values, values)
+
+    def test_encode_into(self):
+        values = [None, 0, 1, -5, 70000, -1.25, 'hé', bytes([0xff]), -(1 << 40)]
+        record = Record.from_values(values)
+        page = bytearray(100)
+        end = record.encode_into(memoryview(page), 10)
+        self.assertEqual(end - 10, record.size())
+        self.assertEqual(bytes(page[10:end]), record.to_bytes())
+        self.assertEqual(Record(page, 10).values, values)
+        # nothing is written outside the record
+        self.assertEqual(page[:10] + page[end:], bytes(100 - record.size()))
+
+    def test_wide_record(self):
+        # 20000 text columns take two byte serial types, a header past the
+        # 32765 bytes that fit a two byte header size
+        values = [f'{i:060}' for i in range(20000)]
+        record = Record.from_values(values)
+        payload = record.to_bytes()
+        self.assertEqual(len(payload), record.size())
+        header_size, cursor = varint(payload, 0)
+        self.assertEqual((header_size, cursor), (40003, 3))
+        self.assertEqual(Record(payload, 0).values, values)
+
     def test_record_read_write_payload(self):
         # 4 byte header
         # col 1 - tinyint, 17
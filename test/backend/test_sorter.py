@@ -0,0 +1,92 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import TestCase
+
+from src.backend.record import sort_key
+from src.backend.sorter import Descending, ExternalSorter
+from src.backend.text import LazyText
+
+class TestSorter(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.rmdir(self.directory)
+
+    def rows(self, count: int):
+        generator = random.Random(7)
+        return [
+            [generator.randrange(100), f'text {generator.randrange(1000)}',
+             generator.random(), bytes(generator.randrange(300)), None, i]
+            for i in range(count)
+        ]
+
+    def test_sorts_in_memory(self):
+        sorter = ExternalSorter(lambda row: sort_key(row[0]), directory=self.directory)
+        rows = self.rows(500)
+        sorter.extend(rows)
+        result = list(sorter.sorted())
+        self.assertEqual(result, sorted(rows, key=lambda row: row[0]))
+        self.assertEqual(sorter.spilled_runs, 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_spills_and_merges(self):
+        rows = self.rows(1500)
+
+        def key(row):
+            return (Descending(sort_key(row[0])), sort_key(row[1]))
+
+        for fan_in in (2, 64):
+            with self.subTest(fan_in=fan_in):
+                sorter = ExternalSorter(
+                    key,
+                    memory=16 * 1024,
+                    page_size=512,
+                    directory=self.directory,
+                    fan_in=fan_in,
+                    read_pages=2,
+                )
+                sorter.extend(rows)
+                self.assertGreater(len(sorter.runs), 2)
+
+                result = list(sorter.sorted())
+                # the sort is stable, equal keys keep their input order
+                self.assertEqual(
+                    result,
+                    sorted(rows, key=lambda row: (-row[0], row[1])),
+                )
+                self.assertEqual(os.listdir(self.directory), [])
+
+    def test_close_removes_spill_file(self):
+        sorter = ExternalSorter(
+            lambda row: sort_key(row[0]), memory=1024, directory=self.directory,
+        )
+        sorter.extend(self.rows(200))
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        rows = sorter.sorted()
+        next(rows)
+        rows.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_encoding(self):
+        # utf-16 text sorts by its raw bytes, as the BINARY collation does
+        words = ['ā', 'b', 'ａ', 'a'] * 50
+        encoded = [LazyText(word.encode('utf-16-le'), 'utf-16-le') for word in words]
+        sorter = ExternalSorter(
+            lambda row: sort_key(row[0]),
+            memory=1024,
+            encoding='utf-16-le',
+            directory=self.directory,
+        )
+        sorter.extend([word] for word in encoded)
+        result = [str(row[0]) for row in sorter.sorted()]
+        self.assertEqual(
+            result,
+            sorted(words, key=lambda word: word.encode('utf-16-le')),
+        )
+
+if __name__ == '__main__':
+    unittest.main()
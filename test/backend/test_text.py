@@ -0,0 +1,43 @@
+import unittest
+from unittest import TestCase
+
+from src.backend.text import LazyText
+
+class TestText(TestCase):
+    def test_lazy_decode(self):
+        text = LazyText('小战俘'.encode('utf-16-le'), 'utf-16-le')
+        self.assertIsNone(text.value)
+
+        # equality and prefix tests run on the raw bytes
+        self.assertEqual(text, '小战俘')
+        self.assertTrue(text.startswith('小'))
+        self.assertFalse(text.startswith('战'))
+        self.assertIsNone(text.value)
+
+        self.assertEqual(str(text), '小战俘')
+        self.assertEqual(text.value, '小战俘')
+        self.assertEqual(len(text), 3)
+        self.assertEqual(hash(text), hash('小战俘'))
+
+    def test_encode(self):
+        raw = 'hello'.encode('utf-16-be')
+        text = LazyText(raw, 'utf-16-be')
+        self.assertIs(text.encode('utf-16-be'), raw)
+        self.assertEqual(text.encode('utf-8'), b'hello')
+        self.assertEqual(text, LazyText(b'hello'))
+
+    def test_ordering(self):
+        a = LazyText(b'apple')
+        b = LazyText(b'banana')
+        self.assertLess(a, b)
+        self.assertLess(a, 'b')
+        self.assertGreater('b', a)
+        self.assertEqual(sorted([b, 'cherry', a]), [a, b, 'cherry'])
+
+        # utf-16le text orders by its raw bytes as the BINARY collation does
+        low = LazyText('ā'.encode('utf-16-le'), 'utf-16-le')
+        high = LazyText('Ȁ'.encode('utf-16-le'), 'utf-16-le')
+        self.assertGreater(low, high)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import sqlite3
+import tempfile
+from typing import List
+
+def create_database(
+    statements: List[str],
+    page_size: int = 4096,
+    directory: str = None,
+) -> str:
+    """
+    create_database writes a fresh database with the stdlib sqlite3 module and
+    returns its path, the caller is responsible for removing it
+    """
+    fd, path = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    os.remove(path)
+
+    connection = sqlite3.connect(path)
+    connection.execute(f'PRAGMA page_size = {page_size}')
+    for statement in statements:
+        connection.execute(statement)
+    connection.commit()
+    connection.close()
+    return path
+
+def series(n: int) -> str:
+    """
+    series returns a common table expression s(value) counting from 1 to n,
+    standing in for generate_series which older sqlite builds lack
+    """
+    return 'WITH RECURSIVE s(value) AS ' \
+           f'(SELECT 1 UNION ALL SELECT value + 1 FROM s WHERE value < {n}) '
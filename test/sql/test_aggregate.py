@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import unittest
+from unittest import mock
+from unittest import TestCase
+
+from src.backend.node import Node
+from src.database import Database
+from src.sql.aggregate import count_rows, edge_rowid
+from src.sql.expression import ExpressionError
+from test.fixtures import create_database, series
+
+class TestAggregate(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT, c REAL, '
+            'pad BLOB)',
+            'CREATE INDEX t_b ON t(b)',
+            series(3000) + 'INSERT INTO t(id, a, b, c, pad) SELECT value * 3, '
+            "value % 13, CASE WHEN value % 5 = 0 THEN NULL ELSE 'g' || (value % 7) "
+            'END, value / 4.0, randomblob(100) FROM s',
+            "INSERT INTO t(a, b, c) VALUES (NULL, '12', 'x'), (99, 'z', NULL)",
+            'DELETE FROM t WHERE id < 30',
+            'CREATE TABLE empty(x)',
+        ], page_size=1024)
+        cls.db = Database(cls.path)
+        cls.connection = sqlite3.connect(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+        os.remove(cls.path)
+
+    def assertSameRows(self, sql: str):
+        expected = self.connection.execute(sql).fetchall()
+        self.assertEqual(list(self.db.execute(sql)), expected, sql)
+
+    def test_tree_walks(self):
+        table = self.db.catalog.table('t')
+        tree = self.db.btree(table.root_page)
+        index = self.db.btree(table.indexes[0].root_page)
+
+        count, low, high = self.connection.execute(
+            'SELECT COUNT(*), MIN(id), MAX(id) FROM t'
+        ).fetchone()
+
+        # no cell is parsed to count or to find the ends of the table
+        with mock.patch.object(Node, 'read_cells', side_effect=AssertionError):
+            self.assertEqual(count_rows(tree), count)
+            self.assertEqual(count_rows(index), count)
+            self.assertEqual(edge_rowid(tree), low)
+            self.assertEqual(edge_rowid(tree, last=True), high)
+
+        empty = self.db.btree(self.db.catalog.table('empty').root_page)
+        self.assertEqual(count_rows(empty), 0)
+        self.assertIsNone(edge_rowid(empty))
+
+    def test_edge_descent_reads_one_page_per_level(self):
+        pages = []
+        get_page = self.db.pager.get_page
+
+        def counting_get_page(page_number):
+            pages.append(page_number)
+            return get_page(page_number)
+
+        table = self.db.catalog.table('t')
+        self.db.pager.get_page = counting_get_page
+        try:
+            edge_rowid(self.db.btree(table.root_page), last=True)
+        finally:
+            del self.db.pager.get_page
+
+        self.assertLessEqual(len(pages), 3)
+
+    def test_matches_sqlite(self):
+        for sql in (
+            'SELECT COUNT(*) FROM t',
+            'SELECT MAX(rowid), count(*), MIN(id) FROM t',
+            'SELECT COUNT(*), MAX(rowid) FROM empty',
+            'SELECT COUNT(*) FROM empty',
+            'SELECT COUNT(*), COUNT(b), SUM(a), AVG(c), MIN(b), MAX(c) FROM t',
+            'SELECT COUNT(*), SUM(a), AVG(a), TOTAL(a), MIN(a) FROM t WHERE id < 0',
+            'SELECT b, COUNT(*), SUM(a), AVG(c) FROM t GROUP BY b',
+            'SELECT a, b, COUNT(*) AS n FROM t WHERE a < 4 GROUP BY 1, b '
+            'ORDER BY n DESC, a, b',
+            'SELECT b AS g, MAX(id) FROM t GROUP BY g HAVING COUNT(*) > 400',
+            'SELECT a, SUM(c) FROM t GROUP BY a ORDER BY SUM(c) DESC LIMIT 3',
+            'SELECT SUM(b), SUM(c) FROM t WHERE id > 8990',
+            'SELECT x, COUNT(*) FROM empty GROUP BY x',
+        ):
+            with self.subTest(sql=sql):
+                self.assertSameRows(sql)
+
+    def test_plans(self):
+        self.assertEqual(self.db.plan('SELECT COUNT(*), MAX(id) FROM t').explain(), [
+            'PROJECT COUNT(*), MAX(id)',
+            '  AGGREGATE t USING B-TREE (COUNT, MAX)',
+        ])
+        self.assertEqual(
+            self.db.plan("SELECT b, SUM(a) FROM t WHERE b > 'g3' GROUP BY b").explain(),
+            [
+                'PROJECT b, SUM(a)',
+                '  AGGREGATE SUM(a) GROUP BY b',
+                '    SEARCH t USING INDEX t_b (b>?)',
+            ],
+        )
+
+    def test_decodes_only_used_columns(self):
+        plan = self.db.plan('SELECT b, COUNT(*) FROM t WHERE a = 1 GROUP BY b')
+        self.assertEqual(plan.child.child.columns, [2])
+
+    def test_errors(self):
+        for sql in (
+            'SELECT a, COUNT(*) FROM t',
+            'SELECT b FROM t GROUP BY a',
+            'SELECT COUNT(*) FROM t GROUP BY COUNT(*)',
+            'SELECT SUM(*) FROM t',
+            'SELECT SUM(MAX(a)) FROM t',
+            'SELECT UPPER(b) FROM t GROUP BY b',
+            'SELECT a FROM t WHERE COUNT(*) > 1',
+        ):
+            with self.subTest(sql=sql):
+                with self.assertRaises(ExpressionError):
+                    list(self.db.execute(sql))
+
+if __name__ == '__main__':
+    unittest.main()
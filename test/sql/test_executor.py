@@ -0,0 +1,316 @@
+import os
+import sqlite3
+import unittest
+from unittest import TestCase
+
+from src.database import Database
+from src.sql.catalog import CatalogError
+from src.sql.expression import ExpressionError
+from test.fixtures import create_database, series
+
+class TestExecutor(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT, c REAL, '
+            'd BLOB, UNIQUE (b, c))',
+            'CREATE INDEX t_a ON t(a)',
+            'CREATE INDEX t_c_desc ON t(c DESC)',
+            series(2000) + 'INSERT INTO t(a, b, c, d) SELECT value % 50, '
+            "CASE WHEN value % 7 = 0 THEN NULL ELSE 'name ' || (value % 300) END, "
+            'value / 8.0, randomblob(value % 3) FROM s',
+            "INSERT INTO t(id, a, b) VALUES (5000, NULL, 'Upper'), "
+            "(5001, '12', '10%'), (5002, 'text', x'00')",
+            'CREATE TABLE empty(x)',
+        ], page_size=1024)
+        cls.db = Database(cls.path)
+        cls.connection = sqlite3.connect(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+        os.remove(cls.path)
+
+    def assertSameRows(self, sql: str, ordered: bool = False):
+        expected = self.connection.execute(sql).fetchall()
+        actual = list(self.db.execute(sql))
+        if not ordered:
+            expected.sort(key=repr)
+            actual.sort(key=repr)
+        self.assertEqual(actual, expected, sql)
+
+    def test_matches_sqlite(self):
+        for where in (
+            'a = 7',
+            "a = '7'",
+            'a > 45',
+            'a >= 10 AND a < 12 AND b IS NOT NULL',
+            'a IS NULL',
+            "a = 'text'",
+            'id = 17',
+            'id BETWEEN 100 AND 110.5',
+            'rowid > 1995',
+            'id < 3 OR id > 5000',
+            "b = 'name 5'",
+            "b = 'name 5' AND a = 5",
+            "b > 'name 98' AND b < 'name 99'",
+            "b LIKE 'NAME 1%'",
+            "b LIKE '10%'",
+            "b GLOB 'name 2*'",
+            "b NOT LIKE 'name%'",
+            'b IN (\'name 1\', \'name 2\') AND a IN (1, 2, 3)',
+            'c > 200.5 AND c <= 201',
+            'c = 1',
+            'NOT (a < 49)',
+            'a = NULL',
+            'd = x\'\'',
+            'a = 3 AND a = 3',
+        ):
+            with self.subTest(where=where):
+                self.assertSameRows(f'SELECT id, a, b, c FROM t WHERE {where}')
+
+    def test_ordering_and_limits(self):
+        for sql in (
+            'SELECT * FROM t ORDER BY a DESC, id LIMIT 30',
+            'SELECT id, b AS name FROM t WHERE a = 3 ORDER BY name, 1 DESC',
+            'SELECT b, a FROM t WHERE b IS NOT NULL ORDER BY b, a LIMIT 20 OFFSET 7',
+            'SELECT id FROM t WHERE a = 9 ORDER BY id LIMIT 5',
+            'SELECT id, c FROM t ORDER BY c DESC LIMIT 3',
+            'SELECT id FROM t ORDER BY id LIMIT 4, 3',
+            'SELECT id FROM t ORDER BY rowid LIMIT -1 OFFSET 1995',
+            'SELECT id, a = 5, b IS NULL FROM t WHERE id <= 10 ORDER BY id',
+            'SELECT x FROM empty',
+        ):
+            with self.subTest(sql=sql):
+                self.assertSameRows(sql, ordered=True)
+
+    def test_sort_spills(self):
+        sql = 'SELECT id, b, c FROM t ORDER BY b DESC, c LIMIT 500'
+        expected = self.connection.execute(sql).fetchall()
+
+        db = Database(self.path, sort_memory=16 * 1024)
+        plan = db.plan(sql)
+        self.assertEqual(list(plan), expected)
+        sort = plan.child.child
+        self.assertGreater(sort.sorter.spilled_runs, 1)
+
+    def test_plans(self):
+        def explain(sql):
+            return self.db.plan(sql).explain()
+
+        self.assertEqual(explain('SELECT a FROM t WHERE id = 5'), [
+            'PROJECT a',
+            '  SEARCH t USING INTEGER PRIMARY KEY (rowid=?)',
+        ])
+        self.assertEqual(explain("SELECT a FROM t WHERE b = 'x' AND c = 5"), [
+            'PROJECT a',
+            '  SEARCH t USING INDEX sqlite_autoindex_t_1 (b=? AND c=?)',
+        ])
+        self.assertEqual(explain('SELECT a FROM t WHERE a > 5 AND c < 3'), [
+            'PROJECT a',
+            '  SEARCH t USING INDEX t_a (a>?) WHERE c < 3',
+        ])
+        # the descending index is not used and LIKE with letters is filtered
+        self.assertEqual(explain("SELECT b FROM t WHERE c = 1 AND b LIKE 'x%'"), [
+            'PROJECT b',
+            "  FILTER b LIKE 'x%'",
+            '    SCAN t WHERE c = 1',
+        ])
+        self.assertEqual(explain('SELECT id FROM t ORDER BY id LIMIT 1'), [
+            'PROJECT id',
+            '  LIMIT 1 OFFSET 0',
+            '    SCAN t',
+        ])
+        self.assertEqual(explain('SELECT id FROM t WHERE a = 1 ORDER BY b'), [
+            'PROJECT id',
+            '  SORT BY b',
+            '    SEARCH t USING INDEX t_a (a=?)',
+        ])
+
+    def test_covering_index(self):
+        def explain(sql):
+            return self.db.plan(sql).explain()
+
+        self.assertEqual(explain('SELECT id, a FROM t WHERE a = 3'), [
+            'PROJECT id, a',
+            '  SEARCH t USING COVERING INDEX t_a (a=?)',
+        ])
+        self.assertEqual(explain("SELECT c FROM t WHERE b = 'x' AND c > 1"), [
+            'PROJECT c',
+            '  SEARCH t USING COVERING INDEX sqlite_autoindex_t_1 (b=? AND c>?)',
+        ])
+        # terms left over are filtered on the rows built from the index
+        self.assertEqual(explain("SELECT b FROM t WHERE b > 'name 5' AND c < 3"), [
+            'PROJECT b',
+            '  FILTER c < 3',
+            "    SEARCH t USING COVERING INDEX sqlite_autoindex_t_1 (b>?)",
+        ])
+        for sql in (
+            'SELECT id, a FROM t WHERE a = 3',
+            'SELECT a, rowid FROM t WHERE a > 47 ORDER BY a DESC',
+            "SELECT b, c FROM t WHERE b = 'name 5'",
+            "SELECT c FROM t WHERE b > 'name 5' AND c < 30",
+            'SELECT a, count(*) FROM t WHERE a < 5 GROUP BY a',
+        ):
+            with self.subTest(sql=sql):
+                self.assertSameRows(sql)
+
+        table_pages = {
+            page_number
+            for page_number, _ in self.db.btree(self.db.catalog.table('t').root_page)
+            .pages()
+        }
+        pages = []
+        get_page = self.db.pager.get_page
+
+        def counting_get_page(page_number):
+            pages.append(page_number)
+            return get_page(page_number)
+
+        self.db.pager.get_page = counting_get_page
+        try:
+            list(self.db.execute('SELECT id FROM t WHERE a = 7'))
+        finally:
+            del self.db.pager.get_page
+        self.assertTrue(pages)
+        self.assertFalse(table_pages & set(pages))
+
+    def test_limit_stops_early(self):
+        pages = []
+        get_page = self.db.pager.get_page
+
+        def counting_get_page(page_number):
+            pages.append(page_number)
+            return get_page(page_number)
+
+        self.db.pager.get_page = counting_get_page
+        try:
+            self.assertEqual(list(self.db.execute('SELECT id FROM t LIMIT 2')),
+                             [(1,), (2,)])
+        finally:
+            del self.db.pager.get_page
+        self.assertLess(len(pages), 5)
+
+    def test_real_affinity(self):
+        # c holds whole numbers every 8 rows, which sqlite stores as integers
+        # and reads back as floats
+        for sql in (
+            'SELECT c, id FROM t WHERE id <= 16',
+            'SELECT c FROM t WHERE c >= 240 ORDER BY c DESC',
+            'SELECT id, c FROM t WHERE id IN (8, 16, 24)',
+            'SELECT sum(c), max(c), min(c) FROM t WHERE id < 5',
+            'SELECT a, total(c), max(c) FROM t WHERE a < 3 GROUP BY a',
+        ):
+            expected = self.connection.execute(sql).fetchall()
+            actual = list(self.db.execute(sql))
+            self.assertEqual(
+                [[type(value) for value in row] for row in actual],
+                [[type(value) for value in row] for row in expected],
+                sql,
+            )
+            self.assertEqual(actual, expected, sql)
+
+    def test_errors(self):
+        with self.assertRaises(CatalogError):
+            self.db.plan('SELECT a FROM missing')
+        with self.assertRaises(CatalogError):
+            self.db.plan('SELECT missing FROM t')
+        with self.assertRaises(ExpressionError):
+            self.db.plan('SELECT a FROM t LIMIT a')
+        with self.assertRaises(ExpressionError):
+            self.db.plan('SELECT a FROM t ORDER BY 3')
+
+class TestWithoutRowid(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = create_database([
+            'CREATE TABLE k(name TEXT, region INTEGER, value REAL, note TEXT, '
+            'PRIMARY KEY (region, name)) WITHOUT ROWID',
+            'CREATE INDEX k_value ON k(value)',
+            series(3000) + 'INSERT INTO k SELECT printf(\'key %05d\', value), '
+            "value % 13, value / 4.0, 'note ' || value FROM s",
+        ], page_size=1024)
+        cls.db = Database(cls.path)
+        cls.connection = sqlite3.connect(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+        os.remove(cls.path)
+
+    def test_matches_sqlite(self):
+        for sql in (
+            'SELECT * FROM k',
+            'SELECT * FROM k WHERE region = 4',
+            "SELECT note FROM k WHERE region = 4 AND name = 'key 00030'",
+            "SELECT * FROM k WHERE region = 4 AND name > 'key 02900'",
+            'SELECT name, value FROM k WHERE region BETWEEN 2 AND 3',
+            'SELECT * FROM k WHERE value > 740',
+            'SELECT name, region FROM k WHERE value < 2',
+            "SELECT count(*) FROM k WHERE note LIKE 'note 1%'",
+            'SELECT count(*) FROM k',
+            'SELECT region, count(*) FROM k GROUP BY region',
+        ):
+            with self.subTest(sql=sql):
+                self.assertEqual(
+                    sorted(self.db.execute(sql), key=repr),
+                    sorted(self.connection.execute(sql).fetchall(), key=repr),
+                )
+
+        # rows come out in primary key order without a sort
+        sql = 'SELECT region, name FROM k ORDER BY region, name LIMIT 20'
+        self.assertEqual(self.db.plan(sql).explain()[1:], [
+            '  LIMIT 20 OFFSET 0',
+            '    SCAN k',
+        ])
+        self.assertEqual(list(self.db.execute(sql)),
+                         self.connection.execute(sql).fetchall())
+
+    def test_plans(self):
+        def explain(sql):
+            return self.db.plan(sql).explain()[1:]
+
+        self.assertEqual(
+            explain("SELECT * FROM k WHERE region = 4 AND name = 'key 00030'"),
+            ['  SEARCH k USING PRIMARY KEY (region=? AND name=?)'],
+        )
+        self.assertEqual(explain('SELECT note FROM k WHERE region > 11'),
+                         ['  SEARCH k USING PRIMARY KEY (region>?)'])
+        self.assertEqual(explain('SELECT note FROM k WHERE value = 3'),
+                         ['  SEARCH k USING INDEX k_value (value=?)'])
+        # entries of k_value hold the primary key after the value
+        self.assertEqual(explain('SELECT name, region FROM k WHERE value = 3'),
+                         ['  SEARCH k USING COVERING INDEX k_value (value=?)'])
+        with self.assertRaises(CatalogError):
+            self.db.plan('SELECT rowid FROM k')
+
+    def test_single_descent(self):
+        tree = self.db.btree(self.db.catalog.table('k').root_page)
+        depth = 1
+        node = tree.node(tree.root_page)
+        while not node.is_leaf():
+            node = tree.node(node.children()[0])
+            depth += 1
+        self.assertGreater(depth, 1)
+
+        pages = []
+        get_page = self.db.pager.get_page
+
+        def counting_get_page(page_number):
+            pages.append(page_number)
+            return get_page(page_number)
+
+        self.db.pager.get_page = counting_get_page
+        try:
+            rows = list(self.db.execute(
+                "SELECT value FROM k WHERE region = 0 AND name = 'key 01300'"
+            ))
+        finally:
+            del self.db.pager.get_page
+        self.assertEqual(rows, [(325.0,)])
+        # page 1 is read for the schema cookie, then one page per level
+        self.assertEqual([page for page in pages if page != 1][0], tree.root_page)
+        self.assertEqual(len([page for page in pages if page != 1]), depth)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import unittest
+from unittest import TestCase
+
+from src.sql.catalog import Affinity, apply_affinity, type_affinity
+from src.sql.lexer import SQLSyntaxError, TokenType, tokenize
+from src.sql.parser import (
+    Between,
+    BinaryOp,
+    ColumnRef,
+    FunctionCall,
+    InList,
+    Like,
+    Literal,
+    Not,
+    OrderingTerm,
+    ResultColumn,
+    Star,
+    parse_create_index,
+    parse_create_table,
+    parse_select,
+)
+
+class TestLexer(TestCase):
+    def test_tokens(self):
+        tokens = tokenize("select \"a b\", x'0aff', 1.5e3, 'it''s' <= -- note\n7")
+        self.assertEqual(
+            [(token.type, token.value) for token in tokens],
+            [
+                (TokenType.KEYWORD, 'SELECT'),
+                (TokenType.IDENTIFIER, 'a b'),
+                (TokenType.OPERATOR, ','),
+                (TokenType.BLOB, b'\x0a\xff'),
+                (TokenType.OPERATOR, ','),
+                (TokenType.FLOAT, 1500.0),
+                (TokenType.OPERATOR, ','),
+                (TokenType.STRING, "it's"),
+                (TokenType.OPERATOR, '<='),
+                (TokenType.INTEGER, 7),
+                (TokenType.END, None),
+            ],
+        )
+
+    def test_errors(self):
+        for sql in ("'open", 'a ^ b', "x'0g'"):
+            with self.subTest(sql=sql):
+                with self.assertRaises(SQLSyntaxError):
+                    tokenize(sql)
+
+class TestParser(TestCase):
+    def test_select(self):
+        select = parse_select(
+            'SELECT *, a AS x, b y FROM main.t '
+            'WHERE a = 1 AND NOT b LIKE \'x%\' OR c BETWEEN -1 AND 2 '
+            'ORDER BY x DESC, 2 LIMIT 10 OFFSET 5;'
+        )
+        self.assertEqual(select.table, 't')
+        self.assertEqual(select.columns, [
+            ResultColumn(Star()),
+            ResultColumn(ColumnRef('a'), 'x'),
+            ResultColumn(ColumnRef('b'), 'y'),
+        ])
+        self.assertEqual(select.where, BinaryOp(
+            'OR',
+            BinaryOp(
+                'AND',
+                BinaryOp('=', ColumnRef('a'), Literal(1)),
+                Not(Like('LIKE', ColumnRef('b'), Literal('x%'))),
+            ),
+            Between(ColumnRef('c'), Literal(-1), Literal(2)),
+        ))
+        self.assertEqual(select.order_by, [
+            OrderingTerm(ColumnRef('x'), True),
+            OrderingTerm(Literal(2)),
+        ])
+        self.assertEqual((select.limit, select.offset), (Literal(10), Literal(5)))
+
+    def test_limit_comma(self):
+        select = parse_select('SELECT a FROM t WHERE a NOT IN (1, 2) LIMIT 5, 10')
+        self.assertEqual(select.where, InList(
+            ColumnRef('a'), [Literal(1), Literal(2)], True,
+        ))
+        self.assertEqual((select.limit, select.offset), (Literal(10), Literal(5)))
+
+    def test_group_by(self):
+        select = parse_select(
+            'SELECT a, count(*), SUM(b) FROM t GROUP BY a HAVING MAX(b) > 1'
+        )
+        self.assertEqual([column.expr for column in select.columns], [
+            ColumnRef('a'),
+            FunctionCall('COUNT', star=True),
+            FunctionCall('SUM', [ColumnRef('b')]),
+        ])
+        self.assertEqual(select.group_by, [ColumnRef('a')])
+        self.assertEqual(select.having, BinaryOp(
+            '>', FunctionCall('MAX', [ColumnRef('b')]), Literal(1),
+        ))
+
+    def test_syntax_errors(self):
+        for sql in ('SELECT FROM t', 'SELECT a t', 'SELECT a FROM t WHERE',
+                    'SELECT a FROM t LIMIT 1 garbage',
+                    'SELECT COUNT(DISTINCT a) FROM t'):
+            with self.subTest(sql=sql):
+                with self.assertRaises(SQLSyntaxError):
+                    parse_select(sql)
+
+    def test_create_table(self):
+        create = parse_create_table(
+            'CREATE TABLE "t x"(id INTEGER PRIMARY KEY, name VARCHAR(20) NOT NULL '
+            'UNIQUE, n DECIMAL(10, 2) DEFAULT (0), CHECK (n > 0), '
+            'UNIQUE (name, n))'
+        )
+        self.assertEqual(create.name, 't x')
+        self.assertEqual([c.name for c in create.columns], ['id', 'name', 'n'])
+        self.assertEqual([c.type for c in create.columns],
+                         ['INTEGER', 'VARCHAR', 'DECIMAL'])
+        self.assertEqual(create.primary_key, ['id'])
+        self.assertEqual(create.unique, [['id'], ['name'], ['name', 'n']])
+        self.assertFalse(create.without_rowid)
+
+        create = parse_create_table(
+            'CREATE TABLE w(a, b, PRIMARY KEY (b, a)) WITHOUT ROWID'
+        )
+        self.assertEqual(create.primary_key, ['b', 'a'])
+        self.assertTrue(create.without_rowid)
+        self.assertTrue(create.primary_key_plain)
+
+        for sql in (
+            'CREATE TABLE w(a, b, PRIMARY KEY (b DESC, a)) WITHOUT ROWID',
+            'CREATE TABLE w(a TEXT COLLATE NOCASE PRIMARY KEY, b) WITHOUT ROWID',
+        ):
+            self.assertFalse(parse_create_table(sql).primary_key_plain, sql)
+
+    def test_create_index(self):
+        create = parse_create_index(
+            'CREATE UNIQUE INDEX IF NOT EXISTS i ON t(a COLLATE NOCASE, b DESC) '
+            'WHERE a > 0'
+        )
+        self.assertEqual(create.name, 'i')
+        self.assertEqual(create.table, 't')
+        self.assertTrue(create.unique and create.partial)
+        self.assertEqual(create.columns[0].collation, 'NOCASE')
+        self.assertTrue(create.columns[1].descending)
+
+class TestAffinity(TestCase):
+    def test_type_affinity(self):
+        for declared, affinity in (
+            ('INTEGER', Affinity.INTEGER),
+            ('BIGINT', Affinity.INTEGER),
+            ('VARCHAR', Affinity.TEXT),
+            ('CLOB', Affinity.TEXT),
+            ('', Affinity.BLOB),
+            ('DOUBLE', Affinity.REAL),
+            ('DECIMAL', Affinity.NUMERIC),
+            # 'INT' wins over 'POINT' being unknown
+            ('POINT', Affinity.INTEGER),
+        ):
+            with self.subTest(declared=declared):
+                self.assertEqual(type_affinity(declared), affinity)
+
+    def test_apply_affinity(self):
+        self.assertEqual(apply_affinity(Affinity.INTEGER, ' 12 '), 12)
+        self.assertEqual(apply_affinity(Affinity.NUMERIC, '1.5'), 1.5)
+        self.assertEqual(apply_affinity(Affinity.REAL, '3.0'), 3)
+        self.assertEqual(apply_affinity(Affinity.INTEGER, 'abc'), 'abc')
+        self.assertEqual(apply_affinity(Affinity.TEXT, 12), '12')
+        self.assertEqual(apply_affinity(Affinity.BLOB, 12), 12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import gc
+import os
+import sqlite3
+import unittest
+from unittest import TestCase, mock
+
+from src.database import Database
+from src.sql.expression import ExpressionError
+from src.sql.parser import Parameter, parse_select
+from src.sql.planner import Planner
+from src.sql.statement import StatementCache
+from test.fixtures import create_database, series
+
+class TestStatement(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+            'CREATE INDEX t_a ON t(a)',
+            series(1000) + "INSERT INTO t(a, b) SELECT value % 40, "
+            "'name ' || (value % 90) FROM s",
+        ], page_size=1024)
+        self.db = Database(self.path)
+        self.connection = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+        os.remove(self.path)
+
+    def assertSameRows(self, sql: str, parameters: tuple):
+        expected = self.connection.execute(sql, parameters).fetchall()
+        actual = list(self.db.execute(sql, parameters))
+        self.assertEqual(sorted(actual, key=repr), sorted(expected, key=repr),
+                         (sql, parameters))
+
+    def test_parse(self):
+        select = parse_select('SELECT a FROM t WHERE a = ? AND b > ? LIMIT ?')
+        self.assertEqual(select.parameters, 3)
+        self.assertEqual(select.where.left.right, Parameter(0))
+        self.assertEqual(select.limit, Parameter(2))
+
+    def test_matches_sqlite(self):
+        for sql, runs in (
+            ('SELECT * FROM t WHERE a = ?', [(7,), ('7',), (None,), (7.5,), ('x',)]),
+            ('SELECT * FROM t WHERE id = ?', [(17,), ('17',), (2000,), ('abc',)]),
+            ('SELECT * FROM t WHERE id BETWEEN ? AND ?', [(10, 20.5), (None, 5)]),
+            ('SELECT id FROM t WHERE rowid > ?', [(990,), ('abc',)]),
+            ('SELECT * FROM t WHERE a = ? AND b = ?', [(5, 'name 5'), (5, 'x')]),
+            ('SELECT * FROM t WHERE b > ? AND b < ?', [('name 8', 'name 81')]),
+            ('SELECT * FROM t WHERE b LIKE ?', [('NAME 1_',), ('%',)]),
+            ('SELECT id, ? FROM t WHERE a IN (?, ?)', [('x', 1, 2), (None, 3, 4)]),
+            ('SELECT a, COUNT(*) FROM t WHERE a < ? GROUP BY a HAVING COUNT(*) > ?',
+             [(10, 24), (3, 0)]),
+            ('SELECT id FROM t ORDER BY b, id LIMIT ? OFFSET ?', [(5, 10), (3, -1)]),
+        ):
+            for parameters in runs:
+                self.assertSameRows(sql, parameters)
+
+    def test_planned_once(self):
+        sql = 'SELECT id FROM t WHERE a = ? ORDER BY id'
+        with mock.patch.object(Planner, 'plan', side_effect=Planner.plan,
+                               autospec=True) as plan:
+            for a in range(40):
+                rows = list(self.db.execute(sql, (a,)))
+                self.assertEqual(len(rows), 25)
+                self.assertEqual(rows[0], (a or 40,))
+        self.assertEqual(plan.call_count, 1)
+        self.assertEqual(self.db.statements.hits, 39)
+
+    def test_parameter_count(self):
+        with self.assertRaises(ExpressionError):
+            list(self.db.execute('SELECT * FROM t WHERE a = ?'))
+        with self.assertRaises(ExpressionError):
+            list(self.db.execute('SELECT * FROM t WHERE a = ?', (1, 2)))
+        with self.assertRaises(ExpressionError):
+            list(self.db.execute('SELECT * FROM t LIMIT ?', ('many',)))
+
+    def test_interleaved_runs(self):
+        sql = 'SELECT id FROM t WHERE a = ? ORDER BY id'
+        first = self.db.execute(sql, (1,))
+        self.assertEqual(next(first), (1,))
+        # the cached statement is still being read, a second one is planned
+        second = self.db.execute(sql, (2,))
+        self.assertEqual(next(second), (2,))
+        self.assertEqual(next(first), (41,))
+        self.assertEqual(next(second), (42,))
+
+        # running a statement again ends the previous run
+        statement = self.db.prepare(sql)
+        rows = statement.execute((3,))
+        next(rows)
+        statement.execute((4,))
+        self.assertEqual(list(rows), [])
+
+    def test_close_ends_runs(self):
+        sql = 'SELECT id FROM t WHERE a = ?'
+        first = self.db.execute(sql, (1,))
+        second = self.db.execute(sql, (2,))
+        next(first), next(second)
+        self.assertEqual(self.db.pager.reads.depth, 2)
+        with mock.patch('sys.unraisablehook') as hook:
+            self.db.close()
+            self.assertEqual(self.db.pager.reads.depth, 0)
+            self.assertEqual(list(first), [])
+            del first, second
+            gc.collect()
+        hook.assert_not_called()
+
+    def test_schema_change(self):
+        sql = "SELECT id FROM t WHERE b = ?"
+        self.assertEqual(len(list(self.db.execute(sql, ('name 3',)))), 12)
+        self.assertEqual(len(self.db.statements), 1)
+        self.assertEqual(self.db.plan(sql).explain()[1], '  SCAN t WHERE b = ?')
+
+        self.connection.execute('CREATE INDEX t_b ON t(b)')
+        self.connection.commit()
+        self.assertEqual(len(list(self.db.execute(sql, ('name 3',)))), 12)
+        statement = self.db.statements.statements[sql]
+        self.assertEqual(
+            statement.explain()[1], '  SEARCH t USING COVERING INDEX t_b (b=?)'
+        )
+        self.assertEqual(self.db.statements.misses, 2)
+
+    def test_schema_checked_on_change(self):
+        sql = 'SELECT b FROM t WHERE id = ?'
+        list(self.db.execute(sql, (1,)))
+        get_page = self.db.pager.get_page
+        with mock.patch.object(self.db.pager, 'get_page', wraps=get_page) as read, \
+                mock.patch('src.database.DBInfo') as parse:
+            # the file cannot change under a read transaction, the cookie is
+            # read when it begins and not again
+            self.db.pager.begin_read()
+            try:
+                for i in range(1, 50):
+                    list(self.db.execute(sql, (i,)))
+            finally:
+                self.db.pager.end_read()
+            self.assertEqual(read.call_args_list.count(mock.call(1)), 1)
+
+            # once the lock is taken afresh only the cookie is read again
+            list(self.db.execute(sql, (1,)))
+            self.assertEqual(read.call_args_list.count(mock.call(1)), 2)
+            parse.assert_not_called()
+
+    def test_lru(self):
+        cache = StatementCache(2)
+        cache.get('SELECT 0 FROM t', 1)
+        statements = [self.db.prepare(f'SELECT {i} FROM t') for i in range(3)]
+        for statement in statements:
+            cache.put(statement)
+            cache.get(statements[0].sql, 1)
+        self.assertEqual(list(cache.statements), ['SELECT 2 FROM t', 'SELECT 0 FROM t'])
+        # a new schema empties the cache
+        self.assertIsNone(cache.get('SELECT 0 FROM t', 2))
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
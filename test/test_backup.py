@@ -0,0 +1,132 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import TestCase
+
+from src.backup import BackupError, Manifest, backup, increment_path, restore, verify
+from test.fixtures import create_database, series
+
+class TestBackup(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+            series(3000) + "INSERT INTO t(a, b) SELECT value, 'row ' || value FROM s",
+        ], page_size=1024)
+        self.directory = tempfile.mkdtemp()
+        self.backups = os.path.join(self.directory, 'backups')
+        self.restored = os.path.join(self.directory, 'restored.db')
+
+    def tearDown(self):
+        os.remove(self.path)
+        shutil.rmtree(self.directory)
+
+    def execute(self, sql: str):
+        connection = sqlite3.connect(self.path)
+        connection.execute(sql)
+        connection.commit()
+        connection.close()
+
+    def assertRestores(self):
+        restore(self.backups, self.restored)
+        with open(self.path, 'rb') as f, open(self.restored, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_incremental(self):
+        first = backup(self.path, self.backups, batch_pages=7)
+        self.assertEqual(first.increment, 1)
+        self.assertEqual(first.copied, first.pages)
+        self.assertRestores()
+
+        # nothing changed, so the change counter settles it
+        self.assertTrue(backup(self.path, self.backups).skipped)
+
+        self.execute('UPDATE t SET b = upper(b) WHERE id = 1500')
+        second = backup(self.path, self.backups, batch_pages=7)
+        self.assertEqual(second.increment, 2)
+        # the header and the leaf holding the row
+        self.assertEqual(second.copied, 2)
+        self.assertRestores()
+
+        self.execute('DELETE FROM t WHERE id > 100')
+        self.execute('VACUUM')
+        third = backup(self.path, self.backups)
+        self.assertLess(third.pages, first.pages)
+        self.assertRestores()
+
+    def test_full(self):
+        backup(self.path, self.backups)
+        self.execute('UPDATE t SET a = 0 WHERE id = 1')
+        backup(self.path, self.backups)
+
+        report = backup(self.path, self.backups, full=True)
+        self.assertEqual(report.copied, report.pages)
+        manifest = Manifest.read(self.backups)
+        self.assertEqual((manifest.base, manifest.latest), (3, 3))
+        self.assertFalse(os.path.exists(increment_path(self.backups, 1)))
+        self.assertRestores()
+
+    def test_verify(self):
+        backup(self.path, self.backups)
+        restore(self.backups, self.restored)
+        self.assertEqual(verify(self.backups, self.restored), [])
+
+        with open(self.restored, 'r+b') as f:
+            f.seek(1024 * 4 + 100)
+            f.write(b'\xff')
+        self.assertEqual(verify(self.backups, self.restored), ['page 5 differs'])
+
+        # a damaged increment is caught by the restore
+        path = increment_path(self.backups, 1)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+        with self.assertRaises(BackupError):
+            restore(self.backups, self.restored)
+
+    def test_wal(self):
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        # commits stay in the WAL while the connection is open
+        connection.execute('PRAGMA wal_autocheckpoint = 0')
+        try:
+            connection.execute('DELETE FROM t WHERE id > 1000')
+            connection.execute('CREATE TABLE u(a)')
+            connection.execute("INSERT INTO u VALUES ('in the wal')")
+            self.assertGreater(os.path.getsize(self.path + '-wal'), 0)
+            backup(self.path, self.backups)
+            self.assertRestoresCommitted(connection)
+
+            connection.execute('UPDATE t SET b = upper(b) WHERE id = 500')
+            connection.execute('CREATE TABLE v(a)')
+            report = backup(self.path, self.backups)
+            self.assertFalse(report.skipped)
+            self.assertLess(report.copied, report.pages)
+            self.assertRestoresCommitted(connection)
+        finally:
+            connection.close()
+
+    def assertRestoresCommitted(self, connection: sqlite3.Connection):
+        restore(self.backups, self.restored)
+        restored = sqlite3.connect(self.restored)
+        try:
+            self.assertEqual(
+                restored.execute('PRAGMA integrity_check').fetchall(),
+                [('ok',)],
+            )
+            self.assertEqual(
+                list(restored.iterdump()),
+                list(connection.iterdump()),
+            )
+        finally:
+            restored.close()
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(self.restored + suffix):
+                os.remove(self.restored + suffix)
+
+    def test_no_backup(self):
+        with self.assertRaises(BackupError):
+            restore(self.backups, self.restored)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import TestCase
+
+from benchmarks.fixtures import SHAPES, Fixture
+from benchmarks.suite import BENCHMARKS, applies, compare, run_case
+
+class TestBenchmarks(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fixtures(self):
+        for shape in SHAPES.values():
+            fixture = Fixture(shape, 20, 1024)
+            path = fixture.create(self.directory)
+            self.assertEqual(fixture.create(self.directory), path)
+
+            connection = sqlite3.connect(path)
+            page_size = connection.execute('PRAGMA page_size').fetchone()
+            self.assertEqual(page_size, (1024,))
+            count = connection.execute('SELECT count(*) FROM t').fetchone()
+            self.assertEqual(count, (20,))
+            connection.close()
+
+    def test_run(self):
+        fixture = Fixture(SHAPES['narrow'], 50, 1024)
+        path = fixture.create(self.directory)
+        results = [
+            run_case(name, path, fixture, 1)
+            for name in BENCHMARKS if applies(name, fixture)
+        ]
+        self.assertEqual([r['benchmark'] for r in results], list(BENCHMARKS))
+        for result in results:
+            self.assertGreater(result['seconds']['min'], 0)
+            if result['baseline'] is not None:
+                self.assertGreater(result['ratio'], 0)
+
+    def test_compare(self):
+        def result(seconds):
+            return {'fixture': 'f', 'benchmark': 'b', 'seconds': {'min': seconds}}
+
+        self.assertEqual(compare([result(1.0)], [result(1.05)], 0.1), [])
+        self.assertEqual(
+            compare([result(1.0)], [result(1.5)], 0.1),
+            ['f b: 50.0% slower'],
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import TestCase
+
+from src.backend.cache import LRUCache
+from src.backend.trace import (
+    READ,
+    RECORD,
+    SCAN,
+    TRACE_HEADER,
+    TRACE_MAGIC,
+    WRITE,
+    PageTrace,
+    TraceReader,
+)
+from src.cachesim import Trace, heatmap, hot_pages, main, simulate
+from src.database import Database
+from test.fixtures import create_database, series
+
+class TestCacheSim(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+            series(3000) + "INSERT INTO t(a, b) SELECT value % 50, "
+            "'row ' || value FROM s",
+        ], page_size=1024)
+        self.directory = tempfile.mkdtemp()
+        self.trace = os.path.join(self.directory, 'trace')
+
+    def tearDown(self):
+        os.remove(self.path)
+        shutil.rmtree(self.directory)
+
+    def write_trace(self, records):
+        trace = PageTrace(self.trace, 1024, buffer_size=RECORD.size * 3)
+        for page_number, access in records:
+            trace.record(page_number, access, b'\x0d')
+        trace.close()
+
+    def test_records(self):
+        db = Database(self.path, trace_file=self.trace)
+        for row_id in (1, 1500, 3000):
+            rows = list(db.execute('SELECT * FROM t WHERE id = ?', [row_id]))
+            self.assertEqual(len(rows), 1)
+        db.create_index('CREATE INDEX t_a ON t(a)')
+        self.assertEqual(len(db.pager.get_pages(1, 4)), 4)
+        recorded = db.pager.trace.records
+        db.close()
+
+        records = list(TraceReader(self.trace))
+        self.assertEqual(len(records), recorded)
+        accesses = {access for _, access, _, _ in records}
+        self.assertEqual(accesses, {READ, WRITE, SCAN})
+        root = {record[2] for record in records if record[0] == 2}
+        self.assertEqual(root, {0x05})
+        times = [nanoseconds for _, _, _, nanoseconds in records]
+        self.assertEqual(times, sorted(times))
+
+        # a record cut short ends the trace
+        with open(self.trace, 'ab') as f:
+            f.write(b'\0' * (RECORD.size - 1))
+        self.assertEqual(len(list(TraceReader(self.trace))), recorded)
+
+        with self.assertRaises(ValueError):
+            Database(self.path, in_memory=True, trace_file=self.trace)
+
+    def test_lru_matches_cache(self):
+        rng = random.Random(7)
+        records = []
+        for _ in range(5000):
+            # a skewed mix of reads with the odd write
+            page_number = int(rng.paretovariate(1.2)) % 300 + 1
+            records.append((page_number, WRITE if rng.random() < 0.05 else READ))
+        self.write_trace(records)
+        trace = Trace(self.trace)
+        self.assertEqual(len(trace), 5000)
+        sizes = [1, 4, 16, 64, 300]
+        curves = simulate(trace, sizes, ['lru', 'arc'])
+
+        for i, size in enumerate(sizes):
+            cache, hits = LRUCache(size), 0
+            for page_number, access in records:
+                if access == WRITE:
+                    cache.pop(page_number)
+                    cache.put(page_number, b'\x0d')
+                elif cache.get(page_number) is not None:
+                    hits += 1
+                else:
+                    cache.put(page_number, b'\x0d')
+            self.assertEqual(curves['lru'].hits[i], hits, size)
+
+        reads = sum(1 for _, access in records if access == READ)
+        self.assertEqual(curves['lru'].reads, reads)
+        for curve in curves.values():
+            self.assertEqual(curve.hits, sorted(curve.hits))
+        # every page fits, so only first reads miss
+        self.assertEqual(curves['arc'].hits[-1], curves['lru'].hits[-1])
+
+        with self.assertRaises(ValueError):
+            simulate(trace, sizes, ['clock'])
+
+    def test_hot_pages_and_heatmap(self):
+        self.write_trace([(5, READ)] * 10 + [(9, WRITE), (9, READ), (200, SCAN)])
+        trace = Trace(self.trace)
+        hot = hot_pages(trace, 2)
+        self.assertEqual([page_number for page_number, _, _ in hot], [5, 9])
+        self.assertEqual(hot[1][2][WRITE], 1)
+        grid = heatmap(trace, rows=4, columns=10)
+        self.assertEqual(sum(map(sum, grid)), len(trace))
+        self.assertEqual(sum(row[0] for row in grid), 12)
+        self.assertEqual(sum(row[9] for row in grid), 1)
+
+    def test_out_of_order_times(self):
+        with open(self.trace, 'wb') as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, 1024, 0.0))
+            for page_number, nanoseconds in ((1, 10), (2, 50), (3, 40)):
+                f.write(RECORD.pack(page_number, READ, 0x0d, nanoseconds))
+        trace = Trace(self.trace)
+        self.assertEqual(trace.duration(), 50 / 1e9)
+        self.assertEqual(sum(map(sum, heatmap(trace, rows=4, columns=4))), 3)
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(main([self.trace, '--heatmap']), 0)
+
+    def test_main(self):
+        db = Database(self.path, trace_file=self.trace)
+        for _ in range(3):
+            list(db.execute('SELECT count(*) FROM t WHERE b > ?', ['row 5']))
+        db.close()
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main([self.trace, '--hot', '3', '--heatmap']), 0)
+        lines = output.getvalue().splitlines()
+        self.assertIn('lru', lines[1])
+        self.assertIn('arc', lines[1])
+        self.assertIn('table interior', output.getvalue())
+
+        with open(self.path, 'rb') as f, open(self.trace, 'wb') as g:
+            g.write(f.read(100))
+        with redirect_stderr(io.StringIO()):
+            self.assertEqual(main([self.trace]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import gc
+import os
+import sqlite3
+import unittest
+from unittest import TestCase, mock
+
+from src import dbapi
+from src.backend.metrics import Metrics
+from test.fixtures import create_database, series
+
+class TestDBAPI(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+            series(1000) + "INSERT INTO t(a, b) SELECT value % 40, "
+            "'name ' || value FROM s",
+        ], page_size=1024)
+        self.connection = dbapi.connect(self.path)
+        self.sqlite = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+        self.sqlite.close()
+        os.remove(self.path)
+
+    def test_fetch(self):
+        sql = 'SELECT id, b FROM t WHERE a = ? ORDER BY id'
+        expected = self.sqlite.execute(sql, [7]).fetchall()
+        cursor = self.connection.cursor()
+        self.assertIs(cursor.execute(sql, [7]), cursor)
+        self.assertEqual([column[0] for column in cursor.description], ['id', 'b'])
+        self.assertEqual(cursor.fetchone(), expected[0])
+        self.assertEqual(cursor.fetchmany(), expected[1:2])
+        cursor.arraysize = 10
+        self.assertEqual(cursor.fetchmany(), expected[2:12])
+        self.assertEqual(cursor.fetchmany(5), expected[12:17])
+        self.assertEqual(cursor.fetchall(), expected[17:])
+        self.assertEqual(cursor.fetchmany(), [])
+        self.assertIsNone(cursor.fetchone())
+
+        # the read transaction ends with the rows, even if they are not read
+        cursor.execute('SELECT * FROM t')
+        cursor.fetchone()
+        self.assertEqual(self.connection.db.pager.reads.depth, 1)
+        cursor.execute('SELECT count(*) FROM t')
+        self.assertEqual(list(cursor), [(1000,)])
+        self.assertEqual(self.connection.db.pager.reads.depth, 0)
+        cursor.close()
+        with self.assertRaises(dbapi.ProgrammingError):
+            cursor.fetchall()
+
+    def test_fetchmany_batches(self):
+        for sql in (
+            'SELECT id, a, b FROM t',
+            'SELECT b FROM t WHERE a > 30',
+            'SELECT id FROM t WHERE a = 3 ORDER BY b LIMIT 7',
+        ):
+            expected = self.sqlite.execute(sql).fetchall()
+            for size in (1, 7, 100, 5000):
+                with self.subTest(sql=sql, size=size):
+                    cursor = self.connection.execute(sql)
+                    rows = []
+                    while batch := cursor.fetchmany(size):
+                        self.assertLessEqual(len(batch), size)
+                        rows.extend(batch)
+                    self.assertEqual(rows, expected)
+
+        # scans produce the rows of a leaf page at a time
+        plan = self.connection.db.plan('SELECT id FROM t')
+        tree = plan.child.tree
+        self.assertEqual(
+            [len(batch) for batch in plan.batches()],
+            [node.num_cells for _, node in tree.leaves()],
+        )
+
+    def test_create_index(self):
+        cursor = self.connection.execute('CREATE INDEX t_a ON t(a)')
+        self.assertIsNone(cursor.description)
+        with self.assertRaises(dbapi.ProgrammingError):
+            cursor.fetchall()
+        self.assertIn(
+            'USING COVERING INDEX t_a',
+            self.connection.db.plan('SELECT id FROM t WHERE a = 3').explain()[1],
+        )
+        with self.assertRaises(dbapi.IntegrityError):
+            self.connection.execute('CREATE UNIQUE INDEX t_a_unique ON t(a)')
+        with self.assertRaises(dbapi.OperationalError):
+            self.connection.execute('CREATE INDEX t_a ON t(b)')
+
+    def test_errors(self):
+        for sql, parameters in (
+            ('SELEC a FROM t', ()),
+            ('SELECT a FROM missing', ()),
+            ('SELECT a FROM t WHERE a = ?', ()),
+        ):
+            with self.subTest(sql=sql), self.assertRaises(dbapi.ProgrammingError):
+                self.connection.execute(sql, parameters)
+        self.assertTrue(issubclass(dbapi.ProgrammingError, dbapi.Error))
+        with self.assertRaises(dbapi.NotSupportedError):
+            self.connection.rollback()
+
+        self.connection.close()
+        with self.assertRaises(dbapi.ProgrammingError):
+            self.connection.cursor()
+
+    def test_close(self):
+        cursors = [self.connection.execute('SELECT * FROM t') for _ in range(2)]
+        for cursor in cursors:
+            cursor.fetchmany(3)
+        with mock.patch('sys.unraisablehook') as hook:
+            self.connection.close()
+            for cursor in cursors:
+                with self.assertRaises(dbapi.ProgrammingError):
+                    cursor.fetchone()
+            del cursors, cursor
+            gc.collect()
+        hook.assert_not_called()
+
+        with self.assertRaises(dbapi.OperationalError):
+            dbapi.connect(self.path + '-missing')
+
+    def test_stats(self):
+        connection = dbapi.connect(self.path, metrics=Metrics())
+        cursor = connection.execute('SELECT * FROM t')
+        self.assertEqual(len(cursor.fetchall()), 1000)
+        self.assertGreater(cursor.stats.pages_read, 0)
+        connection.close()
+
+if __name__ == '__main__':
+    unittest.main()
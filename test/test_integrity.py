@@ -0,0 +1,114 @@
+import os
+import unittest
+from unittest import TestCase
+
+from src.backend.node import Node
+from src.backend.pager import Pager
+from src.integrity import IntegrityChecker, check_record_header
+from test.fixtures import create_database, series
+
+class TestIntegrity(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(a INTEGER PRIMARY KEY, b TEXT, c BLOB)',
+            'CREATE INDEX t_b ON t(b)',
+            series(600) + "INSERT INTO t(b, c) " \
+                "SELECT 'row ' || value, randomblob(value % 5 * 700) FROM s",
+            'DELETE FROM t WHERE a % 4 = 0',
+        ], page_size=1024)
+        self.pager = Pager(self.path, 1024)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_valid_database(self):
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                report = IntegrityChecker(self.path, workers, batch_pages=64).check()
+                self.assertEqual(report.errors, [])
+                self.assertTrue(report.ok)
+                self.assertEqual(report.pages, self.pager.num_pages())
+                self.assertGreater(report.pages_per_second, 0)
+
+    def test_duplicate_child_pointer(self):
+        # point the first child of the table root at its second child
+        data = bytearray(self.pager.get_page(2))
+        self.assertEqual(data[0], 5)
+        cell_pointer = int.from_bytes(data[12:14])
+        second_pointer = int.from_bytes(data[14:16])
+        data[cell_pointer:cell_pointer + 4] = data[second_pointer:second_pointer + 4]
+        self.pager.write_page(2, bytes(data))
+
+        report = IntegrityChecker(self.path, 1).check()
+        self.assertFalse(report.ok)
+        self.assertTrue(any('referenced more than once' in e for e in report.errors))
+        self.assertTrue(any('is never used' in e for e in report.errors))
+
+    def test_overlapping_cells(self):
+        # find a leaf page with at least two cells and point both at one cell
+        for page_number in range(3, self.pager.num_pages() + 1):
+            data = bytearray(self.pager.get_page(page_number))
+            if data[0] == 13 and int.from_bytes(data[3:5]) > 1:
+                break
+        data[10:12] = data[8:10]
+        self.pager.write_page(page_number, bytes(data))
+
+        report = IntegrityChecker(self.path, 1).check()
+        self.assertTrue(any(
+            e.startswith(f'page {page_number}:') and 'overlaps' in e
+            for e in report.errors
+        ))
+
+    def test_index_key_outside_parent(self):
+        # raise the last key of the leftmost leaf of t_b past its parent's key
+        leaves = {}
+        for page_number in range(3, self.pager.num_pages() + 1):
+            data = self.pager.get_page(page_number)
+            if data[0] == 10:
+                node = Node(data, False, 1024)
+                leaves[node.cells[0].record.values[0]] = (page_number, node)
+        page_number, node = leaves[min(leaves)]
+        data = bytearray(node.data)
+        text = data.index(b'row ', node.cells[-1].pointer)
+        data[text:text + 3] = b'zzz'
+        self.pager.write_page(page_number, bytes(data))
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                report = IntegrityChecker(self.path, workers, batch_pages=16).check()
+                self.assertEqual(report.errors, [
+                    f'page {page_number}: keys outside the range of parent',
+                ])
+
+    def test_freelist_count(self):
+        data = bytearray(self.pager.get_page(1))
+        data[36:40] = (int.from_bytes(data[36:40]) + 1).to_bytes(4)
+        self.pager.write_page(1, bytes(data))
+
+        report = IntegrityChecker(self.path, 1).check()
+        self.assertEqual(len(report.errors), 1)
+        self.assertIn('freelist holds', report.errors[0])
+
+    def test_invalid_header(self):
+        data = bytearray(self.pager.get_page(1))
+        data[0:6] = b'sqlite'
+        self.pager.write_page(1, bytes(data))
+
+        report = IntegrityChecker(self.path, 1).check()
+        self.assertFalse(report.ok)
+        self.assertIn('invalid database header', report.errors[0])
+
+    def test_check_record_header(self):
+        # header of 3 bytes, a tinyint and a 1 byte string
+        self.assertIsNone(check_record_header(bytes([0x03, 0x01, 0x0f, 0x05, 0x41]), 5))
+        self.assertEqual(
+            check_record_header(bytes([0x03, 0x01, 0x0f, 0x05]), 4),
+            'record of 5 bytes in payload of 4 bytes',
+        )
+        self.assertEqual(
+            check_record_header(bytes([0x02, 0x0a]), 2),
+            'record uses reserved serial type 10',
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from unittest import TestCase
+
+from src.backend.pager import Pager
+from src.schema import Schema, SchemaEntry
+
+class TestSchema(TestCase):
+    def test_schema(self):
+        schema = Schema(Pager('./test/test.db'), 4084)
+        self.assertEqual(schema.entries, [
+            SchemaEntry(
+                'table',
+                'test',
+                'test',
+                2,
+                'CREATE TABLE test(col1 VARCHAR(2), col2 INTEGER)',
+            ),
+        ])
+        self.assertEqual(schema.tables(), schema.entries)
+        self.assertEqual(schema.indexes(), [])
+        self.assertEqual(schema.find('TEST').rootpage, 2)
+        self.assertIsNone(schema.find('missing'))
+        self.assertEqual(schema.root_pages(), [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import shutil
+import sqlite3
+import unittest
+from unittest import TestCase
+
+from src.database import Database
+from src.sql.operators import IndexScan, TableScan
+from src.stats import Statistics, TreeStats
+from test.fixtures import create_database, series
+
+class TestStatistics(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT, c INTEGER)',
+            'CREATE INDEX t_a ON t(a)',
+            'CREATE INDEX t_ab ON t(a, b)',
+            'CREATE UNIQUE INDEX t_c ON t(c)',
+            series(5000) + "INSERT INTO t(a, b, c) SELECT value % 2, "
+            "'b' || (value % 500), value FROM s",
+            'CREATE TABLE empty(x)',
+            'CREATE TABLE w(k TEXT PRIMARY KEY, v INTEGER) WITHOUT ROWID',
+            'CREATE INDEX w_v ON w(v)',
+            series(300) + "INSERT INTO w SELECT 'k' || value, value % 7 FROM s",
+            'CREATE TABLE w2(a, b, c, PRIMARY KEY (a, b)) WITHOUT ROWID',
+            series(300) + 'INSERT INTO w2 SELECT value % 5, value, 0 FROM s',
+        ], page_size=1024)
+        self.db = Database(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def sqlite_stats(self, path: str) -> dict:
+        connection = sqlite3.connect(path)
+        rows = connection.execute('SELECT idx, stat FROM sqlite_stat1').fetchall()
+        check = connection.execute('PRAGMA integrity_check').fetchone()
+        self.assertEqual(check, ('ok',))
+        connection.close()
+        return dict(rows)
+
+    def test_tree_stats(self):
+        stats = TreeStats.parse('5000 2500 10 unordered sz=12')
+        self.assertEqual(stats, TreeStats(5000, [2500, 10], 12))
+        self.assertEqual(stats.to_stat(), '5000 2500 10 sz=12')
+        self.assertEqual(stats.rows_per_key(2), 10)
+        # past the known columns each column divides the rows by ten
+        self.assertEqual(stats.rows_per_key(3), 5)
+        with self.assertRaises(ValueError):
+            TreeStats.parse('sz=12')
+
+    def test_analyze_matches_sqlite(self):
+        copy = self.path + '.copy'
+        shutil.copy(self.path, copy)
+        try:
+            connection = sqlite3.connect(copy)
+            connection.execute('ANALYZE')
+            connection.commit()
+            connection.close()
+            expected = self.sqlite_stats(copy)
+        finally:
+            os.remove(copy)
+
+        statistics = self.db.analyze()
+        self.assertEqual(statistics.table('t').rows, 5000)
+        self.assertIsNone(statistics.table('empty'))
+
+        # sqlite reads the table back and the file is still consistent
+        written = self.sqlite_stats(self.path)
+        self.assertEqual(written[None], f'5000 sz={statistics.table("t").row_size}')
+        for index, stat in expected.items():
+            self.assertEqual(written[index].split(' sz=')[0], stat)
+
+    def test_statistics_are_read_back(self):
+        self.assertEqual(self.db.statistics.tables, {})
+        statistics = self.db.analyze()
+        self.assertIsNotNone(self.db.schema.find('sqlite_stat1'))
+
+        reopened = Statistics.read(Database(self.path))
+        self.assertEqual(reopened.tables, statistics.tables)
+        self.assertEqual(reopened.indexes, statistics.indexes)
+
+        # analyzing again rewrites the table in place
+        connection = sqlite3.connect(self.path)
+        connection.execute('DELETE FROM t WHERE id > 1000')
+        connection.commit()
+        connection.close()
+        db = Database(self.path)
+        db.analyze()
+        self.assertEqual(Database(self.path).statistics.table('t').rows, 1000)
+        stat = self.sqlite_stats(self.path)['t_a']
+        self.assertEqual(stat.split()[:2], ['1000', '500'])
+
+    def test_sampled_estimates(self):
+        exact = self.db.analyze(write=False)
+        sampled = self.db.analyze(samples=20, write=False)
+
+        self.assertAlmostEqual(sampled.table('t').rows, 5000, delta=1000)
+        for name in ('t_a', 't_ab', 't_c'):
+            estimate, actual = sampled.index(name), exact.index(name)
+            self.assertAlmostEqual(estimate.rows, actual.rows, delta=1000)
+            # the few leaves reached see few of the changes of a column
+            # with two values, so the guesses are loose
+            for guess, average in zip(estimate.averages, actual.averages):
+                self.assertLessEqual(guess, average * 3)
+                self.assertGreaterEqual(guess, average / 3)
+        # nothing was written
+        self.assertIsNone(self.db.schema.find('sqlite_stat1'))
+
+    def test_without_rowid(self):
+        statistics = self.db.analyze()
+        self.assertEqual(statistics.table('w').rows, 300)
+        self.assertEqual(statistics.table('w').averages, [1])
+        self.assertEqual(statistics.table('w2').averages, [60, 1])
+        self.assertEqual(statistics.index('w_v').rows, 300)
+        self.assertEqual(statistics.index('w_v').averages, [43])
+
+        # sqlite names the primary key after the table
+        written = self.sqlite_stats(self.path)
+        self.assertEqual(written['w'].split(' sz=')[0], '300 1')
+        self.assertEqual(written['w_v'].split(' sz=')[0], '300 43')
+        reopened = Database(self.path).statistics
+        self.assertEqual(reopened.table('w2'), statistics.table('w2'))
+
+        self.assertEqual(self.access('SELECT * FROM w WHERE v = 3').index.name, 'w_v')
+        self.assertEqual(
+            list(self.db.execute("SELECT v FROM w WHERE k = 'k10'")),
+            [(3,)],
+        )
+
+    def access(self, sql: str):
+        operator = self.db.plan(sql)
+        while not isinstance(operator, (TableScan, IndexScan)):
+            operator = operator.child
+        return operator
+
+    def test_plans_by_cost(self):
+        # by rule any index seek beats a scan
+        self.assertIsInstance(self.access('SELECT * FROM t WHERE a = 1'), IndexScan)
+
+        self.db.analyze()
+        # half the table matches, reading it through the index costs more
+        self.assertIsInstance(self.access('SELECT * FROM t WHERE a = 1'), TableScan)
+        scan = self.access("SELECT * FROM t WHERE a = 1 AND b = 'b7'")
+        self.assertIsInstance(scan, IndexScan)
+        self.assertEqual(scan.index.name, 't_ab')
+        self.assertEqual(self.access('SELECT * FROM t WHERE c = 7').index.name, 't_c')
+
+        sql = "SELECT id FROM t WHERE a = 1 AND b = 'b7' ORDER BY id"
+        connection = sqlite3.connect(self.path)
+        self.assertEqual(list(self.db.execute(sql)), connection.execute(sql).fetchall())
+        connection.close()
+
+if __name__ == '__main__':
+    unittest.main()
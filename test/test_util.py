@@ -1,7 +1,7 @@
 import unittest
 from unittest import TestCase
 from dataclasses import dataclass
-from src.util import varint, to_varint
+from src.util import varint, to_varint, varint_size, write_varint
 
 
 @dataclass
@@ -45,5 +45,20 @@ class TestVarint(TestCase):
         self.assertEqual(cursor, 9)
         self.assertEqual(input_data, to_varint(result))
 
+    def test_write_varint(self):
+        for value in [0, 0x7f, 0x80, 0x3fff, 0x4000, (1 << 56) - 1, 1 << 56,
+                      1 << 63, (1 << 64) - 1]:
+            with self.subTest(value=value):
+                data = bytearray(11)
+                end = write_varint(memoryview(data), 1, value)
+                self.assertEqual(end - 1, varint_size(value))
+                self.assertEqual(varint(data, 1), (value, end))
+                self.assertEqual(bytes(data[1:end]), to_varint(value))
+
+    def test_negative_varint(self):
+        # negative values are stored as their 64 bit two's complement
+        self.assertEqual(to_varint(-1), bytes([0xff] * 9))
+        self.assertEqual(varint(to_varint(-2), 0), ((1 << 64) - 2, 9))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import unittest
+from unittest import TestCase
+
+from src.database import Database
+from src.integrity import IntegrityChecker
+from src.writer import DatabaseWriter, WriterError
+from test.fixtures import create_database, series
+
+class TestCreateIndex(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT, c BLOB)',
+            series(3000) + "INSERT INTO t(a, b, c) SELECT value % 97, "
+            "CASE WHEN value % 11 = 0 THEN NULL ELSE "
+            "printf('%s %d', CASE value % 3 WHEN 0 THEN 'Name' ELSE 'name' END, "
+            "value % 500) END, randomblob(value % 4) FROM s",
+            "INSERT INTO t(id, a, b) VALUES (5000, 'text', x'00'), (5001, 1.5, 'x')",
+            'ALTER TABLE t ADD COLUMN d INTEGER',
+        ], page_size=1024)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def sqlite_check(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        self.assertEqual(connection.execute('PRAGMA integrity_check').fetchall(),
+                         [('ok',)])
+        return connection
+
+    def test_matches_sqlite(self):
+        db = Database(self.path, sort_memory=16 * 1024)
+        for sql in (
+            'CREATE INDEX t_a ON t(a)',
+            'CREATE INDEX t_b_a ON t(b DESC, a)',
+            'CREATE INDEX t_b_nocase ON t(b COLLATE NOCASE)',
+            'CREATE INDEX t_c_d ON t(c, d);',
+        ):
+            db.create_index(sql)
+        db.close()
+
+        self.assertTrue(IntegrityChecker(self.path, 1).check().ok)
+        connection = self.sqlite_check()
+        self.assertEqual(
+            connection.execute("SELECT sql FROM sqlite_schema WHERE name = 't_c_d'")
+            .fetchone(),
+            ('CREATE INDEX t_c_d ON t(c, d)',),
+        )
+        plan = connection.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM t WHERE a = 5'
+        ).fetchall()
+        self.assertIn('USING COVERING INDEX t_a', plan[0][-1])
+        self.assertEqual(
+            connection.execute('SELECT count(*) FROM t WHERE a = 5').fetchone(),
+            (31,),
+        )
+        connection.close()
+
+        db = Database(self.path)
+        self.assertEqual(
+            db.plan('SELECT id FROM t WHERE a = 5').explain()[1],
+            '  SEARCH t USING COVERING INDEX t_a (a=?)',
+        )
+        self.assertEqual(len(list(db.execute('SELECT id FROM t WHERE a = 5'))), 31)
+        db.close()
+
+    def test_fill_factor(self):
+        db = Database(self.path)
+        full = db.btree(db.create_index('CREATE INDEX full ON t(b)'))
+        half = db.btree(db.create_index('CREATE INDEX half ON t(b)', fill_factor=0.5))
+        leaves = [sum(1 for _ in tree.leaves()) for tree in (full, half)]
+        self.assertGreater(leaves[1], leaves[0] * 1.8)
+        db.close()
+        self.sqlite_check().close()
+
+    def test_unique(self):
+        db = Database(self.path)
+        # d is NULL in every row, and NULLs are distinct from each other
+        db.create_index('CREATE UNIQUE INDEX t_d ON t(d)')
+        db.create_index('CREATE UNIQUE INDEX t_d_desc ON t(d DESC)')
+        with self.assertRaises(WriterError):
+            db.create_index('CREATE UNIQUE INDEX t_a_unique ON t(a)')
+        self.assertIsNone(db.schema.find('t_a_unique'))
+        db.close()
+        self.sqlite_check().close()
+
+    def test_errors(self):
+        db = Database(self.path)
+        for sql in (
+            'CREATE INDEX t_partial ON t(a) WHERE a > 1',
+            'CREATE INDEX t_collated ON t(b COLLATE unknown)',
+            'CREATE INDEX sqlite_autoindex_t ON missing(a)',
+        ):
+            with self.subTest(sql=sql), self.assertRaises(Exception):
+                db.create_index(sql)
+        db.create_index('CREATE INDEX t_a ON t(a)')
+        with self.assertRaises(WriterError):
+            db.create_index('CREATE INDEX t_a ON t(b)')
+        db.close()
+
+class TestWithoutRowid(TestCase):
+    def setUp(self):
+        self.path = create_database([
+            'CREATE TABLE t(id INTEGER PRIMARY KEY, a INTEGER, b TEXT)',
+        ], page_size=1024)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_create_table(self):
+        # rows out of primary key order, row i has the key (i // 37, i % 37)
+        rows = [
+            [f'code {i % 37}', i % 11 if i % 50 else None, 'x' * (i % 300), i // 37]
+            for i in range(4000)
+        ]
+        rows.reverse()
+        expected = sorted((row[3], row[0], row[1], row[2]) for row in rows)
+
+        db = Database(self.path, sort_memory=16 * 1024)
+        writer = DatabaseWriter(db)
+        writer.create_table(
+            'k',
+            'CREATE TABLE k(code TEXT, n INTEGER, s TEXT, g INTEGER, '
+            'PRIMARY KEY (g, code)) WITHOUT ROWID',
+            rows,
+        )
+        writer.commit()
+        db.create_index('CREATE INDEX k_n ON k(n)')
+        db.create_index('CREATE UNIQUE INDEX k_code_g ON k(code, g DESC)')
+        self.assertEqual(
+            list(db.execute("SELECT n FROM k WHERE g = 3 AND code = 'code 0'")),
+            [(111 % 11,)],
+        )
+        db.close()
+
+        self.assertTrue(IntegrityChecker(self.path, 1).check().ok)
+        connection = sqlite3.connect(self.path)
+        self.assertEqual(connection.execute('PRAGMA integrity_check').fetchall(),
+                         [('ok',)])
+        self.assertEqual(
+            connection.execute('SELECT g, code, n, s FROM k').fetchall(),
+            expected,
+        )
+        self.assertEqual(
+            connection.execute('SELECT count(*) FROM k INDEXED BY k_n WHERE n = 3')
+            .fetchone(),
+            connection.execute('SELECT count(*) FROM k NOT INDEXED WHERE n = 3')
+            .fetchone(),
+        )
+        connection.close()
+
+    def test_utf16(self):
+        # code points order these differently than the bytes of UTF-16 do
+        keys = [
+            f'{prefix}{i}'
+            for i in range(300)
+            for prefix in ('a', '\u0101', '\u0161', '\uff21', '\U0001f600')
+        ]
+        for encoding in ('UTF-16le', 'UTF-16be'):
+            with self.subTest(encoding=encoding):
+                path = create_database([
+                    f'PRAGMA encoding = "{encoding}"',
+                    'CREATE TABLE t(a)',
+                ])
+                try:
+                    db = Database(path, sort_memory=16 * 1024)
+                    writer = DatabaseWriter(db)
+                    writer.create_table(
+                        'z',
+                        'CREATE TABLE z(k TEXT PRIMARY KEY, v INTEGER) WITHOUT ROWID',
+                        [[key, i] for i, key in enumerate(keys)],
+                    )
+                    writer.commit()
+                    self.assertEqual(
+                        list(db.execute("SELECT v FROM z WHERE k = ?", [keys[7]])),
+                        [(7,)],
+                    )
+                    db.close()
+
+                    connection = sqlite3.connect(path)
+                    self.assertEqual(
+                        connection.execute('PRAGMA integrity_check').fetchall(),
+                        [('ok',)],
+                    )
+                    self.assertEqual(
+                        connection.execute('SELECT count(*) FROM z').fetchone(),
+                        (len(keys),),
+                    )
+                    connection.close()
+                finally:
+                    os.remove(path)
+
+    def test_constraints(self):
+        db = Database(self.path)
+        for rows in (
+            [['a', 1], ['b', 2], ['a', 3]],
+            [['a', 1], [None, 2]],
+        ):
+            writer = DatabaseWriter(db)
+            try:
+                with self.assertRaises(WriterError):
+                    writer.create_table(
+                        'k', 'CREATE TABLE k(a TEXT PRIMARY KEY, b) WITHOUT ROWID',
+                        rows,
+                    )
+            finally:
+                writer.close()
+        writer = DatabaseWriter(db)
+        try:
+            with self.assertRaises(WriterError):
+                writer.create_table(
+                    'k', 'CREATE TABLE k(a TEXT PRIMARY KEY DESC, b) WITHOUT ROWID',
+                    [],
+                )
+        finally:
+            writer.close()
+        db.close()
+
+if __name__ == '__main__':
+    unittest.main()